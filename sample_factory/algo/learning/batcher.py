@@ -1,5 +1,6 @@
 import random
-from typing import Dict, Iterable, List, Optional, Tuple
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 
 import torch
 from signal_slot.signal_slot import EventLoop, signal
@@ -113,7 +114,16 @@ class Batcher(HeartbeatStoppableEventLoopObject):
 
         self.traj_buffer_queues = buffer_mgr.traj_buffer_queues
         self.traj_tensors = buffer_mgr.traj_tensors_torch
+        self.dedup_framestack = buffer_mgr.dedup_framestack
+        self.rnn_states_stride = buffer_mgr.rnn_states_stride
+        self.storage_dtypes = buffer_mgr.storage_dtypes
+        # training batch for each batch index: either a preallocated buffer we copied the trajectories into,
+        # or a view of the trajectory buffer if the batch was served zero-copy (see --zero_copy_training_batches)
         self.training_batches: List[TensorDict] = []
+        self.batch_buffers: List[TensorDict] = []
+        self.zero_copy: List[bool] = [False] * buffer_mgr.max_batches_to_accumulate
+        self.zero_copy_devices: List[Device] = []
+        self.num_batches = self.num_zero_copy_batches = 0
 
         self.max_batches_to_accumulate = buffer_mgr.max_batches_to_accumulate
         self.available_batches = list(range(self.max_batches_to_accumulate))
@@ -121,6 +131,13 @@ class Batcher(HeartbeatStoppableEventLoopObject):
             [] for _ in range(self.max_batches_to_accumulate)
         ]
 
+        # indices of batches signalled to the learner in order, so it can look ahead and prefetch the next batch
+        # (only used with --learner_prefetch_batches). Learner pops the batches from the left as it consumes them.
+        self.ready_batches: Deque[int] = deque()
+
+        # rollout workers excluded from sampling in sync mode, broadcast to all workers with the next iteration
+        self.excluded_workers: List[int] = []
+
     @signal
     def initialized(self):
         ...
@@ -156,11 +173,22 @@ class Batcher(HeartbeatStoppableEventLoopObject):
                 rnn_size,
                 device,
                 False,
+                self.dedup_framestack,
+                self.rnn_states_stride,
+                self.storage_dtypes,
             )
+            self.batch_buffers.append(training_batch)
             self.training_batches.append(training_batch)
 
+        if self.cfg.zero_copy_training_batches:
+            # trajectory buffers that the learner can train on directly, without copying
+            self.zero_copy_devices = [d for d, t in self.traj_tensors.items() if t["rewards"].device == device]
+
         self.initialized.emit()
 
+    def zero_copy_fraction(self) -> float:
+        return self.num_zero_copy_batches / max(1, self.num_batches)
+
     def on_new_trajectories(self, trajectory_dicts: Iterable[Dict], device: str):
         with self.timing.add_time("batching"):
             for trajectory_dict in trajectory_dicts:
@@ -189,47 +217,86 @@ class Batcher(HeartbeatStoppableEventLoopObject):
                 self.available_batches.pop(0)
                 assert len(self.traj_tensors_to_release[batch_idx]) == 0
 
-                # extract slices of trajectories and copy them to the training batch
-                devices = list(self.slices_for_training.keys())
-                random.shuffle(devices)  # so that no sampling device is preferred
-
-                trajectories_copied = 0
-                remaining = self.traj_per_training_iteration - trajectories_copied
-                for device in devices:
-                    traj_tensors = self.traj_tensors[device]
-                    slices = self.slices_for_training[device]
-                    while remaining > 0 and (traj_slice := slices.get_at_most(remaining)):
-                        # copy data into the training buffer
-                        start = trajectories_copied
-                        stop = start + slice_len(traj_slice)
-
-                        # log.debug(f"Copying {traj_slice} trajectories from {device} to {batch_idx}")
-                        self.training_batches[batch_idx][start:stop] = traj_tensors[traj_slice]
-
-                        # remember that we need to release these trajectories
-                        self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
-
-                        trajectories_copied += slice_len(traj_slice)
-                        remaining = self.traj_per_training_iteration - trajectories_copied
-
-                assert trajectories_copied == self.traj_per_training_iteration and remaining == 0
+                self.num_batches += 1
+                self.zero_copy[batch_idx] = self._try_zero_copy(batch_idx)
+                if self.zero_copy[batch_idx]:
+                    self.num_zero_copy_batches += 1
+                else:
+                    self._copy_to_training_batch(batch_idx)
 
                 # signal the learner that we have a new training batch
+                if self.cfg.learner_prefetch_batches:
+                    self.ready_batches.append(batch_idx)
                 self.training_batches_available.emit(batch_idx)
 
                 if self.cfg.async_rl:
-                    self._release_traj_tensors(batch_idx)
+                    if not self.zero_copy[batch_idx]:
+                        # data is copied, trajectory buffers can be reused right away
+                        self._release_traj_tensors(batch_idx)
                     if not self.available_batches:
                         debug_log_every_n(50, "Signal inference workers to stop experience collection...")
                         self.stop_experience_collection.emit()
 
+    def _try_zero_copy(self, batch_idx: int) -> bool:
+        """
+        If there is a contiguous slice of trajectories on the learner device that covers the entire batch,
+        the learner can train on a view of the trajectory buffer. Otherwise, we fall back to copying.
+        """
+        if not self.cfg.zero_copy_training_batches:
+            return False
+
+        for device in self.zero_copy_devices:
+            traj_slice = self.slices_for_training[device].get_exactly(self.traj_per_training_iteration)
+            if traj_slice is not None:
+                self.training_batches[batch_idx] = self.traj_tensors[device][traj_slice]
+                # we train on these trajectories directly, so they are released only after training
+                self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
+                return True
+
+        return False
+
+    def _copy_to_training_batch(self, batch_idx: int) -> None:
+        with self.timing.add_time("copy_training_batch"):
+            self.training_batches[batch_idx] = self.batch_buffers[batch_idx]
+
+            # extract slices of trajectories and copy them to the training batch
+            devices = list(self.slices_for_training.keys())
+            random.shuffle(devices)  # so that no sampling device is preferred
+
+            trajectories_copied = 0
+            remaining = self.traj_per_training_iteration - trajectories_copied
+            for device in devices:
+                traj_tensors = self.traj_tensors[device]
+                slices = self.slices_for_training[device]
+                while remaining > 0 and (traj_slice := slices.get_at_most(remaining)):
+                    # copy data into the training buffer
+                    start = trajectories_copied
+                    stop = start + slice_len(traj_slice)
+
+                    # log.debug(f"Copying {traj_slice} trajectories from {device} to {batch_idx}")
+                    self.training_batches[batch_idx][start:stop] = traj_tensors[traj_slice]
+
+                    # remember that we need to release these trajectories
+                    self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
+
+                    trajectories_copied += slice_len(traj_slice)
+                    remaining = self.traj_per_training_iteration - trajectories_copied
+
+            assert trajectories_copied == self.traj_per_training_iteration and remaining == 0
+
+    def on_update_stragglers(self, excluded_workers: List[int]) -> None:
+        """Straggling rollout workers to exclude from sampling, see stragglers.py."""
+        self.excluded_workers = excluded_workers
+
     def on_training_batch_released(self, batch_idx: int, training_iteration: int):
         with self.timing.add_time("releasing_batches"):
             self.training_iteration = training_iteration
 
-            if not self.cfg.async_rl:
+            if not self.cfg.async_rl or self.zero_copy[batch_idx]:
                 # in synchronous RL, we release the trajectories after they're processed by the learner
+                # same for batches that the learner trained on directly (zero-copy) in async mode
                 self._release_traj_tensors(batch_idx)
+                self.zero_copy[batch_idx] = False
 
             if not self.available_batches and self.cfg.async_rl:
                 debug_log_every_n(50, "Signal inference workers to resume experience collection...")
@@ -270,8 +337,10 @@ class Batcher(HeartbeatStoppableEventLoopObject):
         for device, batches in new_sampling_batches.items():
             # log.debug(f'Release trajectories {batches}')
             self.traj_buffer_queues[device].put_many(batches)
-        self.trajectory_buffers_available.emit(self.policy_id, self.training_iteration)
+        self.trajectory_buffers_available.emit(self.policy_id, self.training_iteration, self.excluded_workers)
 
     def on_stop(self, *args):
+        if self.cfg.zero_copy_training_batches:
+            log.debug(f"{self.object_id}: {self.zero_copy_fraction():.1%} of training batches served zero-copy")
         self.stop.emit(self.object_id, {self.object_id: self.timing})
         super().on_stop(*args)
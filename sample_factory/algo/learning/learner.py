@@ -4,6 +4,9 @@ import glob
 import os
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
 from os.path import join
 from typing import Callable, Dict, Optional, Tuple
 
@@ -15,11 +18,20 @@ from torch.nn import Module
 from sample_factory.algo.learning.rnn_utils import build_core_out_from_seq, build_rnn_inputs
 from sample_factory.algo.utils.action_distributions import get_action_distribution, is_continuous_action_space
 from sample_factory.algo.utils.env_info import EnvInfo
+from sample_factory.algo.utils.frame_stack import (
+    OBS_FRAME_STEPS,
+    OBS_FRAMES,
+    STACKED_OBS_KEY,
+    FlatStackedObs,
+    deduplicated_framestack,
+    gather_stacked_obs,
+    stacked_obs_for_trajectories,
+)
 from sample_factory.algo.utils.misc import LEARNER_ENV_STEPS, POLICY_ID_KEY, STATS_KEY, TRAIN_STATS, memory_stats
 from sample_factory.algo.utils.model_sharing import ParameterServer
 from sample_factory.algo.utils.optimizers import Lamb
-from sample_factory.algo.utils.rl_utils import gae_advantages, prepare_and_normalize_obs
-from sample_factory.algo.utils.shared_buffers import policy_device
+from sample_factory.algo.utils.rl_utils import gae_advantages, prepare_and_normalize_obs, vtrace_targets_and_advantages
+from sample_factory.algo.utils.shared_buffers import policy_device, reduced_precision_dtypes
 from sample_factory.algo.utils.tensor_dict import TensorDict, shallow_recursive_copy
 from sample_factory.algo.utils.torch_utils import masked_select, synchronize, to_scalar
 from sample_factory.cfg.configurable import Configurable
@@ -32,6 +44,15 @@ from sample_factory.utils.typing import ActionDistribution, Config, InitModelDat
 from sample_factory.utils.utils import ensure_dir_exists, experiment_dir, log
 
 
+@dataclass
+class PrefetchedBatch:
+    batch: TensorDict
+    # policy version used to mark stale experience as invalid, batch can be trained at this version or earlier
+    policy_version: int
+    # resolves to the result of Learner._prepare_batch_timed(), including the precision errors measured on the batch
+    future: Future
+
+
 class LearningRateScheduler:
     def update(self, current_lr, recent_kls):
         return current_lr
@@ -114,10 +135,18 @@ def get_lr_scheduler(cfg) -> LearningRateScheduler:
 
 
 def model_initialization_data(
-    cfg: Config, policy_id: PolicyID, actor_critic: Module, policy_version: int, device: torch.device
+    cfg: Config,
+    policy_id: PolicyID,
+    actor_critic: Module,
+    policy_version: int,
+    device: torch.device,
+    param_server: Optional[ParameterServer] = None,
 ) -> InitModelData:
     # in serial mode we will just use the same actor_critic directly
     state_dict = None if cfg.serial_mode else actor_critic.state_dict()
+    if param_server is not None:
+        # weights and normalizer statistics published in shared slots, if any (see SharedModelState)
+        state_dict = param_server.shared_model_state(state_dict)
     model_state = (policy_id, state_dict, device, policy_version)
     return model_state
 
@@ -138,6 +167,13 @@ class Learner(Configurable):
         self.policy_id = policy_id
 
         self.env_info = env_info
+        self.dedup_framestack: int = deduplicated_framestack(cfg, env_info.obs_space)
+        # with --compact_rnn_states training batches hold one RNN state per recurrence chunk
+        self.rnn_states_stride: int = cfg.recurrence if cfg.compact_rnn_states else 1
+
+        # see --buffer_float_dtype and --validate_reduced_precision
+        self.reduced_precision_dtypes: Dict[str, torch.dtype] = reduced_precision_dtypes(cfg)
+        self.max_precision_errors: Dict[str, float] = dict()
 
         self.device = None
         self.actor_critic: Optional[ActorCritic] = None
@@ -173,6 +209,14 @@ class Learner(Configurable):
         self.exploration_loss_func: Optional[Callable] = None
         self.kl_loss_func: Optional[Callable] = None
 
+        # see --learner_prefetch_batches
+        self.prefetch_executor: Optional[ThreadPoolExecutor] = None
+        self.prefetch_model: Optional[ActorCritic] = None
+        self.prefetched: Optional[PrefetchedBatch] = None
+
+        # number of published normalizer snapshots, see --lock_free_obs_normalizer
+        self.obs_normalizer_version: int = 0
+
         self.is_initialized = False
 
     def init(self) -> InitModelData:
@@ -243,16 +287,31 @@ class Learner(Configurable):
         self.optimizer = optimizer_cls(params, **optimizer_kwargs)
 
         self.load_from_checkpoint(self.policy_id)
-        self.param_server.init(self.actor_critic, self.train_step, self.device)
+        # in serial mode inference workers use the learner's model directly
+        double_buffered_weights = self.cfg.double_buffered_weights and not self.cfg.serial_mode
+        lock_free_obs_normalizer = self.cfg.lock_free_obs_normalizer and self.cfg.normalize_input
+        lock_free_obs_normalizer = lock_free_obs_normalizer and not self.cfg.serial_mode
+        self.param_server.init(
+            self.actor_critic, self.train_step, self.device, double_buffered_weights, lock_free_obs_normalizer
+        )
         self.policy_versions_tensor[self.policy_id] = self.train_step
 
         self.lr_scheduler = get_lr_scheduler(self.cfg)
         self.curr_lr = self.cfg.learning_rate if self.curr_lr is None else self.curr_lr
         self._apply_lr(self.curr_lr)
 
+        if self.cfg.learner_prefetch_batches:
+            # private copy of the model used to prepare the next batch while the main model is being trained
+            self.prefetch_model = create_actor_critic(self.cfg, self.env_info.obs_space, self.env_info.action_space)
+            self.prefetch_model.model_to_device(self.device)
+            self.prefetch_model.train()
+            self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"prefetch_p{self.policy_id}")
+
         self.is_initialized = True
 
-        return model_initialization_data(self.cfg, self.policy_id, self.actor_critic, self.train_step, self.device)
+        return model_initialization_data(
+            self.cfg, self.policy_id, self.actor_critic, self.train_step, self.device, self.param_server
+        )
 
     @staticmethod
     def checkpoint_dir(cfg, policy_id):
@@ -313,6 +372,14 @@ class Learner(Configurable):
 
         return True
 
+    def _publish_weights(self) -> None:
+        # make sure everything (such as policy weights) is committed to shared device memory
+        synchronize(self.cfg, self.device)
+        if self.param_server.weight_slots is not None:
+            self.param_server.weight_slots.publish(self.actor_critic.state_dict(), self.train_step)
+        # this will force policy update on the inference worker (policy worker)
+        self.policy_versions_tensor[self.policy_id] = self.train_step
+
     def _after_optimizer_step(self):
         """A hook to be called after each optimizer step."""
         self.train_step += 1
@@ -359,6 +426,12 @@ class Learner(Configurable):
     def save(self) -> bool:
         return self._save_impl("checkpoint", "", self.cfg.keep_checkpoints)
 
+    def stop_prefetching(self) -> None:
+        if self.prefetch_executor is not None:
+            self._discard_prefetched()
+            self.prefetch_executor.shutdown()
+            self.prefetch_executor = None
+
     def save_milestone(self):
         checkpoint = self._get_checkpoint_dict()
         assert checkpoint is not None
@@ -415,12 +488,10 @@ class Learner(Configurable):
                 # don't re-load progress if we are loading from another policy checkpoint
                 self.load_from_checkpoint(self.policy_to_load, load_progress=False)
 
-            # make sure everything (such as policy weights) is committed to shared device memory
-            synchronize(self.cfg, self.device)
-            # this will force policy update on the inference worker (policy worker)
             # we add max_policy_lag steps so that all experience currently in batches is invalidated
             self.train_step += self.cfg.max_policy_lag + 1
-            self.policy_versions_tensor[self.policy_id] = self.train_step
+            self._publish_weights()
+            self._publish_obs_normalizer(self.actor_critic)
 
             self.policy_to_load = None
 
@@ -523,11 +594,26 @@ class Learner(Configurable):
         return minibatches
 
     @staticmethod
-    def _get_minibatch(buffer, indices):
+    def _get_minibatch(buffer, indices, rnn_states_stride: int = 1):
         if indices is None:
             # handle the case of a single batch, where the entire buffer is a minibatch
             return buffer
 
+        if OBS_FRAMES in buffer or rnn_states_stride > 1:
+            skip_keys = (OBS_FRAMES, "rnn_states")
+            mb = TensorDict({key: value[indices] for key, value in buffer.items() if key not in skip_keys})
+            if OBS_FRAMES in buffer:
+                # deduplicated frames are shared by all samples, stacks are gathered in _calculate_losses()
+                mb[OBS_FRAMES] = buffer[OBS_FRAMES]
+
+            # compact RNN states: one per recurrence chunk, and minibatches always consist of whole chunks
+            if isinstance(indices, slice):
+                chunks = slice(indices.start // rnn_states_stride, indices.stop // rnn_states_stride)
+            else:
+                chunks = indices[::rnn_states_stride] // rnn_states_stride
+            mb["rnn_states"] = buffer["rnn_states"][chunks]
+            return mb
+
         mb = buffer[indices]
         return mb
 
@@ -545,6 +631,15 @@ class Learner(Configurable):
 
             valids = mb.valids
 
+            if self.cfg.lazy_obs_normalization:
+                # statistics were already updated in _prepare_batch(), here we only normalize this minibatch
+                obs = mb.obs
+                if OBS_FRAMES in mb:
+                    # training batch keeps each frame only once, reconstruct the stacks of this minibatch
+                    obs = TensorDict(obs)
+                    obs[STACKED_OBS_KEY] = self._minibatch_stacked_obs(mb)
+                mb.normalized_obs = prepare_and_normalize_obs(self.actor_critic, obs, update_stats=False)
+
         # calculate policy head outside of recurrent loop
         with self.timing.add_time("forward_head"):
             head_outputs = self.actor_critic.forward_head(mb.normalized_obs)
@@ -561,9 +656,10 @@ class Learner(Configurable):
                     done_or_invalid,
                     mb.rnn_states,
                     recurrence,
+                    self.rnn_states_stride,
                 )
             else:
-                rnn_states = mb.rnn_states[::recurrence]
+                rnn_states = mb.rnn_states[:: recurrence // self.rnn_states_stride]
 
         # calculate RNN outputs for each timestep in a loop
         with self.timing.add_time("bptt"):
@@ -577,7 +673,6 @@ class Learner(Configurable):
 
             del head_outputs
 
-        num_trajectories = minibatch_size // recurrence
         assert core_outputs.shape[0] == minibatch_size
 
         with self.timing.add_time("tail"):
@@ -597,44 +692,16 @@ class Learner(Configurable):
         # these computations are not the part of the computation graph
         with torch.no_grad(), self.timing.add_time("advantages_returns"):
             if self.cfg.with_vtrace:
-                # V-trace parameters
-                rho_hat = torch.Tensor([self.cfg.vtrace_rho])
-                c_hat = torch.Tensor([self.cfg.vtrace_c])
-
-                ratios_cpu = ratio.cpu()
-                values_cpu = values.cpu()
-                rewards_cpu = mb.rewards_cpu
-                dones_cpu = mb.dones_cpu
-
-                vtrace_rho = torch.min(rho_hat, ratios_cpu)
-                vtrace_c = torch.min(c_hat, ratios_cpu)
-
-                vs = torch.zeros((num_trajectories * recurrence))
-                adv = torch.zeros((num_trajectories * recurrence))
-
-                next_values = values_cpu[recurrence - 1 :: recurrence] - rewards_cpu[recurrence - 1 :: recurrence]
-                next_values /= self.cfg.gamma
-                next_vs = next_values
-
-                for i in reversed(range(self.cfg.recurrence)):
-                    rewards = rewards_cpu[i::recurrence]
-                    dones = dones_cpu[i::recurrence]
-                    not_done = 1.0 - dones
-                    not_done_gamma = not_done * self.cfg.gamma
-
-                    curr_values = values_cpu[i::recurrence]
-                    curr_vtrace_rho = vtrace_rho[i::recurrence]
-                    curr_vtrace_c = vtrace_c[i::recurrence]
-
-                    delta_s = curr_vtrace_rho * (rewards + not_done_gamma * next_values - curr_values)
-                    adv[i::recurrence] = curr_vtrace_rho * (rewards + not_done_gamma * next_vs - curr_values)
-                    next_vs = curr_values + delta_s + not_done_gamma * curr_vtrace_c * (next_vs - next_values)
-                    vs[i::recurrence] = next_vs
-
-                    next_values = curr_values
-
-                targets = vs.to(self.device)
-                adv = adv.to(self.device)
+                targets, adv = vtrace_targets_and_advantages(
+                    ratio,
+                    values,
+                    mb.rewards,
+                    mb.dones,
+                    self.cfg.gamma,
+                    self.cfg.vtrace_rho,
+                    self.cfg.vtrace_c,
+                    recurrence,
+                )
             else:
                 # using regular GAE
                 adv = mb.advantages
@@ -714,7 +781,7 @@ class Learner(Configurable):
                     indices = minibatches[batch_num]
 
                     # current minibatch consisting of short trajectory segments with length == recurrence
-                    mb = self._get_minibatch(gpu_buffer, indices)
+                    mb = self._get_minibatch(gpu_buffer, indices, self.rnn_states_stride)
 
                     # enable syntactic sugar that allows us to access dict's keys as object attributes
                     mb = AttrDict(mb)
@@ -812,10 +879,7 @@ class Learner(Configurable):
                         del summary_vars
                         force_summaries = False
 
-                    # make sure everything (such as policy weights) is committed to shared device memory
-                    synchronize(self.cfg, self.device)
-                    # this will force policy update on the inference worker (policy worker)
-                    self.policy_versions_tensor[self.policy_id] = self.train_step
+                    self._publish_weights()
 
             # end of an epoch
             if self.lr_scheduler.invoke_after_each_epoch():
@@ -918,7 +982,61 @@ class Learner(Configurable):
 
         return stats
 
-    def _prepare_and_normalize_obs(self, obs: TensorDict) -> TensorDict:
+    def _to_full_precision(self, buff: TensorDict, precision_errors: Dict[str, float]) -> None:
+        """
+        Upcast the fields stored in reduced precision (see --buffer_float_dtype).
+        In validation mode the buffers are float32, instead we measure the error we would get from storing them
+        in reduced precision.
+        :param precision_errors: max errors by field, updated in validation mode
+        """
+        for field, dtype in self.reduced_precision_dtypes.items():
+            tensors = buff["obs"] if field == "obs" else {field: buff[field]}
+            if field == "obs" and OBS_FRAMES in buff:
+                # deduplicated frames of the stacked main observation (see --dedup_framestack)
+                tensors = {**tensors, STACKED_OBS_KEY: buff[OBS_FRAMES]}
+            for key, x in tensors.items():
+                if not x.is_floating_point():
+                    continue
+
+                if self.cfg.validate_reduced_precision:
+                    if field == "values":
+                        x = x[:, :-1]  # value of the last step is not written by the sampler, we bootstrap it here
+                    name = f"obs_{key}" if field == "obs" else field
+                    error = (x - x.to(dtype).float()).abs().max().item()
+                    precision_errors[name] = max(error, precision_errors.get(name, 0.0))
+                elif field == "obs" and key == STACKED_OBS_KEY and OBS_FRAMES in buff:
+                    buff[OBS_FRAMES] = x.float()
+                elif field == "obs":
+                    buff["obs"][key] = x.float()
+                else:
+                    buff[field] = x.float()
+
+    def _normalizer_lock(self, model: ActorCritic):
+        if model is not self.actor_critic:
+            # private copy of the model (see --learner_prefetch_batches), nobody else can see its normalizer
+            return nullcontext()
+        if self.param_server.normalizer_slots is not None:
+            # inference workers only see the snapshots we publish (see --lock_free_obs_normalizer)
+            return nullcontext()
+        # hold the lock while we alter the state of the normalizer since they can be used in other processes too
+        return self._timed_policy_lock("normalizer_lock_wait")
+
+    @contextmanager
+    def _timed_policy_lock(self, key: str):
+        with self.timing.add_time(key):
+            # waiting for the inference workers to finish copying the weights
+            self.param_server.policy_lock.acquire()
+        try:
+            yield
+        finally:
+            self.param_server.policy_lock.release()
+
+    def _publish_obs_normalizer(self, model: ActorCritic) -> None:
+        if model is self.actor_critic and self.param_server.normalizer_slots is not None:
+            self.obs_normalizer_version += 1
+            self.param_server.publish_obs_normalizer(self.obs_normalizer_version)
+
+    def _prepare_and_normalize_obs(self, model: ActorCritic, obs: TensorDict) -> TensorDict:
         og_shape = dict()
 
         # assuming obs is a flat dict, collapse time and envs dimensions into a single batch dimension
@@ -926,9 +1044,9 @@ class Learner(Configurable):
             og_shape[key] = x.shape
             obs[key] = x.view((x.shape[0] * x.shape[1],) + x.shape[2:])
 
-        # hold the lock while we alter the state of the normalizer since they can be used in other processes too
-        with self.param_server.policy_lock:
-            normalized_obs = prepare_and_normalize_obs(self.actor_critic, obs)
+        with self._normalizer_lock(model):
+            normalized_obs = prepare_and_normalize_obs(model, obs)
+        self._publish_obs_normalizer(model)
 
         # restore original shape
         for key, x in normalized_obs.items():
@@ -936,30 +1054,98 @@ class Learner(Configurable):
 
         return normalized_obs
 
-    def _prepare_batch(self, batch: TensorDict) -> Tuple[TensorDict, int, int]:
+    def _update_obs_normalizer(self, model: ActorCritic, obs: TensorDict, stack_frames: Optional[TensorDict]) -> None:
+        """
+        Lazy normalization: only update the running statistics, see --lazy_obs_normalization.
+        :param stack_frames: deduplicated frames and dones of the stacked main observation, if any
+        """
+        flat_obs = {key: x.reshape((x.shape[0] * x.shape[1],) + x.shape[2:]) for key, x in obs.items()}
+        if stack_frames is not None:
+            # stacks are gathered chunk by chunk, together with the rest of the observations
+            frames, dones = stack_frames["frames"], stack_frames["dones"]
+            flat_obs[STACKED_OBS_KEY] = FlatStackedObs(frames, dones, self.dedup_framestack)
+        with self._normalizer_lock(model):
+            # chunks of minibatch size, so we never hold more float observations than a single minibatch
+            model.obs_normalizer.update_running_stats(flat_obs, self.cfg.batch_size)
+        self._publish_obs_normalizer(model)
+
+    def _last_step_stacked_obs(self, stack_frames: TensorDict) -> Tensor:
+        """Frame stacks of the extra last step of the trajectories, used to bootstrap the values."""
+        frames, dones = stack_frames["frames"], stack_frames["dones"]
+        traj_indices = torch.arange(dones.shape[0], device=frames.device)
+        rollout_steps = torch.full_like(traj_indices, dones.shape[1])
+        return gather_stacked_obs(frames, dones, traj_indices, rollout_steps, self.dedup_framestack)
+
+    def _minibatch_stacked_obs(self, mb: AttrDict) -> Tensor:
+        """Frame stacks of the minibatch samples, see OBS_FRAME_STEPS."""
+        frames, dones = mb[OBS_FRAMES]["frames"], mb[OBS_FRAMES]["dones"]
+        rollout = dones.shape[1]
+        traj_indices, rollout_steps = mb[OBS_FRAME_STEPS] // rollout, mb[OBS_FRAME_STEPS] % rollout
+        return gather_stacked_obs(frames, dones, traj_indices, rollout_steps, self.dedup_framestack)
+
+    def _prepare_batch(
+        self,
+        batch: TensorDict,
+        model: Optional[ActorCritic] = None,
+        policy_version: Optional[int] = None,
+        precision_errors: Optional[Dict[str, float]] = None,
+    ) -> Tuple[TensorDict, int, int]:
+        """
+        :param model: model used to normalize observations and bootstrap values, self.actor_critic by default
+        :param policy_version: policy version at which this batch is going to be trained, current version by default
+        :param precision_errors: where to record reduced precision errors, self.max_precision_errors by default
+        """
+        model = self.actor_critic if model is None else model
+        policy_version = self.train_step if policy_version is None else policy_version
+        precision_errors = self.max_precision_errors if precision_errors is None else precision_errors
+
         with torch.no_grad():
             # create a shallow copy so we can modify the dictionary
             # we still reference the same buffers though
             buff = shallow_recursive_copy(batch)
 
+            if self.reduced_precision_dtypes:
+                self._to_full_precision(buff, precision_errors)
+
+            stack_frames: Optional[TensorDict] = None
+            if self.dedup_framestack:
+                # training batch keeps each frame only once (see --dedup_framestack)
+                frames = buff.pop(OBS_FRAMES)
+                if self.cfg.lazy_obs_normalization:
+                    # stacks are reconstructed for each minibatch right before we normalize it
+                    stack_frames = TensorDict(frames=frames, dones=buff["dones"])
+                else:
+                    # all observations are about to be converted to float anyway, reconstruct the full stacks
+                    stacked_obs = stacked_obs_for_trajectories(frames, buff["dones"], self.dedup_framestack)
+                    buff["obs"][STACKED_OBS_KEY] = stacked_obs
+
             # ignore experience from other agents (i.e. on episode boundary) and from inactive agents
             valids: Tensor = buff["policy_id"] == self.policy_id
             # ignore experience that was older than the threshold even before training started
-            curr_policy_version: int = self.train_step
-            buff["valids"][:, :-1] = valids & (curr_policy_version - buff["policy_version"] < self.cfg.max_policy_lag)
+            buff["valids"][:, :-1] = valids & (policy_version - buff["policy_version"] < self.cfg.max_policy_lag)
             # for last T+1 step, we want to use the validity of the previous step
             buff["valids"][:, -1] = buff["valids"][:, -2]
 
             # ensure we're in train mode so that normalization statistics are updated
-            if not self.actor_critic.training:
-                self.actor_critic.train()
-
-            buff["normalized_obs"] = self._prepare_and_normalize_obs(buff["obs"])
-            del buff["obs"]  # don't need non-normalized obs anymore
+            if not model.training:
+                model.train()
+
+            if self.cfg.lazy_obs_normalization:
+                # keep the observations in the original dtype, minibatches are normalized in _calculate_losses()
+                self._update_obs_normalizer(model, buff["obs"], stack_frames)
+                last_obs = {key: x[:, -1] for key, x in buff["obs"].items()}
+                if stack_frames is not None:
+                    last_obs[STACKED_OBS_KEY] = self._last_step_stacked_obs(stack_frames)
+                normalized_last_obs = prepare_and_normalize_obs(model, last_obs, update_stats=False)
+                obs_key = "obs"
+            else:
+                buff["normalized_obs"] = self._prepare_and_normalize_obs(model, buff["obs"])
+                del buff["obs"]  # don't need non-normalized obs anymore
+                normalized_last_obs = buff["normalized_obs"][:, -1]
+                obs_key = "normalized_obs"
 
             # calculate estimated value for the next step (T+1)
-            normalized_last_obs = buff["normalized_obs"][:, -1]
-            next_values = self.actor_critic(normalized_last_obs, buff["rnn_states"][:, -1], values_only=True)["values"]
+            next_values = model(normalized_last_obs, buff["rnn_states"][:, -1], values_only=True)["values"]
             buff["values"][:, -1] = next_values
 
             if self.cfg.normalize_returns:
@@ -968,7 +1154,7 @@ class Learner(Configurable):
                 # rl_games PPO uses a similar approach, see:
                 # https://github.com/Denys88/rl_games/blob/7b5f9500ee65ae0832a7d8613b019c333ecd932c/rl_games/algos_torch/models.py#L51
                 denormalized_values = buff["values"].clone()  # need to clone since normalizer is in-place
-                self.actor_critic.returns_normalizer(denormalized_values, denormalize=True)
+                model.returns_normalizer(denormalized_values, denormalize=True)
             else:
                 # values are not normalized in this case, so we can use them as is
                 denormalized_values = buff["values"]
@@ -983,7 +1169,10 @@ class Learner(Configurable):
 
                 # Multiply by both time_out and done flags to make sure we count only timeouts in terminal states.
                 # There was a bug in older versions of isaacgym where timeouts were reported for non-terminal states.
-                buff["rewards"].add_(self.cfg.gamma * denormalized_values[:, :-1] * buff["time_outs"] * buff["dones"])
+                # Not in-place, so the batch can be prepared again if the prefetched version is discarded.
+                buff["rewards"] = buff["rewards"] + (
+                    self.cfg.gamma * denormalized_values[:, :-1] * buff["time_outs"] * buff["dones"]
+                )
 
             if not self.cfg.with_vtrace:
                 # calculate advantage estimate (in case of V-trace it is done separately for each minibatch)
@@ -994,25 +1183,31 @@ class Learner(Configurable):
                     buff["valids"],
                     self.cfg.gamma,
                     self.cfg.gae_lambda,
+                    self.cfg.gae_backend,
                 )
                 # here returns are not normalized yet, so we should use denormalized values
                 buff["returns"] = buff["advantages"] + buff["valids"][:, :-1] * denormalized_values[:, :-1]
 
             # remove next step obs, rnn_states, and values from the batch, we don't need them anymore
-            for key in ["normalized_obs", "rnn_states", "values", "valids"]:
+            for key in [obs_key, "rnn_states", "values", "valids"]:
                 buff[key] = buff[key][:, :-1]
 
             dataset_size = buff["actions"].shape[0] * buff["actions"].shape[1]
             for d, k, v in iterate_recursively(buff):
                 # collapse first two dimensions (batch and time) into a single dimension
-                d[k] = v.reshape((dataset_size,) + tuple(v.shape[2:]))
+                # (compact RNN states stay compact: dataset_size // recurrence states, one per recurrence chunk)
+                d[k] = v.reshape((v.shape[0] * v.shape[1],) + tuple(v.shape[2:]))
+
+            if stack_frames is not None:
+                # frames are indexed by trajectory and step, they are not split between samples like other fields
+                buff[OBS_FRAMES] = stack_frames
+                buff[OBS_FRAME_STEPS] = torch.arange(dataset_size, device=buff["actions"].device)
 
             buff["dones_cpu"] = buff["dones"].to("cpu", copy=True, dtype=torch.float, non_blocking=True)
-            buff["rewards_cpu"] = buff["rewards"].to("cpu", copy=True, dtype=torch.float, non_blocking=True)
 
             # return normalization parameters are only used on the learner, no need to lock the mutex
             if self.cfg.normalize_returns:
-                self.actor_critic.returns_normalizer(buff["returns"])  # in-place
+                model.returns_normalizer(buff["returns"])  # in-place
 
             num_invalids = dataset_size - buff["valids"].sum().item()
             if num_invalids > 0:
@@ -1029,13 +1224,91 @@ class Learner(Configurable):
 
             return buff, dataset_size, num_invalids
 
-    def train(self, batch: TensorDict) -> Optional[Dict]:
+    def _prepare_batch_timed(
+        self, batch: TensorDict, model: ActorCritic, policy_version: int
+    ) -> Tuple[Tuple[TensorDict, int, int], float, Dict[str, float]]:
+        # Timing and self.max_precision_errors are read by the main thread, so we return the time and
+        # the precision errors and merge them in the main thread
+        start = time.time()
+        precision_errors: Dict[str, float] = dict()
+        prepared = self._prepare_batch(batch, model, policy_version, precision_errors)
+        return prepared, time.time() - start, precision_errors
+
+    def _start_prefetch(self, batch: TensorDict) -> None:
+        """Prepare the next batch in a background thread while we train on the current one."""
+        assert self.prefetched is None
+
+        with self.timing.add_time("prefetch_snapshot"):
+            # weights and normalizer statistics right after the current batch was prepared, this is exactly
+            # what the next batch would see without prefetching, except for the SGD steps on the current batch
+            self.prefetch_model.load_state_dict(self.actor_critic.state_dict())
+
+        # The next batch will be trained after all SGD steps on the current batch. Using this version to mark
+        # stale experience as invalid guarantees we never exceed max_policy_lag (with early stopping there are fewer
+        # steps and we might discard slightly more experience than strictly necessary).
+        policy_version = self.train_step + self.cfg.num_epochs * self.cfg.num_batches_per_epoch
+
+        future = self.prefetch_executor.submit(self._prepare_batch_timed, batch, self.prefetch_model, policy_version)
+        self.prefetched = PrefetchedBatch(batch, policy_version, future)
+
+    def _discard_prefetched(self) -> None:
+        if self.prefetched is not None:
+            # wait for the thread to finish since it writes into the batch
+            self.prefetched.future.result()
+            self.prefetched = None
+
+    def _use_prefetched(self, batch: TensorDict) -> Optional[Tuple[TensorDict, int, int]]:
+        prefetched = self.prefetched
+        if prefetched is None:
+            return None
+        self.prefetched = None
+
+        wait_start = time.time()
+        with self.timing.add_time("prefetch_wait"):
+            prepared, prepare_time, precision_errors = prefetched.future.result()
+        wait_time = time.time() - wait_start
+
+        if prefetched.batch is not batch or self.train_step > prefetched.policy_version:
+            log.debug(f"Learner {self.policy_id} discards the prefetched batch")
+            return None
+
+        # commit normalizer statistics updated by the batch to the main model (and to the inference workers)
+        with self.param_server.policy_lock:
+            self.actor_critic.obs_normalizer.load_state_dict(self.prefetch_model.obs_normalizer.state_dict())
+            if self.actor_critic.returns_normalizer is not None:
+                returns_normalizer_state = self.prefetch_model.returns_normalizer.state_dict()
+                self.actor_critic.returns_normalizer.load_state_dict(returns_normalizer_state)
+        self._publish_obs_normalizer(self.actor_critic)
+
+        for name, error in precision_errors.items():
+            self.max_precision_errors[name] = max(error, self.max_precision_errors.get(name, 0.0))
+
+        # time we would have spent preparing this batch in the main thread minus the time we actually waited for it
+        self.timing.record("prefetch_saved", prepare_time - wait_time, average=10)
+        return prepared
+
+    def train(self, batch: TensorDict, next_batch: Optional[TensorDict] = None) -> Optional[Dict]:
+        """
+        :param batch: training batch to train on
+        :param next_batch: batch that we are going to train on next, if known. With --learner_prefetch_batches
+        it is prepared in a background thread while we train on the current batch.
+        """
         with self.timing.add_time("misc"):
+            if self.new_cfg is not None or self.policy_to_load is not None:
+                # cfg or weights are about to change, the prefetched batch is no longer valid
+                self._discard_prefetched()
+
             self._maybe_update_cfg()
             self._maybe_load_policy()
 
         with self.timing.add_time("prepare_batch"):
-            buff, experience_size, num_invalids = self._prepare_batch(batch)
+            prepared = self._use_prefetched(batch)
+            if prepared is None:
+                prepared = self._prepare_batch(batch)
+            buff, experience_size, num_invalids = prepared
+
+        if next_batch is not None and self.prefetch_executor is not None:
+            self._start_prefetch(next_batch)
 
         if num_invalids >= experience_size:
             if self.cfg.with_pbt:
@@ -1059,5 +1332,7 @@ class Learner(Configurable):
                 if train_stats is not None:
                     stats[TRAIN_STATS] = train_stats
                 stats[STATS_KEY] = memory_stats("learner", self.device)
+                for name, error in self.max_precision_errors.items():
+                    stats[STATS_KEY][f"precision_err_{name}"] = error
 
             return stats
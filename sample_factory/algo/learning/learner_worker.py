@@ -14,9 +14,10 @@ from sample_factory.algo.learning.learner import Learner
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
-from sample_factory.algo.utils.misc import LEARNER_ENV_STEPS, POLICY_ID_KEY
+from sample_factory.algo.utils.misc import LEARNER_ENV_STEPS, POLICY_ID_KEY, STATS_KEY
 from sample_factory.algo.utils.model_sharing import ParameterServer
 from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.algo.utils.tensor_dict import TensorDict
 from sample_factory.algo.utils.torch_utils import init_torch_runtime
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.utils.gpu_utils import cuda_envvars_for_policy
@@ -146,13 +147,25 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
         self.initialized.emit()
         log.debug(f"{self.object_id} finished initialization!")
 
+    def _next_training_batch(self, batch_idx: int) -> Optional[TensorDict]:
+        """Look ahead: if the batcher already has the batch we are going to train on next, we can prefetch it."""
+        ready_batches = self.batcher.ready_batches
+        consumed = ready_batches.popleft()
+        assert consumed == batch_idx, f"Expected to train on batch {consumed}, got {batch_idx}"
+        if ready_batches:
+            return self.batcher.training_batches[ready_batches[0]]
+        return None
+
     def on_new_training_batch(self, batch_idx: int):
-        stats = self.learner.train(self.batcher.training_batches[batch_idx])
+        next_batch = self._next_training_batch(batch_idx) if self.cfg.learner_prefetch_batches else None
+        stats = self.learner.train(self.batcher.training_batches[batch_idx], next_batch)
 
         self.training_iteration_since_resume += 1
         self.training_batch_released.emit(batch_idx, self.training_iteration_since_resume)
         self.finished_training_iteration.emit(self.training_iteration_since_resume)
         if stats is not None:
+            if STATS_KEY in stats and self.cfg.zero_copy_training_batches:
+                stats[STATS_KEY][f"zero_copy_batches_p{self.learner.policy_id}"] = self.batcher.zero_copy_fraction()
             self.report_msg.emit(stats)
 
     # noinspection PyMethodMayBeStatic
@@ -160,6 +173,7 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
         torch.cuda.empty_cache()
 
     def on_stop(self, *args):
+        self.learner.stop_prefetching()
         self.learner.save()
         if not self.cfg.serial_mode:
             self.join_batcher_thread()
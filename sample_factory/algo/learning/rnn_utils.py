@@ -111,7 +111,7 @@ def _build_pack_info_from_dones(
     return rollout_starts_orig, is_new_episode, select_inds, batch_sizes, sorted_indices
 
 
-def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
+def build_rnn_inputs(x, dones_cpu, rnn_states, T: int, rnn_states_stride: int = 1):
     """
     Create a PackedSequence input for an RNN such that each
     set of steps that are part of the same episode are all part of
@@ -121,6 +121,7 @@ def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
     :param dones_cpu: A (N*T) tensor where dones[i] == 1.0 indicates an episode is done, a CPU-bound tensor
     :param rnn_states: A (N*T, -1) tensor of the rnn_hidden_states
     :param T: The length of the rollout
+    :param rnn_states_stride: rnn_states only hold every n-th step, i.e. a (N*T/n, -1) tensor (see --compact_rnn_states)
     :return: tuple(x_seq, rnn_states, select_inds)
         WHERE
         x_seq is the PackedSequence version of x to pass to the RNN
@@ -147,7 +148,9 @@ def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
     # (1 - is_new_episode.view(-1, 1)).index_select(0, rollout_starts) gives us a zero for every beginning of
     # the sequence that is actually also a start of a new episode, and by multiplying this RNN state by zero
     # we ensure no information transfer across episode boundaries.
-    rnn_states = rnn_states.index_select(0, rollout_starts)
+    # sequences that don't start at a stored state (i.e. mid-chunk with compact rnn_states) always start a new
+    # episode, so the state we select for them is zeroed out below anyway
+    rnn_states = rnn_states.index_select(0, torch.div(rollout_starts, rnn_states_stride, rounding_mode="floor"))
     is_same_episode = (1 - is_new_episode.view(-1, 1)).index_select(0, rollout_starts)
     rnn_states = rnn_states * is_same_episode
 
@@ -16,6 +16,7 @@ from sample_factory.algo.learning.batcher import Batcher
 from sample_factory.algo.learning.learner_worker import LearnerWorker
 from sample_factory.algo.sampling.sampler import AbstractSampler
 from sample_factory.algo.sampling.stats import samples_stats_handler, stats_msg_handler, timing_msg_handler
+from sample_factory.algo.sampling.stragglers import StragglerMonitor
 from sample_factory.algo.utils.env_info import EnvInfo, obtain_env_info_in_a_separate_process
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
 from sample_factory.algo.utils.misc import (
@@ -23,6 +24,7 @@ from sample_factory.algo.utils.misc import (
     LEARNER_ENV_STEPS,
     SAMPLES_COLLECTED,
     STATS_KEY,
+    STRAGGLERS,
     TIMING_STATS,
     TRAIN_STATS,
     ExperimentStatus,
@@ -121,6 +123,7 @@ class Runner(EventLoopObject, Configurable):
         self.summaries_interval_sec = self.cfg.experiment_summaries_interval  # sec
         self.heartbeat_report_sec = self.cfg.heartbeat_reporting_interval
         self.update_training_info_every_sec = 5.0
+        self.straggler_report_sec = self.cfg.straggler_report_interval
 
         self.fps_stats = deque([], maxlen=max(self.avg_stats_intervals))
         self.throughput_stats = [deque([], maxlen=10) for _ in range(self.cfg.num_policies)]
@@ -131,6 +134,9 @@ class Runner(EventLoopObject, Configurable):
         self.policy_avg_stats: Dict[str, List[Deque]] = dict()
         self.policy_lag = [dict() for _ in range(self.cfg.num_policies)]
 
+        # exclusion of straggling workers is enabled in connect_components() if the config allows it
+        self.straggler_monitor = StragglerMonitor(self.cfg.straggler_factor, exclude_workers=False)
+
         self._handle_restart()
 
         init_wandb(self.cfg)  # should be done before writers are initialized
@@ -145,6 +151,7 @@ class Runner(EventLoopObject, Configurable):
         self.msg_handlers: Dict[str, List[MsgHandler]] = {
             TIMING_STATS: [timing_msg_handler],
             STATS_KEY: [stats_msg_handler],
+            STRAGGLERS: [self._stragglers_msg_handler],
         }
 
         # handlers for policy-specific messages
@@ -176,6 +183,7 @@ class Runner(EventLoopObject, Configurable):
             periodic(self.cfg.save_milestones_sec, self._save_milestone_policy)
 
         periodic(self.heartbeat_report_sec, self._check_heartbeat)
+        periodic(self.straggler_report_sec, self._report_stragglers)
 
         self.heartbeat_dict = {}
         self.queue_size_dict = {}
@@ -200,6 +208,10 @@ class Runner(EventLoopObject, Configurable):
     def save_milestone(self):
         ...
 
+    @signal
+    def update_stragglers(self):
+        ...
+
     @signal
     def stop(self):
         """Emitted when we're about to stop the experiment."""
@@ -253,6 +265,10 @@ class Runner(EventLoopObject, Configurable):
                     for handler in self.policy_msg_handlers.get(key, ()):
                         handler(self, msg, policy_id)
 
+    @staticmethod
+    def _stragglers_msg_handler(runner: Runner, msg: Dict) -> None:
+        runner.straggler_monitor.on_report(msg[STRAGGLERS])
+
     @staticmethod
     def _learner_steps_handler(runner: Runner, msg: Dict, policy_id: PolicyID) -> None:
         env_steps: int = msg[LEARNER_ENV_STEPS]
@@ -448,6 +464,34 @@ class Runner(EventLoopObject, Configurable):
 
         self.update_training_info.emit(training_info)
 
+    def _report_stragglers(self):
+        """
+        Compare the step latencies of the rollout workers and their envs (see stragglers.py), add the straggler
+        report to the stats. With --exclude_straggler_workers the rollouts of the straggling workers are
+        redistributed among other workers in the next sync mode training iteration.
+        """
+        monitor = self.straggler_monitor
+        stats = monitor.update()
+        if stats is None:
+            return
+
+        self.stats.update(stats)
+
+        if monitor.stragglers or stats["slow_envs"] > 0:
+            slow_envs = {w: sorted(envs) for w, envs in monitor.slow_envs.items() if envs}
+            log.warning(
+                "Straggler report: workers %r step slower than %.1fx the median of %.2f ms per env step "
+                "(excluded: %r), slow envs by worker: %r, env restarts: %d",
+                monitor.stragglers,
+                monitor.factor,
+                stats["worker_step_latency_ms_median"],
+                monitor.excluded_workers,
+                slow_envs,
+                stats["env_restarts"],
+            )
+
+        self.update_stragglers.emit(monitor.excluded_workers)
+
     def update_reward_shaping(self, policy_id: PolicyID, reward_shaping: Dict[str, Any]) -> None:
         self.reward_shaping[policy_id] = reward_shaping
 
@@ -632,6 +676,7 @@ class Runner(EventLoopObject, Configurable):
         self.event_loop.start.connect(self._on_start)
 
         sampler = self.sampler
+        self.straggler_monitor.exclude_workers = self._can_exclude_stragglers()
         for policy_id in range(self.cfg.num_policies):
             # when runner is ready we initialize the learner first and then all other components in a chain
             learner_worker = self.learners[policy_id]
@@ -661,6 +706,8 @@ class Runner(EventLoopObject, Configurable):
             self.save_periodic.connect(learner_worker.save)
             self.save_best.connect(learner_worker.save_best)
             self.save_milestone.connect(learner_worker.save_milestone)
+            if self.straggler_monitor.exclude_workers:
+                self.update_stragglers.connect(batcher.on_update_stragglers)
 
             # stop components when needed
             self._setup_component_termination(self.stop, batcher)
@@ -682,6 +729,15 @@ class Runner(EventLoopObject, Configurable):
         # connect additional signal-slot pairs in the observers if needed
         self._observers_call(AlgoObserver.on_connect_components, self)
 
+    def _can_exclude_stragglers(self) -> bool:
+        """Rollouts of excluded workers are taken over by others, so all of them must sample into the same buffers."""
+        if not self.cfg.exclude_straggler_workers or self.cfg.async_rl or self.cfg.num_policies > 1:
+            return False
+        if len(self.buffer_mgr.traj_buffer_queues) > 1:
+            log.warning("--exclude_straggler_workers is ignored, rollout workers sample on different devices")
+            return False
+        return True
+
     def _should_end_training(self):
         end = len(self.env_steps) > 0 and all(s > self.cfg.train_for_env_steps for s in self.env_steps.values())
         end |= self.total_train_seconds > self.cfg.train_for_seconds
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import numbers
+import time
 from queue import Empty
 from typing import Dict, List, Optional, Tuple
 
@@ -9,14 +10,29 @@ import numpy as np
 import torch
 from torch import Tensor
 
+from sample_factory.algo.sampling.decorrelation import (
+    burst_length,
+    needs_env_decorrelation,
+    sample_flat_action,
+    step_random_actions,
+)
+from sample_factory.algo.sampling.env_reset_pool import EnvResetPool
+from sample_factory.algo.sampling.env_startup import ENV_CHECK, ENV_CREATE, ENV_DECORRELATE, ENV_RESET, run_concurrently
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
 from sample_factory.algo.sampling.sampling_utils import VectorEnvRunner, record_episode_statistics_wrapper_stats
+from sample_factory.algo.sampling.stragglers import StepLatencyTracker
 from sample_factory.algo.utils.env_info import EnvInfo, check_env_info
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, STACKED_OBS_KEY, store_stacked_obs
 from sample_factory.algo.utils.make_env import BatchedVecEnv, SequentialVectorizeWrapper, make_env_func_batched
 from sample_factory.algo.utils.misc import EPISODIC, POLICY_ID_KEY
+from sample_factory.algo.utils.shared_buffers import rnn_states_index
+from sample_factory.algo.utils.subproc_vec_env import SubprocVecEnv
 from sample_factory.algo.utils.tensor_dict import TensorDict
 from sample_factory.algo.utils.torch_utils import synchronize
 from sample_factory.envs.env_utils import (
+    ObsOutputInterface,
     TrainingInfoInterface,
+    find_obs_output_interface,
     find_training_info_interface,
     set_reward_shaping,
     set_training_info,
@@ -103,6 +119,8 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         buffer_mgr,
         sampling_device: str,
         training_info: List[Optional[Dict]],
+        env_step_pool: EnvStepPool,
+        env_reset_pool: Optional[EnvResetPool] = None,
     ):
         # TODO: comment
         """
@@ -116,6 +134,8 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         :param buffer_mgr: a collection of all shared data structures used by the algorithm. Most importantly,
         the trajectory buffers in shared memory.
         :param training_info: curr env steps, reward shaping scheme, etc.
+        :param env_step_pool: steps the envs of the vector, possibly concurrently (see --env_step_threads)
+        :param env_reset_pool: resets the envs in the background at the end of an episode (see --env_reset_prefetch)
         """
         super().__init__(cfg, env_info, worker_idx, split_idx, buffer_mgr, sampling_device)
 
@@ -123,21 +143,29 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         log.debug(f"EnvRunner {worker_idx}-{split_idx} uses policy {self.policy_id}")
 
         self.num_envs = num_envs
+        # envs of the vector are stepped together, we only know the latency of the whole vector (reported as its first env)
+        first_env_id = self.worker_idx * self.cfg.num_envs_per_worker + self.split_idx * self.num_envs
+        self.step_latency = StepLatencyTracker(1, first_env_id)
 
-        self.vec_env: Optional[BatchedVecEnv | SequentialVectorizeWrapper] = None
+        self.vec_env: Optional[BatchedVecEnv | SequentialVectorizeWrapper | SubprocVecEnv] = None
         self.env_training_info_interface: Optional[TrainingInfoInterface] = None
+        self.obs_output_interface: Optional[ObsOutputInterface] = None
 
         self.last_obs = None
+        self.last_obs_in_traj = False  # env wrote last_obs directly into the current trajectory buffer
         self.last_rnn_state = None
         self.policy_id_buffer = None
 
         self.curr_traj: Optional[TensorDict] = None
         self.curr_step: Optional[TensorDict] = None
+        self.curr_traj_rnn_states: Optional[Tensor] = None  # only used with --compact_rnn_states
         self.curr_traj_slice: Optional[slice] = None
 
         self.curr_episode_reward = self.curr_episode_len = None
 
         self.training_info: List[Optional[Dict]] = training_info
+        self.env_step_pool: EnvStepPool = env_step_pool
+        self.env_reset_pool: Optional[EnvResetPool] = env_reset_pool
 
         self.min_raw_rewards = self.max_raw_rewards = None
 
@@ -148,7 +176,7 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         Actually instantiate the env instances.
         Also creates ActorState objects that hold the state of individual actors in (potentially) multi-agent envs.
         """
-        envs: List[BatchedVecEnv] = []
+        env_configs: List[AttrDict] = []
         for env_i in range(self.num_envs):
             vector_idx = self.split_idx * self.num_envs + env_i
 
@@ -160,25 +188,21 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
                 vector_index=vector_idx,
                 env_id=env_id,
             )
+            env_configs.append(env_config)
 
-            # log.info('Creating env %r... %d-%d-%d', env_config, self.worker_idx, self.split_idx, env_i)
-            # a vectorized environment - we assume that it always provides a dict of vectors of obs, rewards, etc.
-            env: BatchedVecEnv = make_env_func_batched(self.cfg, env_config)
-            check_env_info(env, self.env_info, self.cfg)
-
-            env.seed(env_id)  # since Gym 0.26 seeding is done in reset(), we do it in BatchedVecEnv class
-            envs.append(env)
-
-        if len(envs) == 1:
-            # assuming this is already a vectorized environment
-            assert envs[0].num_agents >= 1  # sanity check
-            self.vec_env = envs[0]
+        if self.cfg.env_subprocesses:
+            # every env is simulated in its own child process, children write observations into our trajectories
+            # (created here and not in make_env_func_batched(), which only knows how to make a single env)
+            with self.startup_timeline.record(ENV_CREATE):
+                self.vec_env = SubprocVecEnv(self.cfg, self.env_info, env_configs, self.traj_tensors["obs"])
         else:
-            self.vec_env = SequentialVectorizeWrapper(envs)
+            self.vec_env = self._make_envs_in_process(env_configs)
 
         self.env_training_info_interface = find_training_info_interface(self.vec_env)
+        self.obs_output_interface = find_obs_output_interface(self.vec_env)
 
-        self.last_obs, info = self.vec_env.reset()  # anything we need to do with info? Currently we ignore it
+        with self.startup_timeline.record(ENV_RESET):
+            self.last_obs, info = self.vec_env.reset()  # anything we need to do with info? Currently we ignore it
 
         self.last_rnn_state = torch.zeros_like(self.traj_tensors["rnn_states"][0 : self.vec_env.num_agents, 0])
 
@@ -195,8 +219,106 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         self.min_raw_rewards = torch.empty_like(self.curr_episode_reward).fill_(np.inf)
         self.max_raw_rewards = torch.empty_like(self.curr_episode_reward).fill_(-np.inf)
 
+        if needs_env_decorrelation(self.cfg):
+            self._decorrelate_envs()
+
         self.env_step_ready = True
 
+    def _decorrelate_envs(self) -> None:
+        """
+        Envs step bursts of random actions (see decorrelation.py). Every env of a SequentialVectorizeWrapper steps its
+        own burst, concurrently with --env_creation_threads. Natively vectorized envs and env subprocesses can only
+        step all of their agents together, so the whole split steps a single burst.
+        """
+        started = time.time()
+        first_env_id = self.worker_idx * self.cfg.num_envs_per_worker + self.split_idx * self.num_envs
+
+        if isinstance(self.vec_env, SequentialVectorizeWrapper):
+            envs = self.vec_env.envs
+            env_phases = run_concurrently(
+                lambda env_i: self._decorrelate_env(envs[env_i], env_i, first_env_id + env_i),
+                len(envs),
+                self.cfg.env_creation_threads,
+                f"env_decorrelate_w{self.worker_idx}",
+            )
+            self.decorrelation_phases = [phase for phases in env_phases for phase in phases]
+        else:
+            self.decorrelation_phases = self._decorrelate_env(self.vec_env, 0, first_env_id)
+
+        self.decorrelation_seconds = time.time() - started
+
+    def _decorrelate_env(self, env: BatchedVecEnv | SubprocVecEnv, env_i: int, env_id: int) -> List[int]:
+        """:return: episode phases of the agents of the env after a burst of random actions"""
+        num_agents = env.num_agents
+        phases = torch.zeros(num_agents, dtype=torch.int64)
+
+        def step_random_action():
+            samples = np.stack([sample_flat_action(self.env_info.action_space) for _ in range(num_agents)])
+            actions = preprocess_actions(self.env_info, torch.from_numpy(samples).to(self.device))
+            obs, rew, terminated, truncated, infos = env.step(actions)
+            dones = (terminated | truncated).cpu()
+            phases.add_(1).masked_fill_(dones, 0)
+            return obs, dones.tolist()
+
+        # seeded by the global env index, so envs and workers get different bursts
+        num_steps = burst_length(self.cfg, env_id)
+        with self.startup_timeline.record(ENV_DECORRELATE, env_i) as details:
+            last_obs, details["steps"], _ = step_random_actions(step_random_action, num_steps, True)
+
+        if last_obs is not None:
+            if env is self.vec_env:
+                self.last_obs = last_obs
+            else:
+                # we stepped the env behind the vector's back, its observations go into the rows of the env
+                agents = slice(env_i * num_agents, (env_i + 1) * num_agents)
+                for key, x in last_obs.items():
+                    self.last_obs[key][agents] = x
+
+        return phases.tolist()
+
+    def _make_env(self, env_config: AttrDict, env_i: int) -> BatchedVecEnv:
+        # a vectorized environment - we assume that it always provides a dict of vectors of obs, rewards, etc.
+        with self.startup_timeline.record(ENV_CREATE, env_i):
+            env: BatchedVecEnv = make_env_func_batched(self.cfg, env_config, env_reset_pool=self.env_reset_pool)
+        with self.startup_timeline.record(ENV_CHECK, env_i):
+            check_env_info(env, self.env_info, self.cfg)
+
+        env.seed(env_config.env_id)  # since Gym 0.26 seeding is done in reset(), we do it in BatchedVecEnv class
+        return env
+
+    def _make_envs_in_process(self, env_configs: List[AttrDict]) -> BatchedVecEnv | SequentialVectorizeWrapper:
+        # envs can be created concurrently (see --env_creation_threads), we keep them in the order of the vector
+        envs: List[BatchedVecEnv] = run_concurrently(
+            lambda env_i: self._make_env(env_configs[env_i], env_i),
+            len(env_configs),
+            self.cfg.env_creation_threads,
+            f"env_create_w{self.worker_idx}",
+        )
+
+        if len(envs) == 1:
+            # assuming this is already a vectorized environment
+            assert envs[0].num_agents >= 1  # sanity check
+            return envs[0]
+        else:
+            return SequentialVectorizeWrapper(envs, self.env_step_pool)
+
+    def _set_obs_output(self) -> bool:
+        """
+        Let the env write the observations of the next step directly into their slot in the trajectory buffer.
+        :return: whether the observations will be written into the trajectory
+        """
+        if self.obs_output_interface is None:
+            return False
+
+        next_step = self.rollout_step + 1
+        if next_step >= self.cfg.rollout:
+            # observations after the last step of the rollout also start the next rollout, they have to outlive
+            # the current trajectory buffer which is handed over to the learner
+            return False
+
+        self.obs_output_interface.set_obs_output(self.curr_traj["obs"][:, next_step])
+        return True
+
     def _process_rewards(self, rewards_orig: Tensor, rewards_orig_cpu: Tensor) -> Tensor:
         rewards = rewards_orig * self.cfg.reward_scale
         rewards.clamp_(-self.cfg.reward_clip, self.cfg.reward_clip)
@@ -282,17 +404,23 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         # Saving obs and hidden states for the step AFTER the last step in the current rollout.
         # We're going to need them later when we calculate next step value estimates.
         self.curr_traj["obs"][:, self.cfg.rollout] = self.last_obs
-        self.curr_traj["rnn_states"][:, self.cfg.rollout] = self.last_rnn_state
+        if self.dedup_framestack:
+            store_stacked_obs(self.curr_traj[OBS_FRAMES], self.last_obs[STACKED_OBS_KEY], self.cfg.rollout)
+        if self.cfg.compact_rnn_states:
+            self.curr_traj_rnn_states[:, -1] = self.last_rnn_state
+        else:
+            self.curr_traj["rnn_states"][:, self.cfg.rollout] = self.last_rnn_state
 
         traj_dict = dict(policy_id=self.policy_id, traj_buffer_idx=self.curr_traj_slice)
         return [traj_dict]
 
-    def advance_rollouts(self, policy_id: PolicyID, timing) -> Tuple[List[Dict], List[Dict]]:
+    def advance_rollouts(self, policy_id: PolicyID, request_id: int, timing) -> Tuple[List[Dict], List[Dict]]:
         # TODO: comment
         """
         Main function in VectorEnvRunner. Does one step of simulation (if all actions for all actors are available).
 
         :param policy_id:
+        :param request_id: not used, the whole vector is stepped with a single request
         :param timing: this is just for profiling
         :return: same as reset(), return a set of requests for policy workers, asking them to generate actions for
         the next env step.
@@ -305,7 +433,10 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         complete_rollouts, episodic_stats = [], []
 
         with timing.add_time("env_step"):
+            self.last_obs_in_traj = self._set_obs_output()
+            step_started = time.time()
             self.last_obs, rewards, terminated, truncated, infos = self.vec_env.step(actions)
+            self.step_latency.update([0], [(time.time() - step_started) / self.num_envs])
             dones = terminated | truncated  # both should be either tensors or numpy arrays of bools
 
         with timing.add_time("post_env_step"):
@@ -361,8 +492,21 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
 
             self.curr_traj_slice = buffers
             self.curr_traj = self.traj_tensors[self.curr_traj_slice]
+            if self.cfg.compact_rnn_states:
+                # not indexed by rollout step like the rest of the trajectory, see _save_rnn_states()
+                self.curr_traj_rnn_states = self.curr_traj.pop("rnn_states")
             return True
 
+    def _save_rnn_states(self) -> None:
+        """
+        With --compact_rnn_states inference workers read the current states from a separate per-actor buffer,
+        trajectories only keep the states at the start of each recurrence chunk.
+        """
+        self.rnn_state_tensors[:] = self.last_rnn_state
+        idx = rnn_states_index(self.rollout_step, self.rnn_states_stride)
+        if idx is not None:
+            self.curr_traj_rnn_states[:, idx] = self.last_rnn_state
+
     def generate_policy_request(self) -> Optional[Dict]:
         if not self.env_step_ready:
             # we haven't actually simulated the environment yet
@@ -373,8 +517,15 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
             return None
 
         self.curr_step = self.curr_traj[:, self.rollout_step]
-        # save observations and RNN states in a trajectory
-        self.curr_step[:] = dict(obs=self.last_obs, rnn_states=self.last_rnn_state)
+        # save observations and RNN states in a trajectory, unless the env already put the observations there
+        step_data = dict() if self.last_obs_in_traj else dict(obs=self.last_obs)
+        if self.cfg.compact_rnn_states:
+            self.curr_step[:] = step_data
+            self._save_rnn_states()
+        else:
+            self.curr_step[:] = dict(**step_data, rnn_states=self.last_rnn_state)
+        if self.dedup_framestack:
+            store_stacked_obs(self.curr_traj[OBS_FRAMES], self.last_obs[STACKED_OBS_KEY], self.rollout_step)
         policy_request = {self.policy_id: (self.curr_traj_slice, self.rollout_step)}
         self.env_step_ready = False
         return policy_request
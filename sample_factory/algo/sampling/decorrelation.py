@@ -0,0 +1,94 @@
+"""
+Decorrelation of experience at startup (see --decorrelation_method).
+
+"sleep" (default): rollout workers sleep for up to --decorrelate_experience_max_seconds after their first rollouts, and
+with non-batched sampling env i of the worker steps rollout * i random actions before training starts. Sleeping only
+shifts the workers in time without staggering the episodes, and the env steps add up quadratically with the number
+of envs per worker, so on big experiments this costs minutes at every (re)start.
+
+"random_bursts": workers don't sleep. Every env steps random actions for a random number of steps drawn from the same
+range. With batched sampling natively vectorized envs (and env subprocesses) step all of their agents together, so
+there the whole split steps a single burst. Once the first episode of the env ends we know its length and
+only advance to the target phase modulo this length, so we never step more than about two episodes. Bursts of
+different envs run concurrently with --env_creation_threads.
+
+For both methods we report the dispersion of the episode phases (steps since the last reset) of the envs, overall and
+within the splits, against the time spent on decorrelation.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Sequence, Tuple
+
+import gymnasium as gym
+import numpy as np
+
+from sample_factory.utils.typing import Config
+
+SLEEP = "sleep"
+RANDOM_BURSTS = "random_bursts"
+
+
+def needs_env_decorrelation(cfg: Config) -> bool:
+    """Envs step random actions before training starts (instead of or in addition to the worker sleep)."""
+    if cfg.decorrelation_method == RANDOM_BURSTS:
+        return cfg.decorrelate_envs_on_one_worker or cfg.decorrelate_experience_max_seconds > 0
+    return cfg.decorrelate_envs_on_one_worker and not cfg.batched_sampling
+
+
+def max_decorrelation_steps(cfg: Config) -> int:
+    return cfg.rollout * cfg.num_envs_per_worker
+
+
+def burst_length(cfg: Config, seed: int) -> int:
+    """Random number of decorrelation steps, seeded so that experiments are reproducible."""
+    rng = np.random.default_rng(seed)
+    return int(rng.integers(0, max_decorrelation_steps(cfg) + 1))
+
+
+def sample_flat_action(space: gym.Space) -> np.ndarray:
+    """Random action in the format of the policy outputs, i.e. one value per Discrete action (see action_splits)."""
+    if isinstance(space, gym.spaces.Tuple):
+        return np.concatenate([sample_flat_action(s) for s in space])
+    return np.asarray(space.sample(), dtype=np.float32).reshape(-1)
+
+
+def step_random_actions(
+    step_func: Callable[[], Tuple[Any, Sequence[bool]]], num_steps: int, stop_after_first_episode: bool
+) -> Tuple[Any, int, int]:
+    """
+    :param step_func: steps the env with random actions, returns observations and done flags of all agents
+    :param stop_after_first_episode: when the first episode ends after L steps, step only (num_steps % L) more steps
+    :return: observations after the last step (None if we did not step at all), number of steps taken, episode phase
+    """
+    observations = None
+    steps = phase = 0
+    while steps < num_steps:
+        observations, dones = step_func()
+        steps += 1
+        phase += 1
+
+        if all(dones):
+            if stop_after_first_episode and phase == steps:
+                # first episode of the env is over, now we know its length
+                num_steps = min(num_steps, steps + num_steps % steps)
+            phase = 0
+
+    return observations, steps, phase
+
+
+def phase_dispersion_stats(split_phases: Sequence[Sequence[int]], seconds: float) -> Dict[str, float]:
+    """
+    :param split_phases: steps since the last episode reset of every env (agent) of every split after decorrelation
+    :return: dispersion of the phases of all envs of the worker, and the mean dispersion within the splits. Splits are
+    stepped one after another, so envs of one split that are in phase also request actions at the same time.
+    """
+    phases = [phase for phases in split_phases for phase in phases]
+    phase_std = float(np.std(phases)) if len(phases) > 0 else 0.0
+    split_stds = [float(np.std(phases)) for phases in split_phases if len(phases) > 0]
+    return dict(
+        decorrelation_sec=seconds,
+        decorrelation_phase_std=phase_std,
+        decorrelation_split_phase_std=float(np.mean(split_stds)) if split_stds else 0.0,
+        decorrelation_phase_std_per_sec=phase_std / max(seconds, 1e-3),
+    )
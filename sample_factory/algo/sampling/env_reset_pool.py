@@ -0,0 +1,155 @@
+"""
+Background env resets (see --env_reset_prefetch).
+
+Some envs (DMLab, VizDoom with bots, NetHack) spend 100s of milliseconds or more in reset(). Normally the env is reset
+inline at the end of an episode, which stalls the whole split of the rollout worker. With reset prefetch every env
+slot keeps a spare instance of the env that is reset on a background thread. When the episode of the active instance
+ends, the ready spare is swapped in and the finished instance is reset in the background while the spare is simulated.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import gymnasium as gym
+
+from sample_factory.algo.sampling.inference_batching import WindowHistogram
+from sample_factory.envs.env_utils import (
+    RewardShapingInterface,
+    TrainingInfoInterface,
+    find_training_info_interface,
+    find_wrapper_interface,
+)
+
+ENV_RESET_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class EnvResetPool:
+    """Resets spare env instances on background threads and keeps track of the reset latency we managed to hide."""
+
+    def __init__(self, num_threads: int, name: str = "env_reset"):
+        """:param num_threads: every env slot has at most one reset in flight, so this is usually the number of envs"""
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_threads), thread_name_prefix=name)
+
+        # envs can be stepped (and therefore auto-reset) on the threads of the EnvStepPool
+        self.lock = threading.Lock()
+
+        # duration of the background resets, and the part of it that the rollout worker still had to wait for
+        buckets = [ms / 1000 for ms in ENV_RESET_BUCKETS_MS]
+        self.reset_time_hist = WindowHistogram(buckets)
+        self.exposed_time_hist = WindowHistogram(buckets)
+
+        # totals since the last call to pop_reset_times()
+        self.hidden_time = self.exposed_time = 0.0
+
+    @staticmethod
+    def _timed_reset(env: gym.Env, reset_kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+        started = time.time()
+        result = env.reset(**reset_kwargs)
+        return result, time.time() - started
+
+    def wrap(self, env: gym.Env, make_env: Callable[[], gym.Env]) -> gym.Env:
+        """:return: env that is reset in the background on this pool, make_env creates its spare instance"""
+        return ResetPrefetchWrapper(env, make_env, self)
+
+    def submit(self, env: gym.Env, reset_kwargs: Dict[str, Any]) -> Future:
+        return self.executor.submit(self._timed_reset, env, reset_kwargs)
+
+    def wait(self, reset: Future) -> Tuple[Any, Dict]:
+        """Wait for the background reset of an env we are about to swap in. :return: result of env.reset()"""
+        started = time.time()
+        result, reset_time = reset.result()
+        exposed_time = time.time() - started
+
+        with self.lock:
+            self.hidden_time += max(reset_time - exposed_time, 0.0)
+            self.exposed_time += exposed_time
+            self.reset_time_hist.add(reset_time)
+            self.exposed_time_hist.add(exposed_time)
+
+        return result
+
+    def pop_reset_times(self) -> Tuple[float, float]:
+        """:return: reset latency (seconds) hidden by the background resets and exposed to the rollout worker"""
+        with self.lock:
+            hidden_time, exposed_time = self.hidden_time, self.exposed_time
+            self.hidden_time = self.exposed_time = 0.0
+        return hidden_time, exposed_time
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            stats = self.reset_time_hist.summary("env_reset_ms", scale=1000)
+            stats.update(self.exposed_time_hist.summary("env_reset_exposed_ms", scale=1000))
+        return stats
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+class ResetPrefetchWrapper(gym.Wrapper, TrainingInfoInterface, RewardShapingInterface):
+    """
+    Keeps a spare instance of a single-agent env that is reset in the background.
+    reset() without arguments (auto-reset at the end of an episode) swaps in the spare and resets the finished instance
+    on the EnvResetPool. Resets with a seed or options (i.e. the very first reset) are done inline.
+    """
+
+    # otherwise the spare instance would play exactly the same episodes as the active one
+    SPARE_SEED_OFFSET = 1 << 31
+
+    def __init__(self, env: gym.Env, make_env: Callable[[], gym.Env], reset_pool: EnvResetPool):
+        gym.Wrapper.__init__(self, env)
+        TrainingInfoInterface.__init__(self)
+
+        self.spare_env: gym.Env = make_env()
+        self.reset_pool: EnvResetPool = reset_pool
+        self.spare_reset: Optional[Future] = None
+
+    def _wait_for_spare(self) -> None:
+        if self.spare_reset is not None:
+            self.spare_reset.result()
+            self.spare_reset = None
+
+    def reset(self, **kwargs):
+        if kwargs or self.spare_reset is None:
+            self._wait_for_spare()  # spare env can't be reset twice at the same time
+            result = self.env.reset(**kwargs)
+
+            spare_kwargs = dict(kwargs)
+            if kwargs.get("seed") is not None:
+                spare_kwargs["seed"] = kwargs["seed"] + self.SPARE_SEED_OFFSET
+            self.spare_reset = self.reset_pool.submit(self.spare_env, spare_kwargs)
+            return result
+
+        result = self.reset_pool.wait(self.spare_reset)
+        self.env, self.spare_env = self.spare_env, self.env
+        self.spare_reset = self.reset_pool.submit(self.spare_env, dict())
+        return result
+
+    def _all_envs(self) -> Tuple[gym.Env, gym.Env]:
+        return self.env, self.spare_env
+
+    def set_training_info(self, training_info: Dict) -> None:
+        for env in self._all_envs():
+            env_train_info = find_training_info_interface(env)
+            if env_train_info is not None:
+                env_train_info.set_training_info(training_info)
+
+    def get_default_reward_shaping(self) -> Optional[Dict[str, Any]]:
+        env_rew_shaping = find_wrapper_interface(self.env, RewardShapingInterface)
+        return None if env_rew_shaping is None else env_rew_shaping.get_default_reward_shaping()
+
+    def set_reward_shaping(self, reward_shaping: Dict[str, Any], agent_idx: int | slice) -> None:
+        for env in self._all_envs():
+            env_rew_shaping = find_wrapper_interface(env, RewardShapingInterface)
+            if env_rew_shaping is not None:
+                env_rew_shaping.set_reward_shaping(reward_shaping, agent_idx)
+
+    def close(self):
+        self._wait_for_spare()
+        self.spare_env.close()
+        self.env.close()
@@ -0,0 +1,116 @@
+"""
+Env construction at rollout worker startup (see --env_creation_threads).
+
+Creating an env can take seconds (VizDoom, DMLab), and with dozens of envs per worker creating them one after another
+dominates experiment startup. Envs can be created, checked and reset on a bounded pool of threads instead. Every phase
+is recorded in a startup timeline that the rollout worker writes to the experiment dir.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# phases of env startup recorded in the timeline
+ENV_CREATE = "create"
+ENV_CHECK = "check"
+ENV_RESET = "reset"
+ENV_DECORRELATE = "decorrelate"
+
+
+class StartupTimeline:
+    """Start time and duration of every phase of env startup. Phases can be recorded from multiple threads."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def record(self, phase: str, env_idx: Optional[int] = None, **kwargs):
+        """
+        :param env_idx: index of the env in the vector, None if the phase covers all envs of the vector
+        :return: (as the context) dict of extra details of the event, the caller can add more of them
+        """
+        started = time.time()
+        details = dict(kwargs)
+        try:
+            yield details
+        finally:
+            event = dict(
+                phase=phase,
+                env_idx=env_idx,
+                start=started,
+                duration=time.time() - started,
+                thread=threading.current_thread().name,
+                **details,
+            )
+            with self.lock:
+                self.events.append(event)
+
+    def phase_totals(self) -> Dict[str, float]:
+        """:return: total time spent in each phase, summed over the envs (i.e. can exceed wall time with threads)"""
+        totals = dict()
+        with self.lock:
+            for event in self.events:
+                totals[event["phase"]] = totals.get(event["phase"], 0.0) + event["duration"]
+        return totals
+
+
+def run_concurrently(func: Callable[[int], T], num_items: int, num_threads: int, name: str) -> List[T]:
+    """
+    :param num_threads: 0 or 1 means sequential execution in the calling thread
+    :return: func(i) for i in range(num_items), in this order. Exceptions are re-raised in the calling thread.
+    """
+    num_threads = min(num_threads, num_items)
+    if num_threads <= 1:
+        return [func(i) for i in range(num_items)]
+
+    with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix=name) as executor:
+        return list(executor.map(func, range(num_items)))
+
+
+def merge_startup_timelines(
+    worker_idx: int, start_time: float, timelines: List[StartupTimeline], num_threads: int
+) -> Dict[str, Any]:
+    """
+    Merge the startup timelines of all splits of a rollout worker. Times are in seconds since start_time.
+    :return: json-serializable dict
+    """
+    events = []
+    totals = dict()
+    for split_idx, timeline in enumerate(timelines):
+        for event in timeline.events:
+            event = dict(event, split_idx=split_idx, start=event["start"] - start_time)
+            events.append(event)
+        for phase, total in timeline.phase_totals().items():
+            totals[phase] = totals.get(phase, 0.0) + total
+
+    events.sort(key=lambda e: e["start"])
+    wall_time = max((e["start"] + e["duration"] for e in events), default=0.0)
+    timeline_dict = dict(
+        worker_idx=worker_idx,
+        env_creation_threads=num_threads,
+        wall_time=wall_time,
+        phase_totals=totals,
+        events=events,
+    )
+    return timeline_dict
+
+
+def save_startup_timeline(
+    filename: str, worker_idx: int, start_time: float, timelines: List[StartupTimeline], num_threads: int
+) -> Dict[str, Any]:
+    """
+    Write the startup timelines of all splits of a rollout worker as json, see merge_startup_timelines().
+    :return: the json dict
+    """
+    timeline_dict = merge_startup_timelines(worker_idx, start_time, timelines, num_threads)
+    with open(filename, "w") as json_file:
+        json.dump(timeline_dict, json_file, indent=2)
+    return timeline_dict
@@ -0,0 +1,63 @@
+"""
+Concurrent stepping of the envs of one vector runner (see --env_step_threads).
+
+Many simulators (VizDoom, DMLab, NLE, MuJoCo) release the GIL inside step(), so a few threads within the rollout
+worker can simulate several envs at once. Results are always returned in env order, so the callers write them into
+the same buffers as with sequential stepping.
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sample_factory.algo.sampling.inference_batching import WindowHistogram
+
+ENV_STEP_BUCKETS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+class EnvStepPool:
+    def __init__(self, num_threads: int, num_envs: int, name: str = "env_step"):
+        """
+        :param num_threads: 0 or 1 means sequential stepping in the calling thread
+        :param num_envs: number of envs we step at a time, we never need more threads than that
+        """
+        num_threads = min(num_threads, num_envs)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if num_threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix=name)
+
+        # duration of the individual env steps
+        self.step_time_hist = WindowHistogram([ms / 1000 for ms in ENV_STEP_BUCKETS_MS], maxlen=max(500, 4 * num_envs))
+        # durations of the env steps of the last step() call, in the order of the envs
+        self.last_step_times: List[float] = []
+
+    @staticmethod
+    def _timed_step(env, actions) -> Tuple[Any, float]:
+        started = time.time()
+        result = env.step(actions)
+        return result, time.time() - started
+
+    def step(self, envs: Sequence, actions: Sequence) -> List[Any]:
+        """:return: results of env.step() for every env, in the order of the envs"""
+        if self.executor is None:
+            timed_results = [self._timed_step(e, a) for e, a in zip(envs, actions)]
+        else:
+            # map() preserves the order of the inputs and re-raises exceptions from the env threads
+            timed_results = list(self.executor.map(self._timed_step, envs, actions))
+
+        results, self.last_step_times = [], []
+        for result, step_time in timed_results:
+            self.step_time_hist.add(step_time)
+            self.last_step_times.append(step_time)
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        return self.step_time_hist.summary("env_step_ms", scale=1000)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
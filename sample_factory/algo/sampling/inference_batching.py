@@ -0,0 +1,161 @@
+"""
+Adaptive batching of inference requests (see --inference_batching).
+
+The inference worker collects requests from the rollout workers before running the forward pass. Waiting longer
+produces larger batches (better throughput of the policy) at the cost of the latency of the env steps.
+The controller below learns the cost of the forward pass as a function of the batch size and dispatches the batch
+as soon as waiting any longer would violate the target p95 step latency, or when the batch is full.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import Dict, Sequence
+
+import numpy as np
+
+from sample_factory.utils.typing import Config
+
+
+class LinearCostModel:
+    """
+    Online least squares fit of cost(n) = a + b * n, the time it takes to process a batch of n samples.
+    Old measurements are exponentially forgotten to follow changes in the system load.
+    """
+
+    def __init__(self, decay: float = 0.99):
+        self.decay = decay
+        self.weight = self.sum_n = self.sum_cost = self.sum_nn = self.sum_ncost = 0.0
+
+    def update(self, n: float, cost: float) -> None:
+        d = self.decay
+        self.weight = d * self.weight + 1.0
+        self.sum_n = d * self.sum_n + n
+        self.sum_cost = d * self.sum_cost + cost
+        self.sum_nn = d * self.sum_nn + n * n
+        self.sum_ncost = d * self.sum_ncost + n * cost
+
+    def coefficients(self) -> tuple[float, float]:
+        if self.weight <= 0:
+            return 0.0, 0.0
+
+        mean_n, mean_cost = self.sum_n / self.weight, self.sum_cost / self.weight
+        var_n = self.sum_nn / self.weight - mean_n**2
+        if var_n < 1e-6:
+            # all batches had the same size so far, we can't separate fixed and per-sample cost
+            return mean_cost, 0.0
+
+        b = max(0.0, (self.sum_ncost / self.weight - mean_n * mean_cost) / var_n)
+        a = max(0.0, mean_cost - b * mean_n)
+        return a, b
+
+    def predict(self, n: float) -> float:
+        a, b = self.coefficients()
+        return a + b * n
+
+
+class WindowHistogram:
+    """Distribution of the recent values, summarized as scalars that we can write to Tensorboard."""
+
+    def __init__(self, buckets: Sequence[float], maxlen: int = 500):
+        self.buckets = list(buckets)
+        self.values = deque(maxlen=maxlen)
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.values, q)) if self.values else 0.0
+
+    def summary(self, name: str, scale: float = 1.0) -> Dict[str, float]:
+        if not self.values:
+            return dict()
+
+        values = np.asarray(self.values) * scale
+        stats = {
+            f"{name}_p50": float(np.percentile(values, 50)),
+            f"{name}_p95": float(np.percentile(values, 95)),
+            f"{name}_max": float(values.max()),
+        }
+
+        # fraction of the values in each bucket, bucket is labeled by its upper bound
+        bucket_indices = np.searchsorted(self.buckets, values, side="left")
+        counts = np.bincount(bucket_indices, minlength=len(self.buckets) + 1)
+        for i, upper_bound in enumerate(self.buckets):
+            stats[f"{name}_hist_le_{upper_bound:g}"] = counts[i] / len(values)
+        stats[f"{name}_hist_gt_{self.buckets[-1]:g}"] = counts[-1] / len(values)
+        return stats
+
+
+def batch_size_buckets(max_batch_size: int) -> list[int]:
+    buckets = [1]
+    while buckets[-1] < max_batch_size:
+        buckets.append(buckets[-1] * 2)
+    return buckets
+
+
+QUEUE_WAIT_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50]
+
+
+class AdaptiveBatchingController:
+    """
+    Decides when the inference worker should stop waiting for more requests.
+
+    Latency of the env step is dominated by the request that arrived first: it waits in the queue for the batch to be
+    collected and then for the batch to be processed. We stop waiting when
+    time waited since the first request + predicted cost of the current batch >= slack * target latency,
+    where slack is adjusted online such that the measured p95 of the step latency stays close to the target
+    (this corrects for the cost model error and the overheads we don't measure).
+    """
+
+    def __init__(self, target_latency: float, max_batch_size: int, max_requests: int, window: int = 200):
+        self.target_latency = target_latency
+        self.max_batch_size = max_batch_size  # in samples, 0 means no limit
+        self.max_requests = max_requests  # we can't receive more requests than this, no point in waiting after that
+
+        self.cost_model = LinearCostModel()
+        self.latencies = deque(maxlen=window)
+        self.slack = 1.0
+        self.min_slack, self.max_slack = 0.1, 2.0
+        self.adjust_every = 20
+        self.num_batches = 0
+
+    def batch_is_full(self, num_requests: int, num_samples: int) -> bool:
+        if num_requests >= self.max_requests:
+            return True
+        return 0 < self.max_batch_size <= num_samples
+
+    def wait_budget(self, num_samples: int) -> float:
+        """:return: how long we can wait since the arrival of the first request of the batch."""
+        return max(0.0, self.slack * self.target_latency - self.cost_model.predict(num_samples))
+
+    def record(self, num_samples: int, queue_wait: float, step_time: float) -> None:
+        self.cost_model.update(num_samples, step_time)
+        self.latencies.append(queue_wait + step_time)
+        self.num_batches += 1
+
+        if self.num_batches % self.adjust_every == 0:
+            p95_latency = np.percentile(self.latencies, 95)
+            # multiplicative adjustment, slack goes down quickly when we violate the target and recovers slowly
+            if p95_latency > self.target_latency:
+                self.slack *= 0.8
+            else:
+                self.slack *= 1.05
+            self.slack = min(max(self.slack, self.min_slack), self.max_slack)
+
+    def stats(self) -> Dict[str, float]:
+        a, b = self.cost_model.coefficients()
+        stats = dict(batching_slack=self.slack, batch_cost_fixed_ms=a * 1000, batch_cost_per_sample_us=b * 1e6)
+        if self.latencies:
+            stats["step_latency_ms_p95"] = float(np.percentile(self.latencies, 95)) * 1000
+        return stats
+
+
+def make_batching_controller(cfg: Config, num_policies: int = 1) -> AdaptiveBatchingController | None:
+    """:param num_policies: number of policies served by the inference worker (see --policies_per_inference_worker)"""
+    if cfg.inference_batching != "adaptive":
+        return None
+
+    # requests to one policy arrive in a single queue shared by all inference workers of this policy
+    max_requests = cfg.num_workers * cfg.worker_num_splits * num_policies
+    return AdaptiveBatchingController(cfg.inference_target_latency, cfg.inference_max_batch_size, max_requests)
@@ -12,8 +12,15 @@ import psutil
 import torch
 from signal_slot.signal_slot import TightLoop, Timer, signal
 
+from sample_factory.algo.sampling.inference_batching import (
+    QUEUE_WAIT_BUCKETS_MS,
+    WindowHistogram,
+    batch_size_buckets,
+    make_batching_controller,
+)
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, STACKED_OBS_KEY, gather_stacked_obs
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
 from sample_factory.algo.utils.misc import (
     POLICY_ID_KEY,
@@ -23,21 +30,47 @@ from sample_factory.algo.utils.misc import (
     advance_rollouts_signal,
     memory_stats,
 )
-from sample_factory.algo.utils.model_sharing import ParameterServer, make_parameter_client
-from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.algo.utils.model_sharing import ParameterClient, ParameterServer, make_parameter_client
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs, total_num_agents
 from sample_factory.algo.utils.shared_buffers import policy_device
-from sample_factory.algo.utils.tensor_dict import TensorDict, to_numpy
+from sample_factory.algo.utils.tensor_dict import TensorDict, numpy_compatible, to_numpy
 from sample_factory.algo.utils.tensor_utils import cat_tensors, dict_of_lists_cat, ensure_torch_tensor
 from sample_factory.algo.utils.torch_utils import inference_context, init_torch_runtime, synchronize
 from sample_factory.cfg.configurable import Configurable
-from sample_factory.utils.dicts import dict_of_lists_append_idx
+from sample_factory.model.inference_graph import InferenceGraph
+from sample_factory.model.population_inference import PolicySegment, PopulationInference
+from sample_factory.utils.dicts import dict_of_lists_append, dict_of_lists_append_idx
 from sample_factory.utils.gpu_utils import cuda_envvars_for_policy
 from sample_factory.utils.timing import Timing
 from sample_factory.utils.typing import Device, InitModelData, MpQueue, PolicyID
 from sample_factory.utils.utils import debug_log_every_n, init_file_logger, log
 
-AdvanceRolloutSignals = Dict[int, List[Tuple[int, PolicyID]]]
-PrepareOutputsFunc = Callable[[int, TensorDict, List], AdvanceRolloutSignals]
+AdvanceRolloutSignals = Dict[int, List[Tuple[int, PolicyID, int]]]
+# (worker_idx, split_idx, env_idx, agent_idx) of every sample of a non-batched inference batch
+ActorIndices = Tuple[np.ndarray, ...]
+PrepareOutputsFunc = Callable[[int, TensorDict, List, PolicyID, Optional[ActorIndices]], AdvanceRolloutSignals]
+
+
+def policy_group_name(policy_ids: List[PolicyID]) -> str:
+    """Short name of the set of policies served by one inference worker, i.e. "3" or "0..7"."""
+    return str(policy_ids[0]) if len(policy_ids) == 1 else f"{policy_ids[0]}..{policy_ids[-1]}"
+
+
+def decode_individual_steps(requests: List) -> Tuple[Tuple[np.ndarray, ...], ActorIndices]:
+    """
+    Requests of non-batched rollout workers contain int32 arrays of (env_idx, agent_idx, traj_buffer_idx,
+    rollout_step) rows (see NonBatchedVectorEnvRunner._format_policy_request()).
+    We turn them into index arrays for the trajectory buffers and for the policy outputs without Python loops.
+    :return: (traj_buffer_idx, rollout_step) and (worker_idx, split_idx, env_idx, agent_idx) index arrays
+    """
+    request_data = [data for _, _, data, _, _, _, _ in requests]
+    steps = request_data[0] if len(request_data) == 1 else np.concatenate(request_data)
+
+    steps_per_request = [len(data) for data in request_data]
+    actor_idx = np.repeat(np.array([request[0] for request in requests], dtype=np.int32), steps_per_request)
+    split_idx = np.repeat(np.array([request[1] for request in requests], dtype=np.int32), steps_per_request)
+
+    return (steps[:, 2], steps[:, 3]), (actor_idx, split_idx, steps[:, 0], steps[:, 1])
 
 
 def init_inference_process(sf_context: SampleFactoryContext, worker: InferenceWorker):
@@ -67,21 +100,26 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
     def __init__(
         self,
         event_loop,
-        policy_id: PolicyID,
+        policy_ids: List[PolicyID],
         worker_idx: int,
         buffer_mgr,
-        param_server: ParameterServer,
+        param_servers: Dict[PolicyID, ParameterServer],
         inference_queue: MpQueue,
         cfg,
         env_info: EnvInfo,
     ):
+        """
+        :param policy_ids: policies served by this worker (see --policies_per_inference_worker). Requests for all of
+        them arrive in the same inference_queue, we run one forward pass per policy per iteration of the loop.
+        """
         Configurable.__init__(self, cfg)
-        unique_name = f"{InferenceWorker.__name__}_p{policy_id}-w{worker_idx}"
+        unique_name = f"{InferenceWorker.__name__}_p{policy_group_name(policy_ids)}-w{worker_idx}"
         HeartbeatStoppableEventLoopObject.__init__(self, event_loop, unique_name, cfg.heartbeat_interval)
 
         self.timing = Timing(name=f"{self.object_id} profile")
 
-        self.policy_id: PolicyID = policy_id
+        self.policy_ids: List[PolicyID] = list(policy_ids)
+        self.policy_id: PolicyID = policy_ids[0]  # identifies the worker (together with worker_idx)
         self.worker_idx: int = worker_idx
 
         self.buffer_mgr = buffer_mgr
@@ -89,9 +127,27 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         # shallow copy
         self.traj_tensors: Dict[Device, TensorDict] = copy.copy(buffer_mgr.traj_tensors_torch)
         self.policy_output_tensors: Dict[Device, TensorDict] = copy.copy(buffer_mgr.policy_output_tensors_torch)
-
-        self.device: torch.device = policy_device(cfg, policy_id)
-        self.param_client = make_parameter_client(cfg.serial_mode, param_server, cfg, env_info, self.timing)
+        self.dedup_framestack: int = buffer_mgr.dedup_framestack
+        # with --compact_rnn_states we read current RNN states of the actors from here instead of the trajectories
+        self.rnn_state_tensors: Dict[Device, torch.Tensor] = copy.copy(buffer_mgr.rnn_state_tensors_torch)
+        self.obs_storage_dtype: Optional[torch.dtype] = buffer_mgr.storage_dtypes.get("obs")
+
+        # all policies of the worker run on the same device (one CUDA context per process)
+        self.device: torch.device = policy_device(cfg, self.policy_id)
+        self.devices: Dict[PolicyID, torch.device] = {p: self.device for p in self.policy_ids}
+        self.param_clients: Dict[PolicyID, ParameterClient] = {
+            p: make_parameter_client(cfg.serial_mode, param_servers[p], cfg, env_info, self.timing)
+            for p in self.policy_ids
+        }
+        self.initialized_policies = set()
+
+        # see --inference_graph, None means we run the eager model
+        self.inference_graphs: Optional[Dict[PolicyID, InferenceGraph]] = None
+        if cfg.inference_graph == "trace":
+            self.inference_graphs = {p: InferenceGraph() for p in self.policy_ids}
+        # see --population_inference, created once the models are initialized
+        self.population_inference: Optional[PopulationInference] = None
+        self.env_info = env_info
         self.inference_queue = inference_queue
 
         self.request_count = deque(maxlen=50)
@@ -102,13 +158,29 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         # Although if your workflow involves very lengthy operations that often freeze workers, it can be beneficial
         # to set min_num_requests to 1 (at a cost of potential inefficiency, i.e. policy worker will use very small
         # batches)
-        min_num_requests = self.cfg.num_workers // (self.cfg.num_policies * self.cfg.policy_workers_per_policy)
+        min_num_requests = self.cfg.num_workers * len(self.policy_ids)
+        min_num_requests //= self.cfg.num_policies * self.cfg.policy_workers_per_policy
         min_num_requests //= 3
         self.min_num_requests = max(1, min_num_requests)
         log.info(f"{self.object_id}: min num requests: %d", self.min_num_requests)
 
         self.requests = []
-        self.total_num_samples = self.last_report_samples = 0
+        self.num_request_samples = 0  # total number of samples in self.requests
+
+        # enqueue time of the oldest request in self.requests
+        self.first_request_time: Optional[float] = None
+        self.total_num_samples = 0
+
+        # per-policy throughput and latency
+        self.policy_samples: Dict[PolicyID, int] = {p: 0 for p in self.policy_ids}
+        self.last_report_samples: Dict[PolicyID, int] = {p: 0 for p in self.policy_ids}
+        self.last_report_time = time.time()
+        self.policy_step_times: Dict[PolicyID, deque] = {p: deque(maxlen=100) for p in self.policy_ids}
+
+        # see --inference_batching, None means we use the fixed strategy above
+        self.batching_controller = make_batching_controller(cfg, len(self.policy_ids))
+        self.batch_size_hist = WindowHistogram(batch_size_buckets(total_num_agents(cfg, env_info)))
+        self.queue_wait_hist = WindowHistogram([ms / 1000 for ms in QUEUE_WAIT_BUCKETS_MS])
 
         self._get_inference_requests_func = (
             self._get_inference_requests_serial if cfg.serial_mode else self._get_inference_requests_async
@@ -142,21 +214,53 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         ...
 
     def init(self, init_model_data: Optional[InitModelData]):
+        """Called once for every policy served by this worker, when the model of the policy is initialized."""
         if self.is_initialized:
             return
 
-        if "cpu" in self.traj_tensors:
-            self.traj_tensors["cpu"] = to_numpy(self.traj_tensors["cpu"])
+        if not self.initialized_policies and "cpu" in self.traj_tensors:
+            # numpy is faster for indexing. Buffers with dtypes that have no numpy counterpart stay torch tensors
+            # (i.e. --buffer_float_dtype=bfloat16, which is only supported with batched sampling)
+            if numpy_compatible(self.traj_tensors["cpu"]):
+                self.traj_tensors["cpu"] = to_numpy(self.traj_tensors["cpu"])
             self.policy_output_tensors["cpu"] = to_numpy(self.policy_output_tensors["cpu"])
-
-        state_dict = None
-        policy_version = 0
-        if init_model_data is not None:
-            policy_id, state_dict, self.device, policy_version = init_model_data
-            if policy_id != self.policy_id:
+            if "cpu" in self.rnn_state_tensors and numpy_compatible(self.rnn_state_tensors["cpu"]):
+                self.rnn_state_tensors["cpu"] = to_numpy(self.rnn_state_tensors["cpu"])
+
+        if init_model_data is None:
+            # no model data, all policies start with random weights
+            for policy_id in self.policy_ids:
+                if policy_id not in self.initialized_policies:
+                    self.param_clients[policy_id].on_weights_initialized(None, self.device, 0)
+                    self.initialized_policies.add(policy_id)
+        else:
+            policy_id, state_dict, device, policy_version = init_model_data
+            if policy_id not in self.policy_ids or policy_id in self.initialized_policies:
                 return
+            if not self.cfg.serial_mode:
+                # all policies of the group run on the device of the first policy, weights are copied there.
+                # In serial mode we use the models of the learners directly, so policies stay on their devices
+                device = self.device
+            self.devices[policy_id] = device
+            self.param_clients[policy_id].on_weights_initialized(state_dict, device, policy_version)
+            self.initialized_policies.add(policy_id)
+
+        if len(self.initialized_policies) < len(self.policy_ids):
+            # wait for the models of the remaining policies
+            return
 
-        self.param_client.on_weights_initialized(state_dict, self.device, policy_version)
+        if self.cfg.population_inference == "vmap" and len(self.policy_ids) > 1:
+            if len(set(self.devices.values())) > 1:
+                log.warning(
+                    "%s: policies are on different devices %r, can't stack their parameters for vectorized "
+                    "inference, running one policy at a time",
+                    self.object_id,
+                    self.devices,
+                )
+            else:
+                obs_space, action_space = self.env_info.obs_space, self.env_info.action_space
+                device = self.devices[self.policy_id]
+                self.population_inference = PopulationInference(self.cfg, obs_space, action_space, device)
 
         # we can create and connect Timers and EventLoopObjects here because they all interact within one loop
         self.inference_loop = TightLoop(self.event_loop)
@@ -182,15 +286,30 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         debug_log_every_n(50, f"{self.object_id}: resuming experience collection")
         self.inference_loop.start()
 
-    def _batch_slices(self, timing):
+    def _stacked_obs(self, traj_tensors: TensorDict, traj_indices: torch.Tensor, rollout_steps: torch.Tensor):
+        """Reconstruct frame stacks from deduplicated frames (see --dedup_framestack)."""
+        # trajectory buffers can be numpy views of the shared tensors (non-batched sampling), from_numpy() is free
+        frames, dones = ensure_torch_tensor(traj_tensors[OBS_FRAMES]), ensure_torch_tensor(traj_tensors["dones"])
+        return gather_stacked_obs(frames, dones, traj_indices, rollout_steps, self.dedup_framestack)
+
+    def _batch_slices(self, timing, requests: List):
         with timing.add_time("deserialize"):
             obs = dict()
             rnn_states = []
-            for actor_idx, split_idx, traj_idx, device in self.requests:
+            for actor_idx, split_idx, traj_idx, device, _, _, _ in requests:
                 # TODO: what should we do with data sampled on different devices
                 traj_tensors = self.traj_tensors[device]
                 dict_of_lists_append_idx(obs, traj_tensors["obs"], traj_idx)
-                rnn_states.append(traj_tensors["rnn_states"][traj_idx])
+                if self.dedup_framestack:
+                    traj_slice, rollout_step = traj_idx
+                    traj_indices = torch.arange(traj_slice.start, traj_slice.stop)
+                    rollout_steps = torch.full_like(traj_indices, rollout_step)
+                    stacked_obs = self._stacked_obs(traj_tensors, traj_indices, rollout_steps)
+                    dict_of_lists_append(obs, {STACKED_OBS_KEY: stacked_obs})
+                if self.cfg.compact_rnn_states:
+                    rnn_states.append(self.rnn_state_tensors[device][actor_idx, split_idx])
+                else:
+                    rnn_states.append(traj_tensors["rnn_states"][traj_idx])
 
         with timing.add_time("stack"):
             if len(rnn_states) == 1:
@@ -204,29 +323,34 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
                 dict_of_lists_cat(obs)
                 rnn_states = cat_tensors(rnn_states)
 
-        return obs, rnn_states
+        # policy outputs of batched samples are written by request, see _prepare_policy_outputs_batched()
+        return obs, rnn_states, None
 
-    def _batch_individual_steps(self, timing):
+    def _batch_individual_steps(self, timing, requests: List):
         with timing.add_time("deserialize"):
-            indices = []
-            for request in self.requests:
-                # TODO: what should we do with data sampled on different devices
-                actor_idx, split_idx, request_data, device = request
-                for env_idx, agent_idx, traj_buffer_idx, rollout_step in request_data:
-                    index = [traj_buffer_idx, rollout_step]
-                    indices.append(index)
+            indices, actor_indices = decode_individual_steps(requests)
+            device = requests[0][3]
 
-            indices = tuple(np.array(indices).T)
             traj_tensors = self.traj_tensors[device]  # TODO: multiple sampling devices?
             observations = traj_tensors["obs"][indices]
-            rnn_states = traj_tensors["rnn_states"][indices]
+            if self.dedup_framestack:
+                traj_indices, rollout_steps = indices
+                stacked_obs = self._stacked_obs(
+                    traj_tensors, torch.from_numpy(traj_indices), torch.from_numpy(rollout_steps)
+                )
+                observations[STACKED_OBS_KEY] = stacked_obs
+            if self.cfg.compact_rnn_states:
+                rnn_states = self.rnn_state_tensors[device][actor_indices]
+            else:
+                rnn_states = traj_tensors["rnn_states"][indices]
 
         with timing.add_time("stack"):
             for key, x in observations.items():
                 observations[key] = ensure_torch_tensor(x)
             rnn_states = ensure_torch_tensor(rnn_states)
 
-        return observations, rnn_states
+        # decoded once, we also need these to write the policy outputs
+        return observations, rnn_states, actor_indices
 
     @staticmethod
     def _unsqueeze_0dim_tensors(d: TensorDict):
@@ -235,7 +359,12 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
                 policy_output.unsqueeze_(-1)
 
     def _prepare_policy_outputs_batched(
-        self, num_samples: int, policy_outputs: TensorDict, requests: List
+        self,
+        num_samples: int,
+        policy_outputs: TensorDict,
+        requests: List,
+        policy_id: PolicyID,
+        _actor_indices: Optional[ActorIndices],
     ) -> AdvanceRolloutSignals:
         # gotta unsqueeze some 0-dim tensors
         if num_samples <= 1:
@@ -250,14 +379,14 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         samples_per_actor = num_samples // len(requests)
         ofs = 0
         devices_to_sync = set()
-        for actor_idx, split_idx, _, device in requests:
+        for actor_idx, split_idx, _, device, _, _, _ in requests:
             self.policy_output_tensors[device][actor_idx, split_idx] = policy_outputs[ofs : ofs + samples_per_actor]
             ofs += samples_per_actor
             devices_to_sync.add(device)
 
         signals_to_send: AdvanceRolloutSignals = dict()
-        for actor_idx, split_idx, _, _ in requests:
-            payload = (split_idx, self.policy_id)
+        for actor_idx, split_idx, _, _, _, request_id, _ in requests:
+            payload = (split_idx, policy_id, request_id)
             if actor_idx in signals_to_send:
                 signals_to_send[actor_idx].append(payload)
             else:
@@ -271,7 +400,12 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         return signals_to_send
 
     def _prepare_policy_outputs_non_batched(
-        self, _num_samples: int, policy_outputs: TensorDict, requests: List
+        self,
+        _num_samples: int,
+        policy_outputs: TensorDict,
+        requests: List,
+        policy_id: PolicyID,
+        actor_indices: Optional[ActorIndices],
     ) -> AdvanceRolloutSignals:
         # Respect sampling device instead of just dumping everything on cpu?
         # Although it is hard to imagine a scenario where we have a non-batched env with observations on gpu
@@ -292,60 +426,143 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         output_tensors = torch.cat(output_tensors, dim=1)
 
         signals_to_send: AdvanceRolloutSignals = dict()
-        output_indices = []
-        for request in requests:
-            actor_idx, split_idx, request_data, _ = request
-            for env_idx, agent_idx, traj_buffer_idx, rollout_step in request_data:
-                output_indices.append([actor_idx, split_idx, env_idx, agent_idx])
-
-            payload = (split_idx, self.policy_id)
+        for actor_idx, split_idx, _, _, _, request_id, _ in requests:
+            payload = (split_idx, policy_id, request_id)
             if actor_idx in signals_to_send:
                 signals_to_send[actor_idx].append(payload)
             else:
                 signals_to_send[actor_idx] = [payload]
 
-        output_indices = tuple(np.array(output_indices).T)
-        self.policy_output_tensors[device][output_indices] = output_tensors.numpy()
+        self.policy_output_tensors[device][actor_indices] = output_tensors.numpy()
 
         # this should be a no-op unless we have a non-batched env with observations on gpu
         synchronize(self.cfg, device)
 
         return signals_to_send
 
-    def _handle_policy_steps(self, timing):
+    def _policy_inputs(
+        self, timing, policy_id: PolicyID, requests: List, normalize: bool
+    ) -> Tuple[PolicySegment, Optional[ActorIndices]]:
+        """
+        Batch the requests of the policy and move them to the device, normalize observations if requested.
+        :return: policy inputs and, in non-batched sampling, where the policy outputs of the samples go
+        """
+        obs, rnn_states, actor_indices = self._batch_func(timing, requests)
+        num_samples = rnn_states.shape[0]
+        self.total_num_samples += num_samples
+        self.policy_samples[policy_id] += num_samples
+
+        with timing.add_time("obs_to_device_normalize"):
+            actor_critic = self.param_clients[policy_id].actor_critic
+            if actor_critic.training:
+                actor_critic.eval()  # need to call this because we can be in serial mode
+
+            if self.obs_storage_dtype is not None:
+                # observations are stored in reduced precision (see --buffer_float_dtype)
+                for key, x in obs.items():
+                    x = ensure_torch_tensor(x)
+                    obs[key] = x.float() if x.dtype == self.obs_storage_dtype else x
+
+            if normalize:
+                obs = prepare_and_normalize_obs(actor_critic, obs)
+            else:
+                # normalization is a part of the traced graph
+                for key, x in obs.items():
+                    obs[key] = ensure_torch_tensor(x).to(actor_critic.device_for_input_tensor(key))
+            rnn_states = ensure_torch_tensor(rnn_states).to(self.devices[policy_id]).float()
+
+        return (policy_id, actor_critic, obs, rnn_states), actor_indices
+
+    def _send_policy_outputs(
+        self,
+        timing,
+        policy_id: PolicyID,
+        requests: List,
+        num_samples: int,
+        policy_outputs: TensorDict,
+        actor_indices: Optional[ActorIndices],
+    ) -> None:
+        policy_version = self.param_clients[policy_id].policy_version
+        policy_outputs["policy_version"] = torch.empty([num_samples]).fill_(policy_version)
+
+        with timing.add_time("prepare_outputs"):
+            signals_to_send = self._prepare_policy_outputs_func(
+                num_samples, policy_outputs, requests, policy_id, actor_indices
+            )
+
+        with timing.add_time("send_messages"):
+            for actor_idx, data in signals_to_send.items():
+                self.emit_many(advance_rollouts_signal(actor_idx), data)
+
+    def _handle_policy_steps(self, timing, policy_id: PolicyID, requests: List):
+        """One forward pass of the policy on all of its requests."""
+        inference_graph = None if self.inference_graphs is None else self.inference_graphs[policy_id]
+
         with inference_context(self.cfg.serial_mode):
-            obs, rnn_states = self._batch_func(timing)
-            num_samples = rnn_states.shape[0]
-            self.total_num_samples += num_samples
+            (_, actor_critic, obs, rnn_states), actor_indices = self._policy_inputs(
+                timing, policy_id, requests, normalize=inference_graph is None
+            )
+
+            with timing.add_time("forward"):
+                if inference_graph is None:
+                    policy_outputs = actor_critic(obs, rnn_states)
+                else:
+                    policy_outputs = inference_graph(actor_critic, obs, rnn_states)
 
-            with timing.add_time("obs_to_device_normalize"):
-                actor_critic = self.param_client.actor_critic
-                if actor_critic.training:
-                    actor_critic.eval()  # need to call this because we can be in serial mode
+            self._send_policy_outputs(timing, policy_id, requests, rnn_states.shape[0], policy_outputs, actor_indices)
 
-                normalized_obs = prepare_and_normalize_obs(actor_critic, obs)
-                rnn_states = ensure_torch_tensor(rnn_states).to(self.device).float()
+    def _handle_population_steps(self, timing, requests_by_policy: Dict[PolicyID, List]):
+        """A single vectorized forward pass of all policies that have requests (see --population_inference)."""
+        with inference_context(self.cfg.serial_mode):
+            inputs = [
+                self._policy_inputs(timing, policy_id, requests, normalize=True)
+                for policy_id, requests in requests_by_policy.items()
+            ]
+            segments: List[PolicySegment] = [segment for segment, _ in inputs]
 
             with timing.add_time("forward"):
-                policy_outputs = actor_critic(normalized_obs, rnn_states)
-                policy_outputs["policy_version"] = torch.empty([num_samples]).fill_(self.param_client.policy_version)
+                policy_versions = {p: self.param_clients[p].policy_version for p in requests_by_policy}
+                outputs = self.population_inference(segments, policy_versions)
 
-            with timing.add_time("prepare_outputs"):
-                signals_to_send = self._prepare_policy_outputs_func(num_samples, policy_outputs, self.requests)
+            for (segment, actor_indices), policy_outputs in zip(inputs, outputs):
+                policy_id, num_samples = segment[0], segment[3].shape[0]
+                requests = requests_by_policy[policy_id]
+                self._send_policy_outputs(timing, policy_id, requests, num_samples, policy_outputs, actor_indices)
 
-            with timing.add_time("send_messages"):
-                for actor_idx, data in signals_to_send.items():
-                    self.emit_many(advance_rollouts_signal(actor_idx), data)
+    def _requests_by_policy(self) -> Dict[PolicyID, List]:
+        if len(self.policy_ids) == 1:
+            return {self.policy_id: self.requests}
 
-            self.requests = []
+        requests_by_policy = dict()
+        for request in self.requests:
+            requests_by_policy.setdefault(request[4], []).append(request)
+        return requests_by_policy
+
+    def _add_requests(self, policy_requests: List) -> None:
+        if not policy_requests:
+            return
+        self.requests.extend(policy_requests)
+
+        for _, _, request_data, _, _, _, enqueue_time in policy_requests:
+            if self.first_request_time is None or enqueue_time < self.first_request_time:
+                self.first_request_time = enqueue_time
+            if self.cfg.batched_sampling:
+                traj_slice, _ = request_data
+                self.num_request_samples += traj_slice.stop - traj_slice.start
+            else:
+                self.num_request_samples += len(request_data)
 
     def _get_inference_requests_serial(self):
         try:
-            self.requests.extend(self.inference_queue.get_many(block=False))
+            self._add_requests(self.inference_queue.get_many(block=False))
         except Empty:
             pass
 
     def _get_inference_requests_async(self):
+        if self.batching_controller is not None:
+            self._get_inference_requests_adaptive()
+            return
+
         # Very conservative timer. Only wait a little bit, then continue with what we've got.
         wait_for_min_requests = 0.025
 
@@ -354,7 +571,33 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
             try:
                 with self.timing.timeit("wait_policy"), self.timing.add_time("wait_policy_total"):
                     policy_requests = self.inference_queue.get_many(timeout=0.005)
-                self.requests.extend(policy_requests)
+                self._add_requests(policy_requests)
+            except Empty:
+                pass
+
+    def _get_inference_requests_adaptive(self):
+        """Wait for more requests until the batch is full or waiting longer would violate the latency target."""
+        controller = self.batching_controller
+        idle_wait = 0.025  # return to the event loop every once in a while if there are no requests at all
+
+        waiting_started = time.time()
+        while True:
+            now = time.time()
+            if self.requests:
+                if controller.batch_is_full(len(self.requests), self.num_request_samples):
+                    break
+                timeout = controller.wait_budget(self.num_request_samples) - (now - self.first_request_time)
+                if timeout <= 0:
+                    break
+            else:
+                timeout = idle_wait - (now - waiting_started)
+                if timeout <= 0:
+                    break
+
+            try:
+                with self.timing.timeit("wait_policy"), self.timing.add_time("wait_policy_total"):
+                    policy_requests = self.inference_queue.get_many(timeout=min(timeout, 0.005))
+                self._add_requests(policy_requests)
             except Empty:
                 pass
 
@@ -363,33 +606,67 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         if not self.requests:
             return
 
+        # time the oldest request spent in the queue until we stopped waiting for more requests
+        num_samples, queue_wait = self.num_request_samples, time.time() - self.first_request_time
+
+        requests_by_policy = self._requests_by_policy()
         with self.timing.add_time("update_model"):
-            self.param_client.ensure_weights_updated()
+            for policy_id in requests_by_policy:
+                self.param_clients[policy_id].ensure_weights_updated()
 
+        step_started = time.time()
         with self.timing.timeit("one_step"), self.timing.add_time("handle_policy_step"):
             self.request_count.append(len(self.requests))
-            self._handle_policy_steps(self.timing)
+            if self.population_inference is not None and len(requests_by_policy) > 1:
+                self._handle_population_steps(self.timing, requests_by_policy)
+                for policy_id in requests_by_policy:
+                    self.policy_step_times[policy_id].append(time.time() - step_started)
+            else:
+                for policy_id, requests in requests_by_policy.items():
+                    policy_step_started = time.time()
+                    self._handle_policy_steps(self.timing, policy_id, requests)
+                    self.policy_step_times[policy_id].append(time.time() - policy_step_started)
+
+            self.requests = []
+            self.num_request_samples = 0
+            self.first_request_time = None
+
+        self.batch_size_hist.add(num_samples)
+        self.queue_wait_hist.add(queue_wait)
+        if self.batching_controller is not None:
+            self.batching_controller.record(num_samples, queue_wait, time.time() - step_started)
 
     def _report_stats(self):
         if "one_step" not in self.timing:
             return
 
         timing_stats = dict(wait_policy=self.timing.get("wait_policy", 0), step_policy=self.timing.one_step)
-        samples_since_last_report = self.total_num_samples - self.last_report_samples
-        self.last_report_samples = self.total_num_samples
 
         stats = memory_stats("policy_worker", self.device)
         if len(self.request_count) > 0:
             stats["avg_request_count"] = np.mean(self.request_count)
+        stats.update(self.batch_size_hist.summary("inference_batch_size"))
+        stats.update(self.queue_wait_hist.summary("inference_queue_wait_ms", scale=1000))
+        if self.batching_controller is not None:
+            stats.update(self.batching_controller.stats())
 
-        self.report_msg.emit(
-            {
-                TIMING_STATS: timing_stats,
-                SAMPLES_COLLECTED: samples_since_last_report,
-                POLICY_ID_KEY: self.policy_id,
-                STATS_KEY: stats,
-            }
-        )
+        now = time.time()
+        report_interval = max(now - self.last_report_time, 1e-6)
+        self.last_report_time = now
+
+        msgs = []
+        for policy_id in self.policy_ids:
+            samples_since_last_report = self.policy_samples[policy_id] - self.last_report_samples[policy_id]
+            self.last_report_samples[policy_id] = self.policy_samples[policy_id]
+            msgs.append({SAMPLES_COLLECTED: samples_since_last_report, POLICY_ID_KEY: policy_id})
+
+            if len(self.policy_ids) > 1 and self.policy_step_times[policy_id]:
+                # latency and throughput of the individual policies served by this worker
+                stats[f"inference_p{policy_id}_step_ms"] = np.mean(self.policy_step_times[policy_id]) * 1000
+                stats[f"inference_p{policy_id}_samples_per_sec"] = samples_since_last_report / report_interval
+
+        msgs[0].update({TIMING_STATS: timing_stats, STATS_KEY: stats})
+        self.report_msg.emit(msgs)
 
     def _cache_cleanup(self):
         if self.cfg.device == "gpu":
@@ -401,8 +678,9 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
     def on_stop(self, *args):
         if self.is_initialized:
-            self.param_client.cleanup()
-            del self.param_client
+            for param_client in self.param_clients.values():
+                param_client.cleanup()
+            self.param_clients = dict()
 
         self.stop.emit(self.object_id, {self.object_id: self.timing})
         super().on_stop(*args)
@@ -1,18 +1,30 @@
 from __future__ import annotations
 
 import random
+import time
 from queue import Empty
 from typing import Any, Dict, List, Optional, Tuple
 
 import gymnasium as gym
 import numpy as np
 
+from sample_factory.algo.sampling.decorrelation import (
+    RANDOM_BURSTS,
+    burst_length,
+    needs_env_decorrelation,
+    step_random_actions,
+)
+from sample_factory.algo.sampling.env_reset_pool import EnvResetPool
+from sample_factory.algo.sampling.env_startup import ENV_CHECK, ENV_CREATE, ENV_DECORRELATE, ENV_RESET, run_concurrently
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
 from sample_factory.algo.sampling.sampling_utils import VectorEnvRunner, record_episode_statistics_wrapper_stats
+from sample_factory.algo.sampling.stragglers import StepLatencyTracker
 from sample_factory.algo.utils.agent_policy_mapping import AgentPolicyMapping
 from sample_factory.algo.utils.env_info import EnvInfo, check_env_info
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, STACKED_OBS_KEY, store_stacked_obs
 from sample_factory.algo.utils.make_env import make_env_func_non_batched
 from sample_factory.algo.utils.misc import EPISODIC, POLICY_ID_KEY
-from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.algo.utils.shared_buffers import BufferMgr, rnn_states_index
 from sample_factory.algo.utils.tensor_dict import TensorDict, to_numpy
 from sample_factory.algo.utils.tensor_utils import clone_tensor, ensure_numpy_array
 from sample_factory.envs.env_utils import find_training_info_interface, set_reward_shaping, set_training_info
@@ -42,6 +54,7 @@ class ActorState:
         traj_buffer_queue: MpQueue,
         traj_tensors: TensorDict,
         policy_output_tensors,
+        rnn_state_tensor,
         training_info: List[Optional[Dict]],
         policy_mgr,
     ):
@@ -65,10 +78,14 @@ class ActorState:
 
         self.buffer_mgr: BufferMgr = buffer_mgr
         self.traj_buffer_queue: MpQueue = traj_buffer_queue
+        self.dedup_framestack: int = buffer_mgr.dedup_framestack
         self.policy_output_names = buffer_mgr.output_names
         self.policy_output_sizes = buffer_mgr.output_sizes
         self.policy_output_indices = np.cumsum(self.policy_output_sizes)[:-1]
         self.policy_output_tensors = policy_output_tensors
+        # current RNN state of this actor that the inference worker reads with --compact_rnn_states, None otherwise
+        self.rnn_state_tensor = rnn_state_tensor
+        self.rnn_states_stride: int = buffer_mgr.rnn_states_stride
 
         self.last_actions = None
         self.last_policy_steps = None
@@ -100,6 +117,12 @@ class ActorState:
         """
         set_attr_if_exists(self.env.unwrapped, "curr_policy_idx", self.curr_policy_id)
 
+    def set_env(self, env) -> None:
+        """The env of this actor was replaced with a new instance (see --env_step_timeout)."""
+        self.env = env
+        self.env_training_info_interface = find_training_info_interface(env)
+        self._env_set_curr_policy()
+
     def _update_training_info(self) -> None:
         """Propagate information in the direction RL algo -> environment."""
         if self.training_info[self.curr_policy_id] is not None:
@@ -131,7 +154,24 @@ class ActorState:
         we finalize the trajectory buffer and send it to the learner.
         """
 
+        if self.rnn_state_tensor is not None and "rnn_states" in data:
+            # trajectory RNN states are not indexed by rollout step, see _save_rnn_state()
+            data = dict(data)
+            self._save_rnn_state(data.pop("rnn_states"), rollout_step)
+
         self.curr_traj_buffer[rollout_step] = data
+        if self.dedup_framestack and "obs" in data:
+            # main observation is not in the obs dict, we store only the new frame(s), see frame_stack.py
+            frames = self.curr_traj_buffer[OBS_FRAMES][None]
+            stacked_obs = np.asarray(data["obs"][STACKED_OBS_KEY])[None]
+            store_stacked_obs(frames, stacked_obs, rollout_step)
+
+    def _save_rnn_state(self, rnn_state, rollout_step: int) -> None:
+        """With --compact_rnn_states trajectories only keep the states at the start of each recurrence chunk."""
+        self.rnn_state_tensor[:] = rnn_state
+        idx = rnn_states_index(rollout_step, self.rnn_states_stride)
+        if idx is not None:
+            self.curr_traj_buffer["rnn_states"][idx] = rnn_state
 
     def reset_rnn_state(self):
         self.last_rnn_state[:] = 0.0
@@ -291,23 +331,28 @@ class ActorState:
             self.reset_rnn_state()
 
     def _episodic_stats(self, info: Dict) -> Dict[str, Any]:
-        stats = dict(
-            reward=self.last_episode_reward,
-            len=self.last_episode_duration,
-            episode_extra_stats=info.get("episode_extra_stats", dict()),
-        )
+        return episodic_stats(info, self.last_episode_reward, self.last_episode_duration, self.curr_policy_id)
 
-        if (true_objective := info.get("true_objective", self.last_episode_reward)) is not None:
-            stats["true_objective"] = true_objective
 
-        episode_wrapper_stats = record_episode_statistics_wrapper_stats(info)
-        if episode_wrapper_stats is not None:
-            wrapper_rew, wrapper_len = episode_wrapper_stats
-            stats["RecordEpisodeStatistics_reward"] = wrapper_rew
-            stats["RecordEpisodeStatistics_len"] = wrapper_len
+def episodic_stats(info: Dict, episode_reward, episode_duration, policy_id: PolicyID) -> Dict[str, Any]:
+    """Report of the episode that just ended for one actor."""
+    stats = dict(
+        reward=episode_reward,
+        len=episode_duration,
+        episode_extra_stats=info.get("episode_extra_stats", dict()),
+    )
 
-        report = {EPISODIC: stats, POLICY_ID_KEY: self.curr_policy_id}
-        return report
+    if (true_objective := info.get("true_objective", episode_reward)) is not None:
+        stats["true_objective"] = true_objective
+
+    episode_wrapper_stats = record_episode_statistics_wrapper_stats(info)
+    if episode_wrapper_stats is not None:
+        wrapper_rew, wrapper_len = episode_wrapper_stats
+        stats["RecordEpisodeStatistics_reward"] = wrapper_rew
+        stats["RecordEpisodeStatistics_len"] = wrapper_len
+
+    report = {EPISODIC: stats, POLICY_ID_KEY: policy_id}
+    return report
 
 
 class NonBatchedVectorEnvRunner(VectorEnvRunner):
@@ -321,11 +366,15 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
     passed around.
 
     Individual envs (or agents in these envs in case of multi-agent) can potentially be controlled by different
-    policies when we're doing PBT. We only start simulating the next step in the environment when
-    all actions from all envs and all policies are collected. This leaves optimization potential: we can start
-    simulating some envs right away as actions for them arrive. But usually double-buffered sampling masks
+    policies when we're doing PBT. By default we only start simulating the next step in the environment when
+    all actions from all envs and all policies are collected. Usually double-buffered sampling masks
     this type of inefficiency anyway. The worker is probably still rendering a previous vector of envs when
     the actions arrive.
+
+    With --step_envs_when_ready an env is simulated as soon as all of its agents have actions and the policy request
+    for its next step is sent right away, so one slow policy (or a delayed inference batch) only stalls the envs
+    it controls. Envs still meet at the rollout boundary: trajectories of the whole vector are finalized together,
+    which keeps trajectory buffer management and sync mode rollout counting the same as in the default mode.
     """
 
     def __init__(
@@ -338,6 +387,8 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         buffer_mgr,
         sampling_device: str,
         training_info: List[Optional[Dict[str, Any]]],
+        env_step_pool: EnvStepPool,
+        env_reset_pool: Optional[EnvResetPool] = None,
     ):
         """
         Ctor.
@@ -348,6 +399,8 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         :param split_idx: index of the environment group in double-buffered sampling (either 0 or 1). Always 0 when
         double-buffered sampling is disabled.
         :param training_info: curr env steps, reward shaping scheme, etc.
+        :param env_step_pool: steps the envs of the vector, possibly concurrently (see --env_step_threads)
+        :param env_reset_pool: resets the envs in the background at the end of an episode (see --env_reset_prefetch)
         """
         super().__init__(cfg, env_info, worker_idx, split_idx, buffer_mgr, sampling_device)
 
@@ -355,11 +408,14 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
             # TODO: comment
             self.traj_tensors = to_numpy(self.traj_tensors)
             self.policy_output_tensors = to_numpy(self.policy_output_tensors)
+            if self.rnn_state_tensors is not None:
+                self.rnn_state_tensors = to_numpy(self.rnn_state_tensors)
 
         self.num_envs = num_envs
         self.num_agents = env_info.num_agents
 
         self.envs, self.episode_rewards = [], []
+        self.global_env_indices: List[int] = []  # global index of each env of the vector in the entire system
         self.actor_states: List[List[ActorState]] = []
 
         self.need_trajectory_buffers = self.num_envs * self.num_agents
@@ -367,30 +423,60 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         self.training_info: List[Optional[Dict]] = training_info
 
         self.policy_mgr = AgentPolicyMapping(self.cfg, self.env_info)
+        self.env_step_pool: EnvStepPool = env_step_pool
+        self.env_reset_pool: Optional[EnvResetPool] = env_reset_pool
+
+        first_env_id = self.worker_idx * self.cfg.num_envs_per_worker + self.split_idx * self.num_envs
+        self.step_latency = StepLatencyTracker(self.num_envs, first_env_id)
+
+        # see --step_envs_when_ready, rollout step of every env in the vector
+        self.step_envs_when_ready: bool = cfg.step_envs_when_ready
+        self.env_rollout_steps: List[int] = [0] * self.num_envs
+        self.envs_waiting_for_actions: List[bool] = [False] * self.num_envs
+        self.env_request_time: List[float] = [0.0] * self.num_envs
+        self.envs_to_prepare: List[int] = []  # envs that were just simulated and need a request for the next step
+        # actors waiting for actions, by (policy_id, request_id) of the request that will bring them
+        self.actors_in_flight: Dict[Tuple[PolicyID, int], List[ActorState]] = dict()
+
+    def _make_env(self, env_i: int) -> Tuple[Any, int]:
+        """:return: env instance and its global index in the entire system"""
+        vector_idx = self.split_idx * self.num_envs + env_i
+
+        # global env id within the entire system
+        global_env_idx = self.worker_idx * self.cfg.num_envs_per_worker + vector_idx
+
+        env_config = AttrDict(
+            worker_index=self.worker_idx,
+            vector_index=vector_idx,
+            env_id=global_env_idx,
+        )
+
+        # log.info('Creating env %r... %d-%d-%d', env_config, self.worker_idx, self.split_idx, env_i)
+        with self.startup_timeline.record(ENV_CREATE, env_i):
+            env = make_env_func_non_batched(self.cfg, env_config=env_config, env_reset_pool=self.env_reset_pool)
+        with self.startup_timeline.record(ENV_CHECK, env_i):
+            check_env_info(env, self.env_info, self.cfg)
+
+        return env, global_env_idx
+
+    def _create_envs(self) -> None:
+        """Envs can be created concurrently (see --env_creation_threads), we keep them in the order of the vector."""
+        thread_name = f"env_create_w{self.worker_idx}"
+        for env, global_env_idx in run_concurrently(
+            self._make_env, self.num_envs, self.cfg.env_creation_threads, thread_name
+        ):
+            self.envs.append(env)
+            self.global_env_indices.append(global_env_idx)
 
     def init(self, timing: Timing):
         """
         Actually instantiate the env instances.
         Also creates ActorState objects that hold the state of individual actors in (potentially) multi-agent envs.
         """
-        for env_i in range(self.num_envs):
-            vector_idx = self.split_idx * self.num_envs + env_i
-
-            # global env id within the entire system
-            global_env_idx = self.worker_idx * self.cfg.num_envs_per_worker + vector_idx
-
-            env_config = AttrDict(
-                worker_index=self.worker_idx,
-                vector_index=vector_idx,
-                env_id=global_env_idx,
-            )
-
-            # log.info('Creating env %r... %d-%d-%d', env_config, self.worker_idx, self.split_idx, env_i)
-            env = make_env_func_non_batched(self.cfg, env_config=env_config)
-            check_env_info(env, self.env_info, self.cfg)
-
-            self.envs.append(env)
+        self._create_envs()
 
+        for env_i, env in enumerate(self.envs):
+            global_env_idx = self.global_env_indices[env_i]
             actor_states_env, episode_rewards_env = [], []
             for agent_idx in range(self.num_agents):
                 actor_state = ActorState(
@@ -406,6 +492,7 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
                     self.traj_buffer_queue,
                     self.traj_tensors,
                     self.policy_output_tensors[env_i, agent_idx],
+                    None if self.rnn_state_tensors is None else self.rnn_state_tensors[env_i, agent_idx],
                     self.training_info,
                     self.policy_mgr,
                 )
@@ -425,27 +512,70 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         :return: first requests for policy workers (to generate actions for the very first env step)
         """
 
-        for env_i, e in enumerate(self.envs):
-            seed = self.actor_states[env_i][0].global_env_idx
-            observations, info = e.reset(seed=seed)  # new way of doing seeding since Gym 0.26.0
-
-            if self.cfg.decorrelate_envs_on_one_worker:
-                env_i_split = self.num_envs * self.split_idx + env_i
-                decorrelate_steps = self.cfg.rollout * env_i_split
-
-                log.info("Decorrelating experience for %d frames...", decorrelate_steps)
-                for decorrelate_step in range(decorrelate_steps):
-                    actions = [e.action_space.sample() for _ in range(self.num_agents)]
-                    observations, rew, terminated, truncated, info = e.step(actions)
-
+        for env_i, observations in enumerate(self._reset_all_envs()):
             for agent_i, obs in enumerate(observations):
                 actor_state = self.actor_states[env_i][agent_i]
                 actor_state.last_obs = obs
                 actor_state.last_rnn_state = clone_tensor(self.traj_tensors["rnn_states"][0, 0])
                 actor_state.reset_rnn_state()
 
+        self.envs_to_prepare = list(range(self.num_envs))
         self.env_step_ready = True
 
+    def _reset_all_envs(self) -> List[List[Dict[str, Any]]]:
+        """
+        Very first reset of all envs, followed by decorrelation (see decorrelation.py).
+        Envs are reset and decorrelated concurrently with --env_creation_threads.
+
+        :return: observations of all agents of every env of the vector
+        """
+        thread_name = f"env_reset_w{self.worker_idx}"
+        observations = run_concurrently(self._reset_env, self.num_envs, self.cfg.env_creation_threads, thread_name)
+
+        if needs_env_decorrelation(self.cfg):
+            started = time.time()
+            self.decorrelation_phases = [0] * self.num_envs
+            observations = run_concurrently(
+                lambda env_i: self._decorrelate_env(env_i, observations[env_i]),
+                self.num_envs,
+                self.cfg.env_creation_threads,
+                thread_name,
+            )
+            self.decorrelation_seconds = time.time() - started
+
+        return observations
+
+    def _reset_env(self, env_i: int) -> List[Dict[str, Any]]:
+        """:return: observations of all agents of the env after the first reset"""
+        e = self.envs[env_i]
+        seed = self.global_env_indices[env_i]
+        with self.startup_timeline.record(ENV_RESET, env_i):
+            observations, info = e.reset(seed=seed)  # new way of doing seeding since Gym 0.26.0
+        return observations
+
+    def _decorrelate_env(self, env_i: int, observations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """:return: observations of all agents of the env after the decorrelation steps"""
+        e = self.envs[env_i]
+        random_bursts = self.cfg.decorrelation_method == RANDOM_BURSTS
+        if random_bursts:
+            decorrelate_steps = burst_length(self.cfg, self.global_env_indices[env_i])
+        else:
+            env_i_split = self.num_envs * self.split_idx + env_i
+            decorrelate_steps = self.cfg.rollout * env_i_split
+
+        def step_random_action():
+            actions = [e.action_space.sample() for _ in range(self.num_agents)]
+            obs, rew, terminated, truncated, info = e.step(actions)
+            return obs, [term or trunc for term, trunc in zip(terminated, truncated)]
+
+        log.info("Decorrelating experience for %d frames...", decorrelate_steps)
+        with self.startup_timeline.record(ENV_DECORRELATE, env_i) as details:
+            new_observations, steps, phase = step_random_actions(step_random_action, decorrelate_steps, random_bursts)
+            details["steps"] = steps
+
+        self.decorrelation_phases[env_i] = phase
+        return observations if new_observations is None else new_observations
+
     def _process_policy_outputs(self, policy_id, timing):
         """
         Process the latest data from the policy worker (for policy = policy_id).
@@ -472,34 +602,37 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
                 assert actor_policy != -1
 
                 if actor_policy == policy_id:
-                    # via shared memory mechanism the new data should already be copied into the shared tensors
-
-                    with timing.add_time("split_output_tensors"):
-                        policy_outputs = np.split(
-                            actor_state.policy_output_tensors,
-                            indices_or_sections=actor_state.policy_output_indices,
-                            axis=0,
-                        )
-                    policy_outputs_dict = dict()
-                    for tensor_idx, name in enumerate(actor_state.policy_output_names):
-                        policy_outputs_dict[name] = policy_outputs[tensor_idx]
-
-                    # save parsed trajectory outputs directly into the trajectory buffer
-                    actor_state.set_trajectory_data(policy_outputs_dict, self.rollout_step)
-                    actor_state.last_actions = policy_outputs_dict["actions"].squeeze()
-
-                    # this is an rnn state for the next iteration in the rollout
-                    actor_state.last_rnn_state = policy_outputs_dict["new_rnn_states"]
-                    actor_state.last_value = policy_outputs_dict["values"].item()
-
-                    actor_state.ready = True
+                    self._save_policy_outputs(actor_state, self.rollout_step, timing)
                 elif not actor_state.ready:
                     all_actors_ready = False
 
-        # Potential optimization: when actions are ready for all actors within one environment we can execute
-        # a simulation step right away, without waiting for all other actions to be calculated.
+        # when actions are ready for all actors within one environment we could execute a simulation step right away,
+        # without waiting for all other actions to be calculated (see --step_envs_when_ready)
         return all_actors_ready
 
+    @staticmethod
+    def _save_policy_outputs(actor_state: ActorState, rollout_step: int, timing) -> None:
+        # via shared memory mechanism the new data should already be copied into the shared tensors
+        with timing.add_time("split_output_tensors"):
+            policy_outputs = np.split(
+                actor_state.policy_output_tensors,
+                indices_or_sections=actor_state.policy_output_indices,
+                axis=0,
+            )
+        policy_outputs_dict = dict()
+        for tensor_idx, name in enumerate(actor_state.policy_output_names):
+            policy_outputs_dict[name] = policy_outputs[tensor_idx]
+
+        # save parsed trajectory outputs directly into the trajectory buffer
+        actor_state.set_trajectory_data(policy_outputs_dict, rollout_step)
+        actor_state.last_actions = policy_outputs_dict["actions"].squeeze()
+
+        # this is an rnn state for the next iteration in the rollout
+        actor_state.last_rnn_state = policy_outputs_dict["new_rnn_states"]
+        actor_state.last_value = policy_outputs_dict["values"].item()
+
+        actor_state.ready = True
+
     def _process_rewards(self, rewards, env_i: int):
         """
         Pretty self-explanatory, here we record the episode reward and apply the optional clipping and
@@ -513,12 +646,13 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         rewards = np.clip(rewards, -self.cfg.reward_clip, self.cfg.reward_clip)
         return rewards
 
-    def _process_env_step(self, new_obs, rewards, terminated, truncated, infos, env_i):
+    def _process_env_step(self, new_obs, rewards, terminated, truncated, infos, env_i, rollout_step):
         """
         Process step outputs from a single environment in the vector.
 
         :param new_obs: latest observations from the env
         :param env_i: index of the environment in the vector
+        :param rollout_step: rollout step of the env (the same for all envs unless --step_envs_when_ready)
         :return: episodic stats, not empty only on the episode boundary
         """
 
@@ -535,7 +669,7 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
                 terminated[agent_i],
                 truncated[agent_i],
                 infos[agent_i],
-                self.rollout_step,
+                rollout_step,
             )
 
             actor_state.last_obs = new_obs[agent_i]
@@ -555,7 +689,7 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         for env_i in range(self.num_envs):
             for agent_i in range(self.num_agents):
                 actor = self.actor_states[env_i][agent_i]
-                rollouts.extend(actor.finalize_trajectory(self.rollout_step))
+                rollouts.extend(actor.finalize_trajectory(self.cfg.rollout))
                 self.need_trajectory_buffers += int(actor.needs_buffer)
 
         return rollouts
@@ -567,7 +701,9 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         data in the shared rollout buffer. This is enough for the policy worker to find the step data in the shared
         data structure.
 
-        :return: formatted request to be distributed to policy workers through FIFO queues.
+        :return: formatted request to be distributed to policy workers through FIFO queues: for every policy
+        an int32 array of shape [num_steps, 4], each row is (env_idx, agent_idx, traj_buffer_idx, rollout_step).
+        Policy workers concatenate these arrays and use the columns as indices directly.
         """
 
         policy_request = dict()
@@ -586,6 +722,9 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
                         policy_request[policy_id] = []
                     policy_request[policy_id].append(data)
 
+        for policy_id, data in policy_request.items():
+            policy_request[policy_id] = np.array(data, dtype=np.int32)
+
         return policy_request
 
     def _prepare_next_step(self):
@@ -599,44 +738,49 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         """
 
         for env_i in range(self.num_envs):
-            for agent_i in range(self.num_agents):
-                actor_state = self.actor_states[env_i][agent_i]
+            self._prepare_env_next_step(env_i, self.rollout_step)
 
-                if actor_state.is_active:
-                    actor_state.ready = False
+    def _prepare_env_next_step(self, env_i: int, rollout_step: int) -> List[ActorState]:
+        """:return: active actors of the env, these need actions for the next step"""
+        active_actors = []
+        for actor_state in self.actor_states[env_i]:
+            if actor_state.is_active:
+                actor_state.ready = False
+
+                # populate policy inputs in shared memory
+                policy_inputs = dict(obs=actor_state.last_obs, rnn_states=actor_state.last_rnn_state)
+                actor_state.set_trajectory_data(policy_inputs, rollout_step)
+                active_actors.append(actor_state)
+            else:
+                actor_state.ready = True
 
-                    # populate policy inputs in shared memory
-                    policy_inputs = dict(obs=actor_state.last_obs, rnn_states=actor_state.last_rnn_state)
-                    actor_state.set_trajectory_data(policy_inputs, self.rollout_step)
-                else:
-                    actor_state.ready = True
+        self.env_request_time[env_i] = time.time()
+        self.envs_waiting_for_actions[env_i] = True
+        return active_actors
 
-    def advance_rollouts(self, policy_id: PolicyID, timing) -> Tuple[List[Dict], List[Dict]]:
+    def advance_rollouts(self, policy_id: PolicyID, request_id: int, timing) -> Tuple[List[Dict], List[Dict]]:
         """
         Main function in VectorEnvRunner. Does one step of simulation (if all actions for all actors are available).
 
         :param policy_id:
+        :param request_id: tells which of the requests of this policy is done (see --step_envs_when_ready)
         :param timing: this is just for profiling
         :return: same as reset(), return a set of requests for policy workers, asking them to generate actions for
         the next env step.
         """
+        if self.step_envs_when_ready:
+            return self._advance_ready_envs(policy_id, request_id, timing)
+
         with timing.add_time("save_policy_outputs"):
             all_actors_ready = self._process_policy_outputs(policy_id, timing)
             if not all_actors_ready:
                 # not all policies involved sent their actions, waiting for more
                 return [], []
 
-        complete_rollouts, episodic_stats = [], []
-
-        for env_i, e in enumerate(self.envs):
-            with timing.add_time("env_step"):
-                actions = [s.curr_actions() for s in self.actor_states[env_i]]
-                new_obs, rewards, terminated, truncated, infos = e.step(actions)
-
-            with timing.add_time("overhead"):
-                stats = self._process_env_step(new_obs, rewards, terminated, truncated, infos, env_i)
-                episodic_stats.extend(stats)
+        self._record_wait_for_inference(range(self.num_envs), timing)
+        episodic_stats = self._step_envs(range(self.num_envs), [self.rollout_step] * self.num_envs, timing)
 
+        complete_rollouts = []
         self.rollout_step += 1
         if self.rollout_step == self.cfg.rollout:
             # finalize and serialize the trajectory if we have a complete rollout
@@ -646,6 +790,147 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
         self.env_step_ready = True
         return complete_rollouts, episodic_stats
 
+    def _step_envs(self, env_indices, rollout_steps: List[int], timing) -> List[Dict]:
+        """
+        Simulate one step in each of the envs, possibly concurrently (see --env_step_threads).
+        Env outputs are processed sequentially in env order.
+        """
+        with timing.add_time("env_step"):
+            envs, actions = [], []
+            for env_i in env_indices:
+                self.envs_waiting_for_actions[env_i] = False
+                envs.append(self.envs[env_i])
+                actions.append([s.curr_actions() for s in self.actor_states[env_i]])
+
+            step_results = self.env_step_pool.step(envs, actions)
+            step_results = self._track_step_latency(env_indices, step_results)
+
+        episodic_stats = []
+        with timing.add_time("overhead"):
+            for env_i, rollout_step, step_result in zip(env_indices, rollout_steps, step_results):
+                new_obs, rewards, terminated, truncated, infos = step_result
+                stats = self._process_env_step(new_obs, rewards, terminated, truncated, infos, env_i, rollout_step)
+                episodic_stats.extend(stats)
+
+        return episodic_stats
+
+    def _track_step_latency(self, env_indices, step_results: List[Tuple]) -> List[Tuple]:
+        """
+        Record the latency of the last env steps (see stragglers.py) and restart the envs that took longer than
+        --env_step_timeout to step.
+
+        :return: step results, with the results of the restarted envs replaced
+        """
+        step_times = self.env_step_pool.last_step_times
+        self.step_latency.update(env_indices, step_times)
+
+        timeout = self.cfg.env_step_timeout
+        if timeout <= 0:
+            return step_results
+
+        for i, (env_i, step_time) in enumerate(zip(env_indices, step_times)):
+            if step_time > timeout:
+                step_results[i] = self._restart_env(env_i, step_results[i], step_time)
+        return step_results
+
+    def _restart_env(self, env_i: int, step_result: Tuple, step_time: float) -> Tuple:
+        """
+        Replace an env that exceeded the step timeout with a fresh instance.
+        Rewards of the slow step are kept, but the episode is truncated and the next observations come from the new
+        instance, just like with an auto-reset.
+        """
+        global_env_idx = self.global_env_indices[env_i]
+        log.warning(
+            "Env %d (worker %d) took %.1fs to step (--env_step_timeout=%.1f), restarting it...",
+            global_env_idx,
+            self.worker_idx,
+            step_time,
+            self.cfg.env_step_timeout,
+        )
+
+        self.envs[env_i].close()
+        self.envs[env_i], _ = self._make_env(env_i)
+        self._on_env_restarted(env_i)
+        new_obs, _ = self.envs[env_i].reset()
+
+        self.step_latency.reset_env(env_i)
+        self.env_restarts += 1
+
+        _, rewards, terminated, truncated, infos = step_result
+        # episodes that did not terminate are truncated, so the learner bootstraps from the value of the last obs
+        truncated = [trunc or not term for term, trunc in zip(terminated, truncated)]
+        infos = [dict(info, env_restarted=True) for info in infos]
+        return new_obs, rewards, terminated, truncated, infos
+
+    def _on_env_restarted(self, env_i: int) -> None:
+        """Point the actors of the env to the new instance."""
+        for actor_state in self.actor_states[env_i]:
+            actor_state.set_env(self.envs[env_i])
+
+    def _record_wait_for_inference(self, ready_envs, timing) -> None:
+        """
+        Time from the policy request until all agents of the env got their actions. One measurement per env, so the
+        average is the same per-env wait whether the whole vector or only a few envs are ready.
+        """
+        now = time.time()
+        for env_i in ready_envs:
+            timing.record("wait_for_inference", now - self.env_request_time[env_i], average=10 * self.num_envs)
+
+    def _advance_ready_envs(self, policy_id: PolicyID, request_id: int, timing) -> Tuple[List[Dict], List[Dict]]:
+        """Simulate every env that has actions for all of its agents (see --step_envs_when_ready)."""
+        with timing.add_time("save_policy_outputs"):
+            for actor_state in self.actors_in_flight.pop((policy_id, request_id), []):
+                rollout_step = self.env_rollout_steps[actor_state.env_idx]
+                self._save_policy_outputs(actor_state, rollout_step, timing)
+
+        ready_envs = [
+            env_i
+            for env_i in range(self.num_envs)
+            if self.envs_waiting_for_actions[env_i] and all(s.ready for s in self.actor_states[env_i])
+        ]
+        if ready_envs:
+            self._record_wait_for_inference(ready_envs, timing)
+
+        rollout_steps = [self.env_rollout_steps[env_i] for env_i in ready_envs]
+        episodic_stats = self._step_envs(ready_envs, rollout_steps, timing)
+
+        complete_rollouts = []
+        for env_i in ready_envs:
+            self.env_rollout_steps[env_i] += 1
+            if self.env_rollout_steps[env_i] < self.cfg.rollout:
+                self.envs_to_prepare.append(env_i)
+            # otherwise the env waits for the rest of the vector at the rollout boundary
+
+        if all(step == self.cfg.rollout for step in self.env_rollout_steps):
+            complete_rollouts = self._finalize_trajectories()
+            self.env_rollout_steps = [0] * self.num_envs
+            self.envs_to_prepare = list(range(self.num_envs))
+
+        self.env_step_ready = bool(self.envs_to_prepare)
+        return complete_rollouts, episodic_stats
+
+    def _generate_ready_envs_policy_request(self) -> Dict:
+        """
+        Request actions for the envs that were just simulated (see --step_envs_when_ready).
+        A policy can have several requests in flight, each one is tagged with its own id, so when the outputs
+        arrive we know exactly which actors they are for.
+        """
+        self.policy_request_id += 1
+        policy_request = dict()
+        for env_i in self.envs_to_prepare:
+            for actor_state in self._prepare_env_next_step(env_i, self.env_rollout_steps[env_i]):
+                policy_id = actor_state.curr_policy_id
+                data = (env_i, actor_state.agent_idx, actor_state.curr_traj_buffer_idx, self.env_rollout_steps[env_i])
+                policy_request.setdefault(policy_id, []).append(data)
+                self.actors_in_flight.setdefault((policy_id, self.policy_request_id), []).append(actor_state)
+        self.envs_to_prepare = []
+
+        for policy_id, data in policy_request.items():
+            policy_request[policy_id] = np.array(data, dtype=np.int32)
+
+        # empty request advances the envs where all agents are inactive
+        return policy_request
+
     def update_trajectory_buffers(self, timing) -> bool:
         """
         Request free trajectory buffers to store the next rollout.
@@ -685,6 +970,10 @@ class NonBatchedVectorEnvRunner(VectorEnvRunner):
             # we don't have a shared buffers to store data in - still waiting for one to become available
             return None
 
+        if self.step_envs_when_ready:
+            self.env_step_ready = False
+            return self._generate_ready_envs_policy_request()
+
         self._prepare_next_step()
         policy_request = self._format_policy_request()
         self.env_step_ready = False
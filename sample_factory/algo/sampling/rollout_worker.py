@@ -2,19 +2,26 @@ from __future__ import annotations
 
 import os
 import time
+from os.path import join
 from typing import Any, Dict, List, Optional
 
 import psutil
 import torch
-from signal_slot.signal_slot import signal
+from signal_slot.signal_slot import Timer, signal
 
 from sample_factory.algo.sampling.batched_sampling import BatchedVectorEnvRunner
+from sample_factory.algo.sampling.decorrelation import SLEEP, phase_dispersion_stats
+from sample_factory.algo.sampling.env_reset_pool import EnvResetPool
+from sample_factory.algo.sampling.env_startup import merge_startup_timelines, save_startup_timeline
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
 from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
 from sample_factory.algo.sampling.sampling_utils import VectorEnvRunner, rollout_worker_device
+from sample_factory.algo.sampling.stragglers import rollout_quota, worker_straggler_report
+from sample_factory.algo.sampling.vectorized_non_batched_sampling import VectorizedNonBatchedEnvRunner
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
-from sample_factory.algo.utils.misc import advance_rollouts_signal, new_trajectories_signal
+from sample_factory.algo.utils.misc import STATS_KEY, STRAGGLERS, advance_rollouts_signal, new_trajectories_signal
 from sample_factory.algo.utils.rl_utils import total_num_agents, trajectories_per_training_iteration
 from sample_factory.algo.utils.torch_utils import inference_context
 from sample_factory.cfg.configurable import Configurable
@@ -24,9 +31,11 @@ from sample_factory.utils.typing import MpQueue, PolicyID
 from sample_factory.utils.utils import (
     cores_for_worker_process,
     debug_log_every_n,
+    experiment_dir,
     init_file_logger,
     log,
     set_process_cpu_affinity,
+    startup_timelines_dir,
 )
 
 
@@ -99,6 +108,10 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         assert self.vector_size % self.num_splits == 0, "Vector size should be divisible by num_splits"
 
         self.env_runners: List[VectorEnvRunner] = []
+        self.env_step_pool: Optional[EnvStepPool] = None  # shared by all splits, see --env_step_threads
+        self.env_reset_pool: Optional[EnvResetPool] = None  # see --env_reset_prefetch
+        self.report_timer: Optional[Timer] = None
+        self.straggler_report_timer: Optional[Timer] = None
 
         # training status updated by the runner
         self.training_info: List[Optional[Dict[str, Any]]] = [None for _ in range(self.cfg.num_policies)]
@@ -124,6 +137,9 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         # log.debug(f"Rollout worker {worker_idx} rollouts per iteration: {rollouts_per_iteration}")
         self.rollouts_per_iteration: int = rollouts_per_iteration
         self.remaining_rollouts: List[int] = [self.rollouts_per_iteration for _ in range(self.num_splits)]
+        # straggling workers whose rollouts are redistributed among the others in sync mode, see stragglers.py
+        self.excluded_workers: List[int] = []
+        self.num_excluded_iterations: int = 0  # training iterations this worker sat out
 
         self.experience_decorrelated: bool = False
         self.is_initialized: bool = False
@@ -133,8 +149,21 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         ...
 
     def init(self):
+        init_start = time.time()
+
+        # threads can only be created in the worker process
+        num_envs_per_split = self.vector_size // self.num_splits
+        self.env_step_pool = EnvStepPool(self.cfg.env_step_threads, num_envs_per_split, f"env_step_w{self.worker_idx}")
+        if self.cfg.env_reset_prefetch:
+            self.env_reset_pool = EnvResetPool(self.vector_size, f"env_reset_w{self.worker_idx}")
+
         for split_idx in range(self.num_splits):
-            env_runner_cls = BatchedVectorEnvRunner if self.cfg.batched_sampling else NonBatchedVectorEnvRunner
+            if self.cfg.batched_sampling:
+                env_runner_cls = BatchedVectorEnvRunner
+            elif self.cfg.vectorized_actor_states:
+                env_runner_cls = VectorizedNonBatchedEnvRunner
+            else:
+                env_runner_cls = NonBatchedVectorEnvRunner
 
             env_runner = env_runner_cls(
                 self.cfg,
@@ -145,6 +174,8 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
                 self.buffer_mgr,
                 self.sampling_device,
                 self.training_info,
+                self.env_step_pool,
+                self.env_reset_pool,
             )
 
             env_runner.init(self.timing)
@@ -152,6 +183,8 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
             # send signal to the inference worker to start processing new observations
             self.env_runners.append(env_runner)
 
+        self._report_startup_timeline(init_start)
+
         for r in self.env_runners:
             # This should kickstart experience collection. We will send a policy request to inference worker and
             # will get an "advance_rollout" signal back, and continue this loop of
@@ -161,10 +194,60 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
             # a buffer is freed (see on_trajectory_buffers_available()).
             self._maybe_send_policy_request(r)
 
+        self.report_timer = Timer(self.event_loop, 5.0)
+        self.report_timer.timeout.connect(self._report_stats)
+        # every comparison of the workers on the runner sees fresh latencies, see --straggler_report_interval
+        self.straggler_report_timer = Timer(self.event_loop, self.cfg.straggler_report_interval / 3)
+        self.straggler_report_timer.timeout.connect(self._report_stragglers)
+
         self.is_initialized = True
 
+    def _report_startup_timeline(self, init_start: float) -> None:
+        """Log env startup times of this worker, see --save_startup_timeline for the per-env breakdown."""
+        timelines = [r.startup_timeline for r in self.env_runners]
+        num_threads = self.cfg.env_creation_threads
+        if self.cfg.save_startup_timeline:
+            filename = join(startup_timelines_dir(experiment_dir(self.cfg)), f"startup_w{self.worker_idx:03d}.json")
+            timeline = save_startup_timeline(filename, self.worker_idx, init_start, timelines, num_threads)
+            details = f", see {filename}"
+        else:
+            timeline = merge_startup_timelines(self.worker_idx, init_start, timelines, num_threads)
+            details = ""
+
+        phase_totals = ", ".join(f"{phase}: {total:.2f}s" for phase, total in timeline["phase_totals"].items())
+        log.info(
+            "Worker %d started %d envs in %.2fs (%s)%s",
+            self.worker_idx,
+            self.vector_size,
+            timeline["wall_time"],
+            phase_totals,
+            details,
+        )
+
+    def _record_reset_times(self) -> None:
+        """Reset latency hidden by the background resets vs. latency the envs of this worker still waited for."""
+        hidden_time, exposed_time = self.env_reset_pool.pop_reset_times()
+        self.timing.record("env_reset_hidden", hidden_time)
+        self.timing.record("env_reset_exposed", exposed_time)
+
+    def _report_stats(self) -> None:
+        stats = self.env_step_pool.stats()
+        if self.env_reset_pool is not None:
+            self._record_reset_times()
+            stats.update(self.env_reset_pool.stats())
+        if stats:
+            self.report_msg.emit({STATS_KEY: stats})
+
+    def _report_stragglers(self) -> None:
+        trackers = [r.step_latency for r in self.env_runners]
+        env_restarts = sum(r.env_restarts for r in self.env_runners)
+        report = worker_straggler_report(self.worker_idx, trackers, env_restarts, self.cfg.straggler_factor)
+        self.report_msg.emit({STRAGGLERS: report})
+
     def _decorrelate_experience(self):
-        delay = (float(self.worker_idx) / self.cfg.num_workers) * self.cfg.decorrelate_experience_max_seconds
+        delay = 0.0
+        if self.cfg.decorrelation_method == SLEEP:
+            delay = (float(self.worker_idx) / self.cfg.num_workers) * self.cfg.decorrelate_experience_max_seconds
         if delay > 0.0:
             log.info(
                 "Worker %d, sleep for %.3f sec to decorrelate experience collection",
@@ -174,6 +257,25 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
             time.sleep(delay)
             log.info("Worker %d awakens!", self.worker_idx)
 
+        self._report_decorrelation(delay)
+
+    def _report_decorrelation(self, sleep_seconds: float) -> None:
+        """Dispersion of the episode phases of our envs vs. time spent on decorrelation (see decorrelation.py)."""
+        split_phases = [r.decorrelation_phases for r in self.env_runners]
+        seconds = sleep_seconds + sum(r.decorrelation_seconds for r in self.env_runners)
+        if not any(split_phases) and seconds <= 0.0:
+            return  # no decorrelation
+
+        stats = phase_dispersion_stats(split_phases, seconds)
+        log.info(
+            "Worker %d decorrelation: std of episode phases %.1f steps (%.1f within splits), %.2f sec spent",
+            self.worker_idx,
+            stats["decorrelation_phase_std"],
+            stats["decorrelation_split_phase_std"],
+            seconds,
+        )
+        self.report_msg.emit({STATS_KEY: stats})
+
     def _maybe_send_policy_request(self, runner: VectorEnvRunner):
         if self.remaining_rollouts[runner.split_idx] <= 0:
             # This should only happen in sync mode -- means we completed a sufficient number of rollouts
@@ -194,13 +296,22 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
         with self.timing.add_time("enqueue_policy_requests"):
             if policy_request is not None:
-                self._enqueue_policy_request(runner.split_idx, policy_request)
+                self._enqueue_policy_request(runner.split_idx, policy_request, runner.policy_request_id)
 
-    def _enqueue_policy_request(self, split_idx, policy_inputs):
+    def _enqueue_policy_request(self, split_idx, policy_inputs, request_id: int):
         """Distribute action requests to their corresponding queues."""
 
         for policy_id, requests in policy_inputs.items():
-            policy_request = (self.worker_idx, split_idx, requests, self.sampling_device)
+            # inference workers send the request id back with advance_rollouts, see --step_envs_when_ready
+            policy_request = (
+                self.worker_idx,
+                split_idx,
+                requests,
+                self.sampling_device,
+                policy_id,
+                request_id,
+                time.time(),
+            )
             self.inference_queues[policy_id].put(policy_request)
 
         if not policy_inputs:
@@ -213,7 +324,7 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
             # it's easier to self ourselves a signal than call advance_rollouts() directly because
             # this way we don't have to worry about getting stuck in an infinite loop or processing things like
             # stopping signal
-            self.emit(advance_rollouts_signal(self.worker_idx), split_idx, fake_policy_id)
+            self.emit(advance_rollouts_signal(self.worker_idx), split_idx, fake_policy_id, request_id)
 
     def _enqueue_complete_rollouts(self, complete_rollouts: List[Dict]):
         """Emit complete rollouts."""
@@ -227,7 +338,7 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         for policy_id, rollouts in rollouts_per_policy.items():
             self.emit(new_trajectories_signal(policy_id), rollouts, self.sampling_device)
 
-    def advance_rollouts(self, split_idx: int, policy_id: PolicyID) -> None:
+    def advance_rollouts(self, split_idx: int, policy_id: PolicyID, request_id: int) -> None:
         # TODO: update comment
         """
         Process incoming request from policy worker. Use the data (policy outputs, actions) to advance the simulation
@@ -238,7 +349,7 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         """
         with inference_context(self.cfg.serial_mode):
             runner = self.env_runners[split_idx]
-            complete_rollouts, episodic_stats = runner.advance_rollouts(policy_id, self.timing)
+            complete_rollouts, episodic_stats = runner.advance_rollouts(policy_id, request_id, self.timing)
 
             with self.timing.add_time("complete_rollouts"):
                 if complete_rollouts:
@@ -259,7 +370,9 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
             # we are ready to enqueue inference request
             self._maybe_send_policy_request(runner)
 
-    def on_trajectory_buffers_available(self, policy_id: PolicyID, training_iteration: int):
+    def on_trajectory_buffers_available(
+        self, policy_id: PolicyID, training_iteration: int, excluded_workers: Optional[List[int]] = None
+    ):
         """
         Used to wake up rollout workers waiting for trajectory buffers to be freed.
         In addition to that, we also send information about training iteration per policy. This is useful for
@@ -270,6 +383,9 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         may not necessarily guarantee the same number of trajectories per policy per iteration (i.e. if more agents
         collect experience for one policy than another). Multi-policy sync mode is thus an experimental feature,
         most of the time you should prefer using cfg.async_rl=True for multi-policy training.
+
+        With --exclude_straggler_workers the batcher also tells us which workers are excluded from sampling in the
+        next iteration, so that all workers redistribute the rollouts in the same way.
         """
         if not self.cfg.async_rl:
             # in sync mode we progress one iteration at a time
@@ -280,7 +396,7 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         curr_iteration = min(self.training_iteration)
         if curr_iteration > prev_iteration:
             # allow runners to collect the next portion of rollouts
-            self.remaining_rollouts = [self.rollouts_per_iteration for _ in range(self.num_splits)]
+            self._reset_rollout_quotas(excluded_workers or [])
 
         # we can receive this signal during batcher initialization, before the worker is initialized
         # this is fine, we just ignore it and get the trajectory buffers from the queue later after we do env.reset()
@@ -293,6 +409,30 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         for split_idx in range(self.num_splits):
             self._maybe_send_policy_request(self.env_runners[split_idx])
 
+    def _reset_rollout_quotas(self, excluded_workers: List[int]) -> None:
+        if self.cfg.async_rl or not excluded_workers:
+            self.remaining_rollouts = [self.rollouts_per_iteration for _ in range(self.num_splits)]
+        else:
+            self.remaining_rollouts = [
+                rollout_quota(
+                    self.rollouts_per_iteration,
+                    self.cfg.num_workers,
+                    self.num_splits,
+                    excluded_workers,
+                    self.worker_idx,
+                    split_idx,
+                )
+                for split_idx in range(self.num_splits)
+            ]
+
+        if self.worker_idx in excluded_workers:
+            self.num_excluded_iterations += 1
+            if excluded_workers != self.excluded_workers:
+                log.info(
+                    "Worker %d is a straggler, it will not collect experience in the next iteration", self.worker_idx
+                )
+        self.excluded_workers = excluded_workers
+
     def on_update_training_info(self, training_info: Dict[PolicyID, Dict[str, Any]]) -> None:
         """Update training info, this will be propagated to environments using TrainingInfoInterface and RewardShapingInterface."""
         for policy_id, info in training_info.items():
@@ -301,6 +441,11 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
     def on_stop(self, *args):
         for env_runner in self.env_runners:
             env_runner.close()
+        if self.env_step_pool is not None:
+            self.env_step_pool.close()
+        if self.env_reset_pool is not None:
+            self._record_reset_times()
+            self.env_reset_pool.close()
 
         timings = dict()
         if self.worker_idx in [0, self.cfg.num_workers - 1]:
@@ -4,7 +4,7 @@ from typing import Callable, Dict, List
 from signal_slot.queue_utils import get_queue
 from signal_slot.signal_slot import BoundMethod, EventLoop, EventLoopObject, EventLoopProcess, signal
 
-from sample_factory.algo.sampling.inference_worker import InferenceWorker, init_inference_process
+from sample_factory.algo.sampling.inference_worker import InferenceWorker, init_inference_process, policy_group_name
 from sample_factory.algo.sampling.rollout_worker import RolloutWorker, init_rollout_worker_process
 from sample_factory.algo.utils.context import sf_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
@@ -18,6 +18,13 @@ from sample_factory.utils.typing import Config, MpQueue, PolicyID
 from sample_factory.utils.utils import log
 
 
+def inference_policy_groups(cfg: Config) -> List[List[PolicyID]]:
+    """Consecutive groups of policies served by the same inference workers (see --policies_per_inference_worker)."""
+    policies = list(range(cfg.num_policies))
+    group_size = max(1, cfg.policies_per_inference_worker)
+    return [policies[i : i + group_size] for i in range(0, len(policies), group_size)]
+
+
 class AbstractSampler(EventLoopObject, Configurable):
     def __init__(
         self,
@@ -90,9 +97,14 @@ class Sampler(AbstractSampler, ABC):
         unique_name = Sampler.__name__
         AbstractSampler.__init__(self, event_loop, buffer_mgr, param_servers, cfg, env_info, unique_name)
 
-        self.inference_queues: Dict[PolicyID, MpQueue] = {
-            p: get_queue(cfg.serial_mode) for p in range(self.cfg.num_policies)
-        }
+        # all policies of the group share the queue of their inference workers
+        self.policy_groups: List[List[PolicyID]] = inference_policy_groups(cfg)
+        self.inference_queues: Dict[PolicyID, MpQueue] = dict()
+        for group in self.policy_groups:
+            queue = get_queue(cfg.serial_mode)
+            self.inference_queues.update({p: queue for p in group})
+
+        # inference workers of every group of policies, keyed by the first policy of the group
         self.inference_workers: Dict[PolicyID, List[InferenceWorker]] = dict()
         self.rollout_workers: List[RolloutWorker] = []
 
@@ -105,14 +117,14 @@ class Sampler(AbstractSampler, ABC):
     def _inference_workers_initialized(self):
         ...
 
-    def _make_inference_worker(self, event_loop, policy_id: PolicyID, worker_idx: int, param_server: ParameterServer):
+    def _make_inference_worker(self, event_loop, policy_ids: List[PolicyID], worker_idx: int):
         return InferenceWorker(
             event_loop,
-            policy_id,
+            policy_ids,
             worker_idx,
             self.buffer_mgr,
-            param_server,
-            self.inference_queues[policy_id],
+            {p: self.policy_param_server[p] for p in policy_ids},
+            self.inference_queues[policy_ids[0]],
             self.cfg,
             self.env_info,
         )
@@ -121,8 +133,8 @@ class Sampler(AbstractSampler, ABC):
         return RolloutWorker(event_loop, worker_idx, self.buffer_mgr, self.inference_queues, self.cfg, self.env_info)
 
     def _for_each_inference_worker(self, func: Callable[[InferenceWorker], None]) -> None:
-        for policy_id in range(self.cfg.num_policies):
-            for inference_worker in self.inference_workers[policy_id]:
+        for inference_workers in self.inference_workers.values():
+            for inference_worker in inference_workers:
                 func(inference_worker)
 
     def _for_each_rollout_worker(self, func: Callable[[RolloutWorker], None]) -> None:
@@ -143,21 +155,23 @@ class Sampler(AbstractSampler, ABC):
             self._inference_workers_initialized.connect(rollout_worker.init)
 
             # inference worker signals to advance rollouts when actions are ready
-            for policy_id in range(self.cfg.num_policies):
-                for inference_worker_idx in range(self.cfg.policy_workers_per_policy):
-                    self.inference_workers[policy_id][inference_worker_idx].connect(
-                        advance_rollouts_signal(rollout_worker_idx),
-                        rollout_worker.advance_rollouts,
-                    )
+            self._for_each_inference_worker(
+                lambda w: w.connect(advance_rollouts_signal(rollout_worker_idx), rollout_worker.advance_rollouts)
+            )
 
             # We also connect to our own advance_rollouts signal to avoid getting stuck when we have nothing
             # to send to the inference worker. This can happen if we have an entire trajectory of inactive agents.
             rollout_worker.connect(advance_rollouts_signal(rollout_worker_idx), rollout_worker.advance_rollouts)
 
     def connect_model_initialized(self, policy_id: PolicyID, model_initialized_signal: signal) -> None:
-        for inference_worker in self.inference_workers[policy_id]:
+        group_leader = self._group_leader(policy_id)
+        for inference_worker in self.inference_workers[group_leader]:
             model_initialized_signal.connect(inference_worker.init)
 
+    def _group_leader(self, policy_id: PolicyID) -> PolicyID:
+        """First policy of the group that contains policy_id, identifies the inference workers of the group."""
+        return next(group[0] for group in self.policy_groups if policy_id in group)
+
     def connect_on_new_trajectories(self, policy_id: PolicyID, on_new_trajectories_handler: BoundMethod) -> None:
         signal_name = new_trajectories_signal(policy_id)
         self._for_each_rollout_worker(lambda w: w.connect(signal_name, on_new_trajectories_handler))
@@ -185,8 +199,8 @@ class Sampler(AbstractSampler, ABC):
 
         # check if all workers for all policies are ready
         all_ready = True
-        for policy_id in range(self.cfg.num_policies):
-            all_ready &= all(w.is_ready for w in self.inference_workers[policy_id])
+        for inference_workers in self.inference_workers.values():
+            all_ready &= all(w.is_ready for w in inference_workers)
 
         if all_ready:
             log.info("All inference workers are ready! Signal rollout workers to start!")
@@ -219,12 +233,11 @@ class SerialSampler(Sampler):
     ):
         Sampler.__init__(self, event_loop, buffer_mgr, param_servers, cfg, env_info)
 
-        for policy_id in range(self.cfg.num_policies):
-            self.inference_workers[policy_id] = []
+        for group in self.policy_groups:
+            self.inference_workers[group[0]] = []
             for i in range(self.cfg.policy_workers_per_policy):
-                param_server = self.policy_param_server[policy_id]
-                inference_worker = self._make_inference_worker(self.event_loop, policy_id, i, param_server)
-                self.inference_workers[policy_id].append(inference_worker)
+                inference_worker = self._make_inference_worker(self.event_loop, group, i)
+                self.inference_workers[group[0]].append(inference_worker)
 
         for i in range(self.cfg.num_workers):
             rollout_worker = self._make_rollout_worker(self.event_loop, i)
@@ -252,22 +265,17 @@ class ParallelSampler(Sampler):
         self.processes: List[EventLoopProcess] = []
         mp_ctx = get_mp_ctx(cfg.serial_mode)
 
-        for policy_id in range(self.cfg.num_policies):
-            self.inference_workers[policy_id] = []
+        for group in self.policy_groups:
+            self.inference_workers[group[0]] = []
             for i in range(self.cfg.policy_workers_per_policy):
                 inference_proc = EventLoopProcess(
-                    f"inference_proc{policy_id}-{i}", mp_ctx, init_func=init_inference_process
+                    f"inference_proc{policy_group_name(group)}-{i}", mp_ctx, init_func=init_inference_process
                 )
                 self.processes.append(inference_proc)
-                inference_worker = self._make_inference_worker(
-                    inference_proc.event_loop,
-                    policy_id,
-                    i,
-                    self.policy_param_server[policy_id],
-                )
+                inference_worker = self._make_inference_worker(inference_proc.event_loop, group, i)
                 inference_proc.event_loop.owner = inference_worker
                 inference_proc.set_init_func_args((sf_global_context(), inference_worker))
-                self.inference_workers[policy_id].append(inference_worker)
+                self.inference_workers[group[0]].append(inference_worker)
 
         for i in range(self.cfg.num_workers):
             rollout_proc = EventLoopProcess(f"rollout_proc{i}", mp_ctx, init_func=init_rollout_worker_process)
@@ -4,6 +4,8 @@ from typing import Dict, List, Optional, Tuple
 
 import torch
 
+from sample_factory.algo.sampling.env_startup import StartupTimeline
+from sample_factory.algo.sampling.stragglers import StepLatencyTracker
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.utils.attr_dict import AttrDict
@@ -22,16 +24,34 @@ class VectorEnvRunner(Configurable):
 
         self.rollout_step: int = 0  # current position in the rollout across all envs
         self.env_step_ready = False
+        # id of the last request from generate_policy_request(), inference workers send it back to advance_rollouts()
+        self.policy_request_id: int = 0
 
         self.buffer_mgr = buffer_mgr
         self.traj_buffer_queue = buffer_mgr.traj_buffer_queues[sampling_device]
         self.traj_tensors = buffer_mgr.traj_tensors_torch[sampling_device]
+        self.dedup_framestack = buffer_mgr.dedup_framestack
+        self.rnn_states_stride = buffer_mgr.rnn_states_stride
+        self.rnn_state_tensors = None
+        if cfg.compact_rnn_states:
+            self.rnn_state_tensors = buffer_mgr.rnn_state_tensors_torch[sampling_device][worker_idx, split_idx]
         self.policy_output_tensors = buffer_mgr.policy_output_tensors_torch[sampling_device][worker_idx, split_idx]
 
+        # create/check/reset times of the envs in init(), see --env_creation_threads
+        self.startup_timeline = StartupTimeline()
+
+        # steps since the last episode reset of every env (or agent) after decorrelation, see decorrelation.py
+        self.decorrelation_phases: List[int] = []
+        self.decorrelation_seconds: float = 0.0
+
+        # step latency of the envs and the number of envs replaced after a step timeout, see stragglers.py
+        self.step_latency: Optional[StepLatencyTracker] = None
+        self.env_restarts: int = 0
+
     def init(self, timing: Timing):
         raise NotImplementedError()
 
-    def advance_rollouts(self, policy_id: PolicyID, timing) -> Tuple[List[Dict], List[Dict]]:
+    def advance_rollouts(self, policy_id: PolicyID, request_id: int, timing) -> Tuple[List[Dict], List[Dict]]:
         raise NotImplementedError()
 
     def update_trajectory_buffers(self, timing) -> bool:
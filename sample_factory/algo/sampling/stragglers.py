@@ -0,0 +1,176 @@
+"""
+Detection and mitigation of straggling envs and rollout workers (see --straggler_factor).
+
+Every vector runner keeps an exponential moving average of the step latency of each of its envs. An env (a rollout
+worker) is a straggler when its latency exceeds straggler_factor times the median latency of the envs of the same
+worker (of all workers). Rollout workers report their latency and their slow envs to the runner, which adds a
+straggler report to its periodic stats.
+
+Mitigation:
+- with --env_step_timeout > 0 non-batched runners replace an env that took longer than that to step with a fresh
+instance. The step can't be pre-empted, we restart the env after the slow step returns and truncate its episode.
+- with --exclude_straggler_workers (sync mode only) the rollout quotas of straggling workers in the next training
+iteration are redistributed among the other workers, so the iteration does not wait for the stragglers. The batcher
+broadcasts the exclusions together with the new training iteration, so all workers apply the same ones at the same
+iteration boundary. Excluded workers don't step and don't report their latency, so the exclusion expires at the next
+straggler report unless the worker is still measured to be slow.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# we don't care about the outliers among envs that step faster than that
+MIN_OUTLIER_LATENCY_SEC = 1e-3
+
+
+def find_outliers(
+    latencies: Dict[int, float], factor: float, min_latency: float = MIN_OUTLIER_LATENCY_SEC
+) -> List[int]:
+    """:return: sorted keys whose latency exceeds factor * median of all latencies (and min_latency)"""
+    if len(latencies) < 3:
+        # with two values neither can exceed a multiple of the median, with one there is nothing to compare to
+        return []
+
+    threshold = max(factor * float(np.median(list(latencies.values()))), min_latency)
+    return sorted(key for key, latency in latencies.items() if latency > threshold)
+
+
+def rollout_quota(
+    rollouts_per_iteration: int,
+    num_workers: int,
+    num_splits: int,
+    excluded_workers: Sequence[int],
+    worker_idx: int,
+    split_idx: int,
+) -> int:
+    """
+    Sync mode rollouts of a split of a rollout worker in one training iteration. Rollouts of the excluded workers are
+    redistributed among the splits of other workers so that the total stays the same.
+    """
+    if worker_idx in excluded_workers:
+        return 0
+
+    active_workers = [w for w in range(num_workers) if w not in excluded_workers]
+    total_rollouts = rollouts_per_iteration * num_workers * num_splits
+    num_slots = len(active_workers) * num_splits
+    slot = active_workers.index(worker_idx) * num_splits + split_idx
+    return total_rollouts // num_slots + int(slot < total_rollouts % num_slots)
+
+
+class StepLatencyTracker:
+    """
+    Step latency of every env of a vector runner: moving average per env to find the slow envs, and the total
+    over the current report window to compare rollout workers.
+    """
+
+    def __init__(self, num_envs: int, first_env_id: int, ema_alpha: float = 0.05):
+        """:param first_env_id: global index of the first env of the vector, envs are reported by global index"""
+        self.first_env_id = first_env_id
+        self.ema_alpha = ema_alpha
+        self.latency = np.zeros(num_envs, dtype=np.float64)
+        self.num_steps = np.zeros(num_envs, dtype=np.int64)
+
+        self.window_time: float = 0.0
+        self.window_steps: int = 0
+
+    def update(self, env_indices: Sequence[int], step_times: Sequence[float]) -> None:
+        for env_i, step_time in zip(env_indices, step_times):
+            if self.num_steps[env_i] == 0:
+                self.latency[env_i] = step_time
+            else:
+                self.latency[env_i] += self.ema_alpha * (step_time - self.latency[env_i])
+            self.num_steps[env_i] += 1
+
+            self.window_time += step_time
+            self.window_steps += 1
+
+    def reset_env(self, env_i: int) -> None:
+        """Forget the latency of an env that was restarted."""
+        self.latency[env_i] = 0.0
+        self.num_steps[env_i] = 0
+
+    def env_latencies(self) -> Dict[int, float]:
+        """:return: latency of every env that stepped at least once, by global env index"""
+        stepped = np.nonzero(self.num_steps)[0]
+        return {self.first_env_id + int(env_i): float(self.latency[env_i]) for env_i in stepped}
+
+    def pop_window(self) -> Tuple[float, int]:
+        """:return: total step time and number of env steps since the last call"""
+        window = self.window_time, self.window_steps
+        self.window_time, self.window_steps = 0.0, 0
+        return window
+
+
+def worker_straggler_report(
+    worker_idx: int, trackers: Sequence[StepLatencyTracker], env_restarts: int, factor: float
+) -> Dict[str, Any]:
+    """
+    Step latency of a rollout worker over the report window and the slow envs among all envs of the worker.
+    Latency is None if the worker did not step since the last report (i.e. it was excluded from sampling).
+    """
+    window_time, window_steps = 0.0, 0
+    env_latencies = dict()
+    for tracker in trackers:
+        tracker_time, tracker_steps = tracker.pop_window()
+        window_time += tracker_time
+        window_steps += tracker_steps
+        env_latencies.update(tracker.env_latencies())
+
+    slow_envs = {env_id: env_latencies[env_id] for env_id in find_outliers(env_latencies, factor)}
+    return dict(
+        worker_idx=worker_idx,
+        step_latency=window_time / window_steps if window_steps > 0 else None,
+        slow_envs=slow_envs,
+        env_restarts=env_restarts,
+    )
+
+
+class StragglerMonitor:
+    """Runner-side view of the straggler reports of all rollout workers."""
+
+    def __init__(self, factor: float, exclude_workers: bool):
+        self.factor = factor
+        self.exclude_workers = exclude_workers
+
+        self.worker_latency: Dict[int, float] = dict()  # only workers that stepped since the last update
+        self.slow_envs: Dict[int, Dict[int, float]] = dict()
+        self.env_restarts: Dict[int, int] = dict()
+
+        self.stragglers: List[int] = []
+        self.excluded_workers: List[int] = []
+        self.num_exclusions: Dict[int, int] = dict()  # how many times each worker was excluded so far
+
+    def on_report(self, report: Dict[str, Any]) -> None:
+        worker_idx = report["worker_idx"]
+        if report["step_latency"] is not None:
+            self.worker_latency[worker_idx] = report["step_latency"]
+        self.slow_envs[worker_idx] = report["slow_envs"]
+        self.env_restarts[worker_idx] = report["env_restarts"]
+
+    def update(self) -> Optional[Dict[str, float]]:
+        """
+        Find the straggling workers among those that reported since the last update and decide which ones to exclude.
+        :return: stats for the summaries, None if no worker reported its latency
+        """
+        if not self.worker_latency:
+            return None
+
+        latencies = list(self.worker_latency.values())
+        self.stragglers = find_outliers(self.worker_latency, self.factor)
+        if self.exclude_workers:
+            self.excluded_workers = list(self.stragglers)
+            for worker_idx in self.excluded_workers:
+                self.num_exclusions[worker_idx] = self.num_exclusions.get(worker_idx, 0) + 1
+        self.worker_latency = dict()
+
+        return dict(
+            worker_step_latency_ms_median=1000 * float(np.median(latencies)),
+            worker_step_latency_ms_max=1000 * max(latencies),
+            straggler_workers=len(self.stragglers),
+            excluded_workers=len(self.excluded_workers),
+            slow_envs=sum(len(envs) for envs in self.slow_envs.values()),
+            env_restarts=sum(self.env_restarts.values()),
+        )
@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import time
+from queue import Empty
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gymnasium as gym
+import numpy as np
+
+from sample_factory.algo.sampling.env_reset_pool import EnvResetPool
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
+from sample_factory.algo.sampling.non_batched_sampling import ActorState, NonBatchedVectorEnvRunner, episodic_stats
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, STACKED_OBS_KEY, store_stacked_obs
+from sample_factory.algo.utils.shared_buffers import rnn_states_index
+from sample_factory.envs.env_utils import (
+    TrainingInfoInterface,
+    find_training_info_interface,
+    set_reward_shaping,
+    set_training_info,
+)
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import PolicyID
+from sample_factory.utils.utils import debug_log_every_n, log, set_attr_if_exists
+
+
+class VectorizedNonBatchedEnvRunner(NonBatchedVectorEnvRunner):
+    """
+    Non-batched runner that keeps the state of all actors in the vector in arrays of shape [num_envs, num_agents]
+    instead of one ActorState object per actor (see --vectorized_actor_states).
+
+    Policy outputs, rewards, done flags, observations and policy requests of the whole vector are written
+    with one array operation per step (per policy for policy outputs) using the trajectory buffer index of every actor.
+    Python code that runs per actor is left only for the episode boundaries and for the trajectories that
+    contain experience of multiple policies.
+    Experience is exactly the same as with NonBatchedVectorEnvRunner. --step_envs_when_ready is not supported.
+    """
+
+    def __init__(
+        self,
+        cfg,
+        env_info,
+        num_envs,
+        worker_idx,
+        split_idx,
+        buffer_mgr,
+        sampling_device: str,
+        training_info: List[Optional[Dict[str, Any]]],
+        env_step_pool: EnvStepPool,
+        env_reset_pool: Optional[EnvResetPool] = None,
+    ):
+        super().__init__(
+            cfg,
+            env_info,
+            num_envs,
+            worker_idx,
+            split_idx,
+            buffer_mgr,
+            sampling_device,
+            training_info,
+            env_step_pool,
+            env_reset_pool,
+        )
+        assert not self.step_envs_when_ready, "--step_envs_when_ready is not supported with --vectorized_actor_states"
+        assert isinstance(self.policy_output_tensors, np.ndarray), "Only CPU-side sampling is supported"
+
+        actors_shape = (self.num_envs, self.num_agents)
+        self.traj_buffer_idx = np.zeros(actors_shape, dtype=np.int64)
+        self.needs_buffer = np.ones(actors_shape, dtype=bool)
+        self.curr_policy_id = np.zeros(actors_shape, dtype=np.int32)
+        self.is_active = np.ones(actors_shape, dtype=bool)
+        self.ready = np.zeros(actors_shape, dtype=bool)
+        self.episode_reward = np.zeros(actors_shape, dtype=np.float64)
+        self.episode_len = np.zeros(actors_shape, dtype=np.int64)
+        self.num_trajectories = np.zeros(actors_shape, dtype=np.int64)
+        # indices of all actors in env-major order, this is the order in which NonBatchedVectorEnvRunner visits them
+        self.all_actors: Tuple[np.ndarray, np.ndarray] = np.nonzero(np.ones(actors_shape, dtype=bool))
+
+        # policy outputs are concatenated along the last axis, see alloc_policy_output_tensors()
+        offsets = np.cumsum([0, *buffer_mgr.output_sizes])
+        output_slices = {name: slice(offsets[i], offsets[i + 1]) for i, name in enumerate(buffer_mgr.output_names)}
+        self.actions_slice: slice = output_slices["actions"]
+        self.new_rnn_states_slice: slice = output_slices["new_rnn_states"]
+        # outputs that we save in the trajectories and their shape per step
+        self.traj_outputs: Dict[str, Tuple[slice, Tuple[int, ...]]] = {
+            name: (output_slice, self.traj_tensors[name].shape[2:])
+            for name, output_slice in output_slices.items()
+            if name in self.traj_tensors
+        }
+
+        self.last_obs: List[List[Dict[str, Any]]] = []  # per env, per agent
+        self.last_actions = np.zeros(actors_shape + (self.actions_slice.stop - self.actions_slice.start,), np.float32)
+        self.last_rnn_state = np.zeros(actors_shape + self.traj_tensors["rnn_states"].shape[2:], np.float32)
+
+        self.env_training_info_interfaces: List[Optional[TrainingInfoInterface]] = []
+        self.env_actions: Callable[[np.ndarray], List] = self._env_actions_func()
+
+    def init(self, timing: Timing):
+        """Instantiate the envs, actor states are initialized in the ctor already."""
+        self._create_envs()
+
+        for env_i, env in enumerate(self.envs):
+            self.env_training_info_interfaces.append(find_training_info_interface(env))
+            for agent_i in range(self.num_agents):
+                policy_id = self.policy_mgr.get_policy_for_agent(agent_i, env_i, self.global_env_indices[env_i])
+                self.curr_policy_id[env_i, agent_i] = policy_id
+                set_attr_if_exists(env.unwrapped, "curr_policy_idx", policy_id)
+
+        self._reset()
+
+    def _reset(self):
+        self.last_obs = self._reset_all_envs()
+        self.last_rnn_state[:] = 0.0
+        self.env_step_ready = True
+
+    def _env_actions_func(self) -> Callable[[np.ndarray], List]:
+        """
+        Resolve the action format expected by the envs once, instead of on every step for every actor.
+        Actions are formatted exactly like ActorState.curr_actions() does it.
+        """
+        action_space = self.env_info.action_space
+        if self.env_info.all_discrete or isinstance(action_space, gym.spaces.Discrete):
+            if self.last_actions.shape[-1] == 1:
+                # envs expect a Python int per agent when there's only one discrete action
+                return lambda actions: actions[..., 0].astype(np.int32).tolist()
+            return lambda actions: [list(env_actions) for env_actions in actions.astype(np.int32)]
+        elif isinstance(action_space, gym.spaces.Box):
+            # copy so the envs don't hold views of the actions that we overwrite on the next step
+            return lambda actions: [list(env_actions) for env_actions in actions.copy()]
+        elif isinstance(action_space, gym.spaces.Tuple):
+            split_indices = np.cumsum(self.env_info.action_splits)[:-1]
+            is_discrete = [isinstance(space, gym.spaces.Discrete) for space in action_space]
+
+            def tuple_actions(actions: np.ndarray) -> List:
+                return [
+                    [
+                        [
+                            ActorState._process_action_space(split, discrete)
+                            for split, discrete in zip(np.split(agent_actions, split_indices), is_discrete)
+                        ]
+                        for agent_actions in env_actions
+                    ]
+                    for env_actions in actions
+                ]
+
+            return tuple_actions
+
+        raise NotImplementedError(f"Unknown action space type: {type(action_space)}")
+
+    def _process_policy_outputs(self, policy_id, timing):
+        """
+        Save the outputs for all actors controlled by policy_id into their trajectories.
+        :return: whether we got all outputs for all the actors in our VectorEnvRunner
+        """
+        env_idx, agent_idx = np.nonzero(self.is_active & (self.curr_policy_id == policy_id))
+        outputs = self.policy_output_tensors[env_idx, agent_idx]
+        buffers = self.traj_buffer_idx[env_idx, agent_idx]
+
+        for name, (output_slice, step_shape) in self.traj_outputs.items():
+            self.traj_tensors[name][buffers, self.rollout_step] = outputs[:, output_slice].reshape(-1, *step_shape)
+
+        self.last_actions[env_idx, agent_idx] = outputs[:, self.actions_slice]
+        # this is an rnn state for the next iteration in the rollout
+        self.last_rnn_state[env_idx, agent_idx] = outputs[:, self.new_rnn_states_slice]
+        self.ready[env_idx, agent_idx] = True
+
+        return bool(np.all(self.ready | ~self.is_active))
+
+    def _step_envs(self, env_indices, rollout_steps: List[int], timing) -> List[Dict]:
+        assert len(env_indices) == self.num_envs, "All envs of the vector are stepped together"
+
+        with timing.add_time("env_step"):
+            self.envs_waiting_for_actions = [False] * self.num_envs
+            step_results = self.env_step_pool.step(self.envs, self.env_actions(self.last_actions))
+            step_results = self._track_step_latency(range(self.num_envs), step_results)
+
+        with timing.add_time("overhead"):
+            return self._record_env_steps(step_results, self.rollout_step)
+
+    def _on_env_restarted(self, env_i: int) -> None:
+        env = self.envs[env_i]
+        self.env_training_info_interfaces[env_i] = find_training_info_interface(env)
+        for agent_i in range(self.num_agents):
+            set_attr_if_exists(env.unwrapped, "curr_policy_idx", int(self.curr_policy_id[env_i, agent_i]))
+
+    def _record_env_steps(self, step_results: List[Tuple], rollout_step: int) -> List[Dict]:
+        """Same as ActorState.record_env_step() for all actors of the vector."""
+        new_obs, rewards, terminated, truncated, infos = zip(*step_results)
+
+        # episode rewards are accumulated in double precision, just like the Python floats in ActorState
+        rewards_orig = np.asarray(rewards, dtype=np.float64)
+        rewards = rewards_orig.astype(np.float32) * self.cfg.reward_scale
+        rewards = np.clip(rewards, -self.cfg.reward_clip, self.cfg.reward_clip)
+        terminated = np.asarray(terminated, dtype=bool)
+        truncated = np.asarray(truncated, dtype=bool)
+        dones = terminated | truncated
+
+        buffers = self.traj_buffer_idx
+        self.traj_tensors["rewards"][buffers, rollout_step] = rewards
+        self.traj_tensors["dones"][buffers, rollout_step] = dones
+        self.traj_tensors["time_outs"][buffers, rollout_step] = truncated
+        # -1 policy_id does not match any valid policy on the learner, experience of inactive agents is ignored
+        self.traj_tensors["policy_id"][buffers, rollout_step] = np.where(self.is_active, self.curr_policy_id, -1)
+
+        self.episode_reward += rewards_orig
+        # multiply by frameskip to get the episode lengths matching the actual number of simulated steps
+        self.episode_len += self.env_info.frameskip if self.cfg.summaries_use_frameskip else 1
+
+        self.is_active[:] = [[info.get("is_active", True) for info in env_infos] for env_infos in infos]
+
+        reports = []
+        for env_i, agent_i in zip(*np.nonzero(dones)):
+            reports.append(self._on_episode_end(int(env_i), int(agent_i), infos[env_i][agent_i]))
+
+        self.last_obs = list(new_obs)
+        # reset rnn states to their default values on episode boundaries
+        self.last_rnn_state[dones] = 0.0
+
+        return reports
+
+    def _on_episode_end(self, env_i: int, agent_i: int, info: Dict) -> Dict[str, Any]:
+        policy_id = int(self.curr_policy_id[env_i, agent_i])
+        report = episodic_stats(
+            info, float(self.episode_reward[env_i, agent_i]), int(self.episode_len[env_i, agent_i]), policy_id
+        )
+
+        # propagate information in the direction RL algo -> environment
+        if self.training_info[policy_id] is not None:
+            reward_shaping = self.training_info[policy_id].get("reward_shaping", None)
+            set_reward_shaping(self.envs[env_i], reward_shaping, agent_i)
+            set_training_info(self.env_training_info_interfaces[env_i], self.training_info[policy_id])
+
+        new_policy_id = self.policy_mgr.get_policy_for_agent(agent_i, env_i, self.global_env_indices[env_i])
+        if new_policy_id != policy_id:
+            # policy change can only happen at the episode boundary where rnn states are reset anyway
+            self.curr_policy_id[env_i, agent_i] = new_policy_id
+            set_attr_if_exists(self.envs[env_i].unwrapped, "curr_policy_idx", new_policy_id)
+
+        self.episode_reward[env_i, agent_i] = 0.0
+        self.episode_len[env_i, agent_i] = 0
+        return report
+
+    def _write_policy_inputs(self, env_idx: np.ndarray, agent_idx: np.ndarray, rollout_step: int) -> None:
+        """Write the latest observations and rnn states of the given actors into their trajectories."""
+        if len(env_idx) == 0:
+            return
+
+        buffers = self.traj_buffer_idx[env_idx, agent_idx]
+        actor_obs = [self.last_obs[env_i][agent_i] for env_i, agent_i in zip(env_idx.tolist(), agent_idx.tolist())]
+        for key, obs_buffer in self.traj_tensors["obs"].items():
+            obs_buffer[buffers, rollout_step] = np.stack([obs[key] for obs in actor_obs])
+        if self.dedup_framestack:
+            # main observation is not in the obs dict, we store only the new frame(s), see frame_stack.py
+            stacked_obs = np.stack([np.asarray(obs[STACKED_OBS_KEY]) for obs in actor_obs])
+            store_stacked_obs(self.traj_tensors[OBS_FRAMES], stacked_obs, rollout_step, buffers)
+
+        rnn_states = self.last_rnn_state[env_idx, agent_idx]
+        if self.rnn_state_tensors is not None:
+            # trajectory RNN states are not indexed by rollout step, see ActorState._save_rnn_state()
+            self.rnn_state_tensors[env_idx, agent_idx] = rnn_states
+            idx = rnn_states_index(rollout_step, self.rnn_states_stride)
+            if idx is not None:
+                self.traj_tensors["rnn_states"][buffers, idx] = rnn_states
+        else:
+            self.traj_tensors["rnn_states"][buffers, rollout_step] = rnn_states
+
+    def _finalize_trajectories(self) -> List[Dict[str, Any]]:
+        # Saving obs and hidden states for the step AFTER the last step in the current rollout.
+        # We're going to need them later when we calculate next step value estimates.
+        self._write_policy_inputs(*self.all_actors, self.cfg.rollout)
+
+        policy_ids = self.traj_tensors["policy_id"][self.traj_buffer_idx]
+        single_policy = np.all(policy_ids == policy_ids[..., :1], axis=-1)
+
+        rollouts = []
+        for env_i, agent_i in zip(*(idx.tolist() for idx in self.all_actors)):
+            if single_policy[env_i, agent_i]:
+                policy_id = int(policy_ids[env_i, agent_i, 0])
+                if policy_id == -1:
+                    # the entire trajectory belongs to an inactive agent, see ActorState.finalize_trajectory()
+                    policy_id = int(self.curr_policy_id[env_i, agent_i])
+                traj_buffer_idx = int(self.traj_buffer_idx[env_i, agent_i])
+                rollouts.append(self._trajectory(env_i, agent_i, policy_id, traj_buffer_idx))
+            else:
+                rollouts.extend(self._multi_policy_trajectories(env_i, agent_i, policy_ids[env_i, agent_i]))
+
+        self.needs_buffer[:] = True
+        self.need_trajectory_buffers += self.needs_buffer.size
+        return rollouts
+
+    def _trajectory(self, env_i: int, agent_i: int, policy_id: PolicyID, traj_buffer_idx: int) -> Dict[str, Any]:
+        num_trajectories = int(self.num_trajectories[env_i, agent_i])
+        self.num_trajectories[env_i, agent_i] += 1
+        t_id = f"{policy_id}_{self.worker_idx}_{self.split_idx}_{env_i}_{agent_i}_{num_trajectories}"
+        return dict(t_id=t_id, length=self.cfg.rollout, policy_id=policy_id, traj_buffer_idx=traj_buffer_idx)
+
+    def _multi_policy_trajectories(self, env_i: int, agent_i: int, policy_ids: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        The policy changed in the middle of the rollout, the trajectory is sent to the learners of all policies
+        involved, each in a separate buffer. See ActorState.finalize_trajectory().
+        """
+        unique_policies = np.unique(policy_ids)
+        debug_log_every_n(1000, f"Multiple policies in trajectory buffer: {unique_policies} (-1 means inactive agent)")
+
+        traj_buffer_idx = int(self.traj_buffer_idx[env_i, agent_i])
+        trajectories = []
+        policy_buffers: Dict[PolicyID, int] = dict()
+        for policy_id in unique_policies:
+            policy_id = int(policy_id)
+            if policy_id == -1:
+                policy_id = int(self.curr_policy_id[env_i, agent_i])
+            if policy_id in policy_buffers:
+                continue
+
+            buffer_idx = traj_buffer_idx
+            if buffer_idx in policy_buffers.values():
+                try:
+                    buffer_idx = self.traj_buffer_queue.get(block=True, timeout=100)
+                except Empty:
+                    log.error(
+                        f"Lost trajectory for {policy_id=} ({policy_ids}) since we could not find a trajectory buffer!"
+                    )
+                    continue
+                self.traj_tensors[buffer_idx] = self.traj_tensors[traj_buffer_idx]  # copy TensorDict data recursively
+
+            policy_buffers[policy_id] = buffer_idx
+            trajectories.append(self._trajectory(env_i, agent_i, policy_id, buffer_idx))
+
+        assert len(policy_buffers), "We ought to send our buffer to at least one learner"
+        return trajectories
+
+    def _prepare_next_step(self):
+        """Write observations and rnn states of the active actors into the trajectories for the next step."""
+        env_idx, agent_idx = np.nonzero(self.is_active)
+        self.ready[:] = ~self.is_active
+        self._write_policy_inputs(env_idx, agent_idx, self.rollout_step)
+
+        self.env_request_time = [time.time()] * self.num_envs
+        self.envs_waiting_for_actions = [True] * self.num_envs
+
+    def _format_policy_request(self):
+        """Same format as NonBatchedVectorEnvRunner._format_policy_request(), built with array operations."""
+        env_idx, agent_idx = np.nonzero(self.is_active)
+        buffers = self.traj_buffer_idx[env_idx, agent_idx]
+        rollout_steps = np.full_like(env_idx, self.rollout_step)
+        requests = np.stack([env_idx, agent_idx, buffers, rollout_steps], axis=1).astype(np.int32)
+
+        policy_ids = self.curr_policy_id[env_idx, agent_idx]
+        return {int(policy_id): requests[policy_ids == policy_id] for policy_id in np.unique(policy_ids)}
+
+    def update_trajectory_buffers(self, timing) -> bool:
+        """Request free trajectory buffers to store the next rollout."""
+        while self.need_trajectory_buffers > 0:
+            with timing.add_time("wait_for_trajectories"):
+                try:
+                    buffers = self.traj_buffer_queue.get_many(
+                        block=False,
+                        max_messages_to_get=self.need_trajectory_buffers,
+                    )
+                except Empty:
+                    return False
+
+                env_idx, agent_idx = np.nonzero(self.needs_buffer)
+                env_idx, agent_idx = env_idx[: len(buffers)], agent_idx[: len(buffers)]
+                self.traj_buffer_idx[env_idx, agent_idx] = buffers
+                self.needs_buffer[env_idx, agent_idx] = False
+                self.need_trajectory_buffers -= len(buffers)
+
+        assert self.need_trajectory_buffers == 0
+        return True
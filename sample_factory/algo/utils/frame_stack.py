@@ -0,0 +1,137 @@
+"""
+Frame-deduplicated storage of frame-stacked observations (see --dedup_framestack).
+
+With frame stacking (e.g. --env_framestack=4 in Atari) consecutive observations share all but one frame.
+Instead of storing the full stack for every rollout step, trajectory buffers keep every frame once in
+traj[OBS_FRAMES] which has shape [num_traj, framestack - 1 + rollout + 1, *frame_shape].
+The first framestack - 1 frames are the history that precedes the first step of the rollout, they are taken from the
+full stack observed at step 0. Frame of the rollout step t is stored at index framestack - 1 + t.
+
+Full stacks are reconstructed by an index gather on the inference worker and on the learner.
+Frames that precede the start of the current episode are replaced by the first frame of the episode, this is how
+frame stacking wrappers (i.e. gymnasium FrameStack) fill the stack on reset.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sample_factory.utils.typing import Config, ObsSpace
+
+OBS_FRAMES = "obs_frames"
+STACKED_OBS_KEY = "obs"  # only the main observation can be frame-stacked
+# index of the frame stack of each sample of a learner batch that keeps deduplicated frames (trajectory * rollout + step)
+OBS_FRAME_STEPS = "obs_frame_steps"
+
+
+def deduplicated_framestack(cfg: Config, obs_space: ObsSpace) -> int:
+    """:return: frame stack size if we store deduplicated frames instead of the full stacks, 0 otherwise."""
+    if not cfg.dedup_framestack or cfg.env_framestack <= 1:
+        return 0
+
+    space = obs_space.spaces.get(STACKED_OBS_KEY)
+    if space is None or len(space.shape) < 2 or space.shape[0] != cfg.env_framestack:
+        # frames are not stacked along the first axis of the main observation, nothing to deduplicate
+        return 0
+
+    return cfg.env_framestack
+
+
+def store_stacked_obs(
+    frames: Tensor | np.ndarray,
+    stacked_obs: Tensor | np.ndarray,
+    rollout_step: int,
+    traj_indices: Optional[np.ndarray] = None,
+) -> None:
+    """
+    :param frames: [B, framestack - 1 + rollout + 1, *frame_shape] frame buffer of B trajectories
+    :param stacked_obs: [B, framestack, *frame_shape] full frame stacks observed at rollout_step
+    :param traj_indices: if not None, stacked_obs[i] belongs to the trajectory frames[traj_indices[i]]
+    """
+    if isinstance(frames, Tensor):
+        if not isinstance(stacked_obs, Tensor):
+            stacked_obs = torch.from_numpy(np.asarray(stacked_obs))  # also handles LazyFrames and similar wrappers
+    else:
+        # numpy view of the trajectory buffers (non-batched sampling)
+        stacked_obs = np.asarray(stacked_obs)
+
+    traj = slice(None) if traj_indices is None else traj_indices
+    framestack = stacked_obs.shape[1]
+    if rollout_step == 0:
+        # the very first step of the rollout also provides the history frames
+        frames[traj, :framestack] = stacked_obs
+    else:
+        frames[traj, framestack - 1 + rollout_step] = stacked_obs[:, -1]
+
+
+def gather_stacked_obs(
+    frames: Tensor, dones: Tensor, traj_indices: Tensor, rollout_steps: Tensor, framestack: int
+) -> Tensor:
+    """
+    Reconstruct full frame stacks for a batch of (trajectory, rollout step) pairs.
+
+    :param frames: [num_traj, framestack - 1 + rollout + 1, *frame_shape]
+    :param dones: [num_traj, rollout], only the done flags that precede the requested steps are used
+    :param traj_indices: [B] trajectory indices
+    :param rollout_steps: [B] rollout steps within the trajectories
+    :return: [B, framestack, *frame_shape]
+    """
+    device = frames.device
+    traj_indices = traj_indices.to(device, torch.long)
+    rollout_steps = rollout_steps.to(device, torch.long)
+    rollout = dones.shape[1]
+
+    # step s starts a new episode if dones[s - 1] is set, find the latest such step before each requested step
+    steps = torch.arange(rollout, device=device)
+    boundaries = dones[traj_indices].bool() & (steps.unsqueeze(0) < rollout_steps.unsqueeze(1))
+    episode_start = torch.where(boundaries, steps + 1, 0).max(dim=1).values
+
+    # if the episode started before the current rollout, all history frames are valid
+    earliest_frame = torch.where(episode_start > 0, episode_start + framestack - 1, 0)
+
+    # frame stack of step t consists of frames t ... t + framestack - 1 (in the frame buffer indexing)
+    frame_indices = rollout_steps.unsqueeze(1) + torch.arange(framestack, device=device).unsqueeze(0)
+    frame_indices = torch.max(frame_indices, earliest_frame.unsqueeze(1))
+    return frames[traj_indices.unsqueeze(1), frame_indices]
+
+
+def stacked_obs_for_trajectories(frames: Tensor, dones: Tensor, framestack: int) -> Tensor:
+    """
+    Reconstruct full frame stacks for all steps of the trajectories (including the extra last step).
+    :return: [num_traj, rollout + 1, framestack, *frame_shape]
+    """
+    num_traj, num_steps = frames.shape[0], frames.shape[1] - (framestack - 1)
+    traj_indices = torch.arange(num_traj, device=frames.device).repeat_interleave(num_steps)
+    rollout_steps = torch.arange(num_steps, device=frames.device).repeat(num_traj)
+    stacks = gather_stacked_obs(frames, dones, traj_indices, rollout_steps, framestack)
+    return stacks.view((num_traj, num_steps) + stacks.shape[1:])
+
+
+class FlatStackedObs:
+    """
+    Frame stacks of all steps of the trajectories flattened into a single batch dimension, like the output of
+    stacked_obs_for_trajectories() reshaped to [num_traj * num_steps, framestack, *frame_shape].
+    Stacks are only gathered when the view is sliced, so chunked consumers
+    (i.e. RunningMeanStdInPlace.update_stats_in_chunks()) never materialize the stacks of the entire batch.
+    """
+
+    def __init__(self, frames: Tensor, dones: Tensor, framestack: int):
+        """
+        :param frames: [num_traj, framestack - 1 + rollout + 1, *frame_shape]
+        :param dones: [num_traj, rollout]
+        """
+        self.frames, self.dones, self.framestack = frames, dones, framestack
+        self.num_steps = frames.shape[1] - (framestack - 1)
+        self.shape = torch.Size((frames.shape[0] * self.num_steps, framestack) + frames.shape[2:])
+
+    def size(self) -> torch.Size:
+        return self.shape
+
+    def __getitem__(self, indices: slice) -> Tensor:
+        flat_indices = torch.arange(self.shape[0], device=self.frames.device)[indices]
+        traj_indices, rollout_steps = flat_indices // self.num_steps, flat_indices % self.num_steps
+        return gather_stacked_obs(self.frames, self.dones, traj_indices, rollout_steps, self.framestack)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import gymnasium as gym
 import numpy as np
@@ -12,6 +12,7 @@ from torch import Tensor
 from sample_factory.algo.utils.tensor_utils import dict_of_lists_cat
 from sample_factory.envs.create_env import create_env
 from sample_factory.envs.env_utils import (
+    ObsOutputInterface,
     RewardShapingInterface,
     TrainingInfoInterface,
     find_training_info_interface,
@@ -19,6 +20,11 @@ from sample_factory.envs.env_utils import (
 )
 from sample_factory.utils.dicts import dict_of_lists_append, list_of_dicts_to_dict_of_lists
 from sample_factory.utils.typing import Config
+from sample_factory.utils.utils import log
+
+if TYPE_CHECKING:
+    from sample_factory.algo.sampling.env_reset_pool import EnvResetPool
+    from sample_factory.algo.sampling.env_step_pool import EnvStepPool
 
 Actions = Any
 ListActions = Sequence[Actions]
@@ -237,10 +243,14 @@ class BatchedVecEnv(Wrapper):
         return obs, rew, terminated, truncated, infos
 
 
-class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingInterface):
-    """Vector interface for multiple environments simulated sequentially on one worker."""
+class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingInterface, ObsOutputInterface):
+    """
+    Vector interface for multiple environments simulated on one worker.
+    Envs are stepped sequentially unless we're given an EnvStepPool with multiple threads (see --env_step_threads).
+    Observations of individual envs are gathered directly into the destination set by set_obs_output(), if any.
+    """
 
-    def __init__(self, envs: Sequence):
+    def __init__(self, envs: Sequence, step_pool: Optional[EnvStepPool] = None):
         Wrapper.__init__(self, envs[0])
         TrainingInfoInterface.__init__(self)
         self.single_env_agents = envs[0].num_agents
@@ -250,8 +260,10 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
 
         self.envs = envs
         self.num_agents = self.single_env_agents * len(envs)
+        self.step_pool: Optional[EnvStepPool] = step_pool
 
         self.obs = self.rew = self.terminated = self.truncated = self.infos = None
+        self.obs_output: Optional[Dict[str, Tensor]] = None
 
         self.training_info_interfaces: Optional[List[TrainingInfoInterface]] = []
         self.reward_shaping_interfaces: Optional[List[RewardShapingInterface]] = []
@@ -281,18 +293,31 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
         dict_of_lists_cat(self.obs)
         return self.obs, infos
 
+    def set_obs_output(self, obs_output: Optional[Dict[str, Tensor]]) -> None:
+        self.obs_output = obs_output
+
     def step(self, actions: Tensor):
+        # destination of the observations is only valid for this step
+        obs_output, self.obs_output = self.obs_output, None
+        step_obs = self.obs
+        if obs_output is not None:
+            step_obs = {key: obs_output.get(key, value) for key, value in self.obs.items()}
+
+        env_actions = [actions[self._env_agents(i)] for i in range(len(self.envs))]
+        if self.step_pool is None:
+            step_results = [e.step(a) for e, a in zip(self.envs, env_actions)]
+        else:
+            step_results = self.step_pool.step(self.envs, env_actions)
+
+        # gather results in env order
         infos = []
-        ofs = 0
-        next_ofs = self.single_env_agents
-        for i, e in enumerate(self.envs):
-            idx = slice(ofs, next_ofs)
-            env_actions = actions[idx]
-            obs, rew, terminated, truncated, info = e.step(env_actions)
+        for i, step_result in enumerate(step_results):
+            idx = self._env_agents(i)
+            obs, rew, terminated, truncated, info = step_result
 
             # TODO: test if this works for multi-agent envs
             for key, x in obs.items():
-                self.obs[key][idx] = x
+                step_obs[key][idx] = x
 
             if self.rew is None:
                 self.rew = rew.repeat(len(self.envs))
@@ -305,10 +330,10 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
 
             infos.extend(info)
 
-            ofs += self.single_env_agents
-            next_ofs += self.single_env_agents
+        return step_obs, self.rew, self.terminated, self.truncated, infos
 
-        return self.obs, self.rew, self.terminated, self.truncated, infos
+    def _env_agents(self, env_idx: int) -> slice:
+        return slice(env_idx * self.single_env_agents, (env_idx + 1) * self.single_env_agents)
 
     def set_training_info(self, training_info: Dict) -> None:
         if self.training_info_interfaces is None:
@@ -335,12 +360,32 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
             e.close()
 
 
-def make_env_func_batched(cfg, env_config, render_mode: Optional[str] = None) -> BatchedVecEnv:
+def _create_env(cfg: Config, env_config, render_mode: Optional[str], env_reset_pool: Optional[EnvResetPool]):
+    env = create_env(cfg.env, cfg=cfg, env_config=env_config, render_mode=render_mode)
+    if env_reset_pool is None:
+        return env
+
+    if is_multiagent_env(env):
+        # multi-agent envs reset themselves at the end of an episode, we can't swap in a spare instance
+        if not env_config or env_config.get("vector_index", 0) == 0:
+            log.warning("--env_reset_prefetch has no effect for multi-agent envs")
+        return env
+
+    def make_spare_env():
+        return create_env(cfg.env, cfg=cfg, env_config=env_config, render_mode=render_mode)
+
+    return env_reset_pool.wrap(env, make_spare_env)
+
+
+def make_env_func_batched(
+    cfg, env_config, render_mode: Optional[str] = None, env_reset_pool: Optional[EnvResetPool] = None
+) -> BatchedVecEnv:
     """
     This should yield an environment that always returns a dict of PyTorch tensors (CPU- or GPU-side) or
     a dict of numpy arrays or a dict of lists (depending on what the environment returns in the first place).
+    With env_reset_pool single-agent envs are reset in the background at the end of an episode (--env_reset_prefetch).
     """
-    env = create_env(cfg.env, cfg=cfg, env_config=env_config, render_mode=render_mode)
+    env = _create_env(cfg, env_config, render_mode, env_reset_pool)
 
     # At this point we can be sure that our environment outputs a dictionary of lists (or numpy arrays or tensors)
     # containing obs, rewards, etc. for each agent in the environment.
@@ -369,14 +414,17 @@ class NonBatchedVecEnv(Wrapper):
         super().__init__(env)
 
 
-def make_env_func_non_batched(cfg: Config, env_config, render_mode: Optional[str] = None) -> NonBatchedVecEnv:
+def make_env_func_non_batched(
+    cfg: Config, env_config, render_mode: Optional[str] = None, env_reset_pool: Optional[EnvResetPool] = None
+) -> NonBatchedVecEnv:
     """
     This should yield an environment that always returns a list of {observations, rewards,
     dones, etc.}
     This is for the non-batched sampler which processes each agent's data independently without any vectorization
     (and therefore enables more sophisticated configurations where agents in the same env can be controlled
     by different policies and so on).
+    With env_reset_pool single-agent envs are reset in the background at the end of an episode (--env_reset_prefetch).
     """
-    env = create_env(cfg.env, cfg=cfg, env_config=env_config, render_mode=render_mode)
+    env = _create_env(cfg, env_config, render_mode, env_reset_pool)
     env = NonBatchedVecEnv(env)
     return env
@@ -1,7 +1,7 @@
 import torch
 
 from sample_factory.utils.typing import PolicyID
-from sample_factory.utils.utils import memory_consumption_mb
+from sample_factory.utils.utils import memory_consumption_mb, peak_memory_consumption_mb
 
 EPS = 1e-8
 
@@ -13,6 +13,7 @@ TRAIN_STATS = "train"
 TIMING_STATS = "timing"
 STATS_KEY = "stats"
 SAMPLES_COLLECTED = "samples_collected"
+STRAGGLERS = "stragglers"
 POLICY_ID_KEY = "policy_id"
 
 
@@ -35,10 +36,17 @@ class ExperimentStatus:
 
 def memory_stats(process, device):
     memory_mb = memory_consumption_mb()
-    stats = {f"memory_{process}": memory_mb}
+    stats = {f"memory_{process}": memory_mb, f"memory_{process}_peak": peak_memory_consumption_mb()}
     if device.type != "cpu":
         gpu_mem_mb = torch.cuda.memory_allocated(device) / 1e6
         gpu_cache_mb = torch.cuda.memory_reserved(device) / 1e6
-        stats.update({f"gpu_mem_{process}": gpu_mem_mb, f"gpu_cache_{process}": gpu_cache_mb})
+        gpu_mem_peak_mb = torch.cuda.max_memory_allocated(device) / 1e6
+        stats.update(
+            {
+                f"gpu_mem_{process}": gpu_mem_mb,
+                f"gpu_cache_{process}": gpu_cache_mb,
+                f"gpu_mem_{process}_peak": gpu_mem_peak_mb,
+            }
+        )
 
     return stats
@@ -3,23 +3,107 @@ Utilities for sharing model parameters between components.
 """
 
 import sys
-from typing import Optional
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
 
 import torch
 from torch import Tensor
+from torch.nn import Module
 
 from sample_factory.algo.utils.multiprocessing_utils import get_lock, get_mp_ctx
 from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.quantization import QuantizedPolicy, make_quantized_policy
 from sample_factory.utils.timing import Timing
 from sample_factory.utils.utils import log
 
 
+class SharedWeightSlots:
+    """
+    Double-buffered copies of the model weights in shared memory (see --double_buffered_weights).
+    The learner publishes the weights into the slot that is not the latest one, so readers can copy the latest
+    complete weights without taking the policy lock.
+    Each slot is protected by a sequence number (seqlock): it is odd while the slot is being written.
+    If the sequence number changed while we were copying the weights, the copy is torn and has to be repeated.
+    """
+
+    def __init__(self, state_dict: Dict[str, Tensor]):
+        self.slots = []
+        for _ in range(2):
+            slot = {name: t.detach().clone() for name, t in state_dict.items()}
+            for t in slot.values():
+                if not t.is_cuda:
+                    t.share_memory_()
+            self.slots.append(slot)
+
+        self.device = next(iter(state_dict.values())).device if state_dict else torch.device("cpu")
+
+        # seqlock counters and policy versions of the slots, as well as the index of the latest slot
+        self.seq = torch.zeros([2], dtype=torch.int64).share_memory_()
+        self.versions = torch.full([2], -1, dtype=torch.int64).share_memory_()
+        self.latest = torch.zeros([1], dtype=torch.int64).share_memory_()
+
+    def _synchronize(self, device: torch.device) -> None:
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    def publish(self, state_dict: Dict[str, Tensor], policy_version: int) -> None:
+        """Only called by the learner, there's only one writer per policy."""
+        slot_idx = 1 - self.latest.item()
+        slot = self.slots[slot_idx]
+
+        self.seq[slot_idx] += 1  # odd: readers will discard anything they copy from this slot
+        for name, t in state_dict.items():
+            slot[name].copy_(t)
+        self._synchronize(self.device)  # weights must be in memory before the slot is marked as complete
+        self.versions[slot_idx] = policy_version
+        self.seq[slot_idx] += 1
+
+        self.latest[0] = slot_idx
+
+    def try_read_into(self, model: Module, device: torch.device) -> Optional[int]:
+        """
+        Copy the weights from the latest slot into the model.
+        :return: policy version of the weights, None if the copy is torn and we need to try again
+        """
+        slot_idx = self.latest.item()
+        seq = self.seq[slot_idx].item()
+        if seq % 2 == 1:
+            # learner already moved on and is writing the next weights into this slot
+            return None
+
+        policy_version = self.versions[slot_idx].item()
+        model.load_state_dict(self.slots[slot_idx])
+        self._synchronize(device)  # copy must be complete before we verify that the slot was not overwritten
+
+        if self.seq[slot_idx].item() != seq:
+            return None
+        return policy_version
+
+    def latest_version(self) -> int:
+        return self.versions[self.latest.item()].item()
+
+
+@dataclass
+class SharedModelState:
+    """
+    Sent to the inference workers at initialization instead of a plain state dict when the learner publishes
+    weights (--double_buffered_weights) or observation normalizer statistics (--lock_free_obs_normalizer) in slots.
+    """
+
+    state_dict: Optional[Dict[str, Tensor]] = None  # learner's own weights, copied under the policy lock
+    weight_slots: Optional[SharedWeightSlots] = None
+    normalizer_slots: Optional[SharedWeightSlots] = None
+
+
 class ParameterServer:
     def __init__(self, policy_id, policy_versions: Tensor, serial_mode: bool):
         self.policy_id = policy_id
         self.actor_critic = None
         self.policy_versions = policy_versions
         self.device: Optional[torch.device] = None
+        self.weight_slots: Optional[SharedWeightSlots] = None
+        self.normalizer_slots: Optional[SharedWeightSlots] = None
 
         mp_ctx = get_mp_ctx(serial_mode)
         self._policy_lock = get_lock(serial_mode, mp_ctx)
@@ -28,10 +112,23 @@ class ParameterServer:
     def policy_lock(self):
         return self._policy_lock
 
-    def init(self, actor_critic, policy_version, device: torch.device):
+    def init(
+        self,
+        actor_critic,
+        policy_version,
+        device: torch.device,
+        double_buffered_weights: bool = False,
+        lock_free_obs_normalizer: bool = False,
+    ):
         self.actor_critic = actor_critic
-        self.policy_versions[self.policy_id] = policy_version
         self.device = device
+        if double_buffered_weights:
+            self.weight_slots = SharedWeightSlots(actor_critic.state_dict())
+            self.weight_slots.publish(actor_critic.state_dict(), policy_version)
+        if lock_free_obs_normalizer:
+            self.normalizer_slots = SharedWeightSlots(actor_critic.obs_normalizer.state_dict())
+            self.publish_obs_normalizer(0)
+        self.policy_versions[self.policy_id] = policy_version
         log.debug("Initialized policy %d weights for model version %d", self.policy_id, policy_version)
 
     def update_weights(self, policy_version):
@@ -42,6 +139,16 @@ class ParameterServer:
         """
         self.policy_versions[self.policy_id] = policy_version
 
+    def publish_obs_normalizer(self, version: int) -> None:
+        """Publish a snapshot of the current normalizer statistics (see --lock_free_obs_normalizer)."""
+        self.normalizer_slots.publish(self.actor_critic.obs_normalizer.state_dict(), version)
+
+    def shared_model_state(self, state_dict: Optional[Dict[str, Tensor]]):
+        """:return: what inference workers need to get the weights and normalizer statistics of this policy."""
+        if self.weight_slots is None and self.normalizer_slots is None:
+            return state_dict
+        return SharedModelState(state_dict, self.weight_slots, self.normalizer_slots)
+
 
 class ParameterClient:
     def __init__(self, param_server: ParameterServer, cfg, env_info, timing: Timing):
@@ -57,14 +164,22 @@ class ParameterClient:
         self._actor_critic = None
         self._policy_lock = param_server.policy_lock
 
+        # int8 copy of the policy used for inference instead of self._actor_critic (see --inference_quantization)
+        self._quantized_policy: Optional[QuantizedPolicy] = None
+
         self.timing = timing
 
     @property
     def actor_critic(self):
+        if self._quantized_policy is not None:
+            return self._quantized_policy.model
         return self._actor_critic
 
     @property
     def policy_version(self):
+        """Version of the weights we use for inference."""
+        if self._quantized_policy is not None:
+            return self._quantized_policy.policy_version
         return self.latest_policy_version
 
     def _get_server_policy_version(self):
@@ -72,10 +187,15 @@ class ParameterClient:
 
     def on_weights_initialized(self, state_dict, device: torch.device, policy_version: int) -> None:
         self.latest_policy_version = policy_version
+        self._quantized_policy = make_quantized_policy(self.cfg, self.env_info.obs_space, self.env_info.action_space)
 
     def ensure_weights_updated(self):
         raise NotImplementedError()
 
+    def _maybe_requantize(self) -> None:
+        if self._quantized_policy is not None:
+            self._quantized_policy.maybe_requantize(self._actor_critic, self.latest_policy_version, self.timing)
+
     def cleanup(self):
         pass
 
@@ -88,22 +208,31 @@ class ParameterClientSerial(ParameterClient):
         """
         super().on_weights_initialized(state_dict, device, policy_version)
         self._actor_critic = self.server.actor_critic
+        self._maybe_requantize()
 
     def ensure_weights_updated(self):
-        """In serial case we don't need to do anything."""
+        """In serial case we don't need to do anything (except for updating the quantized copy, if any)."""
         self.latest_policy_version = self._get_server_policy_version()
+        self._maybe_requantize()
 
 
 class ParameterClientAsync(ParameterClient):
+    # with --double_buffered_weights (or normalizer slots), give up after this many torn copies and try again later
+    max_weight_read_attempts = 3
+
     def __init__(self, param_server: ParameterServer, cfg, env_info, timing: Timing):
         super().__init__(param_server, cfg, env_info, timing)
         self._shared_model_weights = None
+        self._weight_slots: Optional[SharedWeightSlots] = None
+        self._normalizer_slots: Optional[SharedWeightSlots] = None
+        self._normalizer_version = -1
+        self._device: Optional[torch.device] = None
         self.num_policy_updates = 0
 
     @property
     def actor_critic(self):
         assert self.latest_policy_version >= 0, "Trying to access actor critic before it is initialized"
-        return self._actor_critic
+        return super().actor_critic
 
     def _init_local_copy(self, device, cfg, obs_space, action_space):
         self._actor_critic = create_actor_critic(cfg, obs_space, action_space)
@@ -117,36 +246,126 @@ class ParameterClientAsync(ParameterClient):
         super().on_weights_initialized(state_dict, device, policy_version)
 
         self._init_local_copy(device, self.cfg, self.env_info.obs_space, self.env_info.action_space)
+        self._device = device
+
+        if isinstance(state_dict, SharedModelState):
+            self._weight_slots, self._normalizer_slots = state_dict.weight_slots, state_dict.normalizer_slots
+            state_dict = state_dict.state_dict
+
+        if self._weight_slots is not None:
+            while not self._update_from_weight_slots():
+                pass  # we can't start without a consistent copy of the weights
+        else:
+            with self._policy_lock:
+                if state_dict is None:
+                    log.warning(f"Parameter client {self.policy_id} received empty state dict, using random weights...")
+                else:
+                    self._actor_critic.load_state_dict(state_dict)
+                    self._shared_model_weights = state_dict
+
+        if self._normalizer_slots is not None:
+            if self._shared_model_weights is not None:
+                # learner updates its normalizer without the policy lock, we only read the published snapshots
+                self._shared_model_weights = {
+                    name: t for name, t in self._shared_model_weights.items() if not name.startswith("obs_normalizer.")
+                }
+            while not self._update_obs_normalizer():
+                pass
+
+        self._maybe_requantize()
+
+    def _update_obs_normalizer(self) -> bool:
+        """
+        Copy the latest snapshot of normalizer statistics if it is newer than what we have.
+        Never blocks, if the learner overwrites the snapshot while we're reading it we try again later.
+        :return: True if we have the latest statistics
+        """
+        if self._normalizer_slots.latest_version() <= self._normalizer_version:
+            return True
+
+        stall_start = time.time()
+        for _ in range(self.max_weight_read_attempts):
+            version = self._normalizer_slots.try_read_into(self._actor_critic.obs_normalizer, self._device)
+            if version is not None:
+                self._normalizer_version = version
+                return True
+            self.timing.record("obs_normalizer_stall", time.time() - stall_start, average=10)
+            stall_start = time.time()
+
+        return False
 
-        with self._policy_lock:
-            if state_dict is None:
-                log.warning(f"Parameter client {self.policy_id} received empty state dict, using random weights...")
-            else:
-                self._actor_critic.load_state_dict(state_dict)
-                self._shared_model_weights = state_dict
+    def _update_from_weight_slots(self) -> bool:
+        """
+        Copy the latest published weights without holding the policy lock.
+        :return: True if we got a consistent copy of the weights
+        """
+        stall_start = time.time()
+        for _ in range(self.max_weight_read_attempts):
+            policy_version = self._weight_slots.try_read_into(self._actor_critic, self._device)
+            if policy_version is not None:
+                self.latest_policy_version = max(self.latest_policy_version, policy_version)
+                # weight slots also contain normalizer statistics which can be older than the latest snapshot
+                self._normalizer_version = -1
+                return True
+            # time spent on torn copies
+            self.timing.record("weight_read_retry", time.time() - stall_start, average=10)
+            stall_start = time.time()
+
+        # learner is publishing faster than we can copy, keep using the current weights and try again later
+        return False
+
+    def _load_shared_weights(self) -> None:
+        with self.timing.time_avg("policy_lock_wait"):
+            # waiting for the learner to finish the optimizer step
+            self._policy_lock.acquire()
+        try:
+            # without the normalizer if its statistics are published separately (see --lock_free_obs_normalizer)
+            self._actor_critic.load_state_dict(self._shared_model_weights, strict=self._normalizer_slots is None)
+        finally:
+            self._policy_lock.release()
 
     def ensure_weights_updated(self):
-        server_policy_version = self._get_server_policy_version()
-        if self.latest_policy_version < server_policy_version and self._shared_model_weights is not None:
-            with self.timing.time_avg("weight_update"), self._policy_lock:
-                self._actor_critic.load_state_dict(self._shared_model_weights)
+        self._ensure_policy_weights_updated()
 
-            self.latest_policy_version = server_policy_version
+        if self._normalizer_slots is not None:
+            with self.timing.time_avg("obs_normalizer_update"):
+                self._update_obs_normalizer()
 
-            self.num_policy_updates += 1
-            if self.num_policy_updates % 10 == 0:
-                log.info(
-                    "Updated weights for policy %d, policy_version %d (%s)",
-                    self.policy_id,
-                    self.latest_policy_version,
-                    str(self.timing.weight_update),
-                )
+        self._maybe_requantize()
+
+    def _ensure_policy_weights_updated(self):
+        server_policy_version = self._get_server_policy_version()
+        if self.latest_policy_version >= server_policy_version:
+            return
+
+        if self._weight_slots is not None:
+            with self.timing.time_avg("weight_update"):
+                if not self._update_from_weight_slots():
+                    return
+        elif self._shared_model_weights is not None:
+            with self.timing.time_avg("weight_update"):
+                self._load_shared_weights()
+            self.latest_policy_version = server_policy_version
+        else:
+            return
+
+        self.num_policy_updates += 1
+        if self.num_policy_updates % 10 == 0:
+            log.info(
+                "Updated weights for policy %d, policy_version %d (%s)",
+                self.policy_id,
+                self.latest_policy_version,
+                str(self.timing.weight_update),
+            )
 
     def cleanup(self):
         # TODO: fix termination problems related to shared CUDA tensors (they are harmless but annoying)
         weights = self._shared_model_weights
         del self._actor_critic
+        del self._quantized_policy
         del self._shared_model_weights
+        del self._weight_slots
+        del self._normalizer_slots
         del self.policy_versions
 
         if weights is not None:
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Dict, Optional, Sequence, Union
+from typing import Dict, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -33,10 +33,12 @@ def num_agents_per_worker(cfg: Config, env_info: EnvInfo) -> int:
     return cfg.num_envs_per_worker * env_info.num_agents
 
 
-def prepare_and_normalize_obs(model: Module, obs: TensorDict | Dict[str, Tensor]) -> TensorDict | Dict[str, Tensor]:
+def prepare_and_normalize_obs(
+    model: Module, obs: TensorDict | Dict[str, Tensor], update_stats: bool = True
+) -> TensorDict | Dict[str, Tensor]:
     for key, x in obs.items():
         obs[key] = ensure_torch_tensor(x).to(model.device_for_input_tensor(key))
-    normalized_obs = model.normalize_obs(obs)
+    normalized_obs = model.normalize_obs(obs, update_stats)
     for key, x in normalized_obs.items():
         normalized_obs[key] = x.type(model.type_for_input_tensor(key))
     return normalized_obs
@@ -73,9 +75,39 @@ def calculate_discounted_sum_torch(
     return discounted_sum
 
 
+@torch.jit.script
+def calculate_discounted_sum_scan_torch(
+    x: Tensor, dones: Tensor, valids: Tensor, discount: float, x_last: Optional[Tensor] = None
+) -> Tensor:
+    """
+    Same as calculate_discounted_sum_torch(), but implemented as a log-depth associative scan over the time axis.
+    Recurrence cumulative[i] = x[i] + a[i] * cumulative[i + 1] is a composition of affine maps, so we can combine
+    segments of length 1, 2, 4, ... in ceil(log2(T)) vectorized steps instead of T sequential ones.
+    Results match the sequential version up to floating point rounding.
+    """
+    # multiplicative coefficient of the recurrence, see calculate_discounted_sum_torch()
+    a = (discount * valids + (1 - valids)) * (1.0 - dones)
+    b = x.clone()
+    if x_last is not None:
+        b[-1] += a[-1] * x_last
+
+    # after the step with offset k, b[i] holds the discounted sum of x[i:i+2k] and a[i] the product of a[i:i+2k]
+    num_steps = len(x)
+    offset = 1
+    while offset < num_steps:
+        # the last `offset` elements are already complete, combine the rest with the segments that follow them
+        b = torch.cat((b[:-offset] + a[:-offset] * b[offset:], b[-offset:]))
+        a = torch.cat((a[:-offset] * a[offset:], a[-offset:]))
+        offset *= 2
+
+    return b
+
+
 # noinspection NonAsciiCharacters
 @torch.jit.script
-def gae_advantages(rewards: Tensor, dones: Tensor, values: Tensor, valids: Tensor, γ: float, λ: float) -> Tensor:
+def gae_advantages(
+    rewards: Tensor, dones: Tensor, values: Tensor, valids: Tensor, γ: float, λ: float, backend: str = "loop"
+) -> Tensor:
     rewards = rewards.transpose(0, 1)  # [E, T] -> [T, E]
     dones = dones.transpose(0, 1).float()  # [E, T] -> [T, E]
     values = values.transpose(0, 1)  # [E, T+1] -> [T+1, E]
@@ -87,13 +119,71 @@ def gae_advantages(rewards: Tensor, dones: Tensor, values: Tensor, valids: Tenso
     # section 3 in GAE paper: calculating advantages
     deltas = (rewards - values[:-1]) * valids[:-1] + (1 - dones) * (γ * values[1:] * valids[1:])
 
-    advantages = calculate_discounted_sum_torch(deltas, dones, valids[:-1], γ * λ)
+    if backend == "scan":
+        advantages = calculate_discounted_sum_scan_torch(deltas, dones, valids[:-1], γ * λ)
+    else:
+        advantages = calculate_discounted_sum_torch(deltas, dones, valids[:-1], γ * λ)
 
     # transpose advantages back to [E, T] before creating a single experience buffer
     advantages.transpose_(0, 1)
     return advantages
 
 
+# noinspection NonAsciiCharacters
+@torch.jit.script
+def vtrace_targets_and_advantages(
+    ratios: Tensor,
+    values: Tensor,
+    rewards: Tensor,
+    dones: Tensor,
+    γ: float,
+    ρ_hat: float,
+    c_hat: float,
+    recurrence: int,
+) -> Tuple[Tensor, Tensor]:
+    """
+    V-trace value targets and advantages (https://arxiv.org/abs/1802.01561).
+    Inputs are flat [num_trajectories * recurrence] tensors, i.e. a learner minibatch consisting of trajectory
+    segments of length == recurrence. The backward recursion runs over the time dimension of a
+    [recurrence, num_trajectories] view of the data, so everything stays on the device of the input tensors.
+
+    :return: (vs, advantages), both in the same flat layout as the inputs.
+    """
+    num_trajectories = ratios.shape[0] // recurrence
+
+    # [N * T] -> [T, N]
+    ratios = ratios.reshape(num_trajectories, recurrence).transpose(0, 1)
+    values = values.reshape(num_trajectories, recurrence).transpose(0, 1)
+    rewards = rewards.reshape(num_trajectories, recurrence).transpose(0, 1)
+    dones = dones.reshape(num_trajectories, recurrence).transpose(0, 1).float()
+
+    vtrace_rho = torch.clamp_max(ratios, ρ_hat)
+    vtrace_c = torch.clamp_max(ratios, c_hat)
+    not_done_gamma = (1.0 - dones) * γ
+
+    vs = torch.empty_like(values)
+    adv = torch.empty_like(values)
+
+    next_values = (values[-1] - rewards[-1]) / γ
+    next_vs = next_values
+
+    i = recurrence - 1
+    while i >= 0:
+        curr_values = values[i]
+        delta_s = vtrace_rho[i] * (rewards[i] + not_done_gamma[i] * next_values - curr_values)
+        adv[i] = vtrace_rho[i] * (rewards[i] + not_done_gamma[i] * next_vs - curr_values)
+        next_vs = curr_values + delta_s + not_done_gamma[i] * vtrace_c[i] * (next_vs - next_values)
+        vs[i] = next_vs
+
+        next_values = curr_values
+        i -= 1
+
+    # [T, N] -> [N * T]
+    vs = vs.transpose(0, 1).reshape(-1)
+    adv = adv.transpose(0, 1).reshape(-1)
+    return vs, adv
+
+
 DonesType = Union[bool, np.ndarray, Tensor, Sequence[bool]]
 
 
@@ -4,7 +4,7 @@ All credit goes to https://github.com/Denys88/rl_games (only slightly changed he
 Thanks a lot, great module!
 """
 
-from typing import Dict, Final, List, Optional, Union
+from typing import Callable, Dict, Final, List, Optional, Union
 
 import gymnasium as gym
 import torch
@@ -61,9 +61,9 @@ class RunningMeanStdInPlace(nn.Module):
         new_var = M2 / tot_count
         return new_mean, new_var, tot_count
 
-    def forward(self, x: Tensor, denormalize: bool = False) -> None:
+    def forward(self, x: Tensor, denormalize: bool = False, update_stats: bool = True) -> None:
         """Normalizes in-place! This function modifies the input tensor and returns nothing."""
-        if self.training and not denormalize:
+        if self.training and update_stats and not denormalize:
             # check if the shape exactly matches or it's a scalar for which we use shape (1, )
             assert x.shape[1:] == self.input_shape or (
                 x.shape[1:] == () and self.input_shape == (1,)
@@ -109,6 +109,48 @@ class RunningMeanStdInPlace(nn.Module):
             else:
                 x.sub_(μ).mul_(1 / σ).clamp_(-clip, clip)
 
+    @torch.jit.unused
+    def update_stats_in_chunks(
+        self, x: Tensor, chunk_size: int, preprocess: Optional[Callable[[Tensor], None]] = None
+    ) -> None:
+        """
+        Same statistics update as forward() in training mode, but does not normalize the data and
+        never materializes a float copy of the entire input: x is converted to float chunk by chunk, per-chunk
+        moments are combined with the parallel variance algorithm (Chan et al.).
+        :param preprocess: optional in-place transformation applied to each float chunk before collecting stats
+        """
+        assert x.shape[1:] == self.input_shape or (
+            x.shape[1:] == () and self.input_shape == (1,)
+        ), f"RMS expected input shape {self.input_shape}, got {x.shape[1:]}"
+
+        batch_count = x.size()[0]
+        mean = m2 = None
+        count = 0
+        for start in range(0, batch_count, chunk_size):
+            chunk = x[start : start + chunk_size].float()
+            if preprocess is not None:
+                preprocess(chunk)
+
+            chunk_mean = chunk.mean(self.axis, keepdim=True)
+            chunk_m2 = (chunk - chunk_mean).square_().sum(self.axis).double()
+            chunk_mean = chunk_mean.view(chunk_m2.shape).double()
+            chunk_count = chunk.numel() // chunk_mean.numel()
+
+            if mean is None:
+                mean, m2, count = chunk_mean, chunk_m2, chunk_count
+            else:
+                delta = chunk_mean - mean
+                tot_count = count + chunk_count
+                mean = mean + delta * chunk_count / tot_count
+                m2 = m2 + chunk_m2 + delta**2 * count * chunk_count / tot_count
+                count = tot_count
+
+        μ = mean.to(self.running_mean.device)
+        σ2 = (m2 / (count - 1)).to(self.running_mean.device)  # unbiased, same as x.var() in forward()
+        self.running_mean[:], self.running_var[:], self.count[:] = self._update_mean_var_count_from_moments(
+            self.running_mean, self.running_var, self.count, μ, σ2, batch_count
+        )
+
 
 class RunningMeanStdDictInPlace(nn.Module):
     def __init__(
@@ -130,10 +172,10 @@ class RunningMeanStdDictInPlace(nn.Module):
             }
         )
 
-    def forward(self, x: Dict[str, Tensor]) -> None:
+    def forward(self, x: Dict[str, Tensor], update_stats: bool = True) -> None:
         """Normalize in-place!"""
         for k, module in self.running_mean_std.items():
-            module(x[k])
+            module(x[k], update_stats=update_stats)
 
 
 def running_mean_std_summaries(running_mean_std_module: Union[nn.Module, ScriptModule, RecursiveScriptModule]):
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import math
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import torch
 from gymnasium import spaces
@@ -11,6 +11,7 @@ from torch import Tensor
 from sample_factory.algo.sampling.sampling_utils import rollout_worker_device
 from sample_factory.algo.utils.action_distributions import calc_num_action_parameters, calc_num_actions
 from sample_factory.algo.utils.env_info import EnvInfo
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, STACKED_OBS_KEY, deduplicated_framestack
 from sample_factory.algo.utils.misc import MAGIC_FLOAT, MAGIC_INT
 from sample_factory.algo.utils.rl_utils import trajectories_per_training_iteration
 from sample_factory.algo.utils.tensor_dict import TensorDict
@@ -18,6 +19,7 @@ from sample_factory.algo.utils.torch_utils import to_torch_dtype
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.model.model_utils import get_rnn_size
 from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.dicts import iterate_recursively
 from sample_factory.utils.gpu_utils import gpus_for_process
 from sample_factory.utils.typing import Device, MpQueue, PolicyID
 from sample_factory.utils.utils import log
@@ -76,7 +78,49 @@ def policy_output_shapes(num_actions, num_action_distribution_parameters) -> Lis
     return policy_outputs
 
 
-def alloc_trajectory_tensors(env_info: EnvInfo, num_traj, rollout, rnn_size, device, share) -> TensorDict:
+def reduced_precision_dtypes(cfg) -> Dict[str, torch.dtype]:
+    """:return: fields selected for reduced precision storage and their storage dtype (see --buffer_float_dtype)."""
+    if cfg.buffer_float_dtype == "float32":
+        return dict()
+
+    dtype = getattr(torch, cfg.buffer_float_dtype)
+    return {field: dtype for field in cfg.reduced_precision_fields}
+
+
+def buffer_storage_dtypes(cfg) -> Dict[str, torch.dtype]:
+    """
+    :return: dtypes of the fields that are actually stored in reduced precision. In validation mode
+    (--validate_reduced_precision) buffers stay in float32 and the learner only measures the error instead.
+    """
+    if cfg.validate_reduced_precision:
+        return dict()
+    return reduced_precision_dtypes(cfg)
+
+
+def storage_dtype(storage_dtypes: Dict[str, torch.dtype], field: str, dtype: torch.dtype) -> torch.dtype:
+    """Integer and boolean fields are always stored as is, only float fields can be stored in reduced precision."""
+    if not dtype.is_floating_point:
+        return dtype
+    return storage_dtypes.get(field, dtype)
+
+
+def alloc_trajectory_tensors(
+    env_info: EnvInfo,
+    num_traj,
+    rollout,
+    rnn_size,
+    device,
+    share,
+    dedup_framestack: int = 0,
+    rnn_states_stride: int = 1,
+    storage_dtypes: Optional[Dict[str, torch.dtype]] = None,
+) -> TensorDict:
+    """
+    :param dedup_framestack: if > 0, store each frame of the stacked main observation only once (see frame_stack.py)
+    :param rnn_states_stride: store RNN states only for every n-th rollout step (see rnn_states_index())
+    :param storage_dtypes: float fields stored in reduced precision (see buffer_storage_dtypes())
+    """
+    storage_dtypes = dict() if storage_dtypes is None else storage_dtypes
     obs_space = env_info.obs_space
 
     tensors = TensorDict()
@@ -88,8 +132,17 @@ def alloc_trajectory_tensors(env_info: EnvInfo, num_traj, rollout, rnn_size, dev
 
     # we need to allocate an extra rollout step here to calculate the value estimates for the last step
     for space_name, space in obs_space.spaces.items():
-        tensors["obs"][space_name] = init_tensor([num_traj, rollout + 1], space.dtype, space.shape, device, share)
-    tensors["rnn_states"] = init_tensor([num_traj, rollout + 1], torch.float32, [rnn_size], device, share)
+        if dedup_framestack and space_name == STACKED_OBS_KEY:
+            # framestack - 1 history frames followed by one frame per rollout step
+            num_frames = dedup_framestack - 1 + rollout + 1
+            obs_dtype = storage_dtype(storage_dtypes, "obs", to_torch_dtype(space.dtype))
+            tensors[OBS_FRAMES] = init_tensor([num_traj, num_frames], obs_dtype, space.shape[1:], device, share)
+            continue
+        obs_dtype = storage_dtype(storage_dtypes, "obs", to_torch_dtype(space.dtype))
+        tensors["obs"][space_name] = init_tensor([num_traj, rollout + 1], obs_dtype, space.shape, device, share)
+    num_rnn_states = rollout // rnn_states_stride + 1
+    rnn_states_dtype = storage_dtype(storage_dtypes, "rnn_states", torch.float32)
+    tensors["rnn_states"] = init_tensor([num_traj, num_rnn_states], rnn_states_dtype, [rnn_size], device, share)
 
     num_actions, num_action_distribution_parameters = action_info(env_info)
     policy_outputs = policy_output_shapes(num_actions, num_action_distribution_parameters)
@@ -100,7 +153,8 @@ def alloc_trajectory_tensors(env_info: EnvInfo, num_traj, rollout, rnn_size, dev
     for name, shape in policy_outputs:
         assert name not in tensors
         rollout_len = rollout + 1 if name in outputs_with_extra_rollout_step else rollout
-        tensors[name] = init_tensor([num_traj, rollout_len], torch.float32, shape, device, share)
+        dtype = storage_dtype(storage_dtypes, name, torch.float32)
+        tensors[name] = init_tensor([num_traj, rollout_len], dtype, shape, device, share)
 
     # env outputs
     tensors["rewards"] = init_tensor([num_traj, rollout], torch.float32, [], device, share)
@@ -117,15 +171,31 @@ def alloc_trajectory_tensors(env_info: EnvInfo, num_traj, rollout, rnn_size, dev
     return tensors
 
 
-def alloc_policy_output_tensors(cfg, env_info: EnvInfo, rnn_size, device, share):
+def rnn_states_index(rollout_step: int, rnn_states_stride: int) -> Optional[int]:
+    """
+    :return: index of the RNN state of this rollout step in traj["rnn_states"], None if the state of this step
+    is not stored (with --compact_rnn_states only states at the start of recurrence chunks are stored)
+    """
+    if rollout_step % rnn_states_stride != 0:
+        return None
+    return rollout_step // rnn_states_stride
+
+
+def per_actor_shape(cfg, env_info: EnvInfo) -> List[int]:
+    """Leading dimensions of the buffers that hold one entry per actor (agent) in the system."""
     num_agents = env_info.num_agents
     envs_per_split = cfg.num_envs_per_worker // cfg.worker_num_splits
 
-    policy_outputs_shape = [cfg.num_workers, cfg.worker_num_splits]
+    shape = [cfg.num_workers, cfg.worker_num_splits]
     if cfg.batched_sampling:
-        policy_outputs_shape += [envs_per_split * num_agents]
+        shape += [envs_per_split * num_agents]
     else:
-        policy_outputs_shape += [envs_per_split, num_agents]
+        shape += [envs_per_split, num_agents]
+    return shape
+
+
+def alloc_policy_output_tensors(cfg, env_info: EnvInfo, rnn_size, device, share):
+    policy_outputs_shape = per_actor_shape(cfg, env_info)
 
     num_actions, num_action_distribution_parameters = action_info(env_info)
     policy_outputs = policy_output_shapes(num_actions, num_action_distribution_parameters)
@@ -192,16 +262,39 @@ class BufferMgr(Configurable):
             # and they are not released until the learner finishes learning from them
             pass
 
+        if cfg.async_rl and cfg.zero_copy_training_batches:
+            # learner holds on to the trajectories of zero-copy batches until it's done training on them,
+            # make sure sampling can continue while all accumulated batches are waiting to be processed
+            num_held = cfg.num_batches_to_accumulate * self.trajectories_per_training_iteration * cfg.num_policies
+            if cfg.batched_sampling:
+                # buffers are handed out to the samplers in slices of this size
+                num_held = math.ceil(num_held / self.sampling_trajectories_per_iteration)
+                num_held *= self.sampling_trajectories_per_iteration
+            for device in self.buffers_per_device:
+                self.buffers_per_device[device] += num_held
+
         # determine the number of minibatches we're allowed to accumulate before experience collection is halted
         self.max_batches_to_accumulate = cfg.num_batches_to_accumulate
         if not cfg.async_rl:
             log.debug("In synchronous mode, we only accumulate one batch. Setting num_batches_to_accumulate to 1")
             self.max_batches_to_accumulate = 1
 
+        self.dedup_framestack = deduplicated_framestack(cfg, env_info.obs_space)
+        if cfg.dedup_framestack and not self.dedup_framestack:
+            log.warning(f"Cannot deduplicate frames: {env_info.obs_space=} is not stacked ({cfg.env_framestack=})")
+
+        # float fields of the trajectories that we store in half precision to save memory and bandwidth
+        self.storage_dtypes: Dict[str, torch.dtype] = buffer_storage_dtypes(cfg)
+
+        # with --compact_rnn_states trajectories only keep states at the start of each recurrence chunk
+        self.rnn_states_stride = cfg.recurrence if cfg.compact_rnn_states else 1
+
         # allocate trajectory buffers for sampling
         self.traj_buffer_queues: Dict[Device, MpQueue] = dict()
         self.traj_tensors_torch = dict()
         self.policy_output_tensors_torch = dict()
+        # current RNN state of each actor, this is where inference workers read it from with --compact_rnn_states
+        self.rnn_state_tensors_torch: Dict[Device, Tensor] = dict()
 
         for device, num_buffers in self.buffers_per_device.items():
             # make sure that at the very least we have enough buffers to feed the learner
@@ -219,12 +312,24 @@ class BufferMgr(Configurable):
                 rnn_size,
                 device,
                 share,
+                self.dedup_framestack,
+                self.rnn_states_stride,
+                self.storage_dtypes,
             )
+            traj_buffers_mb = sum(t.nbytes for _, _, t in iterate_recursively(self.traj_tensors_torch[device])) / 1e6
+            log.debug(f"Allocated {num_buffers} trajectory buffers on {device=}, {traj_buffers_mb:.1f} MB")
+
             self.policy_output_tensors_torch[device], output_names, output_sizes = alloc_policy_output_tensors(
                 cfg, env_info, rnn_size, device, share
             )
             self.output_names, self.output_sizes = output_names, output_sizes
 
+            if cfg.compact_rnn_states:
+                actor_shape = per_actor_shape(cfg, env_info)
+                self.rnn_state_tensors_torch[device] = init_tensor(
+                    actor_shape, torch.float32, [rnn_size], device, share
+                )
+
             if cfg.batched_sampling:
                 # big trajectory batches (slices) for batched sampling
                 for i in range(0, num_buffers, self.sampling_trajectories_per_iteration):
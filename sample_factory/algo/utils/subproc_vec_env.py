@@ -0,0 +1,333 @@
+"""
+Vector of batched envs simulated in child processes of a rollout worker (see --env_subprocesses).
+
+Each env runs in its own process. Children write observations, rewards and done flags straight into a slab of shared
+memory tensors allocated by the rollout worker, so only the commands, actions and infos are pickled. Step and reset
+are batched: the command is sent to all children before we wait for any of them, so the envs are simulated in parallel.
+This decouples env parallelism from the sampler topology: pure-Python envs that hold the GIL can use all cores
+without adding rollout workers (and the inference queues, signals and buffers that come with them).
+
+Children also get the shared observation buffers of the trajectories when they start. When the runner sets an
+observation output (see ObsOutputInterface) that is a view of these buffers, we only send the shape, strides and
+offset of the view with the step command, and every child writes its observations straight into the trajectory.
+Rewards and dones are still read from the slab.
+
+This is not an env backend behind make_env_func_batched(): that factory creates one env for one env_config, while
+this class owns the whole vector of envs of a rollout worker split, their processes, and the mapping of the trajectory
+buffers. BatchedVectorEnvRunner.init() creates it directly, and every child calls make_env_func_batched() for its env.
+"""
+
+from __future__ import annotations
+
+import signal as os_signal
+import traceback
+from functools import partial
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from gymnasium import spaces
+from torch import Tensor
+
+from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context, sf_global_context
+from sample_factory.algo.utils.env_info import EnvInfo, check_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.multiprocessing_utils import get_mp_ctx
+from sample_factory.algo.utils.torch_utils import to_torch_dtype
+from sample_factory.envs.env_utils import (
+    ObsOutputInterface,
+    RewardShapingInterface,
+    TrainingInfoInterface,
+    find_training_info_interface,
+    get_default_reward_shaping,
+    set_reward_shaping,
+    set_training_info,
+)
+from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.typing import Config
+from sample_factory.utils.utils import log
+
+# commands sent from the rollout worker to the env processes
+STEP, RESET, SET_TRAINING_INFO, SET_REWARD_SHAPING, CLOSE = range(5)
+
+
+def _to_numpy(actions: Tensor | np.ndarray | List) -> np.ndarray | List:
+    if isinstance(actions, (list, tuple)):
+        return [_to_numpy(a) for a in actions]
+    # pickling tensors would move them to shared memory on every step, numpy arrays are much cheaper to send
+    # CPU-side envs get numpy actions in-process as well (see process_action_space()), so we don't convert them back
+    return actions.numpy() if isinstance(actions, Tensor) else np.asarray(actions)
+
+
+def _slice_actions(actions: Tensor | np.ndarray | List, idx: slice) -> Tensor | np.ndarray | List:
+    if isinstance(actions, (list, tuple)):
+        # tuple action spaces, see preprocess_actions()
+        return [a[idx] for a in actions]
+    return actions[idx]
+
+
+# shape, strides and storage offset of a view of a shared observation buffer
+ViewGeometry = Tuple[Tuple[int, ...], Tuple[int, ...], int]
+
+
+def _view_geometry(view: Tensor, buffer: Optional[Tensor]) -> Optional[ViewGeometry]:
+    """:return: geometry of the view if it is a view of the buffer, None otherwise"""
+    if buffer is None or view.untyped_storage().data_ptr() != buffer.untyped_storage().data_ptr():
+        return None
+    return tuple(view.shape), view.stride(), view.storage_offset()
+
+
+def _obs_destination(
+    slab: Dict[str, Any],
+    obs_buffers: Dict[str, Tensor],
+    obs_views: Dict[str, ViewGeometry],
+    agents: slice,
+    key: str,
+) -> Tensor:
+    if key not in obs_views:
+        return slab["obs"][key]
+    # the same view of the shared buffer as in the rollout worker, rows of this env only
+    size, stride, offset = obs_views[key]
+    return torch.as_strided(obs_buffers[key], size, stride, offset)[agents]
+
+
+def _write_step_data(
+    slab: Dict[str, Any],
+    obs: Dict[str, Any],
+    obs_destination: Optional[Callable[[str], Tensor]] = None,
+    rew=None,
+    terminated=None,
+    truncated=None,
+) -> None:
+    for key, value in obs.items():
+        dst = slab["obs"][key] if obs_destination is None else obs_destination(key)
+        dst[:] = torch.as_tensor(value)
+    if rew is not None:
+        slab["rewards"][:] = torch.as_tensor(rew)
+        slab["terminated"][:] = torch.as_tensor(terminated)
+        slab["truncated"][:] = torch.as_tensor(truncated)
+
+
+def _env_process(
+    sf_context: SampleFactoryContext,
+    cfg: Config,
+    env_info: EnvInfo,
+    env_config: AttrDict,
+    slab: Dict[str, Any],
+    obs_buffers: Dict[str, Tensor],
+    agents: slice,
+    conn: Connection,
+) -> None:
+    # termination is handled by the parent rollout worker
+    os_signal.signal(os_signal.SIGINT, os_signal.SIG_IGN)
+    torch.set_num_threads(1)
+    set_global_context(sf_context)
+
+    env = None
+    try:
+        env = make_env_func_batched(cfg, env_config)
+        check_env_info(env, env_info, cfg)
+        env.seed(env_config.env_id)
+        training_info_interface = find_training_info_interface(env)
+        conn.send((True, get_default_reward_shaping(env)))
+
+        while True:
+            cmd, data = conn.recv()
+            if cmd == STEP:
+                actions, obs_views = data
+                obs, rew, terminated, truncated, infos = env.step(actions)
+                obs_destination = None
+                if obs_views:
+                    obs_destination = partial(_obs_destination, slab, obs_buffers, obs_views, agents)
+                _write_step_data(slab, obs, obs_destination, rew, terminated, truncated)
+                conn.send((True, infos))
+            elif cmd == RESET:
+                obs, infos = env.reset()
+                _write_step_data(slab, obs)
+                conn.send((True, infos))
+            elif cmd == SET_TRAINING_INFO:
+                set_training_info(training_info_interface, data)
+            elif cmd == SET_REWARD_SHAPING:
+                set_reward_shaping(env, data, slice(0, env.num_agents))
+            elif cmd == CLOSE:
+                break
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if env is not None:
+            env.close()
+        conn.close()
+
+
+def _allocate_slab(num_agents: int, env_info: EnvInfo) -> Dict[str, Any]:
+    obs_space = env_info.obs_space
+    assert isinstance(obs_space, spaces.Dict), "Batched envs always have dictionary observations"
+
+    slab = dict(obs=dict())
+    for key, space in obs_space.spaces.items():
+        slab["obs"][key] = torch.zeros([num_agents, *space.shape], dtype=to_torch_dtype(space.dtype))
+    slab["rewards"] = torch.zeros(num_agents, dtype=torch.float32)
+    slab["terminated"] = torch.zeros(num_agents, dtype=torch.bool)
+    slab["truncated"] = torch.zeros(num_agents, dtype=torch.bool)
+
+    for t in [*slab["obs"].values(), slab["rewards"], slab["terminated"], slab["truncated"]]:
+        t.share_memory_()
+    return slab
+
+
+def _slab_slice(slab: Dict[str, Any], idx: slice) -> Dict[str, Any]:
+    return dict(
+        obs={key: t[idx] for key, t in slab["obs"].items()},
+        rewards=slab["rewards"][idx],
+        terminated=slab["terminated"][idx],
+        truncated=slab["truncated"][idx],
+    )
+
+
+class SubprocVecEnv(TrainingInfoInterface, RewardShapingInterface, ObsOutputInterface):
+    """Same interface as SequentialVectorizeWrapper, but every env is simulated in a separate process."""
+
+    def __init__(
+        self,
+        cfg: Config,
+        env_info: EnvInfo,
+        env_configs: List[AttrDict],
+        obs_buffers: Optional[Dict[str, Tensor]] = None,
+    ):
+        """
+        :param obs_buffers: shared memory observation buffers (i.e. of the trajectories), children can write
+        observations directly into views of these buffers, see set_obs_output()
+        """
+        TrainingInfoInterface.__init__(self)
+
+        self.observation_space = env_info.obs_space
+        self.action_space = env_info.action_space
+
+        self.num_envs = len(env_configs)
+        self.single_env_agents = env_info.num_agents
+        self.num_agents = self.single_env_agents * self.num_envs
+
+        self.slab = _allocate_slab(self.num_agents, env_info)
+
+        # only buffers in shared CPU memory can be mapped into the children
+        obs_buffers = obs_buffers or dict()
+        self.obs_buffers = {key: t for key, t in obs_buffers.items() if not t.is_cuda and t.is_shared()}
+        self.obs_output: Optional[Dict[str, Tensor]] = None
+
+        mp_ctx = get_mp_ctx(serial=False)
+        sf_context = sf_global_context()
+
+        self.conns: List[Connection] = []
+        self.processes = []
+        for i, env_config in enumerate(env_configs):
+            parent_conn, child_conn = mp_ctx.Pipe()
+            agents = self._env_agents(i)
+            env_slab = _slab_slice(self.slab, agents)
+            p = mp_ctx.Process(
+                target=_env_process,
+                args=(sf_context, cfg, env_info, env_config, env_slab, self.obs_buffers, agents, child_conn),
+                name=f"env_proc_{env_config.worker_index}_{env_config.vector_index}",
+                daemon=True,
+            )
+            p.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(p)
+
+        # wait until all envs are created
+        self.default_reward_shaping: Optional[Dict[str, Any]] = self._gather()[0]
+
+    @property
+    def unwrapped(self):
+        return self
+
+    def _env_agents(self, env_idx: int) -> slice:
+        return slice(env_idx * self.single_env_agents, (env_idx + 1) * self.single_env_agents)
+
+    def _gather(self) -> List[Any]:
+        """Wait for replies from all env processes, in env order."""
+        replies = []
+        for i, conn in enumerate(self.conns):
+            try:
+                ok, data = conn.recv()
+            except EOFError:
+                raise RuntimeError(f"Env process {self.processes[i].name} exited unexpectedly")
+            if not ok:
+                raise RuntimeError(f"Exception in env process {self.processes[i].name}:\n{data}")
+            replies.append(data)
+        return replies
+
+    def reset(self, **kwargs) -> Tuple[Dict[str, Tensor], List[Dict]]:
+        for conn in self.conns:
+            conn.send((RESET, None))
+
+        infos = []
+        for info in self._gather():
+            infos.extend(info)
+        return self.slab["obs"], infos
+
+    def set_obs_output(self, obs_output: Optional[Dict[str, Tensor]]) -> None:
+        self.obs_output = obs_output
+
+    def step(self, actions: Tensor | np.ndarray | List):
+        # destination of the observations is only valid for this step
+        obs_output, self.obs_output = self.obs_output, None
+
+        obs_views: Dict[str, ViewGeometry] = dict()
+        for key, view in (obs_output or dict()).items():
+            geometry = _view_geometry(view, self.obs_buffers.get(key))
+            if geometry is not None:
+                obs_views[key] = geometry
+
+        for i, conn in enumerate(self.conns):
+            conn.send((STEP, (_to_numpy(_slice_actions(actions, self._env_agents(i))), obs_views)))
+
+        infos = []
+        for info in self._gather():
+            infos.extend(info)
+
+        slab = self.slab
+        obs = slab["obs"]
+        if obs_output is not None:
+            obs = {key: obs_output.get(key, value) for key, value in obs.items()}
+            for key, dst in obs_output.items():
+                if key not in obs_views:
+                    # not a view of a buffer the children know about, copy from the slab
+                    dst[:] = slab["obs"][key]
+
+        return obs, slab["rewards"], slab["terminated"], slab["truncated"], infos
+
+    def set_training_info(self, training_info: Dict) -> None:
+        super().set_training_info(training_info)
+        for conn in self.conns:
+            conn.send((SET_TRAINING_INFO, training_info))
+
+    def get_default_reward_shaping(self) -> Optional[Dict[str, Any]]:
+        return self.default_reward_shaping
+
+    def set_reward_shaping(self, reward_shaping: Dict[str, Any], agent_indices: int | slice) -> None:
+        assert isinstance(agent_indices, slice)
+        # same reward shaping for all agents of the vector, this is how the batched runner uses it
+        assert agent_indices == slice(0, self.num_agents), f"Unsupported {agent_indices=}"
+        for conn in self.conns:
+            conn.send((SET_REWARD_SHAPING, reward_shaping))
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send((CLOSE, None))
+            except (BrokenPipeError, OSError):
+                pass
+
+        for p in self.processes:
+            p.join(timeout=10)
+            if p.is_alive():
+                log.warning(f"Env process {p.name} did not exit, terminating...")
+                p.terminate()
+
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
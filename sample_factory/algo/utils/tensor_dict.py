@@ -98,6 +98,16 @@ def tensor_dict_to_numpy(d: TensorDict) -> TensorDict:
     return numpy_dict
 
 
+# torch dtypes without a numpy counterpart, tensors of these types can't be viewed as numpy arrays
+NUMPY_INCOMPATIBLE_DTYPES = (torch.bfloat16,)
+
+
+def numpy_compatible(t: Tensor | TensorDict) -> bool:
+    """:return: True if to_numpy() can convert all tensors of t"""
+    tensors = [v for _, _, v in iterate_recursively(t)] if isinstance(t, dict) else [t]
+    return all(x.dtype not in NUMPY_INCOMPATIBLE_DTYPES for x in tensors)
+
+
 def to_numpy(t: Tensor | TensorDict) -> Tensor | TensorDict:
     if isinstance(t, TensorDict):
         return tensor_dict_to_numpy(t)
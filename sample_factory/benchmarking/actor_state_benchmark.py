@@ -0,0 +1,52 @@
+"""
+Overhead of the non-batched rollout worker with one ActorState object per actor (NonBatchedVectorEnvRunner)
+vs actor state kept in arrays (VectorizedNonBatchedEnvRunner, see --vectorized_actor_states).
+
+Runners are driven without inference workers: random policy outputs are written straight into the policy output
+buffers and trajectory buffers are released as soon as they are complete. The synthetic env does almost no work,
+so the measured time is the overhead of the runner itself. The env and the runner driver are shared with the tests
+(see tests/algo/utils.py), so run the benchmark from the root of the repository.
+
+Usage: python -m sample_factory.benchmarking.actor_state_benchmark --num_envs_per_worker 64 --num_agents 4
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.sampling.vectorized_non_batched_sampling import VectorizedNonBatchedEnvRunner
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.utils import log
+from tests.algo.utils import make_runner, parse_args, run_rollouts
+
+
+def main() -> int:
+    cfg = parse_args(sys.argv[1:])
+    log.info(
+        f"Actor state benchmark: {cfg.num_envs_per_worker} envs x {cfg.num_agents} agents, "
+        f"{cfg.num_policies} policies, {cfg.env_steps} steps of the vector"
+    )
+
+    for runner_cls in [NonBatchedVectorEnvRunner, VectorizedNonBatchedEnvRunner]:
+        timing = Timing()
+        runner = make_runner(cfg, runner_cls, timing)
+        run_rollouts(runner, cfg.rollout, np.random.default_rng(0), timing)  # warmup
+
+        start = time.time()
+        run_rollouts(runner, cfg.env_steps, np.random.default_rng(0), timing)
+        elapsed = time.time() - start
+        runner.close()
+
+        agent_steps = cfg.env_steps * cfg.num_envs_per_worker * cfg.num_agents
+        log.info(
+            f"{runner_cls.__name__:32s}: {elapsed / cfg.env_steps * 1000:8.3f} ms per step of the vector, "
+            f"{agent_steps / elapsed:10.0f} agent steps/s"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import time
+from typing import Callable
+
+import torch
+
+
+def time_per_call(func: Callable, device: torch.device, iterations: int, warmup: int = 3) -> float:
+    """Average wall time of func() in seconds. Warmup calls also trigger TorchScript compilation/specialization."""
+    for _ in range(warmup):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.time() - start) / iterations
@@ -0,0 +1,56 @@
+"""
+Benchmark of the GAE discounted sum backends (see --gae_backend).
+For every rollout length reports the time of gae_advantages() with each backend and which one wins.
+
+Usage: python -m sample_factory.benchmarking.gae_benchmark --device=cuda --num_trajectories 256 1024
+"""
+
+import argparse
+import sys
+
+import torch
+
+from sample_factory.algo.utils.rl_utils import gae_advantages
+from sample_factory.benchmarking.benchmark_utils import time_per_call
+from sample_factory.utils.utils import log
+from tests.algo.utils import random_gae_inputs
+
+GAE_BACKENDS = ["loop", "scan"]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    p.add_argument("--rollout", default=[8, 32, 64, 128, 256, 512, 1024], type=int, nargs="+")
+    p.add_argument("--num_trajectories", default=[256, 2048], type=int, nargs="+")
+    p.add_argument("--iterations", default=20, type=int)
+    p.add_argument("--gamma", default=0.99, type=float)
+    p.add_argument("--gae_lambda", default=0.95, type=float)
+    return p.parse_args(argv)
+
+
+def main() -> int:
+    args = parse_args()
+    device = torch.device(args.device)
+
+    log.info(f"GAE benchmark on {device}, {args.iterations} iterations per configuration")
+    for num_trajectories in args.num_trajectories:
+        for rollout in args.rollout:
+            inputs = random_gae_inputs(num_trajectories, rollout, device)
+
+            timings, results = dict(), dict()
+            for backend in GAE_BACKENDS:
+                func = lambda: gae_advantages(*inputs, args.gamma, args.gae_lambda, backend)  # noqa: E731
+                timings[backend] = time_per_call(func, device, args.iterations)
+                results[backend] = func()
+
+            max_err = (results["scan"] - results["loop"]).abs().max().item()
+            winner = min(timings, key=timings.get)
+            timings_str = ", ".join(f"{b} {t * 1000:8.3f} ms" for b, t in timings.items())
+            log.info(f"{num_trajectories=:5d} {rollout=:5d}: {timings_str}, best: {winner:>4s}, {max_err=:.3e}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
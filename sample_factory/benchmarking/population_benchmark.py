@@ -0,0 +1,83 @@
+"""
+Vectorized inference of a population of policies (see --population_inference) vs one forward pass per policy.
+The baseline is what the inference workers do without --population_inference=vmap: every policy runs its own forward
+pass on its own batch (with one inference worker per policy these run in separate processes on separate cores).
+
+Policies are created from the default configuration with random weights, use --encoder_mlp_layers etc. to match
+your architecture. Only feed-forward models are vectorized (vmap does not support GRU/LSTM cores).
+
+Usage: python -m sample_factory.benchmarking.population_benchmark --population_sizes 8 16 --batch_per_policy 32
+"""
+
+import sys
+from typing import List
+
+import gymnasium as gym
+import torch
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.benchmarking.benchmark_utils import time_per_call
+from sample_factory.cfg.arguments import parse_full_cfg, parse_sf_args
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.model_utils import get_rnn_size
+from sample_factory.model.population_inference import PopulationInference
+from sample_factory.utils.utils import log
+
+
+def parse_args(argv: List[str]):
+    # models are not connected to any env, arguments passed by the user take precedence
+    argv = ["--env=population_benchmark", "--experiment=population_benchmark"] + argv
+    parser, _ = parse_sf_args(argv)
+    parser.add_argument("--obs_size", default=64, type=int, help="Size of the (flat) observation vector")
+    parser.add_argument("--num_actions", default=8, type=int, help="Size of the discrete action space")
+    parser.add_argument("--population_sizes", default=[4, 8, 16], type=int, nargs="+")
+    parser.add_argument("--batch_per_policy", default=[8, 32, 128], type=int, nargs="+")
+    parser.add_argument("--iterations", default=50, type=int)
+    parser.set_defaults(device="cpu", use_rnn=False)
+    return parse_full_cfg(parser, argv)
+
+
+def main() -> int:
+    cfg = parse_args(sys.argv[1:])
+    torch.set_num_threads(1)  # this is how inference workers run
+
+    obs_space = gym.spaces.Dict(obs=gym.spaces.Box(-10, 10, (cfg.obs_size,)))
+    action_space = gym.spaces.Discrete(cfg.num_actions)
+    device = torch.device("cpu")
+
+    log.info(f"Population inference benchmark, {cfg.iterations} iterations per configuration")
+    with torch.no_grad():
+        for population_size in cfg.population_sizes:
+            models = [create_actor_critic(cfg, obs_space, action_space) for _ in range(population_size)]
+            for model in models:
+                model.eval()
+            population = PopulationInference(cfg, obs_space, action_space, device)
+            versions = {policy_id: 0 for policy_id in range(population_size)}
+
+            for batch_size in cfg.batch_per_policy:
+                segments = []
+                for policy_id, model in enumerate(models):
+                    obs = dict(obs=torch.randn(batch_size, cfg.obs_size) * 3)
+                    normalized_obs = prepare_and_normalize_obs(model, obs)
+                    rnn_states = torch.zeros(batch_size, get_rnn_size(cfg))
+                    segments.append((policy_id, model, normalized_obs, rnn_states))
+
+                def per_policy():
+                    for _, m, normalized_obs, rnn_states in segments:
+                        m(normalized_obs, rnn_states)
+
+                population(segments, versions)  # build and validate the stacked weights
+                per_policy_time = time_per_call(per_policy, device, cfg.iterations)
+                vmap_time = time_per_call(lambda: population(segments, versions), device, cfg.iterations)
+                fallback = " (eager fallback)" if population.eager_fallback else ""
+
+                log.info(
+                    f"{population_size=:3d} {batch_size=:4d}: per-policy {per_policy_time * 1000:8.3f} ms, "
+                    f"vmap {vmap_time * 1000:8.3f} ms{fallback}, speedup {per_policy_time / vmap_time:5.2f}x"
+                )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Accuracy cost vs throughput gain of the quantized inference copy of the policy (see --inference_quantization).
+For every batch size reports the forward pass time of the fp32 and the quantized policy, and the divergence
+of their action distributions (KL, agreement of the greedy actions) on the same batch.
+
+The model is created from the default configuration with random observations and weights, use --encoder_mlp_layers,
+--rnn_size, etc. to match your architecture. To compare on real data call action_distribution_divergence()
+(sample_factory.model.quantization) with your own model and a batch of observations.
+
+Usage: python -m sample_factory.benchmarking.quantization_benchmark --obs_size=64 --num_actions=8 --batch_sizes 1 64 512
+"""
+
+import sys
+from typing import List
+
+import gymnasium as gym
+import torch
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.benchmarking.benchmark_utils import time_per_call
+from sample_factory.cfg.arguments import parse_full_cfg, parse_sf_args
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.model_utils import get_rnn_size
+from sample_factory.model.quantization import QuantizedPolicy, action_distribution_divergence
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.utils import log
+
+
+def parse_args(argv: List[str]):
+    # model is not connected to any env, arguments passed by the user take precedence
+    argv = ["--env=quantization_benchmark", "--experiment=quantization_benchmark"] + argv
+    parser, _ = parse_sf_args(argv)
+    parser.add_argument("--obs_size", default=64, type=int, help="Size of the (flat) observation vector")
+    parser.add_argument("--num_actions", default=8, type=int, help="Size of the discrete action space")
+    parser.add_argument("--batch_sizes", default=[1, 16, 128, 1024], type=int, nargs="+")
+    parser.add_argument("--iterations", default=50, type=int)
+    parser.set_defaults(device="cpu", inference_quantization="dynamic_int8")
+    return parse_full_cfg(parser, argv)
+
+
+def main() -> int:
+    cfg = parse_args(sys.argv[1:])
+    torch.set_num_threads(1)  # this is how inference workers run
+
+    obs_space = gym.spaces.Dict(obs=gym.spaces.Box(-10, 10, (cfg.obs_size,)))
+    action_space = gym.spaces.Discrete(cfg.num_actions)
+    model = create_actor_critic(cfg, obs_space, action_space)
+    model.eval()
+
+    quantized_policy = QuantizedPolicy(cfg, obs_space, action_space)
+    quantized_policy.maybe_requantize(model, policy_version=0, timing=Timing())
+    quantized = quantized_policy.model
+    device = torch.device("cpu")
+
+    log.info(f"Quantization benchmark ({cfg.inference_quantization}), {cfg.iterations} iterations per batch size")
+    with torch.no_grad():
+        for batch_size in cfg.batch_sizes:
+            obs = dict(obs=torch.randn(batch_size, cfg.obs_size) * 3)
+            normalized_obs = prepare_and_normalize_obs(model, obs)
+            rnn_states = torch.zeros(batch_size, get_rnn_size(cfg))
+
+            fp32_time = time_per_call(lambda: model(normalized_obs, rnn_states), device, cfg.iterations)
+            int8_time = time_per_call(lambda: quantized(normalized_obs, rnn_states), device, cfg.iterations)
+            div = action_distribution_divergence(model, quantized, normalized_obs, rnn_states)
+
+            log.info(
+                f"{batch_size=:5d}: fp32 {fp32_time * 1000:8.3f} ms, int8 {int8_time * 1000:8.3f} ms, "
+                f"speedup {fp32_time / int8_time:5.2f}x, KL mean {div['kl_mean']:.2e} max {div['kl_max']:.2e}, "
+                f"greedy action agreement {div['greedy_action_agreement']:.3f}"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
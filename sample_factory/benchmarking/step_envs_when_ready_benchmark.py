@@ -0,0 +1,103 @@
+"""
+Time that the envs of a non-batched runner wait for their actions (wait_for_inference in the rollout worker profile)
+with and without --step_envs_when_ready, when one of the policies answers slower than the other.
+
+The runner is driven without inference workers, just like in actor_state_benchmark.py (see tests/algo/utils.py). Every round of the driver
+takes --round_ms of wall time (this is the latency of inference). Policy 0 answers all of its outstanding requests
+every round, the slow policy only every --slow_policy_period rounds. Outstanding requests are answered newest first.
+Envs are controlled by the two policies in turns (env_i % num_policies).
+
+Usage: python -m sample_factory.benchmarking.step_envs_when_ready_benchmark --num_envs_per_worker 16 --num_agents 1
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import PolicyID
+from sample_factory.utils.utils import log
+from tests.algo.utils import make_runner, parse_args
+
+SLOW_POLICY = 1
+
+
+def parse_benchmark_args(argv: List[str]) -> Tuple[argparse.Namespace, List[str]]:
+    """:return: arguments of this benchmark, and the rest of argv for the runner (see tests/algo/utils.py)"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_rounds", default=2000, type=int, help="Rounds of the driver per measurement")
+    parser.add_argument("--round_ms", default=1.0, type=float, help="Wall time of one round of the driver")
+    parser.add_argument("--slow_policy_period", default=3, type=int, help="Slow policy answers every N rounds")
+    return parser.parse_known_args(argv)
+
+
+def _write_policy_outputs(runner: NonBatchedVectorEnvRunner, rows: np.ndarray, rng: np.random.Generator) -> None:
+    output_sizes = runner.buffer_mgr.output_sizes
+    actions_end = output_sizes[0]  # actions come first, see policy_output_shapes()
+    outputs = rng.random((len(rows), sum(output_sizes)), dtype=np.float32)
+    outputs[:, :actions_end] = rng.integers(0, runner.env_info.action_space.n, (len(rows), actions_end))
+    runner.policy_output_tensors[rows[:, 0], rows[:, 1]] = outputs
+
+
+def run_rounds(
+    runner: NonBatchedVectorEnvRunner, args: argparse.Namespace, rng: np.random.Generator, timing: Timing
+) -> int:
+    """:return: number of complete trajectories"""
+    answer_period = {0: 1, SLOW_POLICY: args.slow_policy_period}
+    outstanding: Dict[Tuple[PolicyID, int], np.ndarray] = dict()  # (policy_id, request_id) -> rows
+    num_trajectories = 0
+
+    for round_idx in range(args.num_rounds):
+        assert runner.update_trajectory_buffers(timing)
+        request = runner.generate_policy_request()
+        for policy_id, rows in (request or {}).items():
+            outstanding[(policy_id, runner.policy_request_id)] = rows
+
+        time.sleep(args.round_ms / 1000)  # inference
+
+        due = [tag for tag in outstanding if round_idx % answer_period[tag[0]] == answer_period[tag[0]] - 1]
+        for policy_id, request_id in sorted(due, key=lambda tag: tag[1], reverse=True):
+            _write_policy_outputs(runner, outstanding.pop((policy_id, request_id)), rng)
+            rollouts, _ = runner.advance_rollouts(policy_id, request_id, timing)
+            num_trajectories += len(rollouts)
+            # trajectories are released right away, as if the learner consumed them instantly
+            for rollout in rollouts:
+                runner.traj_buffer_queue.put(rollout["traj_buffer_idx"])
+
+    return num_trajectories
+
+
+def main() -> int:
+    args, runner_argv = parse_benchmark_args(sys.argv[1:])
+    # deterministic env to policy mapping: env_i % num_policies
+    runner_argv = ["--num_policies=2", "--async_rl=False", "--num_agents=1"] + runner_argv
+    log.info(
+        f"Step envs when ready benchmark: {args.num_rounds} rounds of {args.round_ms} ms, "
+        f"slow policy answers every {args.slow_policy_period} rounds"
+    )
+
+    for step_envs_when_ready in [False, True]:
+        cfg = parse_args(runner_argv + [f"--step_envs_when_ready={step_envs_when_ready}"])
+        timing = Timing()
+        runner = make_runner(cfg, NonBatchedVectorEnvRunner, timing)
+
+        start = time.time()
+        num_trajectories = run_rounds(runner, args, np.random.default_rng(0), timing)
+        elapsed = time.time() - start
+        runner.close()
+
+        # wait_for_inference is a moving average over the last 10 * num_envs waits, like in the rollout worker
+        log.info(
+            f"--step_envs_when_ready={step_envs_when_ready!s:5s}: wait_for_inference {timing.wait_for_inference} s, "
+            f"{num_trajectories * cfg.rollout / elapsed:10.0f} agent steps/s"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
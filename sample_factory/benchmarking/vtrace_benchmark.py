@@ -0,0 +1,62 @@
+"""
+Microbenchmark for the V-trace computation in the learner.
+Compares the legacy implementation (copy to CPU + Python loop over strided slices) against the device-resident
+vtrace_targets_and_advantages() for a sweep of recurrence and minibatch sizes.
+
+Usage: python -m sample_factory.benchmarking.vtrace_benchmark --device=cuda
+"""
+
+import argparse
+import sys
+
+import torch
+
+from sample_factory.algo.utils.rl_utils import vtrace_targets_and_advantages
+from sample_factory.benchmarking.benchmark_utils import time_per_call
+from sample_factory.utils.utils import log
+from tests.algo.utils import random_vtrace_inputs, vtrace_cpu_loop
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+    p.add_argument("--recurrence", default=[8, 32, 64, 128], type=int, nargs="+")
+    p.add_argument("--batch_size", default=[1024, 4096, 16384], type=int, nargs="+")
+    p.add_argument("--iterations", default=50, type=int)
+    p.add_argument("--gamma", default=0.99, type=float)
+    p.add_argument("--vtrace_rho", default=1.0, type=float)
+    p.add_argument("--vtrace_c", default=1.0, type=float)
+    return p.parse_args(argv)
+
+
+def main() -> int:
+    args = parse_args()
+    device = torch.device(args.device)
+
+    log.info(f"V-trace benchmark on {device}, {args.iterations} iterations per configuration")
+    for recurrence in args.recurrence:
+        for batch_size in args.batch_size:
+            if batch_size % recurrence != 0:
+                log.warning(f"Skipping {batch_size=} not divisible by {recurrence=}")
+                continue
+
+            inputs = random_vtrace_inputs(batch_size, device)
+            params = (args.gamma, args.vtrace_rho, args.vtrace_c, recurrence)
+
+            loop_sec = time_per_call(lambda: vtrace_cpu_loop(*inputs, *params), device, args.iterations)
+            vec_sec = time_per_call(lambda: vtrace_targets_and_advantages(*inputs, *params), device, args.iterations)
+
+            vs_ref, adv_ref = vtrace_cpu_loop(*inputs, *params)
+            vs, adv = vtrace_targets_and_advantages(*inputs, *params)
+            max_err = max((vs - vs_ref).abs().max().item(), (adv - adv_ref).abs().max().item())
+
+            log.info(
+                f"{recurrence=:4d} {batch_size=:6d}: loop {loop_sec * 1000:8.3f} ms, "
+                f"device {vec_sec * 1000:8.3f} ms, speedup x{loop_sec / vec_sec:6.2f}, {max_err=:.3e}"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -126,6 +126,17 @@ def verify_cfg(cfg: Config, env_info: EnvInfo) -> bool:
             f" (for double-buffered sampling you need to use even number of envs per worker)"
         )
 
+    if cfg.env_step_threads < 0:
+        cfg_error(f"{cfg.env_step_threads=} must be non-negative")
+    if cfg.env_creation_threads < 0:
+        cfg_error(f"{cfg.env_creation_threads=} must be non-negative")
+    if cfg.straggler_factor <= 1.0:
+        cfg_error(f"{cfg.straggler_factor=} must be greater than 1")
+    if cfg.straggler_report_interval <= 0:
+        cfg_error(f"{cfg.straggler_report_interval=} must be positive")
+    if cfg.env_step_timeout < 0:
+        cfg_error(f"{cfg.env_step_timeout=} must be non-negative")
+
     if cfg.normalize_returns and cfg.with_vtrace:
         # When we use vtrace the logic for calculating returns is different - we need to recalculate them
         # on every minibatch, because important sampling depends on the trained policy.
@@ -184,6 +195,51 @@ def verify_cfg(cfg: Config, env_info: EnvInfo) -> bool:
             "same amount of experience per policy."
         )
 
+    bfloat16_buffers = cfg.buffer_float_dtype == "bfloat16" and not cfg.validate_reduced_precision
+    if bfloat16_buffers and not cfg.batched_sampling:
+        cfg_error(
+            f"{cfg.buffer_float_dtype=} requires --batched_sampling, non-batched sampling uses numpy views of the buffers"
+        )
+
+    if cfg.env_subprocesses:
+        if not cfg.batched_sampling:
+            cfg_error("--env_subprocesses requires --batched_sampling")
+        if env_info.gpu_actions or (env_info.gpu_observations and cfg.actor_worker_gpus):
+            cfg_error(
+                "--env_subprocesses only supports CPU-side envs (--env_gpu_actions=False and empty --actor_worker_gpus)"
+            )
+        if cfg.env_step_threads > 1:
+            log.warning("--env_step_threads is ignored with --env_subprocesses, every env already has its own process")
+        if cfg.env_reset_prefetch:
+            log.warning(
+                "--env_reset_prefetch is ignored with --env_subprocesses, envs are reset in the child processes"
+            )
+
+    if cfg.env_step_timeout > 0 and cfg.batched_sampling:
+        log.warning("--env_step_timeout is ignored with --batched_sampling, envs of a vector are stepped together")
+
+    if cfg.exclude_straggler_workers and (cfg.async_rl or cfg.num_policies > 1):
+        log.warning("--exclude_straggler_workers is ignored, it only works in sync mode with a single policy")
+
+    if cfg.step_envs_when_ready and cfg.batched_sampling:
+        log.warning(
+            "--step_envs_when_ready is ignored with --batched_sampling, batched envs are always stepped together"
+        )
+
+    if cfg.vectorized_actor_states:
+        if cfg.batched_sampling:
+            log.warning("--vectorized_actor_states is ignored with --batched_sampling, batched runners are vectorized")
+        elif cfg.step_envs_when_ready:
+            cfg_error("--vectorized_actor_states is not compatible with --step_envs_when_ready")
+        elif env_info.gpu_observations and cfg.actor_worker_gpus:
+            cfg_error("--vectorized_actor_states only supports CPU-side envs (empty --actor_worker_gpus)")
+
+    if cfg.inference_quantization != "none" and cfg.device == "gpu":
+        cfg_error(f"{cfg.inference_quantization=} is only supported for CPU inference (--device=cpu)")
+
+    if cfg.population_inference != "per_policy" and cfg.inference_quantization != "none":
+        cfg_error(f"{cfg.population_inference=} stacks fp32 weights, it can't be used with quantized policies")
+
     if cfg.use_rnn:
         if cfg.recurrence <= 1:
             cfg_error(
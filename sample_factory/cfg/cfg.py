@@ -90,6 +90,52 @@ def add_rl_args(p: ArgumentParser):
         "are processed. Set this parameter to 1 to further reduce policy-lag. "
         "If the experience collection is very non-uniform, increasing this parameter can increase overall throughput, at the cost of increased policy-lag.",
     )
+    p.add_argument(
+        "--learner_prefetch_batches",
+        default=False,
+        type=str2bool,
+        help="If another training batch is already accumulated (see --num_batches_to_accumulate), prepare it "
+        "(obs normalization, bootstrap values, GAE) in a background thread while the learner trains on the current batch. "
+        "The next batch is prepared with a copy of the weights and normalizer taken before the SGD steps on the current batch, "
+        "experience that would exceed max_policy_lag by the time the batch is trained is discarded. "
+        "Costs an extra copy of the model. Time saved per iteration is reported as prefetch_saved in the learner profile",
+    )
+    p.add_argument(
+        "--zero_copy_training_batches",
+        default=False,
+        type=str2bool,
+        help="If the trajectories for a training batch occupy a single contiguous slice of the trajectory buffer on the "
+        "learner device (common with batched sampling), train directly on a view of this slice instead of copying it into "
+        "a separate training batch. These trajectories are returned to the samplers only after training on them, also in async mode. "
+        "Falls back to copying when the trajectories are fragmented. Fraction of batches served without a copy is reported as zero_copy_batches_p<policy_id>",
+    )
+    p.add_argument(
+        "--buffer_float_dtype",
+        default="float32",
+        choices=["float32", "float16", "bfloat16"],
+        type=str,
+        help="Storage dtype for the float fields of the shared trajectory buffers and training batches selected by "
+        "--reduced_precision_fields. Halves the memory and the bandwidth needed to copy these fields (i.e. in the Batcher), "
+        "values are upcast to float32 on the inference worker and on the learner. "
+        "bfloat16 has no numpy counterpart and requires --batched_sampling",
+    )
+    p.add_argument(
+        "--reduced_precision_fields",
+        default=["obs", "action_logits", "values", "log_prob_actions"],
+        type=str,
+        nargs="*",
+        choices=["obs", "action_logits", "values", "rnn_states", "log_prob_actions"],
+        help="Fields stored in --buffer_float_dtype if it is not float32. obs stands for all float observations "
+        "(integer observations, i.e. images, are always stored as is). "
+        "RNN states are excluded by default since inference workers read them back from the trajectories (see --compact_rnn_states)",
+    )
+    p.add_argument(
+        "--validate_reduced_precision",
+        default=False,
+        type=str2bool,
+        help="Keep the buffers in float32, but measure the max absolute error for the fields selected by --reduced_precision_fields "
+        "we would get from storing them in --buffer_float_dtype. Max over the run is reported as precision_err_<field> in the learner stats",
+    )
     p.add_argument(
         "--worker_num_splits",
         default=2,
@@ -97,12 +143,170 @@ def add_rl_args(p: ArgumentParser):
         help='Typically we split a vector of envs into two parts for "double buffered" experience collection '
         "Set this to 1 to disable double buffering. Set this to 3 for triple buffering!",
     )
+    p.add_argument(
+        "--env_step_threads",
+        default=0,
+        type=int,
+        help="Step the envs of each split concurrently on a pool of this many threads within the rollout worker. "
+        "Only helps with envs that release the GIL in step() (e.g. VizDoom, DMLab, NLE, MuJoCo), then we can use "
+        "fewer rollout workers with more envs each. Results are gathered in env order, so experience is the same as "
+        "with sequential stepping. 0 (default) or 1 steps the envs one after another in the rollout worker thread. "
+        "See env_step_ms stats for the distribution of the individual env step times.",
+    )
+    p.add_argument(
+        "--env_creation_threads",
+        default=0,
+        type=int,
+        help="Create, check and reset the envs of a rollout worker concurrently on up to this many threads. "
+        "Speeds up experiment startup for envs that take seconds to initialize (VizDoom, DMLab). 0 (default) or 1 "
+        "creates the envs one after another. Only use with envs that can be constructed from multiple threads. "
+        "See --save_startup_timeline for the create/check/reset times of every env.",
+    )
+    p.add_argument(
+        "--save_startup_timeline",
+        default=False,
+        type=str2bool,
+        help="Write create/check/reset/decorrelation times of every env to "
+        "<experiment_dir>/startup/startup_wXXX.json (one file per rollout worker). "
+        "Otherwise rollout workers only log the total time spent in each startup phase.",
+    )
+    p.add_argument(
+        "--env_subprocesses",
+        default=False,
+        type=str2bool,
+        help="Batched sampling only. Simulate every env of a rollout worker in its own child process. Children write "
+        "observations directly into the shared trajectory buffers (rewards and dones into a separate shared slab) and "
+        "step in parallel, so envs that hold the GIL (i.e. pure-Python envs) can use more cores without adding rollout "
+        "workers. In --serial_mode trajectory buffers are not in shared memory and observations are copied from the "
+        "slab. Only CPU-side envs are supported.",
+    )
+    p.add_argument(
+        "--env_reset_prefetch",
+        default=False,
+        type=str2bool,
+        help="Keep a spare instance of every env that is reset on a background thread. When an episode ends, the spare "
+        "is swapped in and the finished instance is reset in the background, so long resets (DMLab, VizDoom with bots, "
+        "NetHack) don't stall the rollout worker. Doubles the number of env instances (memory!). Only single-agent envs "
+        "are supported, multi-agent envs reset themselves. See env_reset_hidden/env_reset_exposed in the rollout "
+        "worker profile.",
+    )
+    p.add_argument(
+        "--step_envs_when_ready",
+        default=False,
+        type=str2bool,
+        help="Non-batched sampling only. Simulate an env as soon as actions for all of its agents are ready, and "
+        "request actions for its next step right away, instead of waiting for actions for all envs in the vector. "
+        "Helps when envs are controlled by different policies (PBT) and some policies respond slower than others. "
+        "A policy can have several requests in flight, every request is tagged with an id that the inference worker "
+        "sends back, so envs never wait for an unrelated request of the same policy. "
+        "Envs still wait for each other at the end of the rollout. See wait_for_inference in the rollout worker profile.",
+    )
+    p.add_argument(
+        "--vectorized_actor_states",
+        default=False,
+        type=str2bool,
+        help="Non-batched sampling only. Keep the state of all actors (agents) of a vector of envs in arrays instead of "
+        "one Python object per actor, and process policy outputs, rewards, dones, actions and observations with a "
+        "few array operations per step for the whole vector. Reduces the rollout worker overhead with many envs "
+        "and agents per worker, see sample_factory/benchmarking/actor_state_benchmark.py. "
+        "Not compatible with --step_envs_when_ready.",
+    )
+    p.add_argument(
+        "--double_buffered_weights",
+        default=False,
+        type=str2bool,
+        help="Learner publishes the weights into two alternating slots in shared memory after each update, guarded by "
+        "a sequence lock. Inference workers copy the latest complete slot without taking the policy lock, so weight "
+        "refreshes don't serialize against the optimizer step. Costs two extra copies of the model and a copy per update "
+        "on the learner. Time inference workers spend on torn copies is reported as weight_read_retry, time "
+        "they spend blocked on the policy lock (without this option) as policy_lock_wait",
+    )
     p.add_argument(
         "--policy_workers_per_policy",
         default=1,
         type=int,
         help="Number of policy workers that compute forward pass (per policy)",
     )
+    p.add_argument(
+        "--policies_per_inference_worker",
+        default=1,
+        type=int,
+        help="Number of policies served by one inference worker. Consecutive policies (i.e. 0..7, 8..15) share the "
+        "inference workers and their request queue, each iteration of the inference loop runs one forward pass per "
+        "policy that has pending requests. Saves processes and memory (CUDA contexts) with large PBT populations "
+        "at the cost of inference throughput per policy. With the GPU all policies of the worker run on the device "
+        "of the first policy of the group, the weights of the other policies are copied there from their learners. "
+        "In --serial_mode the worker uses the models of the learners directly, so each policy runs on the device of "
+        "its learner (and --population_inference=vmap requires all of them on one device). "
+        "--policy_workers_per_policy then means workers per group of policies.",
+    )
+    p.add_argument(
+        "--population_inference",
+        default="per_policy",
+        choices=["per_policy", "vmap"],
+        type=str,
+        help="How an inference worker serving several policies (see --policies_per_inference_worker) evaluates them. "
+        "per_policy: one forward pass per policy. vmap: parameters of all policies (same architecture) are stacked "
+        "and the requests of all policies are evaluated in a single vectorized forward pass (torch.func.vmap), "
+        "which turns many small matmuls into a few large ones. Best for populations of small MLP policies. "
+        "Models that can't be vectorized (i.e. GRU/LSTM cores) fall back to per_policy.",
+    )
+    p.add_argument(
+        "--inference_batching",
+        default="fixed",
+        choices=["fixed", "adaptive"],
+        type=str,
+        help="How inference workers decide when to stop waiting for more requests and run the forward pass. "
+        "fixed: wait up to 25ms for at least 1/3 of the rollout workers. adaptive: learn the cost of the forward pass "
+        "as a function of the batch size and dispatch the batch as soon as waiting any longer would violate "
+        "--inference_target_latency, or when the batch reaches --inference_max_batch_size. "
+        "Batch size and queue wait distributions are reported in both modes",
+    )
+    p.add_argument(
+        "--inference_target_latency",
+        default=0.025,
+        type=float,
+        help="Target p95 latency (in seconds) of the policy step, measured from the arrival of the first request of the "
+        "batch until the actions are written. Larger values favor larger batches (throughput), smaller values favor "
+        "fast responses (latency-bound envs and small models). Only used with --inference_batching=adaptive",
+    )
+    p.add_argument(
+        "--inference_max_batch_size",
+        default=0,
+        type=int,
+        help="Dispatch the batch as soon as it contains this many samples. 0 means no limit, i.e. the batch size is "
+        "limited only by the latency target and the number of rollout workers. "
+        "Only used with --inference_batching=adaptive",
+    )
+    p.add_argument(
+        "--inference_graph",
+        default="eager",
+        choices=["eager", "trace"],
+        type=str,
+        help="eager: inference workers call the policy module as is. trace: the whole sampling path of the policy "
+        "(obs normalization, encoder, core, action distribution, sampling) is traced into a single TorchScript graph "
+        "on the first batch, which removes Python overhead per batch (most noticeable with small models). "
+        "The graph shares weights with the model so weight updates don't require retracing. "
+        "Models that can't be traced (validated against the eager model) fall back to eager execution. "
+        "Note that with tracing the time of the obs normalization is reported as a part of the forward pass",
+    )
+    p.add_argument(
+        "--inference_quantization",
+        default="none",
+        choices=["none", "dynamic_int8"],
+        type=str,
+        help="Run inference on a quantized copy of the policy. dynamic_int8: Linear/GRU/LSTM layers use int8 weights, "
+        "activations are quantized on the fly (torch.ao.quantization.quantize_dynamic). Only for CPU inference. "
+        "The learner always trains in fp32, the quantized copy is rebuilt after the weight updates. "
+        "Use sample_factory.benchmarking.quantization_benchmark to measure the accuracy cost vs throughput gain",
+    )
+    p.add_argument(
+        "--requantize_interval",
+        default=2.0,
+        type=float,
+        help="Minimum time (in seconds) between rebuilds of the quantized copy of the policy. Quantization is not free, "
+        "larger values mean less overhead for the inference workers at the cost of additional policy lag",
+    )
     p.add_argument(
         "--max_policy_lag",
         default=1000,
@@ -163,6 +367,15 @@ def add_rl_args(p: ArgumentParser):
         "Default value (-1) sets recurrence to rollout length for RNNs and to 1 (no recurrence) for feed-forward nets. "
         "If you train with V-trace recurrence should be equal to rollout length.",
     )
+    p.add_argument(
+        "--compact_rnn_states",
+        default=False,
+        type=str2bool,
+        help="Only store RNN hidden states at the start of each recurrence chunk (and for the last, bootstrap step) in "
+        "the trajectory buffers instead of storing them for every step. This is all the learner needs for "
+        "backpropagation through time. Reduces trajectory buffer memory and copying time for large RNNs. "
+        "Inference workers read the current hidden state of each actor from a separate small buffer.",
+    )
     p.add_argument(
         "--shuffle_minibatches",
         default=False,
@@ -245,6 +458,16 @@ def add_rl_args(p: ArgumentParser):
         type=float,
         help="Generalized Advantage Estimation discounting (only used when V-trace is False)",
     )
+    p.add_argument(
+        "--gae_backend",
+        default="loop",
+        type=str,
+        choices=["loop", "scan"],
+        help="How to calculate the discounted sum of TD-errors in GAE. 'loop' iterates over the time axis one step at a time "
+        "(one set of small kernels per timestep). 'scan' uses a log-depth associative scan over the rollout, which is "
+        "usually faster for long rollouts and/or on GPU. Both produce the same advantages up to floating point error. "
+        "See sample_factory.benchmarking.gae_benchmark to pick the best option for your rollout length and device",
+    )
     p.add_argument(
         "--ppo_clip_ratio",
         default=0.1,
@@ -346,6 +569,26 @@ def add_rl_args(p: ArgumentParser):
         nargs="*",
         help="Which observation keys to use for normalization. If None, all observation keys are used (be careful with this!)",
     )
+    p.add_argument(
+        "--lazy_obs_normalization",
+        default=False,
+        type=str2bool,
+        help="If True, the learner only updates the observation normalization statistics once per training iteration "
+        "and normalizes each minibatch right before the forward pass. The training batch then keeps observations "
+        "in their original dtype (e.g. uint8 images) instead of materializing a float copy of the entire batch, "
+        "which substantially reduces learner memory for pixel-based envs at the cost of normalizing "
+        "observations num_epochs times instead of once.",
+    )
+    p.add_argument(
+        "--lock_free_obs_normalizer",
+        default=False,
+        type=str2bool,
+        help="Learner updates the observation normalizer without holding the policy lock and publishes versioned "
+        "snapshots of the statistics to shared memory after each update. Inference workers pick up the latest "
+        "snapshot without blocking instead of reading the statistics with the rest of the weights, so weight refreshes "
+        "on the inference workers don't wait for the normalization of the whole batch on the learner. "
+        "Time the learner waits for the lock otherwise is reported as normalizer_lock_wait",
+    )
 
     # decorrelating experience on startup (optional)
     p.add_argument(
@@ -365,6 +608,18 @@ def add_rl_args(p: ArgumentParser):
         help="In addition to temporal decorrelation of worker processes, also decorrelate envs within one worker process. "
         "For environments with a fixed episode length it can prevent the reset from happening in the same rollout for all envs simultaneously, which makes experience collection more uniform.",
     )
+    p.add_argument(
+        "--decorrelation_method",
+        default="sleep",
+        choices=["sleep", "random_bursts"],
+        type=str,
+        help="sleep: rollout workers sleep for up to --decorrelate_experience_max_seconds after the first rollouts, and "
+        "(non-batched sampling only) env i of a worker steps rollout * i random actions before training. "
+        "random_bursts: no sleeping, every env steps a random number of random actions from the same range "
+        "(with batched sampling natively vectorized envs and --env_subprocesses step one burst per split), cut short "
+        "once the first episode ends (only the phase within the episode matters). Bursts of different envs run concurrently with --env_creation_threads. "
+        "See decorrelation_phase_std_per_sec stats for the episode phase dispersion achieved per second spent.",
+    )
 
     # performance optimizations
     p.add_argument(
@@ -443,6 +698,37 @@ def add_rl_args(p: ArgumentParser):
         type=int,
         help="How often in seconds the runner checks for heartbeats",
     )
+    p.add_argument(
+        "--straggler_factor",
+        default=3.0,
+        type=float,
+        help="An env (a rollout worker) is a straggler when its step latency exceeds this many times the median latency "
+        "of the envs of the same worker (of all workers). The runner logs a straggler report and adds it to the stats "
+        "(straggler_workers, slow_envs, env_restarts, worker_step_latency_ms).",
+    )
+    p.add_argument(
+        "--straggler_report_interval",
+        default=15.0,
+        type=float,
+        help="How often in seconds the runner compares the step latencies of the rollout workers. Rollout workers "
+        "report their latencies three times per interval.",
+    )
+    p.add_argument(
+        "--env_step_timeout",
+        default=0.0,
+        type=float,
+        help="Non-batched sampling only. Replace an env with a new instance when a single step takes longer than this "
+        "many seconds (e.g. a stuck simulator). The step can't be interrupted, the env is restarted after it returns "
+        "and its episode is truncated. 0 (default) disables restarts. Envs that hang forever are detected by heartbeats.",
+    )
+    p.add_argument(
+        "--exclude_straggler_workers",
+        default=False,
+        type=str2bool,
+        help="Sync mode (--async_rl=False) only. Rollouts of straggling workers are redistributed among the other "
+        "workers in the next training iteration, so the iteration does not wait for the slowest worker. Workers are "
+        "re-admitted once they are no longer measured to be slow. Single policy only.",
+    )
 
     # experiment termination
     p.add_argument(
@@ -551,6 +837,15 @@ def add_model_args(p: ArgumentParser):
         help="Optional decoder MLP layers after the policy core. If empty (default) decoder is identity function.",
     )
 
+    p.add_argument(
+        "--jit_script_modules",
+        default=True,
+        type=str2bool,
+        help="Compile the encoder/decoder MLPs, the convolutional encoder and the returns normalizer with "
+        "torch.jit.script. Copies of the policy that need plain PyTorch modules (the quantized inference copy, "
+        "the population inference template) are always built without scripting. Custom models should use "
+        "model_utils.script_module() to respect this setting.",
+    )
     p.add_argument(
         "--nonlinearity", default="elu", choices=["elu", "relu", "tanh"], type=str, help="Type of nonlinearity to use."
     )
@@ -627,6 +922,18 @@ def add_default_env_args(p: ArgumentParser):
     p.add_argument(
         "--env_framestack", default=1, type=int, help="Frame stacking (only used in Atari, and it is usually set to 4)"
     )  # <-- this probably should be moved to environment-specific scripts
+    p.add_argument(
+        "--dedup_framestack",
+        default=False,
+        type=str2bool,
+        help="Store each frame of frame-stacked observations (--env_framestack > 1) only once in the trajectory "
+        "buffers and training batches instead of storing the full stack for every step. Full stacks are "
+        "reconstructed on the inference worker and on the learner. Cuts the memory used by the observations "
+        "roughly by a factor of env_framestack. With --lazy_obs_normalization the learner gathers the stacks "
+        "for one minibatch at a time, otherwise it rebuilds full stacks for the entire training batch before "
+        "converting it to float, so the learner memory is only reduced with lazy normalization. Requires the stack to be the first axis of the main observation "
+        "and the env to fill the stack with the first frame of an episode on reset (as gymnasium FrameStack does)",
+    )
     p.add_argument(
         "--pixel_format", default="CHW", type=str, help="PyTorch expects CHW by default, Ray & TensorFlow expect HWC"
     )
@@ -133,6 +133,26 @@ def set_training_info(training_info_interface: Optional[TrainingInfoInterface],
         training_info_interface.set_training_info(training_info)
 
 
+class ObsOutputInterface:
+    """
+    Vectorized envs that implement this interface can write observations straight into the caller's buffers
+    (i.e. the shared trajectory buffers) instead of their own storage, saving a copy per step.
+    """
+
+    def set_obs_output(self, obs_output: Optional[Dict[str, Any]]) -> None:
+        """
+        :param obs_output: dict of tensors of shape [num_agents, *obs_shape], destination for the observations
+        returned by the next step() call only. Observations with keys not in obs_output are stored as usual.
+        None means the env should use its own storage.
+        """
+        raise NotImplementedError
+
+
+def find_obs_output_interface(env) -> Optional[ObsOutputInterface]:
+    """Unwrap the env until we find the wrapper that implements ObsOutputInterface."""
+    return find_wrapper_interface(env, ObsOutputInterface)
+
+
 def num_env_steps(infos):
     """Calculate number of environment frames in a batch of experience."""
 
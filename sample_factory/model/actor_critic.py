@@ -14,7 +14,7 @@ from sample_factory.model.action_parameterization import (
     ActionParameterizationContinuousNonAdaptiveStddev,
     ActionParameterizationDefault,
 )
-from sample_factory.model.model_utils import model_device
+from sample_factory.model.model_utils import model_device, script_module
 from sample_factory.utils.normalize import ObservationNormalizer
 from sample_factory.utils.typing import ActionSpace, Config, ObsSpace
 
@@ -35,7 +35,7 @@ class ActorCritic(nn.Module, Configurable):
             returns_shape = (1,)  # it's actually a single scalar but we use 1D shape for the normalizer
             self.returns_normalizer = RunningMeanStdInPlace(returns_shape)
             # comment this out for debugging (i.e. to be able to step through normalizer code)
-            self.returns_normalizer = torch.jit.script(self.returns_normalizer)
+            self.returns_normalizer = script_module(cfg, self.returns_normalizer)
 
         self.last_action_distribution = None  # to be populated after each forward step
 
@@ -94,8 +94,8 @@ class ActorCritic(nn.Module, Configurable):
             # do nothing
             pass
 
-    def normalize_obs(self, obs: Dict[str, Tensor]) -> Dict[str, Tensor]:
-        return self.obs_normalizer(obs)
+    def normalize_obs(self, obs: Dict[str, Tensor], update_stats: bool = True) -> Dict[str, Tensor]:
+        return self.obs_normalizer(obs, update_stats)
 
     def summaries(self) -> Dict:
         # Can add more summaries here, like weights statistics
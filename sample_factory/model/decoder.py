@@ -4,7 +4,7 @@ from typing import List
 import torch
 
 from sample_factory.algo.utils.torch_utils import calc_num_elements
-from sample_factory.model.model_utils import ModelModule, create_mlp, nonlinearity
+from sample_factory.model.model_utils import ModelModule, create_mlp, nonlinearity, script_module
 from sample_factory.utils.typing import Config
 
 
@@ -20,7 +20,7 @@ class MlpDecoder(Decoder):
         activation = nonlinearity(cfg)
         self.mlp = create_mlp(decoder_layers, decoder_input_size, activation)
         if len(decoder_layers) > 0:
-            self.mlp = torch.jit.script(self.mlp)
+            self.mlp = script_module(cfg, self.mlp)
 
         self.decoder_out_size = calc_num_elements(self.mlp, (decoder_input_size,))
 
@@ -5,7 +5,7 @@ from gymnasium import spaces
 from torch import Tensor, nn
 
 from sample_factory.algo.utils.torch_utils import calc_num_elements
-from sample_factory.model.model_utils import ModelModule, create_mlp, model_device, nonlinearity
+from sample_factory.model.model_utils import ModelModule, create_mlp, model_device, nonlinearity, script_module
 from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.typing import Config, ObsSpace
 from sample_factory.utils.utils import log
@@ -76,7 +76,7 @@ class MlpEncoder(Encoder):
         mlp_layers: List[int] = cfg.encoder_mlp_layers
         self.mlp_head = create_mlp(mlp_layers, obs_space.shape[0], nonlinearity(cfg))
         if len(mlp_layers) > 0:
-            self.mlp_head = torch.jit.script(self.mlp_head)
+            self.mlp_head = script_module(cfg, self.mlp_head)
         self.encoder_out_size = calc_num_elements(self.mlp_head, obs_space.shape)
 
     def forward(self, obs: Tensor):
@@ -138,7 +138,7 @@ class ConvEncoder(Encoder):
         activation = nonlinearity(self.cfg)
         extra_mlp_layers: List[int] = cfg.encoder_conv_mlp_layers
         enc = ConvEncoderImpl(obs_space.shape, conv_filters, extra_mlp_layers, activation)
-        self.enc = torch.jit.script(enc)
+        self.enc = script_module(cfg, enc)
 
         self.encoder_out_size = calc_num_elements(self.enc, obs_space.shape)
         log.debug(f"Conv encoder output size: {self.encoder_out_size}")
@@ -207,7 +207,7 @@ class ResnetEncoder(Encoder):
 
         self.mlp_layers = create_mlp(cfg.encoder_conv_mlp_layers, self.conv_head_out_size, activation)
 
-        # should we do torch.jit here?
+        # not scripted, on the inference path the whole model is traced with --inference_graph=trace
 
         self.encoder_out_size = calc_num_elements(self.mlp_layers, (self.conv_head_out_size,))
 
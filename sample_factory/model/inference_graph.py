@@ -0,0 +1,112 @@
+"""
+Traced inference graph of the whole sampling path of the policy (see --inference_graph).
+
+Observation normalization, encoder, core, action distribution parameters and sampling are traced into a single
+TorchScript graph, which removes the Python overhead of the module hierarchy and TensorDict construction per batch.
+The traced graph references the parameters and buffers of the model it was traced from. In-place weight
+updates (load_state_dict(), shared weight slots, normalizer snapshots) are thus visible without retracing.
+The graph is only rebuilt when the model object itself changes (i.e. a new quantized copy of the policy).
+
+Models that can't be traced (i.e. data-dependent control flow in custom models) fall back to eager execution.
+"""
+
+from __future__ import annotations
+
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor, nn
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.algo.utils.tensor_dict import TensorDict
+from sample_factory.model.actor_critic import ActorCritic
+from sample_factory.utils.utils import log
+
+# outputs that depend on the sampled actions, we can't compare them between the traced and the eager model
+SAMPLED_OUTPUTS = ("actions", "log_prob_actions")
+
+
+class SamplingForward(nn.Module):
+    """Normalize observations -> encoder -> core -> action distribution -> sample, with flat inputs and outputs."""
+
+    def __init__(self, actor_critic: ActorCritic, output_names: List[str]):
+        super().__init__()
+        self.actor_critic = actor_critic
+        self.output_names = output_names
+
+    def forward(self, obs: Dict[str, Tensor], rnn_states: Tensor) -> Tuple[Tensor, ...]:
+        normalized_obs = prepare_and_normalize_obs(self.actor_critic, dict(obs))
+        result = self.actor_critic(normalized_obs, rnn_states)
+        return tuple(result[name] for name in self.output_names)
+
+
+class InferenceGraph:
+    def __init__(self, validation_atol: float = 1e-4):
+        self.validation_atol = validation_atol
+
+        self.source: Optional[ActorCritic] = None
+        self.traced: Optional[torch.jit.ScriptModule] = None
+        self.output_names: List[str] = []
+        self.eager_fallback = False
+
+    def _eager_forward(self, model: ActorCritic, obs: Dict[str, Tensor], rnn_states: Tensor) -> TensorDict:
+        return model(prepare_and_normalize_obs(model, dict(obs)), rnn_states)
+
+    def _validate(self, model: ActorCritic, obs: Dict[str, Tensor], rnn_states: Tensor) -> Optional[str]:
+        """Check the traced graph against the eager model."""
+        expected = self._eager_forward(model, obs, rnn_states)
+        outputs = dict(zip(self.output_names, self.traced(obs, rnn_states)))
+        for name in self.output_names:
+            if outputs[name].shape != expected[name].shape:
+                return f"{name} shape {tuple(outputs[name].shape)} != {tuple(expected[name].shape)}"
+            if name in SAMPLED_OUTPUTS:
+                continue
+            if not torch.allclose(outputs[name].float(), expected[name].float(), atol=self.validation_atol):
+                return f"{name} differs from the eager model"
+        return None
+
+    def _build(self, model: ActorCritic, obs: Dict[str, Tensor], rnn_states: Tensor) -> None:
+        self.source, self.traced = model, None
+
+        # trace and validate on batches of different sizes (>= 2), so batch size can't be baked into the graph
+        # (with a single sample some models squeeze the batch dimension)
+        def repeated(n: int):
+            return {k: torch.cat([x] * n) for k, x in obs.items()}, torch.cat([rnn_states] * n)
+
+        trace_inputs = repeated(2)
+        validation_inputs = repeated(1 if rnn_states.shape[0] > 1 else 3)
+
+        try:
+            self.output_names = list(self._eager_forward(model, *trace_inputs).keys())
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                # outputs are random (sampled actions), the builtin check_trace would always fail
+                self.traced = torch.jit.trace(
+                    SamplingForward(model, self.output_names), trace_inputs, check_trace=False, strict=False
+                )
+            error = self._validate(model, *validation_inputs)
+        except Exception as exc:
+            error = repr(exc)
+
+        if error is not None:
+            log.warning(f"Could not trace the inference graph of {type(model).__name__}, using eager model: {error}")
+            self.traced = None
+            self.eager_fallback = True
+        else:
+            log.debug(f"Traced inference graph of {type(model).__name__} with outputs {self.output_names}")
+
+    def __call__(self, model: ActorCritic, obs: Dict[str, Tensor], rnn_states: Tensor) -> TensorDict:
+        """
+        Same as model(prepare_and_normalize_obs(model, obs), rnn_states).
+        :param obs: observations on the model device
+        """
+        if self.eager_fallback:
+            return self._eager_forward(model, obs, rnn_states)
+
+        if model is not self.source:
+            self._build(model, obs, rnn_states)
+            if self.eager_fallback:
+                return self._eager_forward(model, obs, rnn_states)
+
+        return TensorDict(zip(self.output_names, self.traced(obs, rnn_states)))
@@ -56,6 +56,13 @@ def create_mlp(layer_sizes: List[int], input_size: int, activation: nn.Module) -
         return nn.Identity()
 
 
+def script_module(cfg: Config, module: nn.Module) -> nn.Module:
+    """Compile the module with torch.jit.script, unless disabled with --jit_script_modules."""
+    if not cfg.jit_script_modules:
+        return module
+    return torch.jit.script(module)
+
+
 class ModelModule(nn.Module, Configurable):
     def __init__(self, cfg: Config):
         nn.Module.__init__(self)
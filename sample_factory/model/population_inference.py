@@ -0,0 +1,191 @@
+"""
+Vectorized inference of a population of same-architecture policies (see --population_inference).
+
+Parameters of all policies served by the inference worker are stacked along a new policy axis and the requests
+of all policies are evaluated with a single torch.func.vmap() of the functional model. For many small policies
+(i.e. MLPs of a PBT population on CPU) this turns many tiny matmuls into a few large batched ones.
+Requests are padded to the largest per-policy batch, padded rows are dropped from the outputs.
+
+Observations are normalized by the policies themselves before the vectorized forward pass (every policy keeps its
+own normalizer statistics), actions are sampled from the concatenated action distribution parameters of all policies.
+Models that vmap does not support (i.e. GRU/LSTM cores) fall back to one forward pass per policy.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor, nn
+from torch.func import functional_call, vmap
+
+from sample_factory.algo.utils.action_distributions import get_action_distribution, sample_actions_log_probs
+from sample_factory.algo.utils.tensor_dict import TensorDict
+from sample_factory.model.actor_critic import ActorCritic, create_actor_critic
+from sample_factory.model.quantization import eager_model_cfg
+from sample_factory.utils.typing import ActionSpace, Config, ObsSpace, PolicyID
+from sample_factory.utils.utils import log
+
+# every policy keeps its own normalizer statistics, observations are normalized before the vectorized forward pass
+NORMALIZER_PREFIXES = ("obs_normalizer.", "returns_normalizer.")
+
+# (policy_id, model, normalized observations, rnn states) of the requests of one policy
+PolicySegment = Tuple[PolicyID, ActorCritic, Dict[str, Tensor], Tensor]
+
+
+class DistributionParamsForward(nn.Module):
+    """Encoder -> core -> values and action distribution parameters, without sampling."""
+
+    def __init__(self, actor_critic: ActorCritic):
+        super().__init__()
+        self.actor_critic = actor_critic
+
+    def forward(self, normalized_obs: Dict[str, Tensor], rnn_states: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+        x = self.actor_critic.forward_head(normalized_obs)
+        x, new_rnn_states = self.actor_critic.forward_core(x, rnn_states)
+        result = self.actor_critic.forward_tail(x, values_only=False, sample_actions=False)
+        return result["values"], result["action_logits"], new_rnn_states
+
+
+def _pad_rows(x: Tensor, num_rows: int) -> Tensor:
+    if x.shape[0] == num_rows:
+        return x
+    return torch.cat([x, x.new_zeros(num_rows - x.shape[0], *x.shape[1:])])
+
+
+class PopulationInference:
+    def __init__(
+        self,
+        cfg: Config,
+        obs_space: ObsSpace,
+        action_space: ActionSpace,
+        device: torch.device,
+        validation_atol: float = 1e-4,
+    ):
+        self.action_space = action_space
+        self.validation_atol = validation_atol
+
+        # holds the architecture, functional_call() replaces its weights with the stacked weights of the population
+        template = create_actor_critic(eager_model_cfg(cfg), obs_space, action_space)
+        template.model_to_device(device)
+        template.eval()
+        for p in template.parameters():
+            p.requires_grad = False
+        self.forward_module = DistributionParamsForward(template)
+
+        self.weight_names: List[str] = [
+            name for name in template.state_dict().keys() if not name.startswith(NORMALIZER_PREFIXES)
+        ]
+
+        self.policy_ids: List[PolicyID] = []
+        self.sources: Dict[PolicyID, ActorCritic] = dict()
+        self.policy_versions: Dict[PolicyID, int] = dict()
+        self.stacked: Optional[Dict[str, Tensor]] = None
+
+        self.validated = False
+        self.eager_fallback = False
+
+    def _source_weights(self, model: ActorCritic) -> Dict[str, Tensor]:
+        state_dict = model.state_dict()
+        return {name: state_dict[name] for name in self.weight_names}
+
+    def update_weights(self, models: Dict[PolicyID, ActorCritic], policy_versions: Dict[PolicyID, int]) -> None:
+        """Copy the weights of the policies that were updated since the last call into the stacked weights."""
+        if self.stacked is None or any(self.sources.get(p) is not m for p, m in models.items()):
+            self.policy_ids = sorted(models.keys())
+            self.sources = dict(models)
+            source_weights = [self._source_weights(models[p]) for p in self.policy_ids]
+            self.stacked = {
+                f"actor_critic.{name}": torch.stack([w[name] for w in source_weights]) for name in self.weight_names
+            }
+            self.policy_versions = dict(policy_versions)
+            return
+
+        for policy_idx, policy_id in enumerate(self.policy_ids):
+            if self.policy_versions[policy_id] == policy_versions[policy_id]:
+                continue
+            for name, w in self._source_weights(models[policy_id]).items():
+                self.stacked[f"actor_critic.{name}"][policy_idx].copy_(w)
+            self.policy_versions[policy_id] = policy_versions[policy_id]
+
+    def _vectorized_forward(self, segments: List[PolicySegment]) -> List[TensorDict]:
+        sizes = [rnn_states.shape[0] for _, _, _, rnn_states in segments]
+        max_size = max(sizes)
+
+        policy_indices = [self.policy_ids.index(policy_id) for policy_id, _, _, _ in segments]
+        if policy_indices == list(range(len(self.policy_ids))):
+            weights = self.stacked
+        else:
+            # only some of the policies have requests
+            idx = torch.tensor(policy_indices, device=next(iter(self.stacked.values())).device)
+            weights = {name: w.index_select(0, idx) for name, w in self.stacked.items()}
+
+        obs = {
+            key: torch.stack([_pad_rows(normalized_obs[key], max_size) for _, _, normalized_obs, _ in segments])
+            for key in segments[0][2].keys()
+        }
+        rnn_states = torch.stack([_pad_rows(rnn_states, max_size) for _, _, _, rnn_states in segments])
+
+        def policy_forward(policy_weights, policy_obs, policy_rnn_states):
+            return functional_call(self.forward_module, policy_weights, (policy_obs, policy_rnn_states))
+
+        values, action_logits, new_rnn_states = vmap(policy_forward)(weights, obs, rnn_states)
+        values = values.reshape(len(segments), max_size)
+
+        # drop the padding, sample actions of all policies at once
+        action_logits = torch.cat([action_logits[i, :n] for i, n in enumerate(sizes)])
+        action_distribution = get_action_distribution(self.action_space, raw_logits=action_logits)
+        actions, log_prob_actions = sample_actions_log_probs(action_distribution)
+        actions = actions.squeeze(dim=1)
+
+        outputs = []
+        ofs = 0
+        for i, n in enumerate(sizes):
+            outputs.append(
+                TensorDict(
+                    values=values[i, :n],
+                    action_logits=action_logits[ofs : ofs + n],
+                    log_prob_actions=log_prob_actions[ofs : ofs + n],
+                    actions=actions[ofs : ofs + n],
+                    new_rnn_states=new_rnn_states[i, :n],
+                )
+            )
+            ofs += n
+        return outputs
+
+    def _validate(self, segments: List[PolicySegment], outputs: List[TensorDict]) -> Optional[str]:
+        """Check the vectorized forward pass against the policies themselves."""
+        for (policy_id, model, normalized_obs, rnn_states), result in zip(segments, outputs):
+            expected = model(normalized_obs, rnn_states)
+            for name in ("values", "action_logits", "new_rnn_states"):
+                x, y = result[name].float(), expected[name].float().reshape(result[name].shape)
+                if not torch.allclose(x, y, atol=self.validation_atol):
+                    return f"{name} of policy {policy_id} differs from the policy model"
+        return None
+
+    def __call__(self, segments: List[PolicySegment], policy_versions: Dict[PolicyID, int]) -> List[TensorDict]:
+        """
+        Same as [model(normalized_obs, rnn_states) for _, model, normalized_obs, rnn_states in segments].
+        :param policy_versions: weights of the policies are copied from their models when the version changes
+        """
+        if self.eager_fallback:
+            return [model(normalized_obs, rnn_states) for _, model, normalized_obs, rnn_states in segments]
+
+        try:
+            models = {policy_id: model for policy_id, model, _, _ in segments}
+            self.update_weights({**self.sources, **models}, {**self.policy_versions, **policy_versions})
+            outputs = self._vectorized_forward(segments)
+            error = None if self.validated else self._validate(segments, outputs)
+        except Exception as exc:
+            if self.validated:
+                raise
+            error = repr(exc)
+
+        if error is not None:
+            log.warning(f"Could not vectorize inference of the population, running one policy at a time: {error}")
+            self.eager_fallback = True
+            self.stacked = None
+            return self(segments, policy_versions)
+
+        self.validated = True
+        return outputs
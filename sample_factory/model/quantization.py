@@ -0,0 +1,123 @@
+"""
+Dynamically quantized copy of the policy for CPU inference (see --inference_quantization).
+
+Linear and recurrent layers of the quantized copy use int8 weights, activations are quantized on the fly.
+The learner and the fp32 copy of the inference worker are unchanged: the quantized copy is rebuilt from the fp32
+weights after the weight updates, but not more often than once per --requantize_interval seconds.
+"""
+
+from __future__ import annotations
+
+import copy
+import time
+from typing import Dict, Optional
+
+import torch
+from torch import Tensor, nn
+
+from sample_factory.algo.utils.action_distributions import argmax_actions
+from sample_factory.model.actor_critic import ActorCritic, create_actor_critic
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import ActionSpace, Config, ObsSpace
+from sample_factory.utils.utils import log
+
+QUANTIZED_LAYER_TYPES = {nn.Linear, nn.GRU, nn.LSTM}
+
+
+def eager_model_cfg(cfg: Config) -> Config:
+    """
+    Parts of the model are compiled with torch.jit.script which hides their layers from quantize_dynamic().
+    :return: copy of cfg that builds the same model with eager modules instead (see --jit_script_modules)
+    """
+    eager_cfg = copy.copy(cfg)
+    eager_cfg.jit_script_modules = False
+    return eager_cfg
+
+
+def quantize_actor_critic(model: ActorCritic) -> ActorCritic:
+    """:return: a copy of the model with int8 Linear/GRU/LSTM layers, the model itself is unchanged."""
+    quantized = torch.ao.quantization.quantize_dynamic(model, QUANTIZED_LAYER_TYPES, dtype=torch.qint8)
+    quantized.eval()
+    return quantized
+
+
+class QuantizedPolicy:
+    """Rate-limited quantization of the latest weights of the fp32 policy."""
+
+    def __init__(self, cfg: Config, obs_space: ObsSpace, action_space: ActionSpace):
+        self.requantize_interval = cfg.requantize_interval
+
+        # we only use this to hold the fp32 weights in a quantizable (not scripted) module
+        self.eager_model = create_actor_critic(eager_model_cfg(cfg), obs_space, action_space)
+        self.eager_model.eval()
+        for p in self.eager_model.parameters():
+            p.requires_grad = False
+
+        self.model: Optional[ActorCritic] = None
+        self.policy_version = -1
+        self.last_quantization = 0.0
+
+    def maybe_requantize(self, source: ActorCritic, policy_version: int, timing: Timing) -> bool:
+        """
+        :param source: fp32 model with the latest weights
+        :return: True if the quantized copy was rebuilt
+        """
+        if self.model is not None:
+            if policy_version <= self.policy_version:
+                return False
+            if time.time() - self.last_quantization < self.requantize_interval:
+                return False
+
+        with timing.time_avg("requantize"):
+            self.eager_model.load_state_dict(source.state_dict())
+            self.model = quantize_actor_critic(self.eager_model)
+            # normalizer statistics change much more often than the weights, share them with the fp32 model
+            # instead of quantizing a snapshot (they are also updated separately with --lock_free_obs_normalizer)
+            self.model.obs_normalizer = source.obs_normalizer
+
+        self.policy_version = policy_version
+        self.last_quantization = time.time()
+        return True
+
+
+def make_quantized_policy(cfg: Config, obs_space: ObsSpace, action_space: ActionSpace) -> Optional[QuantizedPolicy]:
+    if cfg.inference_quantization == "none":
+        return None
+    log.debug(f"Using {cfg.inference_quantization} quantized copy of the policy for inference")
+    return QuantizedPolicy(cfg, obs_space, action_space)
+
+
+@torch.no_grad()
+def action_distribution_divergence(
+    reference: ActorCritic, candidate: ActorCritic, normalized_obs: Dict[str, Tensor], rnn_states: Tensor
+) -> Dict[str, float]:
+    """
+    Compare action distributions of two policies (i.e. fp32 and quantized) on the same batch.
+    :return: mean and max KL(reference || candidate), fraction of samples where the greedy actions agree and
+    max absolute errors of the action distribution parameters and the values
+    """
+    reference.eval()
+    candidate.eval()
+
+    ref_result = reference(normalized_obs, rnn_states)
+    ref_distribution = reference.action_distribution()
+    result = candidate(normalized_obs, rnn_states)
+    distribution = candidate.action_distribution()
+
+    kl = ref_distribution.kl_divergence(distribution)
+    ref_actions, actions = argmax_actions(ref_distribution), argmax_actions(distribution)
+    if ref_actions.dtype.is_floating_point:
+        # continuous actions, compare the means
+        action_agreement = torch.isclose(ref_actions, actions, rtol=1e-2, atol=1e-2)
+    else:
+        action_agreement = ref_actions == actions
+    if action_agreement.dim() > 1:
+        action_agreement = action_agreement.all(dim=-1)
+
+    return dict(
+        kl_mean=kl.mean().item(),
+        kl_max=kl.max().item(),
+        greedy_action_agreement=action_agreement.float().mean().item(),
+        action_logits_max_err=(ref_result["action_logits"] - result["action_logits"]).abs().max().item(),
+        values_max_err=(ref_result["values"] - result["values"]).abs().max().item(),
+    )
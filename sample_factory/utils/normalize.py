@@ -6,6 +6,8 @@ in RunningMeanStd is saved/loaded to/from checkpoints via normal mechanisms.
 
 We do this normalization step as preprocessing before inference or learning. It is important to do it only once
 before each learning iteration (not before each epoch or minibatch), since this is just redundant work.
+With --lazy_obs_normalization the learner only updates the statistics once per iteration and normalizes
+each minibatch right before the forward pass, so the full batch of observations stays in its original dtype.
 
 If no data normalization is needed we just keep the original data.
 Otherwise, we create a copy of data and do all of the operations operations in-place.
@@ -48,7 +50,15 @@ class ObservationNormalizer(nn.Module):
 
         return obs_clone
 
-    def forward(self, obs_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    def _sub_mean_and_scale(self, obs: torch.Tensor) -> None:
+        """In-place. Subtraction of mean and scaling is only applied to default "obs"."""
+        if self.should_sub_mean:
+            obs.sub_(self.sub_mean)
+
+        if self.should_scale:
+            obs.mul_(1.0 / self.scale)
+
+    def forward(self, obs_dict: Dict[str, torch.Tensor], update_stats: bool = True) -> Dict[str, torch.Tensor]:
         if not self.should_normalize:
             return obs_dict
 
@@ -56,19 +66,27 @@ class ObservationNormalizer(nn.Module):
             # since we are creating a clone, it is safe to use in-place operations
             obs_clone = self._clone_tensordict(obs_dict)
 
-            # subtraction of mean and scaling is only applied to default "obs"
             # this should be modified for custom obs dicts
-            if self.should_sub_mean:
-                obs_clone["obs"].sub_(self.sub_mean)
-
-            if self.should_scale:
-                obs_clone["obs"].mul_(1.0 / self.scale)
+            self._sub_mean_and_scale(obs_clone["obs"])
 
             if self.running_mean_std:
-                self.running_mean_std(obs_clone)  # in-place normalization
+                self.running_mean_std(obs_clone, update_stats)  # in-place normalization
 
         return obs_clone
 
+    def update_running_stats(self, obs_dict: Dict[str, torch.Tensor], chunk_size: int) -> None:
+        """
+        Update running mean/std statistics exactly like forward() would in training mode, without producing
+        normalized observations. Observations are converted to float in chunks of `chunk_size` samples.
+        """
+        if not self.running_mean_std or not self.training:
+            return
+
+        with torch.no_grad():
+            for k, rms in self.running_mean_std.running_mean_std.items():
+                preprocess = self._sub_mean_and_scale if k == "obs" else None
+                rms.update_stats_in_chunks(obs_dict[k], chunk_size, preprocess)
+
     def summaries(self) -> Dict:
         res = dict()
         if self.running_mean_std:
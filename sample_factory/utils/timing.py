@@ -107,6 +107,14 @@ class Timing(AttrDict):
     def time_avg(self, key, average=10):
         return self._init_context(key, average=average)
 
+    def record(self, key: str, value: float, average: Optional[int] = None) -> None:
+        """
+        Add a measurement that was taken outside of a timing context (i.e. in a different thread) as a child
+        of the currently open context. Additive by default, averaged if `average` is provided.
+        """
+        ctx = self._init_context(key, additive=average is None, average=average)
+        ctx._record_measurement(key, value)
+
     @staticmethod
     def _time_str(value):
         return f"{value:.4f}" if isinstance(value, float) else str(value)
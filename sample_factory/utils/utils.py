@@ -6,6 +6,7 @@ import logging
 import operator
 import os
 import pwd
+import resource
 import tempfile
 import time
 from os.path import join
@@ -257,6 +258,13 @@ def memory_consumption_mb():
     return process.memory_info().rss / (1024 * 1024)
 
 
+def peak_memory_consumption_mb():
+    """Peak resident memory of the current process since it started."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss / (1024 * 1024) if platform == "darwin" else max_rss / 1024
+
+
 def kill(proc_pid):
     process = psutil.Process(proc_pid)
     for proc in process.children(recursive=True):
@@ -412,6 +420,10 @@ def summaries_dir(experiment_dir_, mkdir=True) -> str:
     return maybe_ensure_dir_exists(join(experiment_dir_, ".summary"), mkdir)
 
 
+def startup_timelines_dir(experiment_dir_, mkdir=True) -> str:
+    return maybe_ensure_dir_exists(join(experiment_dir_, "startup"), mkdir)
+
+
 def cfg_file(cfg: Config) -> str:
     return join(experiment_dir(cfg=cfg), "config.json")
 
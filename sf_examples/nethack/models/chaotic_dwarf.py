@@ -31,6 +31,7 @@ from torch.nn import functional as F
 
 from sample_factory.algo.utils.torch_utils import calc_num_elements
 from sample_factory.model.encoder import Encoder
+from sample_factory.model.model_utils import script_module
 from sample_factory.utils.typing import Config, ObsSpace
 
 
@@ -248,18 +249,18 @@ class ChaoticDwarvenGPT5(Encoder):
             screen_shape = (24 * pixel_size, 80 * pixel_size)
         else:
             screen_shape = (cfg.crop_dim * pixel_size, cfg.crop_dim * pixel_size)
-        self.screen_encoder = torch.jit.script(ScreenEncoder(screen_shape))
+        self.screen_encoder = script_module(cfg, ScreenEncoder(screen_shape))
         screen_shape = obs_space["screen_image"].shape
 
         # top and bottom encoders
         if self.use_tty_only:
             self.topline_encoder = TopLineEncoder()
-            self.bottomline_encoder = torch.jit.script(BottomLinesEncoder())
+            self.bottomline_encoder = script_module(cfg, BottomLinesEncoder())
             topline_shape = (obs_space["tty_chars"].shape[1],)
             bottomline_shape = (2 * obs_space["tty_chars"].shape[1],)
         else:
-            self.topline_encoder = torch.jit.script(MessageEncoder())
-            self.bottomline_encoder = torch.jit.script(BLStatsEncoder())
+            self.topline_encoder = script_module(cfg, MessageEncoder())
+            self.bottomline_encoder = script_module(cfg, BLStatsEncoder())
             topline_shape = obs_space["message"].shape
             bottomline_shape = obs_space["blstats"].shape
 
@@ -0,0 +1,124 @@
+from queue import Empty
+from typing import List, Tuple
+
+import pytest
+from signal_slot.signal_slot import EventLoop
+
+from sample_factory.algo.learning.batcher import Batcher
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.utils.typing import Config
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+def _zero_copy_test_cfg(batched_sampling: bool, async_rl: bool = True, zero_copy: bool = True) -> Config:
+    cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_env_v1", "--experiment=test_batcher"])
+    cfg.num_workers = 1
+    cfg.num_envs_per_worker = 2
+    cfg.worker_num_splits = 1
+    cfg.rollout = 8
+    cfg.batch_size = 32  # 4 trajectories per training batch
+    cfg.num_batches_to_accumulate = 2
+    cfg.batched_sampling = batched_sampling
+    cfg.async_rl = async_rl
+    cfg.serial_mode = True
+    cfg.device = "cpu"
+    cfg.zero_copy_training_batches = zero_copy
+    return cfg
+
+
+def _make_batcher(cfg: Config) -> Tuple[Batcher, BufferMgr]:
+    register_custom_components()
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+    tmp_env.close()
+
+    buffer_mgr = BufferMgr(cfg, env_info)
+    batcher = Batcher(EventLoop("test_batcher_evt_loop"), 0, buffer_mgr, cfg, env_info)
+    batcher.init()
+
+    # pretend that all trajectory buffers were taken by the rollout workers
+    _released(buffer_mgr)
+    return batcher, buffer_mgr
+
+
+def _released(buffer_mgr: BufferMgr) -> List:
+    """Trajectory buffers that the batcher handed back to sampling so far."""
+    released = []
+    while True:
+        try:
+            released.extend(buffer_mgr.traj_buffer_queues["cpu"].get_many(block=False, max_messages_to_get=1000))
+        except Empty:
+            return released
+
+
+def _send_trajectories(batcher: Batcher, cfg: Config, indices: List[int]) -> None:
+    if cfg.batched_sampling:
+        # batched rollout workers send slices of the size of the whole vector of envs
+        step = cfg.num_envs_per_worker
+        trajectories = [dict(policy_id=0, traj_buffer_idx=slice(i, i + step)) for i in indices[::step]]
+    else:
+        trajectories = [dict(policy_id=0, traj_buffer_idx=i) for i in indices]
+    batcher.on_new_trajectories(trajectories, "cpu")
+
+
+def _as_indices(released: List) -> List[int]:
+    indices = []
+    for r in released:
+        indices.extend(range(r.start, r.stop) if isinstance(r, slice) else [r])
+    return sorted(indices)
+
+
+class TestZeroCopyBatches:
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    def test_contiguous_trajectories(self, batched_sampling: bool):
+        cfg = _zero_copy_test_cfg(batched_sampling)
+        batcher, buffer_mgr = _make_batcher(cfg)
+
+        _send_trajectories(batcher, cfg, [4, 5, 6, 7])
+        assert batcher.zero_copy[0]
+        assert batcher.zero_copy_fraction() == 1.0
+
+        # the learner trains on a view of the trajectory buffers
+        traj_tensors = buffer_mgr.traj_tensors_torch["cpu"]
+        batch = batcher.training_batches[0]
+        assert batch["rewards"].data_ptr() == traj_tensors["rewards"][4].data_ptr()
+        assert batch["obs"]["obs"].data_ptr() == traj_tensors["obs"]["obs"][4].data_ptr()
+
+        # the trajectories are not reused for sampling until the learner is done with them
+        assert _released(buffer_mgr) == []
+        batcher.on_training_batch_released(0, 1)
+        assert _as_indices(_released(buffer_mgr)) == [4, 5, 6, 7]
+        assert not batcher.zero_copy[0]
+
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    def test_copy_fallback(self, batched_sampling: bool):
+        cfg = _zero_copy_test_cfg(batched_sampling)
+        batcher, buffer_mgr = _make_batcher(cfg)
+
+        # there is no contiguous slice that covers the entire batch
+        _send_trajectories(batcher, cfg, [0, 1, 6, 7])
+        assert not batcher.zero_copy[0]
+        assert batcher.zero_copy_fraction() == 0.0
+        assert batcher.training_batches[0] is batcher.batch_buffers[0]
+
+        # data is copied, so in async mode the trajectories can be reused right away
+        assert _as_indices(_released(buffer_mgr)) == [0, 1, 6, 7]
+
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    @pytest.mark.parametrize("async_rl", [False, True])
+    def test_buffer_reservation(self, batched_sampling: bool, async_rl: bool):
+        buffers = dict()
+        for zero_copy in [False, True]:
+            cfg = _zero_copy_test_cfg(batched_sampling, async_rl, zero_copy)
+            _, buffer_mgr = _make_batcher(cfg)
+            buffers[zero_copy] = buffer_mgr.buffers_per_device["cpu"]
+
+        if async_rl:
+            # all accumulated batches can be held by the learner while the samplers keep going
+            traj_per_batch = buffer_mgr.trajectories_per_training_iteration
+            assert buffers[True] - buffers[False] == cfg.num_batches_to_accumulate * traj_per_batch
+        else:
+            # in sync mode trajectories are held until training is done anyway
+            assert buffers[True] == buffers[False]
@@ -0,0 +1,106 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+
+from sample_factory.algo.sampling.batched_sampling import BatchedVectorEnvRunner
+from sample_factory.algo.sampling.decorrelation import (
+    max_decorrelation_steps,
+    phase_dispersion_stats,
+    sample_flat_action,
+    step_random_actions,
+)
+from sample_factory.algo.sampling.env_startup import ENV_DECORRELATE
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args
+
+
+def _fixed_length_episodes(episode_len: int):
+    t = 0
+
+    def step_func():
+        nonlocal t
+        t += 1
+        return t, [t % episode_len == 0]
+
+    return step_func
+
+
+class TestDecorrelation:
+    @pytest.mark.parametrize(
+        "num_steps, stop_after_first_episode, expected_steps",
+        [(0, True, 0), (7, True, 7), (25, False, 25), (25, True, 15), (40, True, 10)],
+    )
+    def test_step_random_actions(self, num_steps: int, stop_after_first_episode: bool, expected_steps: int):
+        episode_len = 10
+        obs, steps, phase = step_random_actions(
+            _fixed_length_episodes(episode_len), num_steps, stop_after_first_episode
+        )
+        assert steps == expected_steps
+        assert obs == (None if num_steps == 0 else steps)
+        # either way we end up at the same phase of the episode
+        assert phase == num_steps % episode_len
+
+    def test_sample_flat_action(self):
+        space = gym.spaces.Tuple([gym.spaces.Discrete(3), gym.spaces.Box(-1, 1, (2,)), gym.spaces.Discrete(5)])
+        action = sample_flat_action(space)
+        assert action.shape == (4,) and action.dtype == np.float32
+        assert action[0] in range(3) and action[3] in range(5)
+
+    def test_phase_dispersion_stats(self):
+        stats = phase_dispersion_stats([[0, 10, 20], [5, 5]], seconds=2.0)
+        assert stats["decorrelation_phase_std"] == pytest.approx(np.std([0, 10, 20, 5, 5]))
+        assert stats["decorrelation_split_phase_std"] == pytest.approx(np.std([0, 10, 20]) / 2)
+        assert stats["decorrelation_phase_std_per_sec"] == pytest.approx(stats["decorrelation_phase_std"] / 2.0)
+
+    def test_random_bursts_are_cheaper(self):
+        def decorrelate(method: str):
+            argv = [
+                "--num_envs_per_worker=8",
+                "--episode_len=20",
+                "--rollout=32",
+                "--decorrelate_envs_on_one_worker=True",
+                f"--decorrelation_method={method}",
+            ]
+            cfg = parse_args(argv)
+            runner = make_runner(cfg, NonBatchedVectorEnvRunner, Timing())
+            runner.close()
+
+            events = [e for e in runner.startup_timeline.events if e["phase"] == ENV_DECORRELATE]
+            assert len(events) == len(runner.decorrelation_phases) == cfg.num_envs_per_worker
+            assert all(e["steps"] <= max_decorrelation_steps(cfg) for e in events)
+            return sum(e["steps"] for e in events), runner.decorrelation_phases
+
+        sleep_steps, _ = decorrelate("sleep")
+        burst_steps, burst_phases = decorrelate("random_bursts")
+
+        assert sleep_steps == 32 * sum(range(8))
+        assert burst_steps < sleep_steps / 2
+        assert np.std(burst_phases) > 0
+
+    def test_batched_bursts_per_env(self):
+        argv = [
+            "--batched_sampling=True",
+            "--num_envs_per_worker=8",
+            "--num_agents=2",
+            "--episode_len=20",
+            "--rollout=16",
+            "--decorrelate_envs_on_one_worker=True",
+            "--decorrelation_method=random_bursts",
+        ]
+        cfg = parse_args(argv)
+        runner = make_runner(cfg, BatchedVectorEnvRunner, Timing())
+
+        # every env of the split steps its own burst
+        events = [e for e in runner.startup_timeline.events if e["phase"] == ENV_DECORRELATE]
+        assert sorted(e["env_idx"] for e in events) == list(range(cfg.num_envs_per_worker))
+        envs = [e.unwrapped for e in runner.vec_env.envs]
+        phases = [env.t for env in envs for _ in range(cfg.num_agents)]
+        assert runner.decorrelation_phases == phases
+        assert len(set(phases)) > 1
+
+        # observations of the envs we stepped one by one are in their rows of the vector
+        expected_obs = [torch.from_numpy(obs) for env in envs for obs in env._obs()]
+        assert torch.equal(runner.last_obs["obs"], torch.stack(expected_obs))
+        runner.close()
@@ -0,0 +1,95 @@
+import itertools
+import time
+
+import gymnasium as gym
+import numpy as np
+
+from sample_factory.algo.sampling.env_reset_pool import EnvResetPool, ResetPrefetchWrapper
+from sample_factory.algo.utils.make_env import NonBatchedMultiAgentWrapper
+from sample_factory.envs.env_utils import TrainingInfoInterface, find_training_info_interface
+
+EPISODE_LEN = 3
+RESET_SECONDS = 0.05
+
+
+class _SlowResetEnv(gym.Env, TrainingInfoInterface):
+    instance_ids = itertools.count()
+
+    def __init__(self, step_seconds: float = 0.0):
+        TrainingInfoInterface.__init__(self)
+        self.instance_id = next(self.instance_ids)
+        self.step_seconds = step_seconds
+        self.reset_seed = None
+        self.t = 0
+        self.observation_space = gym.spaces.Box(0, 1e6, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+
+    def _obs(self):
+        return np.array([self.instance_id, self.t], dtype=np.float32)
+
+    def reset(self, seed=None, **kwargs):
+        time.sleep(RESET_SECONDS)
+        self.reset_seed = seed if seed is not None else self.reset_seed
+        self.t = 0
+        return self._obs(), {}
+
+    def step(self, action):
+        time.sleep(self.step_seconds)
+        self.t += 1
+        return self._obs(), 1.0, self.t >= EPISODE_LEN, False, {}
+
+
+def _make_env(reset_pool: EnvResetPool, step_seconds: float = 0.0):
+    def make_env():
+        return _SlowResetEnv(step_seconds)
+
+    return NonBatchedMultiAgentWrapper(ResetPrefetchWrapper(make_env(), make_env, reset_pool))
+
+
+class TestEnvResetPool:
+    def test_swap_spare_env(self):
+        reset_pool = EnvResetPool(num_threads=1)
+        env = _make_env(reset_pool)
+        prefetch_env = env.env
+        active, spare = prefetch_env.env, prefetch_env.spare_env
+
+        obs, _ = env.reset(seed=7)
+        assert obs[0][0] == active.instance_id
+        assert active.reset_seed == 7
+
+        instances = []
+        for _ in range(4 * EPISODE_LEN):
+            obs, _, terminated, _, info = env.step([0])
+            if terminated[0]:
+                # episode ended: the observation comes from the freshly reset spare instance
+                assert obs[0][1] == 0 and "reset_info" in info[0]
+                instances.append(obs[0][0])
+
+        assert instances == [spare.instance_id, active.instance_id, spare.instance_id, active.instance_id]
+        assert spare.reset_seed == 7 + ResetPrefetchWrapper.SPARE_SEED_OFFSET
+
+        training_info = dict(approx_total_training_steps=42)
+        find_training_info_interface(env).set_training_info(training_info)
+        assert active.training_info == spare.training_info == training_info
+
+        env.close()
+        reset_pool.close()
+
+    def test_hidden_reset_time(self):
+        reset_pool = EnvResetPool(num_threads=1)
+        # steps of the episode take longer than the reset, so the spare is always ready
+        env = _make_env(reset_pool, step_seconds=RESET_SECONDS)
+        env.reset()
+
+        num_episodes = 3
+        for _ in range(num_episodes * EPISODE_LEN):
+            env.step([0])
+
+        hidden_time, exposed_time = reset_pool.pop_reset_times()
+        assert hidden_time > 0.8 * num_episodes * RESET_SECONDS
+        assert exposed_time < 0.2 * num_episodes * RESET_SECONDS
+        assert reset_pool.pop_reset_times() == (0.0, 0.0)
+        assert reset_pool.stats()["env_reset_ms_p50"] >= RESET_SECONDS * 1000
+
+        env.close()
+        reset_pool.close()
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+
+import pytest
+
+from sample_factory.algo.sampling.env_startup import (
+    ENV_CHECK,
+    ENV_CREATE,
+    ENV_RESET,
+    StartupTimeline,
+    run_concurrently,
+    save_startup_timeline,
+)
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args
+
+
+class TestEnvStartup:
+    @pytest.mark.parametrize("num_threads", [0, 1, 3])
+    def test_run_concurrently(self, num_threads: int):
+        lock = threading.Lock()
+        running = max_running = 0
+
+        def func(i: int) -> int:
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+            return i * i
+
+        assert run_concurrently(func, 8, num_threads, "test") == [i * i for i in range(8)]
+        assert max_running <= max(num_threads, 1)
+
+    def test_exceptions(self):
+        def func(i: int) -> int:
+            if i == 2:
+                raise ValueError("env creation failed")
+            return i
+
+        with pytest.raises(ValueError):
+            run_concurrently(func, 4, 2, "test")
+
+    def test_save_timeline(self, tmp_path):
+        start_time = time.time()
+        timelines = [StartupTimeline(), StartupTimeline()]
+        for split_idx, timeline in enumerate(timelines):
+            for env_i in range(2):
+                with timeline.record(ENV_CREATE, env_i):
+                    time.sleep(0.01)
+            with timeline.record(ENV_RESET):
+                pass
+
+        filename = str(tmp_path / "startup_w000.json")
+        save_startup_timeline(filename, 0, start_time, timelines, num_threads=2)
+        with open(filename) as json_file:
+            timeline = json.load(json_file)
+
+        events = timeline["events"]
+        assert len(events) == 6
+        assert [e["start"] for e in events] == sorted(e["start"] for e in events)
+        assert {(e["split_idx"], e["env_idx"]) for e in events if e["phase"] == ENV_CREATE} == {
+            (s, e) for s in range(2) for e in range(2)
+        }
+        assert timeline["phase_totals"][ENV_CREATE] >= 4 * 0.01
+        assert timeline["wall_time"] >= timeline["phase_totals"][ENV_CREATE]
+
+    def test_runner_timeline(self):
+        num_envs = 6
+        cfg = parse_args([f"--num_envs_per_worker={num_envs}", "--env_creation_threads=3"])
+        runner = make_runner(cfg, NonBatchedVectorEnvRunner, Timing())
+
+        events = runner.startup_timeline.events
+        for phase in [ENV_CREATE, ENV_CHECK, ENV_RESET]:
+            assert sorted(e["env_idx"] for e in events if e["phase"] == phase) == list(range(num_envs))
+        assert len({e["thread"] for e in events}) > 1
+
+        # envs are still in the order of the vector
+        assert runner.global_env_indices == list(range(num_envs))
+        runner.close()
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
+
+
+class _SleepyEnv:
+    """Sleeping releases the GIL, just like simulators implemented in C/C++."""
+
+    def __init__(self, idx: int, step_sec: float):
+        self.idx = idx
+        self.step_sec = step_sec
+        self.threads = set()
+
+    def step(self, action):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.step_sec)
+        if action < 0:
+            raise ValueError(f"Invalid action {action}")
+        return self.idx, action
+
+
+class TestEnvStepPool:
+    @pytest.mark.parametrize("num_threads", [0, 1, 4])
+    def test_results_in_env_order(self, num_threads: int):
+        # envs with a shorter step finish first, but results should be in the order of the envs
+        envs = [_SleepyEnv(i, step_sec=0.001 * (8 - i)) for i in range(8)]
+        pool = EnvStepPool(num_threads, len(envs))
+
+        for step in range(3):
+            results = pool.step(envs, [step * 10 + i for i in range(8)])
+            assert results == [(i, step * 10 + i) for i in range(8)]
+
+        stats = pool.stats()
+        assert stats["env_step_ms_max"] >= 7.0
+        assert sum(v for k, v in stats.items() if "_hist_" in k) == pytest.approx(1.0)
+        assert len(pool.step_time_hist.values) == 3 * 8
+
+        threads_used = set().union(*(e.threads for e in envs))
+        if num_threads <= 1:
+            assert pool.executor is None
+            assert threads_used == {threading.get_ident()}
+        else:
+            assert threading.get_ident() not in threads_used
+
+        pool.close()
+
+    def test_concurrent_steps(self):
+        envs = [_SleepyEnv(i, step_sec=0.05) for i in range(4)]
+        pool = EnvStepPool(num_threads=16, num_envs=len(envs))
+        assert pool.executor._max_workers == 4
+
+        started = time.time()
+        pool.step(envs, [0] * len(envs))
+        assert time.time() - started < 0.15  # sequential stepping would take 0.2 sec
+
+        pool.close()
+
+    def test_exceptions(self):
+        envs = [_SleepyEnv(i, step_sec=0) for i in range(2)]
+        pool = EnvStepPool(2, len(envs))
+        with pytest.raises(ValueError):
+            pool.step(envs, [0, -1])
+        pool.close()
@@ -0,0 +1,99 @@
+from collections import deque
+
+import pytest
+import torch
+
+from sample_factory.algo.utils.frame_stack import (
+    FlatStackedObs,
+    gather_stacked_obs,
+    stacked_obs_for_trajectories,
+    store_stacked_obs,
+)
+
+
+def _collect_rollouts(num_traj: int, rollout: int, framestack: int, num_rollouts: int, done_prob: float):
+    """Emulates gymnasium FrameStack: on reset the stack is filled with the first frame of the episode."""
+    frame_shape = (2, 3)
+    frame_counter = 0
+
+    def new_frame():
+        nonlocal frame_counter
+        frame_counter += 1
+        return torch.full(frame_shape, frame_counter, dtype=torch.uint8)
+
+    stacks = []
+    for _ in range(num_traj):
+        first_frame = new_frame()
+        stacks.append(deque([first_frame] * framestack, maxlen=framestack))
+
+    rollouts = []
+    for _ in range(num_rollouts):
+        frames = torch.zeros((num_traj, framestack - 1 + rollout + 1) + frame_shape, dtype=torch.uint8)
+        dones = torch.rand(num_traj, rollout) < done_prob
+        full_stacks = torch.zeros((num_traj, rollout + 1, framestack) + frame_shape, dtype=torch.uint8)
+
+        for step in range(rollout + 1):
+            stacked_obs = torch.stack([torch.stack(list(s)) for s in stacks])
+            full_stacks[:, step] = stacked_obs
+            store_stacked_obs(frames, stacked_obs, step)
+
+            if step == rollout:
+                # the last step is only used to bootstrap, the env is not stepped in this rollout
+                break
+
+            for traj in range(num_traj):
+                frame = new_frame()
+                if dones[traj, step]:
+                    stacks[traj].extend([frame] * framestack)
+                else:
+                    stacks[traj].append(frame)
+
+        rollouts.append((frames, dones, full_stacks))
+
+        # the first step of the next rollout is the last step of this one
+        for traj in range(num_traj):
+            stacks[traj] = deque(list(full_stacks[traj, -1]), maxlen=framestack)
+
+    return rollouts
+
+
+class TestFrameStack:
+    @pytest.mark.parametrize("framestack", [2, 4])
+    @pytest.mark.parametrize("rollout", [1, 3, 16])
+    @pytest.mark.parametrize("done_prob", [0.0, 0.3, 1.0])
+    def test_reconstruct_stacks(self, framestack: int, rollout: int, done_prob: float):
+        torch.manual_seed(0)
+        rollouts = _collect_rollouts(5, rollout, framestack, num_rollouts=3, done_prob=done_prob)
+
+        for frames, dones, full_stacks in rollouts:
+            assert torch.equal(stacked_obs_for_trajectories(frames, dones, framestack), full_stacks)
+
+    def test_gather_individual_steps(self):
+        torch.manual_seed(1)
+        framestack, rollout = 4, 8
+        frames, dones, full_stacks = _collect_rollouts(6, rollout, framestack, num_rollouts=2, done_prob=0.3)[-1]
+
+        traj_indices = torch.tensor([5, 0, 3, 3])
+        rollout_steps = torch.tensor([0, 8, 2, 7])
+        stacks = gather_stacked_obs(frames, dones, traj_indices, rollout_steps, framestack)
+        assert torch.equal(stacks, full_stacks[traj_indices, rollout_steps])
+
+        # done flags at and after the requested step are not used, they might not be written yet
+        dones_in_progress = dones.clone()
+        dones_in_progress[3, 2:] = True
+        partial_stacks = gather_stacked_obs(
+            frames, dones_in_progress, traj_indices[2:3], rollout_steps[2:3], framestack
+        )
+        assert torch.equal(partial_stacks, full_stacks[3, 2].unsqueeze(0))
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 100])
+    def test_flat_stacked_obs_chunks(self, chunk_size: int):
+        torch.manual_seed(2)
+        framestack, rollout = 4, 8
+        frames, dones, full_stacks = _collect_rollouts(3, rollout, framestack, num_rollouts=2, done_prob=0.3)[-1]
+        flat_stacks = full_stacks.view((-1,) + full_stacks.shape[2:])
+
+        flat_obs = FlatStackedObs(frames, dones, framestack)
+        assert flat_obs.shape == flat_stacks.shape
+        chunks = [flat_obs[start : start + chunk_size] for start in range(0, flat_obs.size()[0], chunk_size)]
+        assert torch.equal(torch.cat(chunks), flat_stacks)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.inference_batching import (
+    AdaptiveBatchingController,
+    LinearCostModel,
+    WindowHistogram,
+    batch_size_buckets,
+)
+
+
+class TestInferenceBatching:
+    def test_cost_model(self):
+        rng = np.random.default_rng(0)
+        model = LinearCostModel()
+        assert model.predict(10) == 0.0
+
+        for _ in range(500):
+            n = int(rng.integers(1, 256))
+            model.update(n, 0.002 + 1e-5 * n + rng.normal(0, 1e-5))
+
+        a, b = model.coefficients()
+        assert a == pytest.approx(0.002, rel=0.05)
+        assert b == pytest.approx(1e-5, rel=0.05)
+
+        # constant batch size, we can only learn the average cost
+        model = LinearCostModel()
+        for _ in range(10):
+            model.update(32, 0.004)
+        assert model.coefficients() == pytest.approx((0.004, 0.0))
+
+    def test_histogram(self):
+        hist = WindowHistogram(batch_size_buckets(100), maxlen=4)
+        assert hist.buckets == [1, 2, 4, 8, 16, 32, 64, 128]
+        assert hist.summary("batch") == dict()
+
+        for value in [1, 3, 3, 100, 1000]:
+            hist.add(value)
+
+        # window only contains the last 4 values
+        stats = hist.summary("batch")
+        assert stats["batch_max"] == 1000
+        assert stats["batch_hist_le_4"] == 0.5
+        assert stats["batch_hist_le_128"] == 0.25
+        assert stats["batch_hist_gt_128"] == 0.25
+        assert sum(v for k, v in stats.items() if "_hist_" in k) == pytest.approx(1.0)
+
+    def test_dispatch(self):
+        controller = AdaptiveBatchingController(target_latency=0.01, max_batch_size=64, max_requests=8)
+        assert controller.batch_is_full(num_requests=8, num_samples=1)
+        assert controller.batch_is_full(num_requests=1, num_samples=64)
+        assert not controller.batch_is_full(num_requests=1, num_samples=63)
+        assert controller.wait_budget(16) == pytest.approx(0.01)
+
+        # expensive forward pass leaves less time for waiting
+        for n in [8, 16, 32, 64]:
+            controller.record(n, queue_wait=0.0, step_time=1e-4 * n)
+        assert controller.wait_budget(16) == pytest.approx(0.01 - 0.0016, abs=1e-6)
+        assert controller.wait_budget(64) < controller.wait_budget(16)
+        assert controller.wait_budget(1000) == 0.0
+
+    def test_latency_feedback(self):
+        controller = AdaptiveBatchingController(target_latency=0.01, max_batch_size=0, max_requests=100)
+        assert not controller.batch_is_full(num_requests=99, num_samples=10**6)
+
+        # we always dispatch 2ms later than we're allowed to (i.e. polling granularity), controller has to compensate
+        for _ in range(400):
+            queue_wait = controller.wait_budget(32) + 0.002
+            controller.record(32, queue_wait=queue_wait, step_time=0.005)
+        p95 = controller.stats()["step_latency_ms_p95"]
+        assert controller.slack < 1.0
+        assert p95 <= 10.0 * 1.1
+
+        # system got faster, controller should recover the slack
+        slack = controller.slack
+        for _ in range(200):
+            controller.record(32, queue_wait=0.0, step_time=0.001)
+        assert controller.slack > slack
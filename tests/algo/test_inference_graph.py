@@ -0,0 +1,100 @@
+import gymnasium as gym
+import pytest
+import torch
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.cfg.arguments import default_cfg
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.inference_graph import SAMPLED_OUTPUTS, InferenceGraph
+from sample_factory.model.model_utils import get_rnn_size
+
+
+def _graph_test_model(use_rnn: bool, rnn_type: str, share_weights: bool, action_space: gym.Space):
+    cfg = default_cfg(env="inference_graph_test")
+    cfg.use_rnn = use_rnn
+    cfg.rnn_type = rnn_type
+    cfg.actor_critic_share_weights = share_weights
+    cfg.normalize_input = True
+
+    obs_space = gym.spaces.Dict(
+        obs=gym.spaces.Box(-1, 1, (16,)), measurements=gym.spaces.Box(0, 255, (4,), dtype="uint8")
+    )
+    model = create_actor_critic(cfg, obs_space, action_space)
+    model.eval()
+    return cfg, model
+
+
+def _random_inputs(cfg, batch_size: int):
+    obs = dict(
+        obs=torch.randn(batch_size, 16),
+        measurements=torch.randint(0, 255, (batch_size, 4), dtype=torch.uint8),
+    )
+    rnn_states = torch.randn(batch_size, get_rnn_size(cfg)) * 0.1
+    return obs, rnn_states
+
+
+def _assert_matches_eager(graph: InferenceGraph, model, obs, rnn_states):
+    expected = model(prepare_and_normalize_obs(model, dict(obs)), rnn_states)
+    outputs = graph(model, obs, rnn_states)
+    assert set(outputs.keys()) == set(expected.keys())
+    for key in expected.keys():
+        assert outputs[key].shape == expected[key].shape, key
+        if key not in SAMPLED_OUTPUTS:
+            assert torch.allclose(outputs[key], expected[key], atol=1e-5), key
+
+
+class TestInferenceGraph:
+    @pytest.mark.parametrize(
+        "use_rnn,rnn_type,share_weights", [(False, "gru", True), (True, "gru", True), (True, "lstm", False)]
+    )
+    @pytest.mark.parametrize(
+        "action_space",
+        [gym.spaces.Discrete(5), gym.spaces.Box(-1, 1, (3,)), gym.spaces.Tuple([gym.spaces.Discrete(3)] * 2)],
+    )
+    def test_traced_matches_eager(self, use_rnn: bool, rnn_type: str, share_weights: bool, action_space: gym.Space):
+        torch.manual_seed(0)
+        cfg, model = _graph_test_model(use_rnn, rnn_type, share_weights, action_space)
+        graph = InferenceGraph()
+
+        with torch.no_grad():
+            # graph is traced on the first batch, but it is not specialized to its batch size
+            for batch_size in [7, 1, 32]:
+                _assert_matches_eager(graph, model, *_random_inputs(cfg, batch_size))
+
+        assert graph.traced is not None and not graph.eager_fallback
+
+    def test_weight_updates(self):
+        torch.manual_seed(1)
+        cfg, model = _graph_test_model(True, "gru", True, gym.spaces.Discrete(5))
+        graph = InferenceGraph()
+
+        with torch.no_grad():
+            _assert_matches_eager(graph, model, *_random_inputs(cfg, 8))
+            traced = graph.traced
+
+            # weights and normalizer statistics are updated in-place, the graph sees them without retracing
+            model.load_state_dict({k: v + 0.1 if v.is_floating_point() else v for k, v in model.state_dict().items()})
+            _assert_matches_eager(graph, model, *_random_inputs(cfg, 8))
+            assert graph.traced is traced
+
+            # new model object (i.e. quantized copy of the policy) requires a new graph
+            _, new_model = _graph_test_model(True, "gru", True, gym.spaces.Discrete(5))
+            _assert_matches_eager(graph, new_model, *_random_inputs(cfg, 8))
+            assert graph.traced is not traced
+
+    def test_eager_fallback(self):
+        cfg, model = _graph_test_model(False, "gru", True, gym.spaces.Discrete(5))
+        forward_head = model.forward_head
+
+        def untraceable_forward_head(normalized_obs):
+            # conversion to numpy turns the head output into a constant of the traced graph
+            return torch.from_numpy(forward_head(normalized_obs).numpy())
+
+        model.forward_head = untraceable_forward_head
+        graph = InferenceGraph()
+
+        with torch.no_grad():
+            for batch_size in [4, 16]:
+                _assert_matches_eager(graph, model, *_random_inputs(cfg, batch_size))
+
+        assert graph.eager_fallback and graph.traced is None
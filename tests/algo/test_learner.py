@@ -1,19 +1,28 @@
 import copy
 import random
+from collections import deque
+from typing import List, Optional, Tuple
 
+import gymnasium as gym
+import numpy as np
 import pytest
 import torch
 
 from sample_factory.algo.learning.learner import Learner
 from sample_factory.algo.sampling.sync_sampling_api import SyncSamplingAPI
 from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.frame_stack import OBS_FRAMES, stacked_obs_for_trajectories
 from sample_factory.algo.utils.make_env import make_env_func_batched
-from sample_factory.algo.utils.model_sharing import ParameterServer
-from sample_factory.algo.utils.rl_utils import samples_per_trajectory
-from sample_factory.algo.utils.tensor_dict import cat_tensordicts
-from sample_factory.cfg.arguments import verify_cfg
+from sample_factory.algo.utils.misc import TRAIN_STATS
+from sample_factory.algo.utils.model_sharing import ParameterServer, make_parameter_client
+from sample_factory.algo.utils.rl_utils import samples_per_trajectory, trajectories_per_training_iteration
+from sample_factory.algo.utils.tensor_dict import TensorDict, cat_tensordicts
+from sample_factory.cfg.arguments import default_cfg, verify_cfg
+from sample_factory.envs.env_utils import register_env
 from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.dicts import iterate_recursively
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import Config
 from sf_examples.mujoco.train_mujoco import parse_mujoco_cfg, register_mujoco_components
 
 
@@ -164,3 +173,494 @@ class TestValidMasks:
         assert torch.allclose(res.exploration_loss, invalid_res.exploration_loss, atol=atol, rtol=rtol)
         assert torch.allclose(res.kl_loss, invalid_res.kl_loss, atol=atol, rtol=rtol)
         assert torch.allclose(res.value_loss, invalid_res.value_loss, atol=atol, rtol=rtol)
+
+
+def _mujoco_test_cfg(use_rnn: bool) -> Config:
+    cfg = parse_mujoco_cfg(argv=["--env=mujoco_humanoid", "--experiment=test_learner"])
+    # this matches what we used when data was collected
+    cfg.num_workers = 2
+    cfg.rollout = 8
+    cfg.batch_size = 32
+    cfg.device = "cpu"
+    cfg.serial_mode = True
+    cfg.decorrelate_envs_on_one_worker = False
+    cfg.normalize_returns = False
+    cfg.normalize_input = False
+    cfg.use_rnn = use_rnn
+    cfg.recurrence = cfg.rollout if cfg.use_rnn else 1
+    return cfg
+
+
+def _init_learner_and_collect(cfg: Config, num_samples: int) -> Tuple[Learner, List[TensorDict]]:
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+
+    assert verify_cfg(cfg, env_info)
+
+    # here we're setting up the sampler to collect some trajectory batches as test data
+    policy_id = 0
+    policy_versions = torch.zeros([cfg.num_policies], dtype=torch.int32)
+    param_server = ParameterServer(policy_id, policy_versions, cfg.serial_mode)
+    sampler = SyncSamplingAPI(cfg, env_info, param_servers={policy_id: param_server})
+
+    learner: Learner = Learner(cfg, env_info, policy_versions, policy_id, param_server)
+    init_model_data = learner.init()
+    assert learner.actor_critic is not None
+    assert init_model_data is not None
+    assert init_model_data[0] == policy_id
+    sampler.start({policy_id: init_model_data})
+
+    trajectories = []
+    sampled = 0
+    while sampled < num_samples:
+        traj = sampler.get_trajectories_sync()
+        assert traj is not None
+        sampled += samples_per_trajectory(traj)
+        trajectories.append(traj)
+
+    sampler.stop()
+    return learner, trajectories
+
+
+def _split_into_batches(cfg: Config, trajectories: List[TensorDict], num_batches: int) -> List[TensorDict]:
+    all_trajectories = cat_tensordicts(trajectories)
+    traj_per_batch = trajectories_per_training_iteration(cfg)
+    return [copy.deepcopy(all_trajectories[i * traj_per_batch : (i + 1) * traj_per_batch]) for i in range(num_batches)]
+
+
+def _init_learner_and_batches(cfg: Config, num_batches: int) -> Tuple[Learner, List[TensorDict]]:
+    """Learner plus num_batches full training batches collected by its initial policy."""
+    num_samples = num_batches * cfg.batch_size * cfg.num_batches_per_epoch
+    learner, trajectories = _init_learner_and_collect(cfg, num_samples)
+    return learner, _split_into_batches(cfg, trajectories, num_batches)
+
+
+class _MujocoLearnerTest:
+    @pytest.fixture(scope="class", autouse=True)
+    def register_mujoco_fixture(self):
+        register_mujoco_components()
+
+
+class TestPrefetch(_MujocoLearnerTest):
+    def test_prefetch_matches_sequential(self):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.normalize_input = True
+        cfg.normalize_returns = True
+        cfg.seed = 42  # so that all learners start with identical weights
+
+        learner, batches = _init_learner_and_batches(cfg, 2)
+
+        prefetch_cfg = copy.deepcopy(cfg)
+        prefetch_cfg.learner_prefetch_batches = True
+        prefetch_learner, _ = _init_learner_and_collect(prefetch_cfg, 0)
+        # prepares batches but never trains, i.e. it always has the weights from before any SGD steps
+        reference_learner, _ = _init_learner_and_collect(copy.deepcopy(cfg), 0)
+
+        # the first batch is prepared in the main thread in both cases, so training on it must be identical
+        np.random.seed(0)
+        stats = learner.train(copy.deepcopy(batches[0]))[TRAIN_STATS]
+        prefetch_batches = copy.deepcopy(batches)
+        np.random.seed(0)
+        prefetch_stats = prefetch_learner.train(prefetch_batches[0], next_batch=prefetch_batches[1])[TRAIN_STATS]
+        assert prefetch_learner.prefetched is not None
+
+        for key in ["loss", "policy_loss", "value_loss", "kl_loss", "exploration_loss", "grad_norm"]:
+            assert np.isclose(float(stats[key]), float(prefetch_stats[key]), atol=1e-5), key
+        for param, prefetch_param in zip(learner.actor_critic.parameters(), prefetch_learner.actor_critic.parameters()):
+            assert torch.allclose(param, prefetch_param)
+
+        # The second batch was prepared with the weights from before the SGD steps on the first batch. Observations
+        # are normalized the same way, but bootstrap values of the last step (and therefore advantages and returns)
+        # come from the old value head. They match a learner that prepares both batches without training.
+        # noinspection PyProtectedMember
+        buff, _, _ = learner._prepare_batch(copy.deepcopy(batches[1]))
+        (prefetch_buff, _, _), _, _ = prefetch_learner.prefetched.future.result()
+        # noinspection PyProtectedMember
+        reference_learner._prepare_batch(copy.deepcopy(batches[0]))
+        # noinspection PyProtectedMember
+        reference_buff, _, _ = reference_learner._prepare_batch(copy.deepcopy(batches[1]))
+
+        assert torch.allclose(buff["normalized_obs"]["obs"], prefetch_buff["normalized_obs"]["obs"])
+        assert torch.equal(buff["valids"], prefetch_buff["valids"])
+        assert not torch.allclose(buff["advantages"], prefetch_buff["advantages"])
+        for key in ["advantages", "returns"]:
+            assert torch.allclose(prefetch_buff[key], reference_buff[key], atol=1e-5), key
+
+        prefetch_learner.train(prefetch_batches[1])
+        assert prefetch_learner.prefetched is None
+        assert "prefetch_saved" in prefetch_learner.timing
+
+        # normalizers see the same data in the same order
+        normalizer_state = learner.actor_critic.obs_normalizer.state_dict()
+        prefetch_normalizer_state = prefetch_learner.actor_critic.obs_normalizer.state_dict()
+        for key, value in normalizer_state.items():
+            assert torch.allclose(value, prefetch_normalizer_state[key])
+        # returns are normalized with statistics of the returns computed from the old bootstrap values
+        returns_normalizer_state = reference_learner.actor_critic.returns_normalizer.state_dict()
+        prefetch_returns_normalizer_state = prefetch_learner.actor_critic.returns_normalizer.state_dict()
+        for key, value in returns_normalizer_state.items():
+            assert torch.allclose(value, prefetch_returns_normalizer_state[key])
+        assert prefetch_learner.train_step == 2 * cfg.num_epochs * cfg.num_batches_per_epoch
+
+        prefetch_learner.stop_prefetching()
+
+    def test_prefetch_discarded_on_policy_load(self):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.learner_prefetch_batches = True
+        cfg.value_bootstrap = True
+
+        learner, batches = _init_learner_and_batches(cfg, 2)
+        rewards_before = batches[1]["rewards"].clone()
+
+        learner.train(batches[0], next_batch=batches[1])
+        assert learner.prefetched is not None
+
+        # the batch was collected before the policy was replaced, so after the load it is entirely stale
+        learner.set_policy_to_load(learner.policy_id)
+        assert learner.train(batches[1]) is None
+        assert learner.prefetched is None
+        # preparing the batch must not modify the source buffers, otherwise re-preparing it is incorrect
+        assert torch.equal(batches[1]["rewards"], rewards_before)
+
+        learner.stop_prefetching()
+
+    def test_prefetch_precision_errors(self):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.learner_prefetch_batches = True
+        cfg.buffer_float_dtype = "float16"
+        cfg.validate_reduced_precision = True
+
+        learner, batches = _init_learner_and_batches(cfg, 2)
+        learner.train(batches[0], next_batch=batches[1])
+        errors = dict(learner.max_precision_errors)
+        assert errors
+
+        # the prefetch thread reports errors with the prepared batch instead of writing them while we read them
+        _, _, prefetch_errors = learner.prefetched.future.result()
+        assert prefetch_errors.keys() == errors.keys()
+        assert learner.max_precision_errors == errors
+
+        stats = learner.train(batches[1])
+        assert learner.prefetched is None
+        for name, error in learner.max_precision_errors.items():
+            assert error >= errors[name]
+            assert stats["stats"][f"precision_err_{name}"] == error
+
+        learner.stop_prefetching()
+
+
+class TestLazyObsNormalization(_MujocoLearnerTest):
+    def test_lazy_matches_eager(self):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.normalize_input = True
+        cfg.obs_subtract_mean = 0.5
+        cfg.obs_scale = 2.0
+        cfg.seed = 42  # so that both learners start with identical weights
+
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+
+        lazy_cfg = copy.deepcopy(cfg)
+        lazy_cfg.lazy_obs_normalization = True
+        lazy_learner, _ = _init_learner_and_collect(lazy_cfg, 0)
+
+        # noinspection PyProtectedMember
+        buff, _, num_invalids = learner._prepare_batch(copy.deepcopy(batch))
+        # noinspection PyProtectedMember
+        lazy_buff, _, lazy_num_invalids = lazy_learner._prepare_batch(copy.deepcopy(batch))
+
+        assert "normalized_obs" not in lazy_buff
+        assert lazy_buff["obs"]["obs"].shape == buff["normalized_obs"]["obs"].shape
+        assert torch.allclose(buff["advantages"], lazy_buff["advantages"], atol=1e-5)
+
+        normalizer_state = learner.actor_critic.obs_normalizer.state_dict()
+        lazy_normalizer_state = lazy_learner.actor_critic.obs_normalizer.state_dict()
+        for key, value in normalizer_state.items():
+            assert torch.allclose(value, lazy_normalizer_state[key])
+
+        res = _learner_losses_res(learner, AttrDict(buff), num_invalids)
+        lazy_res = _learner_losses_res(lazy_learner, AttrDict(lazy_buff), lazy_num_invalids)
+        for key, value in res.items():
+            assert torch.allclose(torch.as_tensor(value), torch.as_tensor(lazy_res[key]), atol=1e-5), key
+
+    def test_lazy_batch_memory(self):
+        # uint8 image observations, eager normalization turns them into a float32 copy of the entire batch
+        cfg = _framestack_test_cfg()
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+        lazy_cfg = copy.deepcopy(cfg)
+        lazy_cfg.lazy_obs_normalization = True
+        lazy_learner, _ = _init_learner_and_collect(lazy_cfg, 0)
+
+        # noinspection PyProtectedMember
+        buff, dataset_size, num_invalids = learner._prepare_batch(copy.deepcopy(batch))
+        # noinspection PyProtectedMember
+        lazy_buff, _, _ = lazy_learner._prepare_batch(copy.deepcopy(batch))
+
+        obs_bytes = _tensor_bytes(buff["normalized_obs"])
+        lazy_obs_bytes = _tensor_bytes(lazy_buff["obs"])
+        assert lazy_buff["obs"]["obs"].dtype == torch.uint8
+        assert obs_bytes == 4 * lazy_obs_bytes
+        assert _tensor_bytes(buff) - _tensor_bytes(lazy_buff) == obs_bytes - lazy_obs_bytes
+
+        # float observations only exist for one minibatch at a time
+        # noinspection PyProtectedMember
+        indices = lazy_learner._get_minibatches(cfg.batch_size, dataset_size)[0]
+        # noinspection PyProtectedMember
+        mb = AttrDict(lazy_learner._get_minibatch(lazy_buff, indices))
+        _learner_losses_res(lazy_learner, mb, num_invalids)
+        assert _tensor_bytes(mb.normalized_obs) == obs_bytes * cfg.batch_size // dataset_size
+
+
+class TestCompactRnnStates(_MujocoLearnerTest):
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    def test_compact_matches_full(self, batched_sampling: bool):
+        cfg = _mujoco_test_cfg(use_rnn=True)
+        cfg.recurrence = 4
+        cfg.batched_sampling = batched_sampling
+        cfg.seed = 42  # so that both learners start with identical weights
+
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+        assert batch["rnn_states"].shape[1] == cfg.rollout + 1
+
+        compact_cfg = copy.deepcopy(cfg)
+        compact_cfg.compact_rnn_states = True
+        compact_learner, compact_trajectories = _init_learner_and_collect(compact_cfg, cfg.batch_size)
+        num_rnn_states = cfg.rollout // cfg.recurrence + 1
+        assert compact_trajectories[0]["rnn_states"].shape[1] == num_rnn_states
+
+        # same data as the sampler would have stored: states at chunk boundaries and the bootstrap state
+        compact_batch = copy.deepcopy(batch)
+        compact_batch["rnn_states"] = batch["rnn_states"][:, :: cfg.recurrence].clone()
+        assert compact_batch["rnn_states"].shape[1] == num_rnn_states
+
+        # noinspection PyProtectedMember
+        buff, _, num_invalids = learner._prepare_batch(copy.deepcopy(batch))
+        # noinspection PyProtectedMember
+        compact_buff, _, compact_num_invalids = compact_learner._prepare_batch(compact_batch)
+        assert torch.allclose(buff["advantages"], compact_buff["advantages"], atol=1e-5)
+        # one state per recurrence chunk, not per step
+        assert torch.equal(compact_buff["rnn_states"], buff["rnn_states"][:: cfg.recurrence])
+
+        res = _learner_losses_res(learner, AttrDict(buff), num_invalids)
+        compact_res = _learner_losses_res(compact_learner, AttrDict(compact_buff), compact_num_invalids)
+        for key, value in res.items():
+            assert torch.allclose(torch.as_tensor(value), torch.as_tensor(compact_res[key]), atol=1e-5), key
+
+    @pytest.mark.parametrize("shuffle_minibatches", [False, True])
+    def test_compact_training_matches_full(self, shuffle_minibatches: bool):
+        cfg = _mujoco_test_cfg(use_rnn=True)
+        cfg.recurrence = 4
+        cfg.num_batches_per_epoch = 2
+        cfg.num_epochs = 2
+        cfg.shuffle_minibatches = shuffle_minibatches
+        cfg.seed = 42  # so that both learners start with identical weights
+
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+
+        compact_cfg = copy.deepcopy(cfg)
+        compact_cfg.compact_rnn_states = True
+        compact_learner, _ = _init_learner_and_collect(compact_cfg, 0)
+        compact_batch = copy.deepcopy(batch)
+        compact_batch["rnn_states"] = batch["rnn_states"][:, :: cfg.recurrence].clone()
+
+        # same minibatch order, and summaries are recorded for the same minibatch
+        np.random.seed(0)
+        stats = learner.train(copy.deepcopy(batch))[TRAIN_STATS]
+        np.random.seed(0)
+        compact_stats = compact_learner.train(compact_batch)[TRAIN_STATS]
+
+        for key in ["loss", "policy_loss", "value_loss", "kl_loss", "exploration_loss", "grad_norm"]:
+            assert np.isclose(float(stats[key]), float(compact_stats[key]), atol=1e-5), key
+        for param, compact_param in zip(learner.actor_critic.parameters(), compact_learner.actor_critic.parameters()):
+            assert torch.allclose(param, compact_param, atol=1e-5)
+
+
+class TestReducedPrecision(_MujocoLearnerTest):
+    @pytest.mark.parametrize("batched_sampling,dtype", [(False, "float16"), (True, "float16"), (True, "bfloat16")])
+    def test_reduced_precision_buffers(self, batched_sampling: bool, dtype: str):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.batched_sampling = batched_sampling
+        cfg.buffer_float_dtype = dtype
+        cfg.normalize_input = True
+
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+        for field in cfg.reduced_precision_fields:
+            tensors = batch[field].values() if field == "obs" else [batch[field]]
+            for x in tensors:
+                assert x.dtype == getattr(torch, dtype), field
+        assert batch["actions"].dtype == torch.float32
+        assert batch["rnn_states"].dtype == torch.float32
+
+        # noinspection PyProtectedMember
+        buff, _, _ = learner._prepare_batch(batch)
+        for field in ["normalized_obs", "action_logits", "values", "log_prob_actions"]:
+            tensors = buff[field].values() if field == "normalized_obs" else [buff[field]]
+            for x in tensors:
+                assert x.dtype == torch.float32, field
+
+        assert learner.train(batch) is not None
+
+    def test_validation_mode(self):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.buffer_float_dtype = "float16"
+        cfg.validate_reduced_precision = True
+
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+        assert batch["values"].dtype == torch.float32
+
+        stats = learner.train(batch)
+        errors = {key: value for key, value in stats["stats"].items() if key.startswith("precision_err_")}
+        assert set(errors.keys()) == {
+            "precision_err_obs_obs",
+            "precision_err_action_logits",
+            "precision_err_values",
+            "precision_err_log_prob_actions",
+        }
+        magnitudes = {
+            "precision_err_obs_obs": batch["obs"]["obs"],
+            "precision_err_action_logits": batch["action_logits"],
+            "precision_err_values": batch["values"],
+            "precision_err_log_prob_actions": batch["log_prob_actions"],
+        }
+        for key, error in errors.items():
+            # float16 has 11 significant bits, rounding error is relative to the magnitude of the values
+            max_abs = max(1.0, magnitudes[key].abs().max().item())
+            assert 0.0 <= error <= max_abs * 2**-11, key
+
+
+class TestLockFreeObsNormalizer(_MujocoLearnerTest):
+    @pytest.mark.parametrize("double_buffered_weights", [False, True])
+    def test_inference_sees_published_stats(self, double_buffered_weights: bool):
+        cfg = _mujoco_test_cfg(use_rnn=False)
+        cfg.normalize_input = True
+        learner, (batch,) = _init_learner_and_batches(cfg, 1)
+
+        # learner and inference worker in the same process, but sharing the model as if they were not
+        async_cfg = copy.deepcopy(cfg)
+        async_cfg.serial_mode = False
+        async_cfg.lock_free_obs_normalizer = True
+        async_cfg.double_buffered_weights = double_buffered_weights
+        param_server = ParameterServer(0, torch.zeros([1], dtype=torch.int32), serial_mode=False)
+        async_learner = Learner(async_cfg, learner.env_info, param_server.policy_versions, 0, param_server)
+        policy_id, state_dict, device, policy_version = async_learner.init()
+        client = make_parameter_client(False, param_server, async_cfg, learner.env_info, Timing())
+        client.on_weights_initialized(state_dict, device, policy_version)
+
+        async_learner.train(batch)
+        learner_stats = async_learner.actor_critic.obs_normalizer.state_dict()
+        assert async_learner.obs_normalizer_version > 0
+        assert "normalizer_lock_wait" not in async_learner.timing
+
+        client.ensure_weights_updated()
+        assert client.policy_version == async_learner.train_step
+        inference_stats = client.actor_critic.obs_normalizer.state_dict()
+        for key, value in learner_stats.items():
+            assert torch.equal(value, inference_stats[key]), key
+        for key, value in async_learner.actor_critic.state_dict().items():
+            assert torch.equal(value, client.actor_critic.state_dict()[key]), key
+
+
+FRAMESTACK_TEST_ENV = "learner_framestack_test_env"
+FRAMESTACK = 4
+
+
+class _FrameStackEnv(gym.Env):
+    """Random image frames stacked like gymnasium FrameStack does: on reset the stack is filled with the first frame."""
+
+    def __init__(self):
+        self.observation_space = gym.spaces.Box(0, 255, (FRAMESTACK, 42, 42), dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(3)
+        self.rng = np.random.default_rng(0)
+        self.stack = deque(maxlen=FRAMESTACK)
+        self.t = 0
+
+    def _frame(self) -> np.ndarray:
+        return self.rng.integers(0, 256, self.observation_space.shape[1:], dtype=np.uint8)
+
+    def reset(self, seed: Optional[int] = None, **kwargs):
+        self.t = 0
+        self.stack.extend([self._frame()] * FRAMESTACK)
+        return np.stack(self.stack), dict()
+
+    def step(self, action):
+        self.t += 1
+        self.stack.append(self._frame())
+        return np.stack(self.stack), float(action), self.t >= 5, False, dict()
+
+    def render(self):
+        pass
+
+
+def make_framestack_env(_full_env_name, cfg=None, env_config=None, render_mode: Optional[str] = None):
+    return _FrameStackEnv()
+
+
+def _framestack_test_cfg() -> Config:
+    register_env(FRAMESTACK_TEST_ENV, make_framestack_env)
+    cfg = default_cfg(env=FRAMESTACK_TEST_ENV)
+    cfg.num_workers = 2
+    cfg.rollout = 8
+    cfg.batch_size = 32
+    cfg.num_batches_per_epoch = 2
+    cfg.device = "cpu"
+    cfg.serial_mode = True
+    cfg.decorrelate_envs_on_one_worker = False
+    cfg.use_rnn = False
+    cfg.recurrence = 1
+    cfg.encoder_conv_architecture = "convnet_simple"
+    cfg.env_framestack = FRAMESTACK
+    cfg.normalize_input = True
+    cfg.seed = 42  # so that both learners start with identical weights
+    return cfg
+
+
+def _tensor_bytes(d: TensorDict) -> int:
+    return sum(x.numel() * x.element_size() for _, _, x in iterate_recursively(d))
+
+
+class TestDedupFramestack:
+    def test_lazy_minibatch_stacks(self):
+        cfg = _framestack_test_cfg()
+        cfg.lazy_obs_normalization = True
+
+        dedup_cfg = copy.deepcopy(cfg)
+        dedup_cfg.dedup_framestack = True
+        dedup_learner, (batch,) = _init_learner_and_batches(dedup_cfg, 1)
+        assert "obs" not in batch["obs"]
+        learner, _ = _init_learner_and_collect(cfg, 0)
+
+        # same experience with the full stacks the sampler would have stored without --dedup_framestack
+        full_batch = copy.deepcopy(batch)
+        frames = full_batch.pop(OBS_FRAMES)
+        full_batch["obs"]["obs"] = stacked_obs_for_trajectories(frames, full_batch["dones"], FRAMESTACK)
+
+        # noinspection PyProtectedMember
+        buff, dataset_size, num_invalids = learner._prepare_batch(full_batch)
+        # noinspection PyProtectedMember
+        dedup_buff, _, dedup_num_invalids = dedup_learner._prepare_batch(copy.deepcopy(batch))
+        assert torch.allclose(buff["advantages"], dedup_buff["advantages"], atol=1e-5)
+
+        # the training batch keeps every frame once, not framestack times
+        assert "obs" not in dedup_buff["obs"]
+        assert dedup_buff[OBS_FRAMES]["frames"].numel() == frames.numel()
+        assert buff["obs"]["obs"].numel() == dataset_size * FRAMESTACK * frames[0, 0].numel()
+
+        normalizer_state = learner.actor_critic.obs_normalizer.state_dict()
+        dedup_normalizer_state = dedup_learner.actor_critic.obs_normalizer.state_dict()
+        for key, value in normalizer_state.items():
+            assert torch.allclose(value, dedup_normalizer_state[key]), key
+
+        # noinspection PyProtectedMember
+        minibatches = learner._get_minibatches(cfg.batch_size, dataset_size)
+        for indices in minibatches:
+            # noinspection PyProtectedMember
+            mb = AttrDict(learner._get_minibatch(buff, indices))
+            # noinspection PyProtectedMember
+            dedup_mb = AttrDict(dedup_learner._get_minibatch(dedup_buff, indices))
+            res = _learner_losses_res(learner, mb, num_invalids)
+            dedup_res = _learner_losses_res(dedup_learner, dedup_mb, dedup_num_invalids)
+            for key, value in res.items():
+                if value is None:
+                    continue  # loss is disabled
+                assert torch.allclose(torch.as_tensor(value), torch.as_tensor(dedup_res[key]), atol=1e-5), key
+
+        assert dedup_learner.train(batch) is not None
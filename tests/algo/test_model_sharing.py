@@ -0,0 +1,135 @@
+import copy
+import threading
+
+import gymnasium as gym
+import torch
+from torch import nn
+
+from sample_factory.algo.utils.model_sharing import SharedWeightSlots
+from sample_factory.algo.utils.running_mean_std import RunningMeanStdDictInPlace
+
+
+def _model() -> nn.Module:
+    return nn.Sequential(nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 4))
+
+
+def _fill(model: nn.Module, value: float) -> None:
+    with torch.no_grad():
+        for p in model.parameters():
+            p.fill_(value)
+
+
+class TestSharedWeightSlots:
+    def test_publish_and_read(self):
+        learner_model, inference_model = _model(), _model()
+        slots = SharedWeightSlots(learner_model.state_dict())
+
+        for version in range(1, 4):
+            _fill(learner_model, float(version))
+            slots.publish(learner_model.state_dict(), version)
+            assert slots.try_read_into(inference_model, torch.device("cpu")) == version
+            for p in inference_model.parameters():
+                assert torch.all(p == version)
+
+        # slots are copies, training the learner model does not affect the published weights
+        _fill(learner_model, -1.0)
+        assert slots.try_read_into(inference_model, torch.device("cpu")) == 3
+        for p in inference_model.parameters():
+            assert torch.all(p == 3)
+
+    def test_slot_being_written(self):
+        model = _model()
+        slots = SharedWeightSlots(model.state_dict())
+        slots.publish(model.state_dict(), 0)
+
+        latest = slots.latest.item()
+        slots.seq[latest] += 1  # pretend the learner is writing into the latest slot (i.e. it lapped the reader)
+        assert slots.try_read_into(_model(), torch.device("cpu")) is None
+        slots.seq[latest] += 1
+        assert slots.try_read_into(_model(), torch.device("cpu")) == 0
+
+    def test_concurrent_publishing(self):
+        learner_model, inference_model = _model(), _model()
+        _fill(learner_model, 0.0)
+        slots = SharedWeightSlots(learner_model.state_dict())
+        slots.publish(learner_model.state_dict(), 0)
+
+        num_versions = 300
+        stop = threading.Event()
+
+        def learner():
+            for version in range(1, num_versions + 1):
+                _fill(learner_model, float(version))
+                slots.publish(learner_model.state_dict(), version)
+            stop.set()
+
+        thread = threading.Thread(target=learner)
+        thread.start()
+
+        num_reads = num_torn = 0
+        last_version = 0
+        while not stop.is_set():
+            version = slots.try_read_into(inference_model, torch.device("cpu"))
+            if version is None:
+                num_torn += 1
+                continue
+
+            num_reads += 1
+            # a complete read never mixes weights from different versions
+            assert version >= last_version
+            for p in inference_model.parameters():
+                assert torch.all(p == version)
+            last_version = version
+
+        thread.join()
+        assert num_reads > 0
+        assert slots.try_read_into(inference_model, torch.device("cpu")) == num_versions
+
+
+class TestObsNormalizerSnapshots:
+    def test_concurrent_readers_and_writer(self):
+        obs_space = gym.spaces.Dict(dict(obs=gym.spaces.Box(-10.0, 10.0, shape=(64,))))
+        learner_normalizer = RunningMeanStdDictInPlace(obs_space)
+        slots = SharedWeightSlots(learner_normalizer.state_dict())
+
+        # every snapshot the learner ever published, readers must only see exactly these
+        published = {0: copy.deepcopy(learner_normalizer.state_dict())}
+        slots.publish(learner_normalizer.state_dict(), 0)
+
+        num_updates, num_readers = 200, 4
+        stop = threading.Event()
+        errors = []
+
+        def learner():
+            for version in range(1, num_updates + 1):
+                # normalization updates the statistics in place, nobody else can see them until we publish
+                learner_normalizer(dict(obs=torch.randn(256, 64) * version + version))
+                published[version] = copy.deepcopy(learner_normalizer.state_dict())
+                slots.publish(learner_normalizer.state_dict(), version)
+            stop.set()
+
+        def inference_worker(reader_idx: int):
+            normalizer = RunningMeanStdDictInPlace(obs_space)
+            num_reads, last_version = 0, -1
+            while not stop.is_set() or num_reads == 0:
+                if slots.latest_version() <= last_version:
+                    continue
+                version = slots.try_read_into(normalizer, torch.device("cpu"))
+                if version is None:
+                    continue  # torn read, the learner was faster
+                if version < last_version:
+                    errors.append(f"reader {reader_idx} went back in time from {last_version} to {version}")
+                for name, t in normalizer.state_dict().items():
+                    if not torch.equal(t, published[version][name]):
+                        errors.append(f"reader {reader_idx} got inconsistent {name} for {version=}")
+                num_reads, last_version = num_reads + 1, version
+
+        readers = [threading.Thread(target=inference_worker, args=(i,)) for i in range(num_readers)]
+        for r in readers:
+            r.start()
+        learner()
+        for r in readers:
+            r.join()
+
+        assert not errors, errors[:10]
+        assert slots.latest_version() == num_updates
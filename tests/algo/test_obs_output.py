@@ -0,0 +1,50 @@
+import gymnasium as gym
+import numpy as np
+import torch
+
+from sample_factory.algo.utils.make_env import BatchedVecEnv, SequentialVectorizeWrapper
+from sample_factory.envs.env_utils import find_obs_output_interface
+
+
+class _CountingEnv(gym.Env):
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.t = 0
+        self.observation_space = gym.spaces.Box(0, 1e6, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+
+    def _obs(self):
+        return np.array([self.idx, self.t], dtype=np.float32)
+
+    def reset(self, **kwargs):
+        self.t = 0
+        return self._obs(), {}
+
+    def step(self, action):
+        self.t += 1
+        return self._obs(), 1.0, False, False, {}
+
+
+class TestObsOutput:
+    def test_write_into_obs_output(self):
+        num_envs = 3
+        vec_env = SequentialVectorizeWrapper([BatchedVecEnv(_CountingEnv(i)) for i in range(num_envs)])
+        assert find_obs_output_interface(vec_env) is vec_env
+        vec_env.reset()
+
+        # e.g. trajectory buffer of shape [num_agents, rollout, *obs_shape]
+        traj_obs = torch.zeros(num_envs, 4, 2, dtype=torch.float16)
+        actions = np.zeros(num_envs, dtype=np.int32)
+
+        vec_env.set_obs_output(dict(obs=traj_obs[:, 1]))
+        obs, *_ = vec_env.step(actions)
+        expected = torch.tensor([[i, 1] for i in range(num_envs)], dtype=torch.float16)
+        assert obs["obs"].data_ptr() == traj_obs[:, 1].data_ptr()
+        assert torch.equal(traj_obs[:, 1], expected)
+
+        # obs_output only applies to one step, after that the env uses its own storage
+        obs, *_ = vec_env.step(actions)
+        assert obs["obs"].dtype == torch.float32
+        assert torch.equal(obs["obs"], torch.tensor([[i, 2] for i in range(num_envs)], dtype=torch.float32))
+        assert torch.equal(traj_obs[:, 1], expected)
+        assert not traj_obs[:, 2].any()
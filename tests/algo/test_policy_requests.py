@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.inference_worker import decode_individual_steps
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.sampling.vectorized_non_batched_sampling import VectorizedNonBatchedEnvRunner
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args, run_rollouts
+
+
+class TestPolicyRequests:
+    @pytest.mark.parametrize("runner_cls", [NonBatchedVectorEnvRunner, VectorizedNonBatchedEnvRunner])
+    def test_int32_request_format(self, runner_cls):
+        cfg = parse_args(["--num_envs_per_worker=4", "--num_agents=3", "--inactive_prob=0.3", "--num_policies=2"])
+        timing = Timing()
+        runner = make_runner(cfg, runner_cls, timing)
+        run_rollouts(runner, 5, np.random.default_rng(0), timing)
+
+        assert runner.update_trajectory_buffers(timing)
+        request = runner.generate_policy_request()
+        assert len(request) > 0
+
+        reference = make_runner(cfg, NonBatchedVectorEnvRunner, timing)
+        run_rollouts(reference, 5, np.random.default_rng(0), timing)
+        assert reference.update_trajectory_buffers(timing)
+        expected_request = reference.generate_policy_request()
+
+        for policy_id, rows in request.items():
+            # one (env_idx, agent_idx, traj_buffer_idx, rollout_step) row per active agent of the policy
+            assert rows.dtype == np.int32 and rows.ndim == 2 and rows.shape[1] == 4
+            assert np.array_equal(rows, expected_request[policy_id])
+            for env_i, agent_i, traj_buffer_idx, rollout_step in rows:
+                actor = reference.actor_states[env_i][agent_i]
+                assert actor.is_active and actor.curr_policy_id == policy_id
+                assert (traj_buffer_idx, rollout_step) == (actor.curr_traj_buffer_idx, reference.rollout_step)
+
+        # the inference worker concatenates requests of several rollout workers and splits
+        rows = next(iter(request.values()))
+        requests = [(3, 1, rows, "cpu", 0, 0, 0.0), (5, 0, rows[:1], "cpu", 0, 0, 0.0)]
+        (traj_buffer_idx, rollout_step), actor_indices = decode_individual_steps(requests)
+        assert np.array_equal(traj_buffer_idx, np.concatenate([rows[:, 2], rows[:1, 2]]))
+        assert np.array_equal(rollout_step, np.concatenate([rows[:, 3], rows[:1, 3]]))
+
+        worker_idx, split_idx, env_idx, agent_idx = actor_indices
+        assert np.array_equal(worker_idx, [3] * len(rows) + [5])
+        assert np.array_equal(split_idx, [1] * len(rows) + [0])
+        assert np.array_equal(env_idx, np.concatenate([rows[:, 0], rows[:1, 0]]))
+        assert np.array_equal(agent_idx, np.concatenate([rows[:, 1], rows[:1, 1]]))
+
+        runner.close()
+        reference.close()
@@ -0,0 +1,94 @@
+import gymnasium as gym
+import pytest
+import torch
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.cfg.arguments import default_cfg
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.model_utils import get_rnn_size
+from sample_factory.model.population_inference import PopulationInference
+
+
+def _population_test_models(num_policies: int, use_rnn: bool, share_weights: bool, action_space: gym.Space):
+    cfg = default_cfg(env="population_inference_test")
+    cfg.use_rnn = use_rnn
+    cfg.actor_critic_share_weights = share_weights
+    cfg.normalize_input = True
+
+    obs_space = gym.spaces.Dict(obs=gym.spaces.Box(-1, 1, (16,)))
+    models = [create_actor_critic(cfg, obs_space, action_space) for _ in range(num_policies)]
+    for model in models:
+        model.eval()
+    population = PopulationInference(cfg, obs_space, action_space, torch.device("cpu"))
+    return cfg, models, population
+
+
+def _segments(cfg, models, batch_sizes):
+    segments = []
+    for policy_id, (model, batch_size) in enumerate(zip(models, batch_sizes)):
+        if batch_size == 0:
+            continue
+        normalized_obs = prepare_and_normalize_obs(model, dict(obs=torch.randn(batch_size, 16)))
+        rnn_states = torch.randn(batch_size, get_rnn_size(cfg)) * 0.1
+        segments.append((policy_id, model, normalized_obs, rnn_states))
+    return segments
+
+
+def _assert_matches_policies(segments, outputs):
+    assert len(outputs) == len(segments)
+    for (_, model, normalized_obs, rnn_states), result in zip(segments, outputs):
+        expected = model(normalized_obs, rnn_states)
+        batch_size = rnn_states.shape[0]
+        for key in ("values", "action_logits", "actions", "log_prob_actions", "new_rnn_states"):
+            assert result[key].shape[0] == batch_size, key
+        for key in ("values", "action_logits", "new_rnn_states"):
+            assert torch.allclose(result[key], expected[key].reshape(result[key].shape), atol=1e-5), key
+
+
+class TestPopulationInference:
+    @pytest.mark.parametrize("share_weights", [True, False])
+    @pytest.mark.parametrize(
+        "action_space",
+        [gym.spaces.Discrete(5), gym.spaces.Box(-1, 1, (3,)), gym.spaces.Tuple([gym.spaces.Discrete(3)] * 2)],
+    )
+    def test_matches_policies(self, share_weights: bool, action_space: gym.Space):
+        torch.manual_seed(0)
+        cfg, models, population = _population_test_models(4, False, share_weights, action_space)
+        versions = {policy_id: 0 for policy_id in range(len(models))}
+
+        with torch.no_grad():
+            # uneven batches are padded, policies without requests are skipped
+            for batch_sizes in [(3, 8, 1, 5), (4, 4, 4, 4), (0, 7, 0, 2), (1, 0, 0, 0)]:
+                segments = _segments(cfg, models, batch_sizes)
+                _assert_matches_policies(segments, population(segments, versions))
+
+        assert population.validated and not population.eager_fallback
+
+    def test_weight_updates(self):
+        torch.manual_seed(1)
+        cfg, models, population = _population_test_models(3, False, True, gym.spaces.Discrete(5))
+        versions = {policy_id: 0 for policy_id in range(len(models))}
+
+        with torch.no_grad():
+            segments = _segments(cfg, models, (4, 4, 4))
+            _assert_matches_policies(segments, population(segments, versions))
+            stacked = population.stacked
+
+            # weights of the policies are updated in-place, stacked copy follows the policy version
+            models[1].load_state_dict(
+                {k: v + 0.1 if v.is_floating_point() else v for k, v in models[1].state_dict().items()}
+            )
+            versions[1] = 1
+            _assert_matches_policies(segments, population(segments, versions))
+            assert population.stacked is stacked
+
+    def test_eager_fallback(self):
+        # vmap has no batching rules for the recurrent cores
+        cfg, models, population = _population_test_models(2, True, True, gym.spaces.Discrete(5))
+
+        with torch.no_grad():
+            for batch_sizes in [(4, 2), (3, 3)]:
+                segments = _segments(cfg, models, batch_sizes)
+                _assert_matches_policies(segments, population(segments, {0: 0, 1: 0}))
+
+        assert population.eager_fallback
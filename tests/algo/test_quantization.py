@@ -0,0 +1,85 @@
+import gymnasium as gym
+import pytest
+import torch
+from torch import nn
+
+from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
+from sample_factory.cfg.arguments import default_cfg
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.model_utils import get_rnn_size
+from sample_factory.model.quantization import QuantizedPolicy, action_distribution_divergence, eager_model_cfg
+from sample_factory.utils.timing import Timing
+
+
+def _quantization_test_model(rnn_type: str, action_space: gym.Space):
+    cfg = default_cfg(env="quantization_test")
+    cfg.use_rnn = True
+    cfg.rnn_type = rnn_type
+    cfg.normalize_input = True
+    cfg.inference_quantization = "dynamic_int8"
+    cfg.requantize_interval = 1000.0
+
+    obs_space = gym.spaces.Dict(obs=gym.spaces.Box(-1, 1, (16,)))
+    model = create_actor_critic(cfg, obs_space, action_space)
+    model.eval()
+    return cfg, obs_space, model
+
+
+class TestQuantization:
+    @pytest.mark.parametrize("rnn_type", ["gru", "lstm"])
+    @pytest.mark.parametrize("action_space", [gym.spaces.Discrete(5), gym.spaces.Box(-1, 1, (3,))])
+    def test_quantized_policy(self, rnn_type: str, action_space: gym.Space):
+        torch.manual_seed(0)
+        cfg, obs_space, model = _quantization_test_model(rnn_type, action_space)
+        quantized_policy = QuantizedPolicy(cfg, obs_space, action_space)
+        assert quantized_policy.maybe_requantize(model, policy_version=0, timing=Timing())
+
+        quantized = quantized_policy.model
+        assert quantized_policy.policy_version == 0
+        # scripted parts of the model (i.e. MLP encoder) are quantized too
+        assert not any(type(m) in (nn.Linear, nn.GRU, nn.LSTM) for m in quantized.modules())
+        assert quantized.obs_normalizer is model.obs_normalizer
+
+        obs = dict(obs=torch.randn(64, 16))
+        normalized_obs = prepare_and_normalize_obs(model, obs)
+        rnn_states = torch.randn(64, get_rnn_size(cfg)) * 0.1
+        div = action_distribution_divergence(model, quantized, normalized_obs, rnn_states)
+        assert 0.0 <= div["kl_mean"] <= div["kl_max"] < 1e-2
+        assert div["greedy_action_agreement"] > 0.8
+        assert div["values_max_err"] < 0.1
+
+    def test_rate_limit(self):
+        cfg, obs_space, model = _quantization_test_model("gru", gym.spaces.Discrete(5))
+        quantized_policy = QuantizedPolicy(cfg, obs_space, model.action_space)
+        timing = Timing()
+
+        assert quantized_policy.maybe_requantize(model, policy_version=0, timing=timing)
+        first_copy = quantized_policy.model
+
+        # new weights, but it's too early to requantize
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(1.0)
+        assert not quantized_policy.maybe_requantize(model, policy_version=1, timing=timing)
+        assert quantized_policy.model is first_copy and quantized_policy.policy_version == 0
+
+        quantized_policy.requantize_interval = 0.0
+        assert not quantized_policy.maybe_requantize(model, policy_version=0, timing=timing)  # nothing new
+        assert quantized_policy.maybe_requantize(model, policy_version=1, timing=timing)
+        assert quantized_policy.policy_version == 1
+
+        # quantized copy follows the new weights
+        head = quantized_policy.model.critic_linear
+        assert torch.allclose(head.weight().dequantize(), model.critic_linear.weight, atol=0.05)
+
+    def test_eager_model_cfg(self):
+        cfg, obs_space, model = _quantization_test_model("gru", gym.spaces.Discrete(5))
+        cfg.normalize_returns = True
+        eager_cfg = eager_model_cfg(cfg)
+        assert cfg.jit_script_modules and not eager_cfg.jit_script_modules
+
+        def scripted_modules(m):
+            return [name for name, module in m.named_modules() if isinstance(module, torch.jit.ScriptModule)]
+
+        assert scripted_modules(create_actor_critic(cfg, obs_space, gym.spaces.Discrete(5)))
+        assert not scripted_modules(create_actor_critic(eager_cfg, obs_space, gym.spaces.Discrete(5)))
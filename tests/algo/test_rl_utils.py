@@ -0,0 +1,70 @@
+import pytest
+import torch
+
+from sample_factory.algo.utils.rl_utils import (
+    calculate_discounted_sum_scan_torch,
+    calculate_discounted_sum_torch,
+    gae_advantages,
+    vtrace_targets_and_advantages,
+)
+from tests.algo.utils import random_gae_inputs, random_vtrace_inputs, vtrace_cpu_loop
+
+
+class TestVTrace:
+    @pytest.mark.parametrize("recurrence", [1, 2, 16, 32])
+    @pytest.mark.parametrize("num_trajectories", [1, 7, 64])
+    @pytest.mark.parametrize("vtrace_rho,vtrace_c", [(1.0, 1.0), (0.8, 1.2)])
+    def test_vtrace_matches_loop(self, recurrence: int, num_trajectories: int, vtrace_rho: float, vtrace_c: float):
+        torch.manual_seed(recurrence * 1000 + num_trajectories)
+        gamma = 0.99
+
+        inputs = random_vtrace_inputs(num_trajectories * recurrence, torch.device("cpu"), done_prob=0.2)
+        params = (gamma, vtrace_rho, vtrace_c, recurrence)
+
+        vs_ref, adv_ref = vtrace_cpu_loop(*inputs, *params)
+        vs, adv = vtrace_targets_and_advantages(*inputs, *params)
+
+        assert vs.shape == vs_ref.shape and adv.shape == adv_ref.shape
+        # same sequence of floating point operations on CPU, results should be bitwise identical
+        assert torch.equal(vs, vs_ref)
+        assert torch.equal(adv, adv_ref)
+
+    @pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+    def test_vtrace_stays_on_device(self):
+        recurrence, num_trajectories = 16, 32
+        inputs = random_vtrace_inputs(num_trajectories * recurrence, torch.device("cuda"))
+        params = (0.99, 1.0, 1.0, recurrence)
+
+        vs, adv = vtrace_targets_and_advantages(*inputs, *params)
+        assert vs.is_cuda and adv.is_cuda
+
+        vs_ref, adv_ref = vtrace_cpu_loop(*inputs, *params)
+        assert torch.allclose(vs, vs_ref, atol=1e-5)
+        assert torch.allclose(adv, adv_ref, atol=1e-5)
+
+
+class TestDiscountedSum:
+    @pytest.mark.parametrize("num_steps", [1, 2, 5, 32, 257])
+    @pytest.mark.parametrize("with_x_last", [False, True])
+    def test_scan_matches_loop(self, num_steps: int, with_x_last: bool):
+        torch.manual_seed(num_steps)
+        num_envs = 13
+
+        valids = (torch.rand(num_steps, num_envs) > 0.2).float()
+        dones = (torch.rand(num_steps, num_envs) < 0.1).float()
+        x = torch.randn(num_steps, num_envs) * valids
+        x_last = torch.randn(num_envs) if with_x_last else None
+
+        expected = calculate_discounted_sum_torch(x, dones, valids, 0.97, x_last)
+        actual = calculate_discounted_sum_scan_torch(x, dones, valids, 0.97, x_last)
+        assert torch.allclose(actual, expected, atol=1e-5)
+
+    @pytest.mark.parametrize("rollout", [1, 16, 100, 512])
+    def test_gae_backends(self, rollout: int):
+        torch.manual_seed(rollout)
+        inputs = random_gae_inputs(64, rollout, torch.device("cpu"), done_prob=0.1, invalid_prob=0.1)
+
+        expected = gae_advantages(*inputs, 0.99, 0.95, "loop")
+        actual = gae_advantages(*inputs, 0.99, 0.95, "scan")
+        assert actual.shape == expected.shape == (64, rollout)
+        assert torch.allclose(actual, expected, atol=1e-5)
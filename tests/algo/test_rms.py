@@ -66,3 +66,24 @@ class TestRMS:
 
     def test_jit(self):
         self.test_rms_sanity(batch_size=10, shape=(1,), norm_only=False, use_jit=True)
+
+    @pytest.mark.parametrize("per_channel", [False, True])
+    @pytest.mark.parametrize("chunk_size", [7, 64, 1000])
+    def test_chunked_stats_update(self, per_channel: bool, chunk_size: int):
+        shape = (3, 5, 4)
+        data = torch.randint(0, 256, (100,) + shape, dtype=torch.uint8)
+
+        normalizer = RunningMeanStdInPlace(shape, per_channel=per_channel)
+        chunked_normalizer = RunningMeanStdInPlace(shape, per_channel=per_channel)
+        for _ in range(2):
+            normalizer(data.float())
+            chunked_normalizer.update_stats_in_chunks(data, chunk_size)
+
+        assert torch.allclose(normalizer.running_mean, chunked_normalizer.running_mean)
+        assert torch.allclose(normalizer.running_var, chunked_normalizer.running_var)
+        assert torch.equal(normalizer.count, chunked_normalizer.count)
+
+        # stats update is skipped, data is only normalized
+        data_float = data.float()
+        normalizer(data_float, update_stats=False)
+        assert torch.equal(normalizer.count, chunked_normalizer.count)
@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.utils.agent_policy_mapping import AgentPolicyMapping
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args
+
+NUM_ENVS = 4
+SLOW_POLICY = 1
+# every how many rounds a policy answers all of its outstanding requests
+ANSWER_PERIOD = {0: 2, SLOW_POLICY: 3}
+
+
+def _write_policy_outputs(runner: NonBatchedVectorEnvRunner, rows: np.ndarray) -> None:
+    """Policy outputs depend only on the env, agent and rollout step, not on the order in which policies answer."""
+    output_sizes = runner.buffer_mgr.output_sizes
+    actions_end = output_sizes[0]  # actions come first, see policy_output_shapes()
+    for env_i, agent_i, _, rollout_step in rows:
+        rng = np.random.default_rng([env_i, agent_i, rollout_step])
+        outputs = rng.random(sum(output_sizes), dtype=np.float32)
+        outputs[:actions_end] = rng.integers(0, runner.env_info.action_space.n, actions_end)
+        runner.policy_output_tensors[env_i, agent_i] = outputs
+
+
+def _env_steps(runner: NonBatchedVectorEnvRunner) -> List[int]:
+    if runner.step_envs_when_ready:
+        return list(runner.env_rollout_steps)
+    return [runner.rollout_step] * runner.num_envs
+
+
+def _mixed_policy_for_agent(_policy_mgr: AgentPolicyMapping, agent_idx: int, env_idx: int, _global_env_idx: int):
+    """Second agent of every odd env is controlled by the slow policy, everything else by policy 0."""
+    return SLOW_POLICY if env_idx % 2 == 1 and agent_idx == 1 else 0
+
+
+def _run(
+    step_envs_when_ready: bool, num_rounds: int, num_agents: int = 1
+) -> Tuple[Dict[str, Dict[str, np.ndarray]], List[List[int]], int]:
+    """
+    Drive the runner like the rollout worker does, policies answer every ANSWER_PERIOD rounds.
+    Outstanding requests of a policy are answered newest first, so outputs only end up in the right envs if
+    advance_rollouts() can tell which request is done.
+    :return: completed trajectories by id, rollout steps of all envs after every answer, and the largest number of
+    requests of one policy in flight at the same time
+    """
+    cfg = parse_args(
+        [
+            f"--num_envs_per_worker={NUM_ENVS}",
+            f"--num_agents={num_agents}",
+            "--num_policies=2",
+            "--async_rl=False",  # deterministic env to policy mapping: env_i % num_policies
+            "--rollout=8",
+            "--episode_len=12",
+            f"--step_envs_when_ready={step_envs_when_ready}",
+        ]
+    )
+    timing = Timing()
+    runner = make_runner(cfg, NonBatchedVectorEnvRunner, timing)
+
+    trajectories, env_steps, max_in_flight = dict(), [], 0
+    outstanding: Dict[Tuple[int, int], np.ndarray] = dict()  # (policy_id, request_id) -> rows
+    for round_idx in range(num_rounds):
+        assert runner.update_trajectory_buffers(timing)
+        request = runner.generate_policy_request()
+        for policy_id, rows in (request or {}).items():
+            outstanding[(policy_id, runner.policy_request_id)] = rows
+
+        policies_in_flight = [policy_id for policy_id, _ in outstanding]
+        max_in_flight = max([max_in_flight] + [policies_in_flight.count(p) for p in policies_in_flight])
+
+        due = [tag for tag in outstanding if round_idx % ANSWER_PERIOD[tag[0]] == ANSWER_PERIOD[tag[0]] - 1]
+        for policy_id, request_id in sorted(due, key=lambda tag: tag[1], reverse=True):
+            rows = outstanding.pop((policy_id, request_id))
+            _write_policy_outputs(runner, rows)
+            steps_before = _env_steps(runner)
+            rollouts, _ = runner.advance_rollouts(policy_id, request_id, timing)
+            steps_after = _env_steps(runner)
+            env_steps.append(steps_after)
+
+            if step_envs_when_ready and not rollouts:
+                # envs step as soon as the last of their requests is answered, other envs keep waiting
+                waiting = {env_i for other_rows in outstanding.values() for env_i in other_rows[:, 0]}
+                for env_i in range(NUM_ENVS):
+                    stepped = steps_after[env_i] != steps_before[env_i]
+                    assert stepped == (env_i in rows[:, 0] and env_i not in waiting)
+
+            for rollout in rollouts:
+                traj = runner.traj_tensors[rollout["traj_buffer_idx"]]
+                trajectories[rollout["t_id"]] = {
+                    key: np.copy(traj[key]) for key in ["actions", "rewards", "dones", "policy_id", "valids"]
+                }
+                trajectories[rollout["t_id"]]["obs"] = np.copy(traj["obs"]["obs"])
+                # trajectories are released right away, as if the learner consumed them instantly
+                runner.traj_buffer_queue.put(rollout["traj_buffer_idx"])
+
+    runner.close()
+    return trajectories, env_steps, max_in_flight
+
+
+def _assert_same_trajectories(ready_trajectories: Dict, trajectories: Dict) -> None:
+    # envs meet at the rollout boundary, so we produce the same rollouts with exactly the same data
+    assert len(trajectories) >= 2 * NUM_ENVS
+    assert ready_trajectories.keys() == trajectories.keys()
+    for t_id, traj in trajectories.items():
+        for key, value in traj.items():
+            assert np.array_equal(ready_trajectories[t_id][key], value), (t_id, key)
+
+
+class TestStepEnvsWhenReady:
+    @pytest.mark.parametrize("num_rounds", [60])
+    def test_matches_default_mode(self, num_rounds: int):
+        ready_trajectories, ready_steps, _ = _run(step_envs_when_ready=True, num_rounds=num_rounds)
+        trajectories, steps, _ = _run(step_envs_when_ready=False, num_rounds=num_rounds)
+
+        # fast policy envs got ahead of the slow ones at some point, in the default mode the vector steps together
+        assert any(len(set(s)) > 1 for s in ready_steps)
+        assert all(len(set(s)) == 1 for s in steps)
+        _assert_same_trajectories(ready_trajectories, trajectories)
+
+    @pytest.mark.parametrize("num_rounds", [60])
+    def test_several_requests_per_policy(self, num_rounds: int, monkeypatch):
+        """Envs where only some agents wait for the slow policy request actions from policy 0 at different times."""
+        monkeypatch.setattr(AgentPolicyMapping, "get_policy_for_agent", _mixed_policy_for_agent)
+        ready_trajectories, _, max_in_flight = _run(step_envs_when_ready=True, num_rounds=num_rounds, num_agents=2)
+        trajectories, _, _ = _run(step_envs_when_ready=False, num_rounds=num_rounds, num_agents=2)
+
+        assert max_in_flight > 1
+        _assert_same_trajectories(ready_trajectories, trajectories)
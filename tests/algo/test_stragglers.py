@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.sampling.stragglers import (
+    StepLatencyTracker,
+    StragglerMonitor,
+    find_outliers,
+    rollout_quota,
+    worker_straggler_report,
+)
+from sample_factory.algo.sampling.vectorized_non_batched_sampling import VectorizedNonBatchedEnvRunner
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args, run_rollouts
+
+
+class TestStragglers:
+    def test_find_outliers(self):
+        assert find_outliers({0: 1.0, 1: 1.0, 2: 10.0}, factor=3.0) == [2]
+        assert find_outliers({0: 1.0, 1: 10.0}, factor=3.0) == []
+        # envs that are fast in absolute terms are never stragglers
+        assert find_outliers({0: 1e-5, 1: 1e-5, 2: 1e-4}, factor=3.0) == []
+
+    @pytest.mark.parametrize("num_workers, num_splits, excluded", [(4, 1, [2]), (5, 2, [0, 3]), (3, 2, [])])
+    def test_rollout_quota(self, num_workers, num_splits, excluded):
+        rollouts_per_iteration = 3
+        quotas = {
+            (w, s): rollout_quota(rollouts_per_iteration, num_workers, num_splits, excluded, w, s)
+            for w in range(num_workers)
+            for s in range(num_splits)
+        }
+
+        # the learner gets exactly the same number of trajectories as without exclusion
+        assert sum(quotas.values()) == rollouts_per_iteration * num_workers * num_splits
+        assert all(quotas[(w, s)] == 0 for w in excluded for s in range(num_splits))
+        active = [q for (w, _), q in quotas.items() if w not in excluded]
+        assert max(active) - min(active) <= 1
+
+    def test_latency_tracker(self):
+        tracker = StepLatencyTracker(num_envs=4, first_env_id=8)
+        for _ in range(20):
+            tracker.update(range(4), [0.01, 0.01, 0.01, 0.1])
+        tracker.update([0], [0.01])
+
+        report = worker_straggler_report(1, [tracker], env_restarts=2, factor=3.0)
+        assert list(report["slow_envs"].keys()) == [11]
+        assert report["step_latency"] == pytest.approx((80 * 0.01 + 20 * 0.1 - 19 * 0.01) / 81)
+        assert report["env_restarts"] == 2
+
+        # nothing stepped since the last report
+        tracker.reset_env(3)
+        report = worker_straggler_report(1, [tracker], env_restarts=2, factor=3.0)
+        assert report["step_latency"] is None and report["slow_envs"] == {}
+
+    def test_monitor(self):
+        monitor = StragglerMonitor(factor=3.0, exclude_workers=True)
+        assert monitor.update() is None
+
+        for worker_idx, latency in enumerate([0.01, 0.012, 0.011, 0.05]):
+            monitor.on_report(dict(worker_idx=worker_idx, step_latency=latency, slow_envs={}, env_restarts=1))
+        stats = monitor.update()
+        assert monitor.stragglers == monitor.excluded_workers == [3]
+        assert stats["straggler_workers"] == 1 and stats["env_restarts"] == 4
+        assert stats["worker_step_latency_ms_max"] == pytest.approx(50)
+
+        # excluded worker did not step, it is re-admitted
+        for worker_idx in range(3):
+            monitor.on_report(dict(worker_idx=worker_idx, step_latency=0.01, slow_envs={}, env_restarts=1))
+        monitor.on_report(dict(worker_idx=3, step_latency=None, slow_envs={}, env_restarts=1))
+        monitor.update()
+        assert monitor.excluded_workers == []
+        # the history of exclusions is kept
+        assert monitor.num_exclusions == {3: 1}
+
+    @pytest.mark.parametrize("runner_cls", [NonBatchedVectorEnvRunner, VectorizedNonBatchedEnvRunner])
+    def test_env_restart(self, runner_cls, monkeypatch):
+        num_envs, slow_env = 4, 2
+        cfg = parse_args([f"--num_envs_per_worker={num_envs}", "--env_step_timeout=0.5", "--episode_len=1000"])
+        runner = make_runner(cfg, runner_cls, Timing())
+        slow_instance = runner.envs[slow_env]
+
+        # pretend that the first step of one env took too long
+        pool = runner.env_step_pool
+        step = pool.step
+
+        def slow_step(envs, actions):
+            results = step(envs, actions)
+            if slow_instance in envs:
+                pool.last_step_times[envs.index(slow_instance)] = 1.0
+            return results
+
+        monkeypatch.setattr(pool, "step", slow_step)
+        timing = Timing()
+        _, episodic_stats = run_rollouts(runner, 5, np.random.default_rng(0), timing)
+
+        assert runner.env_restarts == 1
+        assert runner.envs[slow_env] is not slow_instance
+        assert runner.step_latency.num_steps[slow_env] == 4 and runner.step_latency.num_steps[0] == 5
+
+        # episodes of the agents of the restarted env were truncated, other episodes continue
+        assert len(episodic_stats) == runner.num_agents
+        runner.close()
@@ -0,0 +1,150 @@
+from typing import Optional
+
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.subproc_vec_env import SubprocVecEnv
+from sample_factory.cfg.arguments import default_cfg
+from sample_factory.envs.env_utils import register_env
+from sample_factory.utils.attr_dict import AttrDict
+
+SUBPROC_TEST_ENV = "subproc_vec_env_test"
+EPISODE_LEN = 3
+INVALID_ACTION = 4
+
+
+class _CountingEnv(gym.Env):
+    """Observations tell which env produced them and at which step, so we can check where they land in the slab."""
+
+    def __init__(self, env_id: int):
+        self.env_id = env_id
+        self.observation_space = gym.spaces.Box(-100, 100, (3,))
+        self.action_space = gym.spaces.Discrete(5)
+        self.t = 0
+
+    def _obs(self, action: int):
+        return np.array([self.env_id, self.t, action], dtype=np.float32)
+
+    def reset(self, seed: Optional[int] = None, **kwargs):
+        self.t = 0
+        return self._obs(-1), dict()
+
+    def step(self, action):
+        action = int(action)
+        if action == INVALID_ACTION:
+            raise ValueError(f"Invalid action in env {self.env_id}")
+        self.t += 1
+        return self._obs(action), 10.0 * self.env_id + action, self.t >= EPISODE_LEN, False, dict()
+
+    def render(self):
+        pass
+
+
+def make_counting_env(_full_env_name, cfg=None, env_config=None, render_mode: Optional[str] = None):
+    return _CountingEnv(env_config.env_id if env_config else 0)
+
+
+def _make_vec_env(num_envs: int, obs_buffers: bool = False) -> SubprocVecEnv:
+    register_env(SUBPROC_TEST_ENV, make_counting_env)
+    cfg = default_cfg(env=SUBPROC_TEST_ENV)
+    cfg.env_subprocesses = True
+    cfg.batched_sampling = True
+
+    env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(env, cfg)
+    env.close()
+
+    env_configs = [AttrDict(worker_index=0, vector_index=i, env_id=i) for i in range(num_envs)]
+    # like trajectory buffers of shape [num_trajectories, rollout, *obs_shape]
+    traj_obs = dict(obs=torch.zeros(num_envs + 3, 4, 3).share_memory_()) if obs_buffers else None
+    return SubprocVecEnv(cfg, env_info, env_configs, traj_obs)
+
+
+class TestSubprocVecEnv:
+    def test_slab_writes(self):
+        num_envs = 3
+        vec_env = _make_vec_env(num_envs)
+        assert vec_env.num_agents == num_envs
+
+        obs, infos = vec_env.reset()
+        assert len(infos) == num_envs
+        assert torch.equal(obs["obs"][:, 0], torch.arange(num_envs, dtype=torch.float32))
+        assert torch.all(obs["obs"][:, 1] == 0)
+
+        for t in range(1, EPISODE_LEN + 1):
+            actions = torch.tensor([1, 2, 3])
+            obs, rewards, terminated, truncated, infos = vec_env.step(actions)
+
+            # every child wrote its own rows of the shared slab, we return the slab itself (no copies)
+            assert obs["obs"] is vec_env.slab["obs"]["obs"] and rewards is vec_env.slab["rewards"]
+            assert torch.equal(obs["obs"][:, 0], torch.arange(num_envs, dtype=torch.float32))
+            if t < EPISODE_LEN:
+                assert torch.all(obs["obs"][:, 1] == t)
+                assert torch.equal(obs["obs"][:, 2], actions.float())
+            else:
+                # episode ended, batched envs auto-reset and return the first observation of the next episode
+                assert torch.all(obs["obs"][:, 1] == 0)
+            assert torch.equal(rewards, torch.tensor([1.0, 12.0, 23.0]))
+            assert torch.equal(terminated, torch.full((num_envs,), t >= EPISODE_LEN))
+            assert not truncated.any()
+
+        vec_env.close()
+
+    def test_obs_output(self):
+        num_envs = 3
+        vec_env = _make_vec_env(num_envs, obs_buffers=True)
+        traj_obs = vec_env.obs_buffers["obs"]
+        vec_env.reset()
+
+        # children write straight into the trajectory slot, the slab keeps the observations of the previous step
+        dst = traj_obs[2:5, 1]
+        vec_env.set_obs_output(dict(obs=dst))
+        obs, *_ = vec_env.step(torch.tensor([1, 2, 3]))
+        assert obs["obs"] is dst
+        assert torch.equal(dst[:, 0], torch.arange(num_envs, dtype=torch.float32))
+        assert torch.all(dst[:, 1] == 1) and torch.equal(dst[:, 2], torch.tensor([1.0, 2.0, 3.0]))
+        assert torch.all(vec_env.slab["obs"]["obs"][:, 1] == 0)
+        assert not traj_obs[:2].any() and not traj_obs[5:].any() and not traj_obs[2:5, 0].any()
+
+        # obs_output only applies to one step
+        obs, *_ = vec_env.step(torch.tensor([1, 2, 3]))
+        assert obs["obs"] is vec_env.slab["obs"]["obs"] and torch.all(obs["obs"][:, 1] == 2)
+        assert torch.all(dst[:, 1] == 1)
+
+        # destinations the children don't know about are filled from the slab
+        private_dst = torch.zeros(num_envs, 3)
+        vec_env.set_obs_output(dict(obs=private_dst))
+        obs, *_ = vec_env.step(torch.tensor([1, 2, 3]))
+        assert obs["obs"] is private_dst and torch.all(private_dst[:, 1] == 0)  # new episode after EPISODE_LEN
+        assert torch.equal(private_dst, vec_env.slab["obs"]["obs"])
+
+        vec_env.close()
+
+    def test_child_exception(self):
+        vec_env = _make_vec_env(2)
+        vec_env.reset()
+
+        with pytest.raises(RuntimeError, match="Invalid action in env 1"):
+            vec_env.step(torch.tensor([0, INVALID_ACTION]))
+
+        # the failed child exited, the parent can still shut down the rest of the vector
+        vec_env.processes[1].join(timeout=10)
+        assert not vec_env.processes[1].is_alive()
+        vec_env.close()
+
+    def test_close(self):
+        vec_env = _make_vec_env(2)
+        vec_env.reset()
+        processes = list(vec_env.processes)
+        assert all(p.is_alive() for p in processes)
+
+        vec_env.close()
+        assert all(not p.is_alive() and p.exitcode == 0 for p in processes)
+        assert vec_env.conns == []
+
+        # closing twice is harmless
+        vec_env.close()
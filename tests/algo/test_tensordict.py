@@ -2,7 +2,7 @@ import numpy as np
 import pytest
 import torch
 
-from sample_factory.algo.utils.tensor_dict import TensorDict, cat_tensordicts
+from sample_factory.algo.utils.tensor_dict import TensorDict, cat_tensordicts, numpy_compatible, to_numpy
 
 
 class TestParams:
@@ -65,3 +65,12 @@ class TestParams:
         d_cat = cat_tensordicts([d1, d2])
         assert np.array_equal(d_cat["a"], np.concatenate([d1["a"], d2["a"]]))
         assert np.array_equal(d_cat["b"], np.concatenate([d1["b"], d2["b"]]))
+
+    def test_numpy_compatible(self):
+        d = TensorDict(obs=TensorDict(obs=torch.zeros((2, 3), dtype=torch.float16)), dones=torch.zeros(2))
+        assert numpy_compatible(d)
+        assert to_numpy(d)["obs"]["obs"].dtype == np.float16
+
+        d["obs"]["obs"] = torch.zeros((2, 3), dtype=torch.bfloat16)
+        assert not numpy_compatible(d)
+        assert numpy_compatible(d["dones"]) and not numpy_compatible(d["obs"]["obs"])
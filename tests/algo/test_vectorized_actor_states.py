@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.sampling.vectorized_non_batched_sampling import VectorizedNonBatchedEnvRunner
+from sample_factory.utils.dicts import iter_dicts_recursively
+from sample_factory.utils.timing import Timing
+from tests.algo.utils import make_runner, parse_args, run_rollouts
+
+
+def _collect(argv, runner_cls):
+    cfg = parse_args(argv)
+    timing = Timing()
+    runner = make_runner(cfg, runner_cls, timing)
+    rollouts, stats = run_rollouts(runner, cfg.rollout * 3 + 5, np.random.default_rng(0), timing)
+    runner.close()
+    return runner, rollouts, stats
+
+
+class TestVectorizedActorStates:
+    @pytest.mark.parametrize("num_policies", [1, 3])
+    @pytest.mark.parametrize("compact_rnn_states", [False, True])
+    def test_same_experience(self, num_policies: int, compact_rnn_states: bool):
+        argv = [
+            "--num_envs_per_worker=6",
+            "--num_agents=3",
+            "--episode_len=20",
+            "--inactive_prob=0.1",
+            "--rollout=16",
+            "--recurrence=8",
+            f"--num_policies={num_policies}",
+            f"--compact_rnn_states={compact_rnn_states}",
+        ]
+        runner, rollouts, stats = _collect(argv, NonBatchedVectorEnvRunner)
+        vec_runner, vec_rollouts, vec_stats = _collect(argv, VectorizedNonBatchedEnvRunner)
+
+        assert len(rollouts) > 0 and len(stats) > 0
+        assert vec_rollouts == rollouts
+
+        assert len(vec_stats) == len(stats)
+        for vec_report, report in zip(vec_stats, stats):
+            assert vec_report["policy_id"] == report["policy_id"]
+            assert vec_report["episodic"]["reward"] == pytest.approx(report["episodic"]["reward"])
+            assert vec_report["episodic"]["len"] == report["episodic"]["len"]
+
+        for _, _, key, t, vec_t in iter_dicts_recursively(runner.traj_tensors, vec_runner.traj_tensors):
+            assert np.array_equal(t, vec_t), key
+        if compact_rnn_states:
+            assert np.array_equal(runner.rnn_state_tensors, vec_runner.rnn_state_tensors)
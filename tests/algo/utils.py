@@ -0,0 +1,207 @@
+"""
+Helpers shared by the tests and the benchmarks: a synthetic multi-agent env, a rollout worker runner driven without
+inference workers, and random inputs (and a reference implementation) for the advantage calculations.
+"""
+
+import random
+from typing import Dict, List, Optional, Tuple, Type
+
+import gymnasium as gym
+import numpy as np
+import torch
+from torch import Tensor
+
+from sample_factory.algo.sampling.env_step_pool import EnvStepPool
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.cfg.arguments import parse_full_cfg, parse_sf_args
+from sample_factory.envs.env_utils import register_env
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import Config
+
+SYNTHETIC_ENV = "synthetic_multi_agent_env"
+
+
+class SyntheticMultiAgentEnv(gym.Env):
+    """Multi-agent env that does almost no work. Episode lengths vary so that episodes end at different steps."""
+
+    def __init__(self, cfg: Config):
+        self.num_agents = cfg.num_agents
+        self.is_multiagent = True
+        self.max_episode_len = cfg.episode_len
+        self.inactive_prob = cfg.inactive_prob
+
+        self.observation_space = gym.spaces.Box(-1, 1, (cfg.obs_size,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(4)
+
+        self.rng = np.random.default_rng(0)
+        self.obs_pool = [self.rng.random(cfg.obs_size, dtype=np.float32) for _ in range(16)]
+        self.t = self.episode_len = 0
+
+    def _obs(self) -> List[np.ndarray]:
+        return [self.obs_pool[(self.t + agent_i) % len(self.obs_pool)] for agent_i in range(self.num_agents)]
+
+    def reset(self, seed: Optional[int] = None, **kwargs):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.t = 0
+        self.episode_len = int(self.rng.integers(self.max_episode_len // 2, self.max_episode_len + 1))
+        return self._obs(), [dict() for _ in range(self.num_agents)]
+
+    def step(self, actions):
+        self.t += 1
+        rewards = [0.1 * a for a in actions]
+        infos = [dict(is_active=self.rng.random() >= self.inactive_prob) for _ in range(self.num_agents)]
+
+        done = self.t >= self.episode_len
+        obs = self._obs()
+        if done:
+            # multi-agent envs auto-reset
+            obs, _ = self.reset()
+        return obs, rewards, [done] * self.num_agents, [False] * self.num_agents, infos
+
+    def render(self):
+        pass
+
+
+def make_synthetic_env(_full_env_name, cfg=None, _env_config=None, render_mode: Optional[str] = None):
+    return SyntheticMultiAgentEnv(cfg)
+
+
+def parse_args(argv: List[str]) -> Config:
+    argv = [f"--env={SYNTHETIC_ENV}", "--experiment=synthetic_multi_agent"] + argv
+    parser, _ = parse_sf_args(argv)
+    parser.add_argument("--num_agents", default=4, type=int, help="Number of agents in each env")
+    parser.add_argument("--obs_size", default=64, type=int, help="Size of the (flat) observation vector")
+    parser.add_argument("--episode_len", default=100, type=int, help="Maximum episode length")
+    parser.add_argument("--inactive_prob", default=0.0, type=float, help="Probability that an agent is inactive")
+    parser.add_argument("--env_steps", default=512, type=int, help="Env steps of the vector per measurement")
+    parser.set_defaults(
+        num_workers=1,
+        num_envs_per_worker=64,
+        worker_num_splits=1,
+        batched_sampling=False,
+        serial_mode=True,
+        async_rl=True,
+        decorrelate_envs_on_one_worker=False,
+        env_gpu_observations=False,
+    )
+    return parse_full_cfg(parser, argv)
+
+
+def make_runner(cfg: Config, runner_cls: Type[NonBatchedVectorEnvRunner], timing: Timing) -> NonBatchedVectorEnvRunner:
+    register_env(SYNTHETIC_ENV, make_synthetic_env)
+    env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(env, cfg)
+    env.close()
+
+    random.seed(0)  # random policy to agent mapping
+    buffer_mgr = BufferMgr(cfg, env_info)
+    env_step_pool = EnvStepPool(cfg.env_step_threads, cfg.num_envs_per_worker)
+    training_info = [None] * cfg.num_policies
+    runner = runner_cls(cfg, env_info, cfg.num_envs_per_worker, 0, 0, buffer_mgr, "cpu", training_info, env_step_pool)
+    runner.init(timing)
+    return runner
+
+
+def run_rollouts(
+    runner: NonBatchedVectorEnvRunner, env_steps: int, rng: np.random.Generator, timing: Timing
+) -> Tuple[List[Dict], List[Dict]]:
+    """Drive the runner like the rollout worker does, with random policy outputs instead of inference workers."""
+    output_sizes = runner.buffer_mgr.output_sizes
+    actions_end = output_sizes[0]  # actions come first, see policy_output_shapes()
+    num_actions = runner.env_info.action_space.n
+
+    all_rollouts, all_stats = [], []
+    for _ in range(env_steps):
+        assert runner.update_trajectory_buffers(timing)
+        request = runner.generate_policy_request()
+        for policy_id in sorted(request):
+            rows = request[policy_id]
+            outputs = rng.random((len(rows), sum(output_sizes)), dtype=np.float32)
+            outputs[:, :actions_end] = rng.integers(0, num_actions, (len(rows), actions_end))
+            runner.policy_output_tensors[rows[:, 0], rows[:, 1]] = outputs
+
+        # fake policy id advances the envs without active agents, just like in the rollout worker
+        for policy_id in sorted(request) or [-1]:
+            rollouts, stats = runner.advance_rollouts(policy_id, runner.policy_request_id, timing)
+            all_rollouts.extend(rollouts)
+            all_stats.extend(stats)
+            # trajectories are released right away, as if the learner consumed them instantly
+            for rollout in rollouts:
+                runner.traj_buffer_queue.put(rollout["traj_buffer_idx"])
+
+    return all_rollouts, all_stats
+
+
+def random_gae_inputs(
+    num_trajectories: int, rollout: int, device: torch.device, done_prob: float = 0.05, invalid_prob: float = 0.05
+) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    """Batch in the learner layout: rewards/dones [E, T], values/valids [E, T+1]."""
+    rewards = torch.randn(num_trajectories, rollout, device=device)
+    dones = torch.rand(num_trajectories, rollout, device=device) < done_prob
+    values = torch.randn(num_trajectories, rollout + 1, device=device)
+    valids = torch.rand(num_trajectories, rollout + 1, device=device) >= invalid_prob
+    return rewards, dones, values, valids
+
+
+def vtrace_cpu_loop(
+    ratios: Tensor,
+    values: Tensor,
+    rewards: Tensor,
+    dones: Tensor,
+    gamma: float,
+    rho_hat: float,
+    c_hat: float,
+    recurrence: int,
+) -> Tuple[Tensor, Tensor]:
+    """The original learner implementation of V-trace, kept as a reference for benchmarks and tests."""
+    device = ratios.device
+    num_trajectories = ratios.shape[0] // recurrence
+
+    rho_hat = torch.Tensor([rho_hat])
+    c_hat = torch.Tensor([c_hat])
+
+    ratios_cpu = ratios.cpu()
+    values_cpu = values.cpu()
+    rewards_cpu = rewards.to("cpu", dtype=torch.float)
+    dones_cpu = dones.to("cpu", dtype=torch.float)
+
+    vtrace_rho = torch.min(rho_hat, ratios_cpu)
+    vtrace_c = torch.min(c_hat, ratios_cpu)
+
+    vs = torch.zeros((num_trajectories * recurrence))
+    adv = torch.zeros((num_trajectories * recurrence))
+
+    next_values = values_cpu[recurrence - 1 :: recurrence] - rewards_cpu[recurrence - 1 :: recurrence]
+    next_values /= gamma
+    next_vs = next_values
+
+    for i in reversed(range(recurrence)):
+        curr_rewards = rewards_cpu[i::recurrence]
+        not_done_gamma = (1.0 - dones_cpu[i::recurrence]) * gamma
+
+        curr_values = values_cpu[i::recurrence]
+        curr_vtrace_rho = vtrace_rho[i::recurrence]
+        curr_vtrace_c = vtrace_c[i::recurrence]
+
+        delta_s = curr_vtrace_rho * (curr_rewards + not_done_gamma * next_values - curr_values)
+        adv[i::recurrence] = curr_vtrace_rho * (curr_rewards + not_done_gamma * next_vs - curr_values)
+        next_vs = curr_values + delta_s + not_done_gamma * curr_vtrace_c * (next_vs - next_values)
+        vs[i::recurrence] = next_vs
+
+        next_values = curr_values
+
+    return vs.to(device), adv.to(device)
+
+
+def random_vtrace_inputs(
+    minibatch_size: int, device: torch.device, done_prob: float = 0.05
+) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    ratios = torch.exp(torch.randn(minibatch_size, device=device) * 0.3)
+    values = torch.randn(minibatch_size, device=device)
+    rewards = torch.randn(minibatch_size, device=device)
+    dones = (torch.rand(minibatch_size, device=device) < done_prob).float()
+    return ratios, values, rewards, dones
@@ -1,7 +1,10 @@
+import itertools
 import shutil
+import time
 from os.path import isdir
-from typing import Callable, Tuple
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 
+import gymnasium as gym
 import pytest
 
 from sample_factory.algo.sampling.batched_sampling import BatchedVectorEnvRunner
@@ -16,11 +19,16 @@ from sample_factory.envs.env_utils import (
     TrainingInfoInterface,
     find_training_info_interface,
     find_wrapper_interface,
+    register_env,
 )
 from sample_factory.train import make_runner
 from sample_factory.utils.typing import Config
 from sample_factory.utils.utils import experiment_dir, log
-from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+from sf_examples.train_custom_env_custom_model import (
+    make_custom_env_func,
+    parse_custom_args,
+    register_custom_components,
+)
 
 
 def default_test_cfg(
@@ -111,6 +119,96 @@ def run_test_env(
             assert isinstance(env_rew_shaping, RewardShapingInterface)
 
     reset_global_context()
+    return runner
+
+
+def _feature_cfgs(flags: Dict[str, Any], **variants: Sequence[Any]) -> List[Dict[str, Any]]:
+    """Flags of a feature combined with every combination of the variants."""
+    return [dict(flags, **dict(zip(variants, values))) for values in itertools.product(*variants.values())]
+
+
+def _cfg_id(feature_cfg: Dict[str, Any]) -> str:
+    return ",".join(f"{key}={value}" for key, value in feature_cfg.items())
+
+
+# behavior of the features is covered by their unit tests, here we only train with them for a few iterations
+FEATURE_CFGS = [
+    *_feature_cfgs(dict(zero_copy_training_batches=True), batched_sampling=[False, True], async_rl=[False, True]),
+    *_feature_cfgs(dict(double_buffered_weights=True), batched_sampling=[False, True]),
+    *_feature_cfgs(
+        dict(lock_free_obs_normalizer=True),
+        double_buffered_weights=[False, True],
+        learner_prefetch_batches=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(num_workers=2, inference_batching="adaptive", inference_max_batch_size=4),
+        batched_sampling=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(inference_quantization="dynamic_int8", requantize_interval=0.1),
+        serial_mode=[False, True],
+        lock_free_obs_normalizer=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(inference_graph="trace", requantize_interval=0.1),
+        batched_sampling=[False, True],
+        inference_quantization=["none", "dynamic_int8"],
+    ),
+    *_feature_cfgs(
+        dict(num_envs_per_worker=8, train_for_env_steps=400, env_step_threads=2),
+        batched_sampling=[False, True],
+        serial_mode=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(num_envs_per_worker=4, train_for_env_steps=400, batched_sampling=True, env_subprocesses=True),
+        serial_mode=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(num_envs_per_worker=4, train_for_env_steps=400, env_reset_prefetch=True),
+        batched_sampling=[False, True],
+        serial_mode=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(num_workers=2, num_envs_per_worker=4, train_for_env_steps=400, env_creation_threads=2),
+        batched_sampling=[False, True],
+    ),
+    *_feature_cfgs(
+        dict(
+            num_workers=2,
+            num_envs_per_worker=4,
+            train_for_env_steps=400,
+            serial_mode=True,
+            custom_env_episode_len=50,
+            decorrelate_envs_on_one_worker=True,
+            decorrelate_experience_max_seconds=10,
+            decorrelation_method="random_bursts",
+        ),
+        batched_sampling=[False, True],
+    ),
+]
+
+
+# envs of this rollout worker step much slower than the rest, see test_stragglers
+SLOW_WORKER_ENV = "my_custom_env_slow_worker"
+SLOW_WORKER = 1
+
+
+class _SlowStepWrapper(gym.Wrapper):
+    def step(self, action):
+        time.sleep(0.005)
+        return self.env.step(action)
+
+
+def make_slow_worker_env_func(full_env_name, cfg=None, env_config=None, render_mode=None):
+    env = make_custom_env_func(full_env_name, cfg, env_config, render_mode)
+    if env_config is not None and env_config.worker_index == SLOW_WORKER:
+        env = _SlowStepWrapper(env)
+    return env
+
+
+def register_slow_worker_components():
+    register_custom_components()
+    register_env(SLOW_WORKER_ENV, make_slow_worker_env_func)
 
 
 class TestExample:
@@ -138,6 +236,51 @@ class TestExample:
         cfg.async_rl = async_rl
         run_test_env(cfg, eval_cfg)
 
+    @pytest.mark.parametrize("feature_cfg", FEATURE_CFGS, ids=_cfg_id)
+    def test_feature_smoke(self, feature_cfg: Dict[str, Any]):
+        """
+        Short training run with an optional feature turned on, just to make sure nothing crashes or throws exceptions.
+        """
+        cfg, eval_cfg = default_test_cfg()
+        cfg.num_workers = 1
+        cfg.train_for_env_steps = 200
+        for key, value in feature_cfg.items():
+            setattr(cfg, key, value)
+        run_test_env(cfg, eval_cfg)
+
+    def test_stragglers(self):
+        """
+        Envs that exceed --env_step_timeout are restarted, and the workers that are much slower than the rest are
+        excluded from sampling in the next training iterations.
+        """
+        cfg, eval_cfg = default_test_cfg(env_name=SLOW_WORKER_ENV)
+        cfg.num_workers = 4
+        cfg.num_envs_per_worker = 2
+        cfg.batch_size = 256
+        # the run is long enough in iterations, while the slow worker samples every iteration takes longer than
+        # a comparison of the workers, so it is excluded at least once no matter how fast the machine is
+        cfg.train_for_env_steps = 30 * cfg.batch_size
+        cfg.straggler_report_interval = 0.3
+        cfg.batched_sampling = False  # batched runners can't restart individual envs
+        cfg.serial_mode = True  # so we can look at the rollout workers afterwards
+        cfg.async_rl = False
+        cfg.exclude_straggler_workers = True
+        # every step of every env exceeds the timeout, envs are restarted all the time
+        cfg.env_step_timeout = 1e-9
+        runner = run_test_env(
+            cfg, eval_cfg, register_custom_components_func=register_slow_worker_components, env_name=SLOW_WORKER_ENV
+        )
+
+        # exclusions expire and come back while the run goes on, so we only check the history, not the final state
+        monitor = runner.straggler_monitor
+        assert sorted(monitor.env_restarts.keys()) == list(range(cfg.num_workers))
+        assert all(restarts > 0 for restarts in monitor.env_restarts.values())
+        assert list(monitor.num_exclusions.keys()) == [SLOW_WORKER]
+
+        # the slow worker sat out some iterations, its rollouts were collected by the others
+        for worker in runner.sampler.rollout_workers:
+            assert (worker.num_excluded_iterations > 0) == (worker.worker_idx == SLOW_WORKER)
+
     @pytest.mark.parametrize("batched_sampling", [True, False])
     def test_chk_envs(self, batched_sampling: bool):
         cfg, eval_cfg = default_test_cfg()
@@ -44,6 +44,64 @@ class TestExampleMulti:
             expected_reward_at_least=-6,  # random policy does ~-5.5, here we don't learn long enough to improve
         )
 
+    @pytest.mark.parametrize("async_rl", [False, True])
+    @pytest.mark.parametrize("serial_mode", [True, False])
+    def test_step_envs_when_ready(self, async_rl: bool, serial_mode: bool):
+        cfg, eval_cfg = default_multi_cfg()
+        cfg.async_rl = async_rl
+        cfg.train_for_env_steps = 2048
+        cfg.num_workers = 2
+        cfg.batch_size = 256
+        cfg.serial_mode = serial_mode
+        cfg.batched_sampling = False
+        cfg.step_envs_when_ready = True
+
+        run_test_env_multi(cfg, eval_cfg, expected_reward_at_least=-6)
+
+    @pytest.mark.parametrize("async_rl", [False, True])
+    @pytest.mark.parametrize("serial_mode", [True, False])
+    def test_vectorized_actor_states(self, async_rl: bool, serial_mode: bool):
+        cfg, eval_cfg = default_multi_cfg()
+        cfg.async_rl = async_rl
+        cfg.train_for_env_steps = 2048
+        cfg.num_workers = 2
+        cfg.batch_size = 256
+        cfg.serial_mode = serial_mode
+        cfg.batched_sampling = False
+        cfg.vectorized_actor_states = True
+
+        run_test_env_multi(cfg, eval_cfg, expected_reward_at_least=-6)
+
+    @pytest.mark.parametrize("serial_mode", [True, False])
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    @pytest.mark.parametrize("population_inference,use_rnn", [("per_policy", True), ("vmap", False), ("vmap", True)])
+    def test_shared_inference_worker(
+        self, serial_mode: bool, batched_sampling: bool, population_inference: str, use_rnn: bool
+    ):
+        cfg, eval_cfg = default_multi_cfg()
+        cfg.async_rl = True
+        cfg.train_for_env_steps = 2048
+        cfg.num_workers = 2
+        cfg.batch_size = 256
+        cfg.serial_mode = serial_mode
+        cfg.batched_sampling = batched_sampling
+        cfg.policies_per_inference_worker = 2
+        cfg.population_inference = population_inference
+        cfg.use_rnn = eval_cfg.use_rnn = use_rnn
+
+        runner = run_test_env_multi(cfg, eval_cfg, expected_reward_at_least=-6)
+
+        if serial_mode and population_inference == "vmap":
+            # we can directly access the inference workers in serial mode
+            workers = [w for group in runner.sampler.inference_workers.values() for w in group]
+            assert workers
+            for worker in workers:
+                population = worker.population_inference
+                assert population is not None
+                # vmap has no batching rules for the recurrent cores, these populations run one policy at a time
+                assert population.eager_fallback == use_rnn
+                assert population.validated != use_rnn
+
     def test_example_multi(self):
         cfg, eval_cfg = default_multi_cfg()
         cfg.async_rl = True